@@ -53,6 +53,7 @@ from modules.agricultural_machinery import agricultural_machinery_section
 from modules.land_use import land_use_section
 from modules.holding_labour_permanent import holding_labour_permanent_form
 from helpers import calculate_age
+from modules.low_bandwidth import celebrate, inject_css, render_bandwidth_controls, show_map
 
 # =============================================================================
 # STREAMLIT CONFIGURATION & THEMING
@@ -65,7 +66,7 @@ st.set_page_config(
 )
 
 # Custom CSS for enhanced UI
-st.markdown("""
+inject_css("""
 <style>
     .main-header {
         font-size: 2.5rem;
@@ -118,7 +119,7 @@ st.markdown("""
         margin-right: 8px;
     }
 </style>
-""", unsafe_allow_html=True)
+""")
 
 # =============================================================================
 # SESSION STATE MANAGEMENT
@@ -252,12 +253,12 @@ def holder_location_widget(holder_id):
                 get_radius=50,
                 pickable=True,
             )
-            st.pydeck_chart(pdk.Deck(
+            show_map(pd.DataFrame([[current_lat, current_lon]], columns=["lat", "lon"]), pdk.Deck(
                 map_style="mapbox://styles/mapbox/satellite-streets-v11",
                 initial_view_state=view_state,
                 layers=[layer],
                 tooltip={"html": "<b>Farm Location</b><br/>Lat: {lat}<br/>Lon: {lon}"}
-            ))
+            ), zoom=16)
         except Exception as e:
             st.warning(f"Advanced map unavailable: {e}")
             st.map(pd.DataFrame([[current_lat, current_lon]], columns=["lat", "lon"]), zoom=15)
@@ -377,7 +378,7 @@ def holder_location_widget(holder_id):
                                 {"lat": current_lat, "lon": current_lon, "hid": holder_id}
                             )
                         st.success("✅ Farm location persisted successfully!")
-                        st.balloons()
+                        celebrate()
                     except Exception as e:
                         st.error(f"❌ Location persistence failed: {e}")
             else:
@@ -683,6 +684,7 @@ def main():
 
         st.sidebar.success(f"✅ Authenticated as {user['username']} ({role.title()})")
         logout_user()
+        render_bandwidth_controls()
 
         if role == "holder":
             holder_id = create_holder_for_user(user_id, user["username"])
@@ -801,7 +803,7 @@ def render_survey_dashboard(holder_id):
             # Interactive map
             st.markdown("### 🗺️ Farm Location Visualization")
             df = pd.DataFrame([[holder_info['latitude'], holder_info['longitude']]], columns=["lat", "lon"])
-            st.map(df, zoom=15)
+            show_map(df, zoom=15)
 
     except Exception as e:
         st.error(f"📊 Dashboard initialization error: {e}")
@@ -861,7 +863,7 @@ def render_navigation_controls(current_section, holder_id):
             if st.button("✅ Complete Survey", type="primary", use_container_width=True):
                 mark_section_complete(current_section)
                 st.success("🎉 Agricultural census completed successfully!")
-                st.balloons()
+                celebrate()
 
 def render_progress_analytics(current_section):
     """Enhanced progress analytics"""
@@ -0,0 +1,262 @@
+"""
+Buffered Agent Activity Log
+Batches activity events in-process and writes them to the month-partitioned
+agent_activity_log table with one multi-row insert per flush
+"""
+
+import atexit
+import json
+import logging
+import threading
+from collections import deque
+from datetime import date, datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import text
+
+from census_app.db import engine
+
+logger = logging.getLogger('activity_log')
+
+ACTIVITY_LOG_CONFIG = {
+    'batch_size': 200,        # flush as soon as this many events are buffered
+    'flush_interval': 2,      # seconds between time-based flushes
+    'max_buffer': 20000,      # oldest events are dropped beyond this while the DB is down
+    'months_ahead': 2,        # partitions created ahead of time
+    'retention_months': 12,
+}
+
+
+# ---------------- Partitions ----------------
+def _month_start(day: date, offset: int = 0) -> date:
+    month_index = day.year * 12 + day.month - 1 + offset
+    return date(month_index // 12, month_index % 12 + 1, 1)
+
+
+def _partition_name(month: date) -> str:
+    return f"agent_activity_log_y{month.year}m{month.month:02d}"
+
+
+def ensure_month_partitions(conn, months_ahead: Optional[int] = None, from_month: Optional[date] = None):
+    """Create monthly partitions from from_month (default: this month) through months_ahead"""
+    months_ahead = ACTIVITY_LOG_CONFIG['months_ahead'] if months_ahead is None else months_ahead
+    start = _month_start(from_month or date.today())
+    end = _month_start(date.today(), months_ahead)
+    month = start
+    while month <= end:
+        conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {_partition_name(month)}
+            PARTITION OF agent_activity_log
+            FOR VALUES FROM ('{month.isoformat()}') TO ('{_month_start(month, 1).isoformat()}')
+        """))
+        month = _month_start(month, 1)
+
+
+def setup_activity_log_tables():
+    """
+    Create the month-partitioned agent_activity_log
+
+    An existing unpartitioned table is migrated in place: it is renamed, its
+    rows are copied into the partitioned table and the old table is dropped.
+    """
+    try:
+        with engine.begin() as conn:
+            legacy_kind = conn.execute(text("""
+                SELECT c.relkind FROM pg_class c
+                JOIN pg_namespace n ON n.oid = c.relnamespace
+                WHERE c.relname = 'agent_activity_log' AND n.nspname = current_schema()
+            """)).scalar()
+            migrate = legacy_kind == 'r'
+            if migrate:
+                conn.execute(text("ALTER TABLE agent_activity_log RENAME TO agent_activity_log_unpartitioned"))
+
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS agent_activity_log (
+                    log_id BIGSERIAL,
+                    agent_id INTEGER,
+                    activity_type VARCHAR(50),
+                    description TEXT,
+                    metadata JSONB,
+                    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+                    PRIMARY KEY (log_id, created_at)
+                ) PARTITION BY RANGE (created_at)
+            """))
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS agent_activity_log_default
+                PARTITION OF agent_activity_log DEFAULT
+            """))
+            conn.execute(text("""
+                CREATE INDEX IF NOT EXISTS idx_agent_activity_log_agent_time
+                ON agent_activity_log (agent_id, created_at DESC)
+            """))
+
+            first_month = None
+            if migrate:
+                first_month = conn.execute(text("""
+                    SELECT MIN(created_at) FROM agent_activity_log_unpartitioned
+                """)).scalar()
+            ensure_month_partitions(conn, from_month=first_month.date() if first_month else None)
+
+            if migrate:
+                conn.execute(text("""
+                    INSERT INTO agent_activity_log
+                    (agent_id, activity_type, description, metadata, created_at)
+                    SELECT agent_id, activity_type, description,
+                           metadata::jsonb, COALESCE(created_at, NOW())
+                    FROM agent_activity_log_unpartitioned
+                    ORDER BY created_at
+                """))
+                conn.execute(text("DROP TABLE agent_activity_log_unpartitioned"))
+                logger.info("Migrated agent_activity_log to monthly partitions")
+        return True
+    except Exception as e:
+        logger.error(f"Error setting up activity log tables: {str(e)}")
+        return False
+
+
+def prune_activity_partitions(retention_months: Optional[int] = None) -> List[str]:
+    """
+    Drop monthly partitions that ended before the retention window
+
+    Runs once a day from the ActivityLogWriter thread.
+    """
+    retention_months = retention_months or ACTIVITY_LOG_CONFIG['retention_months']
+    cutoff = _month_start(date.today(), -retention_months)
+    dropped = []
+    with engine.begin() as conn:
+        partitions = conn.execute(text("""
+            SELECT c.relname FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            JOIN pg_class p ON p.oid = i.inhparent
+            WHERE p.relname = 'agent_activity_log'
+            AND c.relname ~ '^agent_activity_log_y[0-9]{4}m[0-9]{2}$'
+        """)).scalars().all()
+        for name in partitions:
+            month = date(int(name[-7:-3]), int(name[-2:]), 1)
+            if _month_start(month, 1) <= cutoff:
+                conn.execute(text(f"DROP TABLE {name}"))
+                dropped.append(name)
+    if dropped:
+        logger.info(f"Dropped activity log partitions: {dropped}")
+    return dropped
+
+
+# ---------------- Buffered Writer ----------------
+class ActivityLogWriter(threading.Thread):
+    """
+    Background writer for activity events
+
+    log() only appends to an in-memory buffer; the thread flushes when the
+    buffer reaches batch_size or every flush_interval seconds, and close()
+    flushes whatever is left (registered with atexit).
+    """
+
+    def __init__(self, batch_size: Optional[int] = None, flush_interval: Optional[float] = None):
+        super().__init__(name='activity-log-writer', daemon=True)
+        self.batch_size = batch_size or ACTIVITY_LOG_CONFIG['batch_size']
+        self.flush_interval = flush_interval or ACTIVITY_LOG_CONFIG['flush_interval']
+        self.buffer = deque(maxlen=ACTIVITY_LOG_CONFIG['max_buffer'])
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.wake = threading.Event()
+        self.stopped = threading.Event()
+        self.partitions_month = _month_start(date.today())
+        self.pruned_on = None
+
+    def log(self, agent_id: int, activity_type: str, description: str,
+            metadata: Optional[Dict] = None):
+        event = {
+            'agent_id': agent_id,
+            'activity_type': activity_type,
+            'description': description,
+            'metadata': metadata,
+            'created_at': datetime.now().isoformat()
+        }
+        with self.lock:
+            if len(self.buffer) == self.buffer.maxlen:
+                logger.warning("Activity log buffer full, dropping oldest event")
+            self.buffer.append(event)
+            full = len(self.buffer) >= self.batch_size
+        if full:
+            self.wake.set()
+
+    def pending_events(self, agent_id: int) -> List[Dict]:
+        """Buffered events for one agent that have not been written yet, newest first"""
+        with self.lock:
+            return [dict(event) for event in reversed(self.buffer) if event['agent_id'] == agent_id]
+
+    def flush(self) -> int:
+        """Write every buffered event in one multi-row insert"""
+        with self.flush_lock:
+            with self.lock:
+                events = list(self.buffer)
+                self.buffer.clear()
+            if not events:
+                return 0
+
+            current_month = _month_start(date.today())
+            if current_month != self.partitions_month:
+                # Rows outside every monthly partition still land in the default one
+                try:
+                    with engine.begin() as conn:
+                        ensure_month_partitions(conn)
+                except Exception as e:
+                    logger.error(f"Error creating activity log partitions: {str(e)}")
+                self.partitions_month = current_month
+
+            try:
+                with engine.begin() as conn:
+                    conn.execute(text("""
+                        INSERT INTO agent_activity_log
+                        (agent_id, activity_type, description, metadata, created_at)
+                        SELECT agent_id, activity_type, description, metadata, created_at
+                        FROM jsonb_to_recordset(CAST(:events AS JSONB))
+                             AS e(agent_id INTEGER, activity_type TEXT, description TEXT,
+                                  metadata JSONB, created_at TIMESTAMP)
+                    """), {'events': json.dumps(events, default=str)})
+                return len(events)
+            except Exception as e:
+                logger.error(f"Activity log flush failed, keeping {len(events)} events: {str(e)}")
+                with self.lock:
+                    # Put the batch back in front of anything logged meanwhile
+                    self.buffer.extendleft(reversed(events))
+                return 0
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.wake.wait(self.flush_interval)
+            self.wake.clear()
+            self.flush()
+            if self.pruned_on != date.today():
+                # Drop partitions past retention_months once a day
+                try:
+                    prune_activity_partitions()
+                except Exception as e:
+                    logger.error(f"Error pruning activity log partitions: {str(e)}")
+                self.pruned_on = date.today()
+
+    def close(self):
+        self.stopped.set()
+        self.wake.set()
+        if self.is_alive():
+            self.join(timeout=5)
+        self.flush()
+
+
+_writer: Optional[ActivityLogWriter] = None
+_writer_lock = threading.Lock()
+
+
+def get_activity_writer() -> ActivityLogWriter:
+    """Process-wide activity writer, started on first use"""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = ActivityLogWriter()
+            _writer.start()
+            atexit.register(_writer.close)
+        return _writer
+
+
+# Run table setup when module is imported
+setup_activity_log_tables()
@@ -0,0 +1,186 @@
+"""
+Agent Statistics Engine
+Every agent KPI from a single pass over agent_assignments using FILTER aggregates,
+for one agent or for all agents on an island, with query timings kept for review
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional
+
+import pandas as pd
+import streamlit as st
+from sqlalchemy import text
+
+from census_app.db import engine
+
+logger = logging.getLogger('agent_stats')
+
+STATS_CONFIG = {
+    'slow_query_ms': 200,     # timings above this are logged as warnings
+    'timing_history': 200,    # recent timings kept per process
+    'trend_days': 30,
+}
+
+OPEN_STATUSES = ('assigned', 'scheduled', 'in_progress')
+# SQL list literal for IN (...); the statuses are fixed identifiers, never user input
+OPEN_STATUSES_SQL = ", ".join(f"'{status}'" for status in OPEN_STATUSES)
+
+# KPI name -> aggregate over agent_assignments aa. All are computed in one scan.
+KPI_AGGREGATES = {
+    'total_assigned': "COUNT(aa.assignment_id)",
+    'total_surveys': "COUNT(*) FILTER (WHERE aa.status = 'completed')",
+    'this_month': "COUNT(*) FILTER (WHERE aa.status = 'completed' "
+                  "AND aa.completed_date >= DATE_TRUNC('month', CURRENT_DATE))",
+    'today': "COUNT(*) FILTER (WHERE aa.status = 'completed' AND aa.completed_date >= CURRENT_DATE)",
+    'last_30_days': "COUNT(*) FILTER (WHERE aa.status = 'completed' "
+                    f"AND aa.completed_date >= CURRENT_DATE - {STATS_CONFIG['trend_days']})",
+    'open_assignments': f"COUNT(*) FILTER (WHERE aa.status IN ({OPEN_STATUSES_SQL}))",
+    'first_time_complete': "COUNT(*) FILTER (WHERE aa.status = 'completed' AND aa.contact_attempts = 1)",
+    'avg_duration': "ROUND(AVG(EXTRACT(EPOCH FROM (aa.completed_date - aa.assignment_date)) / 60) "
+                    "FILTER (WHERE aa.status = 'completed' AND aa.completed_date IS NOT NULL)::numeric, 1)",
+    'avg_contact_attempts': "ROUND(AVG(aa.contact_attempts) FILTER (WHERE aa.status = 'completed')::numeric, 1)",
+}
+
+_timings = deque(maxlen=STATS_CONFIG['timing_history'])
+_timings_lock = threading.Lock()
+
+
+def _kpi_select() -> str:
+    return ",\n".join(f"{expression} AS {name}" for name, expression in KPI_AGGREGATES.items())
+
+
+def _record_timing(query: str, started: float, rows: int) -> float:
+    elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+    with _timings_lock:
+        _timings.append({'query': query, 'ms': elapsed_ms, 'rows': rows, 'at': time.time()})
+    if elapsed_ms > STATS_CONFIG['slow_query_ms']:
+        logger.warning(f"Slow {query}: {elapsed_ms} ms for {rows} row(s)")
+    return elapsed_ms
+
+
+def get_stats_timings() -> List[Dict]:
+    """Recent statistics query timings in this process, newest last"""
+    with _timings_lock:
+        return list(_timings)
+
+
+def _derive(row: Dict) -> Dict:
+    """Rates computed from the raw counts"""
+    stats = {name: row.get(name) for name in KPI_AGGREGATES}
+    for name in KPI_AGGREGATES:
+        if name not in ('avg_duration', 'avg_contact_attempts'):
+            stats[name] = int(stats[name] or 0)
+    for name in ('avg_duration', 'avg_contact_attempts'):
+        stats[name] = float(stats[name]) if stats[name] is not None else None
+
+    assigned, completed = stats['total_assigned'], stats['total_surveys']
+    closed = assigned - stats['open_assignments']
+    stats['completion_rate'] = round(completed / assigned * 100, 1) if assigned else 0.0
+    stats['first_time_completion_rate'] = (round(stats['first_time_complete'] / completed * 100, 1)
+                                           if completed else 0.0)
+    # Share of finished assignments that ended completed rather than cancelled/refused
+    stats['success_rate'] = round(completed / closed * 100, 1) if closed else 0.0
+    stats['avg_per_day'] = round(stats['last_30_days'] / STATS_CONFIG['trend_days'], 2)
+    return stats
+
+
+def get_agent_kpis(agent_id: int) -> Dict:
+    """
+    All KPIs for one agent in a single query
+
+    Errors propagate to the caller; the elapsed time is returned as query_ms.
+    """
+    started = time.perf_counter()
+    with engine.connect() as conn:
+        row = conn.execute(text(f"""
+            SELECT {_kpi_select()}
+            FROM agent_assignments aa
+            WHERE aa.agent_id = :aid
+        """), {'aid': agent_id}).mappings().first()
+    stats = _derive(dict(row or {}))
+    stats['query_ms'] = _record_timing('agent_kpis', started, 1)
+    return stats
+
+
+def get_island_agent_kpis(island_id: Optional[int] = None) -> List[Dict]:
+    """
+    KPIs for every active agent on an island (or all islands) in a single query
+
+    Agents without assignments are included with zero counts.
+    """
+    island_filter = "AND a.assigned_island_id = :iid" if island_id is not None else ""
+    started = time.perf_counter()
+    with engine.connect() as conn:
+        rows = conn.execute(text(f"""
+            SELECT a.agent_id, a.agent_code, a.full_name, a.assigned_island_id,
+                   {_kpi_select()}
+            FROM agents a
+            LEFT JOIN agent_assignments aa ON aa.agent_id = a.agent_id
+            WHERE a.status = 'active' {island_filter}
+            GROUP BY a.agent_id, a.agent_code, a.full_name, a.assigned_island_id
+            ORDER BY a.agent_code
+        """), {'iid': island_id}).mappings().all()
+    elapsed_ms = _record_timing('island_agent_kpis', started, len(rows))
+
+    results = []
+    for row in rows:
+        stats = _derive(dict(row))
+        stats.update({key: row[key] for key in ('agent_id', 'agent_code', 'full_name', 'assigned_island_id')})
+        results.append(stats)
+    if results:
+        results[0]['query_ms'] = elapsed_ms
+    return results
+
+
+def render_island_agent_statistics():
+    """Supervisor panel: KPIs for every agent on an island"""
+    st.subheader("📊 Agent Performance")
+
+    try:
+        with engine.connect() as conn:
+            islands = conn.execute(text("SELECT island_id, island_name FROM islands ORDER BY island_name")).fetchall()
+    except Exception as e:
+        st.error(f"Could not load islands: {e}")
+        return
+    options = {None: "All Islands", **{row.island_id: row.island_name for row in islands}}
+    island_id = st.selectbox("Island", list(options.keys()), format_func=options.get, key="agent_stats_island")
+
+    try:
+        kpis = get_island_agent_kpis(island_id)
+    except Exception as e:
+        st.error(f"Could not load agent statistics: {e}")
+        return
+
+    if not kpis:
+        st.info("No active agents on this island.")
+        return
+
+    df = pd.DataFrame(kpis).drop(columns=['query_ms'], errors='ignore')
+    col_m = st.columns(4)
+    with col_m[0]:
+        st.metric("Agents", len(df))
+    with col_m[1]:
+        st.metric("Completed This Month", int(df['this_month'].sum()))
+    with col_m[2]:
+        st.metric("Open Assignments", int(df['open_assignments'].sum()))
+    with col_m[3]:
+        st.metric("Query Time", f"{kpis[0].get('query_ms', 0)} ms")
+
+    columns = ['agent_code', 'full_name', 'total_surveys', 'this_month', 'today', 'open_assignments',
+               'completion_rate', 'first_time_completion_rate', 'success_rate', 'avg_duration', 'avg_per_day']
+    st.dataframe(df[columns], use_container_width=True, hide_index=True)
+
+    timings = get_stats_timings()
+    with st.expander(f"⏱️ Query Timings ({len(timings)} recent)"):
+        if not timings:
+            st.info("No statistics queries timed yet.")
+        else:
+            timings_df = pd.DataFrame(timings)
+            timings_df['at'] = pd.to_datetime(timings_df['at'], unit='s')
+            summary = timings_df.groupby('query')['ms'].describe(percentiles=[0.5, 0.95])
+            st.dataframe(summary[['count', '50%', '95%', 'max']], use_container_width=True)
+            st.caption(f"Queries over {STATS_CONFIG['slow_query_ms']} ms are logged as slow")
+            st.dataframe(timings_df.iloc[::-1].head(20), use_container_width=True, hide_index=True)
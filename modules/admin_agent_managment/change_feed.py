@@ -0,0 +1,375 @@
+"""
+Live Change Feed
+Postgres LISTEN/NOTIFY statement triggers on agent_assignments, holders, registration_form and
+emergency_alerts, with one listener thread per process pushing deltas into session-scoped subscriptions
+"""
+
+import json
+import logging
+import select
+import threading
+import weakref
+from collections import Counter, deque
+from typing import Callable, Dict, Iterable, List, Optional
+
+import streamlit as st
+from sqlalchemy import text
+
+from census_app.db import engine
+
+logger = logging.getLogger('change_feed')
+
+CHANNEL = 'census_changes'
+
+FEED_CONFIG = {
+    'poll_timeout': 5,          # seconds the listener blocks waiting for notifications
+    'reconnect_delay': 5,
+    'subscription_buffer': 1000,
+    'refresh_interval': 5,      # seconds between live fragment checks in the UI
+    'max_payload': 7900,        # bytes; larger statements notify an overflow instead of their rows
+}
+
+# table -> columns carried in each notification; the first is the primary key.
+# Payloads stay small (NOTIFY is capped at 8000 bytes), consumers fetch rows if needed.
+# One notification is sent per statement carrying every changed row; statements too
+# large for one payload send {'overflow': true} and subscribers reload in full.
+WATCHED_TABLES = {
+    'agent_assignments': ['assignment_id', 'agent_id', 'status', 'holder_id'],
+    'holders': ['holder_id', 'status', 'owner_id', 'assigned_agent_id'],
+    'registration_form': ['id', 'island'],
+    'emergency_alerts': ['alert_id', 'agent_id', 'alert_type', 'priority', 'status'],
+}
+
+
+def setup_change_feed():
+    """Create the notify trigger function and attach it to every watched table"""
+    try:
+        with engine.begin() as conn:
+            conn.execute(text(f"""
+                CREATE OR REPLACE FUNCTION notify_census_changes() RETURNS trigger
+                LANGUAGE plpgsql
+                AS $$
+                DECLARE
+                    changes JSONB;
+                    payload TEXT;
+                BEGIN
+                    -- Statement-level: new_rows / old_rows are the transition tables,
+                    -- reduced to the watched columns passed as trigger arguments
+                    IF TG_OP = 'INSERT' THEN
+                        SELECT jsonb_agg(jsonb_build_object('new', n.r)) INTO changes
+                        FROM (SELECT (SELECT jsonb_object_agg(c, to_jsonb(x) -> c) FROM unnest(TG_ARGV) c) AS r
+                              FROM new_rows x) n;
+                    ELSIF TG_OP = 'DELETE' THEN
+                        SELECT jsonb_agg(jsonb_build_object('old', o.r)) INTO changes
+                        FROM (SELECT (SELECT jsonb_object_agg(c, to_jsonb(x) -> c) FROM unnest(TG_ARGV) c) AS r
+                              FROM old_rows x) o;
+                    ELSE
+                        -- Only watched columns matter to listeners
+                        SELECT jsonb_agg(jsonb_build_object('new', n.r, 'old', o.r)) INTO changes
+                        FROM (SELECT (SELECT jsonb_object_agg(c, to_jsonb(x) -> c) FROM unnest(TG_ARGV) c) AS r
+                              FROM new_rows x) n
+                        JOIN (SELECT (SELECT jsonb_object_agg(c, to_jsonb(x) -> c) FROM unnest(TG_ARGV) c) AS r
+                              FROM old_rows x) o ON o.r -> TG_ARGV[0] = n.r -> TG_ARGV[0]
+                        WHERE n.r IS DISTINCT FROM o.r;
+                    END IF;
+                    IF changes IS NULL THEN
+                        RETURN NULL;
+                    END IF;
+
+                    payload := jsonb_build_object('table', TG_TABLE_NAME, 'op', TG_OP, 'rows', changes)::text;
+                    IF octet_length(payload) > {FEED_CONFIG['max_payload']} THEN
+                        payload := jsonb_build_object(
+                            'table', TG_TABLE_NAME,
+                            'op', TG_OP,
+                            'overflow', TRUE,
+                            'count', jsonb_array_length(changes)
+                        )::text;
+                    END IF;
+                    PERFORM pg_notify('{CHANNEL}', payload);
+                    RETURN NULL;
+                END;
+                $$
+            """))
+    except Exception as e:
+        logger.error(f"Error creating change feed function: {str(e)}")
+        return False
+
+    for table in WATCHED_TABLES:
+        attach_change_trigger(table)
+    return True
+
+
+def attach_change_trigger(table: str) -> bool:
+    """
+    Create the change feed triggers on one watched table if they are missing
+
+    Transition tables need one trigger per event. Existing triggers are left
+    alone so importing the module takes no lock on the table.
+    """
+    args = ", ".join(f"'{column}'" for column in WATCHED_TABLES[table])
+    transitions = {
+        'INSERT': "REFERENCING NEW TABLE AS new_rows",
+        'UPDATE': "REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows",
+        'DELETE': "REFERENCING OLD TABLE AS old_rows",
+    }
+    try:
+        with engine.begin() as conn:
+            existing = conn.execute(text("""
+                SELECT tgname FROM pg_trigger
+                WHERE tgrelid = to_regclass(:table) AND NOT tgisinternal
+            """), {'table': table}).scalars().all()
+            if not existing and conn.execute(text("SELECT to_regclass(:table)"), {'table': table}).scalar() is None:
+                # Tables owned by other modules may not exist yet (e.g. registration_form)
+                logger.warning(f"Change feed trigger not created for {table}: table does not exist")
+                return False
+            if f"trg_{table}_change_feed" in existing:
+                # Row-level trigger from before statement-level notifications
+                conn.execute(text(f"DROP TRIGGER trg_{table}_change_feed ON {table}"))
+            for op, referencing in transitions.items():
+                name = f"trg_{table}_change_feed_{op.lower()}"
+                if name in existing:
+                    continue
+                conn.execute(text(f"""
+                    CREATE TRIGGER {name}
+                    AFTER {op} ON {table}
+                    {referencing}
+                    FOR EACH STATEMENT EXECUTE FUNCTION notify_census_changes({args})
+                """))
+        return True
+    except Exception as e:
+        logger.warning(f"Change feed trigger not created for {table}: {str(e)}")
+        return False
+
+
+# ---------------- Subscriptions ----------------
+class ChangeSubscription:
+    """
+    Per-session queue of change events
+
+    The listener thread pushes matching events; the session drains them on
+    its next run. If the buffer overflows, overflowed is set so the consumer
+    knows to reload in full instead of applying deltas.
+    """
+
+    def __init__(self, tables: Iterable[str], predicate: Optional[Callable[[Dict], bool]] = None):
+        self.tables = set(tables)
+        self.predicate = predicate
+        self.events = deque(maxlen=FEED_CONFIG['subscription_buffer'])
+        self.overflowed = False
+        self.lock = threading.Lock()
+
+    def push(self, event: Dict):
+        if event.get('table') not in self.tables:
+            return
+        if self.predicate and not self.predicate(event):
+            return
+        with self.lock:
+            if len(self.events) == self.events.maxlen:
+                self.overflowed = True
+            self.events.append(event)
+
+    def drain(self) -> List[Dict]:
+        with self.lock:
+            events = list(self.events)
+            self.events.clear()
+            return events
+
+    def mark_overflowed(self, table: str):
+        """A change to table could not be delivered row by row"""
+        if table in self.tables:
+            with self.lock:
+                self.overflowed = True
+
+    def reset_overflow(self) -> bool:
+        with self.lock:
+            overflowed, self.overflowed = self.overflowed, False
+            return overflowed
+
+
+class ChangeFeedListener(threading.Thread):
+    """Single LISTEN connection per process fanning notifications out to subscriptions"""
+
+    def __init__(self):
+        super().__init__(name='change-feed-listener', daemon=True)
+        self.subscriptions = weakref.WeakSet()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def subscribe(self, subscription: ChangeSubscription) -> ChangeSubscription:
+        with self.lock:
+            self.subscriptions.add(subscription)
+        return subscription
+
+    def _dispatch(self, payload: str):
+        try:
+            notification = json.loads(payload)
+            table = notification['table']
+        except (ValueError, KeyError):
+            logger.warning(f"Ignoring malformed change payload: {payload[:200]}")
+            return
+        with self.lock:
+            subscriptions = list(self.subscriptions)
+        if notification.get('overflow'):
+            for subscription in subscriptions:
+                subscription.mark_overflowed(table)
+            return
+
+        # Fan the statement's rows out as one event per row
+        key = WATCHED_TABLES.get(table, ['id'])[0]
+        for row in notification.get('rows') or []:
+            new, old = row.get('new'), row.get('old')
+            event = {
+                'table': table,
+                'op': notification.get('op'),
+                'id': (new or old or {}).get(key),
+                'new': new,
+                'old': old,
+            }
+            for subscription in subscriptions:
+                subscription.push(event)
+
+    def _listen(self):
+        raw = engine.raw_connection()
+        raw.detach()  # Held for the life of the thread, keep it out of the pool
+        dbapi_conn = getattr(raw, 'dbapi_connection', None) or raw.connection
+        dbapi_conn.autocommit = True
+        try:
+            with dbapi_conn.cursor() as cursor:
+                cursor.execute(f"LISTEN {CHANNEL}")
+            logger.info(f"Listening on {CHANNEL}")
+            while not self.stopped.is_set():
+                if select.select([dbapi_conn], [], [], FEED_CONFIG['poll_timeout']) == ([], [], []):
+                    continue
+                dbapi_conn.poll()
+                while dbapi_conn.notifies:
+                    self._dispatch(dbapi_conn.notifies.pop(0).payload)
+        finally:
+            dbapi_conn.close()
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                self._listen()
+            except Exception as e:
+                logger.error(f"Change feed listener error, reconnecting: {str(e)}")
+                # Subscribers may have missed events while disconnected
+                with self.lock:
+                    for subscription in list(self.subscriptions):
+                        subscription.overflowed = True
+                self.stopped.wait(FEED_CONFIG['reconnect_delay'])
+
+    def stop(self):
+        self.stopped.set()
+
+
+_listener: Optional[ChangeFeedListener] = None
+_listener_lock = threading.Lock()
+
+
+def get_change_listener() -> ChangeFeedListener:
+    """Process-wide listener, started on first use"""
+    global _listener
+    with _listener_lock:
+        if _listener is None:
+            _listener = ChangeFeedListener()
+            _listener.start()
+        return _listener
+
+
+def get_session_subscription(key: str, tables: Iterable[str],
+                             predicate: Optional[Callable[[Dict], bool]] = None) -> ChangeSubscription:
+    """Subscription stored in this Streamlit session, created on first use"""
+    state_key = f"change_feed_{key}"
+    if state_key not in st.session_state:
+        st.session_state[state_key] = get_change_listener().subscribe(ChangeSubscription(tables, predicate))
+    return st.session_state[state_key]
+
+
+def live_fragment(func=None, *, run_every: Optional[float] = None):
+    """
+    Re-run func every run_every seconds (default refresh_interval) where
+    Streamlit supports fragments; usable as @live_fragment or @live_fragment(run_every=1)
+    """
+    def decorate(f):
+        fragment = getattr(st, 'fragment', None)
+        if fragment is None:
+            return f
+        return fragment(run_every=run_every or FEED_CONFIG['refresh_interval'])(f)
+
+    return decorate(func) if func is not None else decorate
+
+
+# ---------------- Live Counters ----------------
+class LiveCounters:
+    """
+    Status counters loaded once per session and kept current from change events
+
+    counts[table][status] mirrors SELECT status, COUNT(*) ... GROUP BY status;
+    registration_form has no status and is counted under 'total'.
+    """
+
+    def __init__(self):
+        self.counts: Dict[str, Counter] = {}
+        self.load()
+
+    def load(self):
+        counts = {table: Counter() for table in WATCHED_TABLES}
+        for table, columns in WATCHED_TABLES.items():
+            key = "COALESCE(status, 'unknown')" if 'status' in columns else "'total'"
+            try:
+                with engine.connect() as conn:
+                    rows = conn.execute(text(f"SELECT {key}, COUNT(*) FROM {table} GROUP BY 1")).fetchall()
+            except Exception as e:
+                logger.warning(f"Live counter load failed for {table}: {str(e)}")
+                continue
+            counts[table].update({row[0]: row[1] for row in rows})
+        self.counts = counts
+
+    @staticmethod
+    def _key(row: Optional[Dict]) -> Optional[str]:
+        if row is None:
+            return None
+        return (row.get('status') or 'unknown') if 'status' in row else 'total'
+
+    def apply(self, events: List[Dict]):
+        for event in events:
+            counter = self.counts.setdefault(event['table'], Counter())
+            old_key, new_key = self._key(event.get('old')), self._key(event.get('new'))
+            if old_key == new_key:
+                continue
+            if old_key is not None:
+                counter[old_key] -= 1
+            if new_key is not None:
+                counter[new_key] += 1
+
+
+def get_live_counters() -> LiveCounters:
+    """This session's counters with every pending change applied"""
+    subscription = get_session_subscription('live_counters', WATCHED_TABLES.keys())
+    counters = st.session_state.get('live_counters')
+    if counters is None or subscription.reset_overflow():
+        subscription.drain()
+        counters = LiveCounters()
+        st.session_state['live_counters'] = counters
+    else:
+        counters.apply(subscription.drain())
+    return counters
+
+
+@live_fragment
+def render_live_counters():
+    """Compact live counters for the admin sidebar"""
+    counters = get_live_counters()
+    holders = counters.counts.get('holders', Counter())
+    assignments = counters.counts.get('agent_assignments', Counter())
+    st.markdown("**📈 Live Counters**")
+    st.caption(
+        f"Holders: {sum(holders.values())} ({holders.get('pending', 0)} pending)  \n"
+        f"Assignments: {assignments.get('assigned', 0)} assigned, "
+        f"{assignments.get('in_progress', 0)} in progress, {assignments.get('completed', 0)} completed  \n"
+        f"Registrations: {counters.counts.get('registration_form', Counter()).get('total', 0)}"
+    )
+
+
+# Run trigger setup when module is imported
+setup_change_feed()
@@ -0,0 +1,304 @@
+"""
+Field-level Conflict Resolution for Synced Holder Records
+Version columns, per-field merge rules and the reviewable sync_conflicts table
+"""
+
+import logging
+from typing import Dict, List, Optional
+
+import pandas as pd
+import streamlit as st
+from sqlalchemy import text
+
+from census_app.db import engine
+
+logger = logging.getLogger('sync_conflicts')
+
+# Per-field merge rules for holders, applied when a device edit races an
+# online edit of the same field (the field changed on the server after the
+# device last pulled the record):
+#   server_wins - keep the online value; the device value waits for review
+#   device_wins - take the device value (e.g. GPS captured on site)
+#   latest_wins - whichever edit was made last wins
+# Every race is written to sync_conflicts whichever side wins.
+HOLDER_MERGE_RULES: Dict[str, tuple] = {
+    # field: (sql type, rule)
+    'name': ('text', 'server_wins'),
+    'date_of_birth': ('date', 'server_wins'),
+    'gender': ('text', 'server_wins'),
+    'education_level': ('text', 'latest_wins'),
+    'marital_status': ('text', 'latest_wins'),
+    'phone_number': ('text', 'latest_wins'),
+    'email': ('text', 'latest_wins'),
+    'latitude': ('double precision', 'device_wins'),
+    'longitude': ('double precision', 'device_wins'),
+}
+
+
+def setup_conflict_tables():
+    """Create version columns, the field stamping trigger and sync_conflicts"""
+    tracked = ", ".join(f"'{field}'" for field in HOLDER_MERGE_RULES)
+    try:
+        with engine.begin() as conn:
+            conn.execute(text("""
+                ALTER TABLE holders
+                ADD COLUMN IF NOT EXISTS row_version BIGINT NOT NULL DEFAULT 0,
+                ADD COLUMN IF NOT EXISTS field_versions JSONB NOT NULL DEFAULT '{}'::jsonb
+            """))
+            # Stamp each tracked field with the time it last changed, unless the
+            # statement set its stamp itself (the sync path stamps device edit time)
+            conn.execute(text("""
+                CREATE OR REPLACE FUNCTION stamp_field_versions() RETURNS trigger
+                LANGUAGE plpgsql
+                AS $$
+                DECLARE
+                    stamps JSONB;
+                BEGIN
+                    SELECT COALESCE(jsonb_object_agg(n.key, to_jsonb(clock_timestamp()::timestamp)), '{}'::jsonb)
+                    INTO stamps
+                    FROM jsonb_each(to_jsonb(NEW)) n
+                    JOIN jsonb_each(to_jsonb(OLD)) o ON o.key = n.key
+                    WHERE n.key = ANY(TG_ARGV)
+                      AND n.value IS DISTINCT FROM o.value
+                      AND (NEW.field_versions -> n.key) IS NOT DISTINCT FROM (OLD.field_versions -> n.key);
+
+                    NEW.field_versions := COALESCE(NEW.field_versions, '{}'::jsonb) || stamps;
+                    NEW.row_version := COALESCE(OLD.row_version, 0) + 1;
+                    RETURN NEW;
+                END;
+                $$
+            """))
+            conn.execute(text("DROP TRIGGER IF EXISTS trg_holders_field_versions ON holders"))
+            conn.execute(text(f"""
+                CREATE TRIGGER trg_holders_field_versions
+                BEFORE UPDATE ON holders
+                FOR EACH ROW EXECUTE FUNCTION stamp_field_versions({tracked})
+            """))
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS sync_conflicts (
+                    conflict_id BIGSERIAL PRIMARY KEY,
+                    table_name VARCHAR(50) NOT NULL,
+                    record_id INTEGER NOT NULL,
+                    field_name VARCHAR(50) NOT NULL,
+                    server_value TEXT,
+                    device_value TEXT,
+                    server_changed_at TIMESTAMP,
+                    device_collected_at TIMESTAMP,
+                    agent_id INTEGER,
+                    source_row_id BIGINT,
+                    merge_rule VARCHAR(20) NOT NULL,
+                    resolution VARCHAR(10) NOT NULL,
+                    status VARCHAR(20) NOT NULL DEFAULT 'open',
+                    detected_at TIMESTAMP NOT NULL DEFAULT NOW(),
+                    resolved_at TIMESTAMP,
+                    resolved_by INTEGER
+                )
+            """))
+            conn.execute(text("""
+                CREATE INDEX IF NOT EXISTS idx_sync_conflicts_status
+                ON sync_conflicts (status, detected_at DESC)
+            """))
+        return True
+    except Exception as e:
+        logger.error(f"Error setting up conflict tables: {str(e)}")
+        return False
+
+
+def build_holder_merge_statement(source_table: str) -> str:
+    """
+    Build the single statement that merges holder_information rows field by field
+
+    Every incoming row contributes the fields its (possibly partial) payload
+    carries, and the latest value per holder and field is taken, so a {name}
+    edit followed by a {phone} edit in one chunk applies both. A field is
+    written when that value differs from the stored one and either the
+    server copy has not changed since the device's base (metadata.base_at,
+    falling back to collected_at) or its merge rule lets the device win.
+    Races are logged to sync_conflicts in the same statement.
+    """
+    candidates = []
+    for field, (sql_type, rule) in HOLDER_MERGE_RULES.items():
+        candidates.append(f"""
+            SELECT i.holder_id, i.row_id, i.agent_id, i.collected_at, i.base_at,
+                   '{field}' AS field, '{rule}' AS rule,
+                   i.data_payload->>'{field}' AS device_value,
+                   h.{field}::text AS server_value,
+                   (h.field_versions->>'{field}')::timestamp AS server_at,
+                   (i.data_payload->>'{field}')::{sql_type} IS DISTINCT FROM h.{field} AS differs
+            FROM incoming i
+            JOIN holders h ON h.holder_id = i.holder_id
+            WHERE i.data_payload->>'{field}' IS NOT NULL""")
+
+    assignments = ",\n        ".join(
+        f"{field} = CASE WHEN a.vals ? '{field}' THEN (a.vals->>'{field}')::{sql_type} ELSE h.{field} END"
+        for field, (sql_type, _) in HOLDER_MERGE_RULES.items()
+    )
+
+    return f"""
+    WITH incoming AS (
+        SELECT holder_id, row_id, agent_id, data_payload, collected_at,
+               COALESCE((metadata->>'base_at')::timestamp, collected_at) AS base_at
+        FROM {source_table}
+        WHERE data_type = 'holder_information' AND holder_id IS NOT NULL
+    ),
+    candidates AS ({' UNION ALL '.join(candidates)}
+    ),
+    changes AS (
+        SELECT * FROM (
+            SELECT DISTINCT ON (holder_id, field) *
+            FROM candidates
+            ORDER BY holder_id, field, collected_at DESC, row_id DESC
+        ) latest
+        WHERE differs
+    ),
+    decided AS (
+        SELECT c.*,
+               (c.server_at IS NOT NULL AND c.server_at > c.base_at) AS concurrent,
+               (c.server_at IS NULL OR c.server_at <= c.base_at
+                OR c.rule = 'device_wins'
+                OR (c.rule = 'latest_wins' AND c.collected_at >= c.server_at)) AS accepted
+        FROM changes c
+    ),
+    logged AS (
+        INSERT INTO sync_conflicts
+        (table_name, record_id, field_name, server_value, device_value,
+         server_changed_at, device_collected_at, agent_id, source_row_id,
+         merge_rule, resolution, status)
+        SELECT 'holders', holder_id, field, server_value, device_value,
+               server_at, collected_at, agent_id, row_id,
+               rule,
+               CASE WHEN accepted THEN 'device' ELSE 'server' END,
+               CASE WHEN accepted THEN 'auto_resolved' ELSE 'open' END
+        FROM decided
+        WHERE concurrent
+        RETURNING 1
+    ),
+    accepted AS (
+        SELECT holder_id,
+               jsonb_object_agg(field, device_value) AS vals,
+               jsonb_object_agg(field, collected_at) AS stamps
+        FROM decided
+        WHERE accepted
+        GROUP BY holder_id
+    )
+    UPDATE holders h
+    SET {assignments},
+        field_versions = COALESCE(h.field_versions, '{{}}'::jsonb) || a.stamps,
+        updated_at = NOW()
+    FROM accepted a
+    WHERE h.holder_id = a.holder_id
+    """
+
+
+# ---------------- Review ----------------
+def get_sync_conflicts(status: Optional[str] = 'open', limit: int = 50,
+                       offset: int = 0) -> List[Dict]:
+    """Get logged sync conflicts, newest first"""
+    query = """
+        SELECT c.conflict_id, c.table_name, c.record_id, h.name AS holder_name,
+               c.field_name, c.server_value, c.device_value, c.server_changed_at,
+               c.device_collected_at, c.agent_id, c.merge_rule, c.resolution,
+               c.status, c.detected_at
+        FROM sync_conflicts c
+        LEFT JOIN holders h ON c.table_name = 'holders' AND h.holder_id = c.record_id
+    """
+    params = {'lim': limit, 'off': offset}
+    if status:
+        query += " WHERE c.status = :status"
+        params['status'] = status
+    query += " ORDER BY c.detected_at DESC, c.conflict_id DESC LIMIT :lim OFFSET :off"
+
+    try:
+        with engine.connect() as conn:
+            result = conn.execute(text(query), params).mappings().all()
+            return [dict(row) for row in result]
+    except Exception as e:
+        logger.error(f"Error fetching sync conflicts: {str(e)}")
+        return []
+
+
+def resolve_conflict(conflict_id: int, keep: str, reviewer_id: Optional[int] = None) -> bool:
+    """
+    Close a conflict, writing the chosen value back if it is not the current one
+
+    Args:
+        conflict_id: Conflict to resolve
+        keep: 'server' or 'device'
+        reviewer_id: User resolving the conflict
+    """
+    if keep not in ('server', 'device'):
+        raise ValueError(f"Unknown resolution: {keep}")
+
+    try:
+        with engine.begin() as conn:
+            conflict = conn.execute(text("""
+                SELECT table_name, record_id, field_name, server_value, device_value, resolution
+                FROM sync_conflicts
+                WHERE conflict_id = :cid AND status <> 'resolved'
+                FOR UPDATE
+            """), {'cid': conflict_id}).mappings().first()
+            if not conflict:
+                return False
+
+            field = conflict['field_name']
+            if conflict['table_name'] != 'holders' or field not in HOLDER_MERGE_RULES:
+                logger.warning(f"Conflict {conflict_id} targets an unmanaged field")
+                return False
+
+            if keep != conflict['resolution']:
+                sql_type = HOLDER_MERGE_RULES[field][0]
+                value = conflict['device_value'] if keep == 'device' else conflict['server_value']
+                conn.execute(text(f"""
+                    UPDATE holders
+                    SET {field} = CAST(:value AS {sql_type}), updated_at = NOW()
+                    WHERE holder_id = :hid
+                """), {'value': value, 'hid': conflict['record_id']})
+
+            conn.execute(text("""
+                UPDATE sync_conflicts
+                SET status = 'resolved', resolution = :keep,
+                    resolved_at = NOW(), resolved_by = :uid
+                WHERE conflict_id = :cid
+            """), {'keep': keep, 'uid': reviewer_id, 'cid': conflict_id})
+        return True
+    except Exception as e:
+        logger.error(f"Error resolving conflict {conflict_id}: {str(e)}")
+        return False
+
+
+def render_conflict_review(reviewer_id: Optional[int] = None):
+    """Admin view for reviewing field conflicts raised during sync"""
+    st.subheader("⚖️ Sync Conflicts")
+
+    status = st.selectbox("Status", ["open", "auto_resolved", "resolved"], key="conflict_status")
+    conflicts = get_sync_conflicts(status=status)
+    if not conflicts:
+        st.info("No sync conflicts to review.")
+        return
+
+    df = pd.DataFrame(conflicts)
+    st.dataframe(df, use_container_width=True)
+
+    if status == "resolved":
+        return
+
+    conflict_id = st.selectbox("Conflict to resolve", df["conflict_id"].tolist(), key="conflict_pick")
+    col1, col2 = st.columns(2)
+    with col1:
+        if st.button("🖥️ Keep Server Value"):
+            if resolve_conflict(conflict_id, 'server', reviewer_id):
+                st.success(f"Conflict {conflict_id} resolved (server value kept).")
+                st.rerun()
+            else:
+                st.error("Could not resolve conflict.")
+    with col2:
+        if st.button("📱 Keep Device Value"):
+            if resolve_conflict(conflict_id, 'device', reviewer_id):
+                st.success(f"Conflict {conflict_id} resolved (device value kept).")
+                st.rerun()
+            else:
+                st.error("Could not resolve conflict.")
+
+
+# Run table setup when module is imported
+setup_conflict_tables()
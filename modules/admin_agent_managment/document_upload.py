@@ -0,0 +1,490 @@
+"""
+Resumable Chunked Document Uploads
+Interview documents arrive in checksummed chunks, are staged on disk and
+assembled server-side into local or object-store storage
+
+Devices upload through the ingestion service (ingest_service.py):
+    POST /documents/uploads                     start or resume an upload
+    PUT  /documents/uploads/<id>/chunks/<n>     one chunk, X-Chunk-Checksum: <sha256>
+    GET  /documents/uploads/<id>                status and missing chunks
+    POST /documents/uploads/<id>/complete       assemble and verify
+"""
+
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import shutil
+import time
+import uuid
+from typing import BinaryIO, Dict, Iterator, List, Optional
+from urllib import error as urlerror
+from urllib import request as urlrequest
+
+from sqlalchemy import text
+
+from census_app.db import engine
+
+logger = logging.getLogger('document_upload')
+
+UPLOAD_CONFIG = {
+    'chunk_size': 1024 * 1024,            # 1 MB, small enough for intermittent links
+    'max_chunk_bytes': 8 * 1024 * 1024,
+    'max_file_bytes': 200 * 1024 * 1024,
+    'block_size': 64 * 1024,              # streaming read/write unit
+    'storage_dir': os.getenv('DOCUMENT_STORAGE_DIR', 'uploads/documents'),
+    # Set to store assembled documents in an S3-compatible bucket instead of on disk
+    'bucket': os.getenv('DOCUMENT_STORAGE_BUCKET'),
+    'endpoint_url': os.getenv('DOCUMENT_STORAGE_ENDPOINT'),
+    'allowed_types': ['jpg', 'jpeg', 'png', 'pdf'],
+}
+
+
+def setup_document_tables():
+    """Create upload and chunk tracking tables if they don't exist"""
+    try:
+        with engine.begin() as conn:
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS document_uploads (
+                    upload_id UUID PRIMARY KEY,
+                    assignment_id INTEGER,
+                    agent_id INTEGER,
+                    document_type VARCHAR(50),
+                    file_name VARCHAR(255) NOT NULL,
+                    content_type VARCHAR(100),
+                    total_size BIGINT NOT NULL,
+                    chunk_size INTEGER NOT NULL,
+                    total_chunks INTEGER NOT NULL,
+                    file_checksum VARCHAR(64),
+                    storage_backend VARCHAR(10),
+                    storage_key TEXT,
+                    status VARCHAR(20) NOT NULL DEFAULT 'uploading',
+                    error_message TEXT,
+                    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+                    completed_at TIMESTAMP
+                )
+            """))
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS document_upload_chunks (
+                    upload_id UUID NOT NULL REFERENCES document_uploads(upload_id) ON DELETE CASCADE,
+                    chunk_index INTEGER NOT NULL,
+                    size INTEGER NOT NULL,
+                    checksum VARCHAR(64) NOT NULL,
+                    received_at TIMESTAMP NOT NULL DEFAULT NOW(),
+                    PRIMARY KEY (upload_id, chunk_index)
+                )
+            """))
+            conn.execute(text("""
+                CREATE INDEX IF NOT EXISTS idx_document_uploads_assignment
+                ON document_uploads (assignment_id, status)
+            """))
+        return True
+    except Exception as e:
+        logger.error(f"Error setting up document tables: {str(e)}")
+        return False
+
+
+# ---------------- Storage ----------------
+class _BlockReader(io.RawIOBase):
+    """File-like view over a block iterator, for streaming uploads"""
+
+    def __init__(self, blocks: Iterator[bytes]):
+        self._blocks = blocks
+        self._buffer = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buffer:
+            try:
+                self._buffer = next(self._blocks)
+            except StopIteration:
+                return 0
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+
+class DocumentStorage:
+    """
+    Stages chunks as part files on local disk and streams the assembled
+    document to its final location; subclasses decide where that is
+    """
+
+    backend = 'local'
+
+    def __init__(self, root: Optional[str] = None):
+        self.root = root or UPLOAD_CONFIG['storage_dir']
+
+    def _parts_dir(self, upload_id: str) -> str:
+        return os.path.join(self.root, '.parts', upload_id)
+
+    def _part_path(self, upload_id: str, chunk_index: int) -> str:
+        return os.path.join(self._parts_dir(upload_id), f"{chunk_index:06d}.part")
+
+    def write_part(self, upload_id: str, chunk_index: int, stream: BinaryIO,
+                   size: int, checksum: str) -> None:
+        """Stream one chunk to its part file, verifying its SHA-256 checksum"""
+        os.makedirs(self._parts_dir(upload_id), exist_ok=True)
+        final_path = self._part_path(upload_id, chunk_index)
+        tmp_path = f"{final_path}.{uuid.uuid4().hex}.tmp"
+        hasher = hashlib.sha256()
+        remaining = size
+        try:
+            with open(tmp_path, 'wb') as out:
+                while remaining > 0:
+                    block = stream.read(min(UPLOAD_CONFIG['block_size'], remaining))
+                    if not block:
+                        raise ValueError(f"Chunk {chunk_index} truncated, {remaining} bytes missing")
+                    hasher.update(block)
+                    out.write(block)
+                    remaining -= len(block)
+            if hasher.hexdigest() != checksum.lower():
+                raise ValueError(f"Checksum mismatch for chunk {chunk_index}")
+            os.replace(tmp_path, final_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def iter_parts(self, upload_id: str, total_chunks: int, hasher) -> Iterator[bytes]:
+        """Yield the document's bytes part by part, updating hasher as it goes"""
+        for chunk_index in range(total_chunks):
+            with open(self._part_path(upload_id, chunk_index), 'rb') as part:
+                while True:
+                    block = part.read(UPLOAD_CONFIG['block_size'])
+                    if not block:
+                        break
+                    hasher.update(block)
+                    yield block
+
+    def store(self, storage_key: str, reader: BinaryIO) -> None:
+        """Write the assembled document at storage_key"""
+        final_path = os.path.join(self.root, storage_key)
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        tmp_path = f"{final_path}.tmp"
+        with open(tmp_path, 'wb') as out:
+            shutil.copyfileobj(reader, out, UPLOAD_CONFIG['block_size'])
+        os.replace(tmp_path, final_path)
+
+    def discard(self, storage_key: str) -> None:
+        path = os.path.join(self.root, storage_key)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def discard_parts(self, upload_id: str) -> None:
+        shutil.rmtree(self._parts_dir(upload_id), ignore_errors=True)
+
+
+class ObjectStoreDocumentStorage(DocumentStorage):
+    """Stores assembled documents in an S3-compatible bucket (requires boto3)"""
+
+    backend = 's3'
+
+    def __init__(self, bucket: str, endpoint_url: Optional[str] = None, root: Optional[str] = None):
+        super().__init__(root)
+        try:
+            import boto3
+        except ImportError:
+            raise RuntimeError("boto3 is required for object-store document storage")
+        self.bucket = bucket
+        self.client = boto3.client('s3', endpoint_url=endpoint_url)
+
+    def store(self, storage_key: str, reader: BinaryIO) -> None:
+        # upload_fileobj streams with multipart uploads, never buffering the whole file
+        self.client.upload_fileobj(reader, self.bucket, storage_key)
+
+    def discard(self, storage_key: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=storage_key)
+
+
+def get_document_storage() -> DocumentStorage:
+    """Storage backend chosen by configuration"""
+    if UPLOAD_CONFIG['bucket']:
+        return ObjectStoreDocumentStorage(UPLOAD_CONFIG['bucket'], UPLOAD_CONFIG['endpoint_url'])
+    return DocumentStorage()
+
+
+def _safe_file_name(file_name: str) -> str:
+    name = re.sub(r'[^A-Za-z0-9._-]', '_', os.path.basename(file_name or ''))
+    return name.strip('.') or 'document'
+
+
+# ---------------- Upload Lifecycle ----------------
+def start_upload(assignment_id: Optional[int], agent_id: Optional[int], file_name: str,
+                 total_size: int, file_checksum: Optional[str] = None,
+                 content_type: Optional[str] = None, document_type: Optional[str] = None,
+                 chunk_size: Optional[int] = None) -> Dict:
+    """
+    Start an upload, or resume the unfinished one for the same file
+
+    An upload is resumed when agent, assignment, file name, size and checksum
+    match, so a device that lost its connection only sends the chunks still
+    missing, and never picks up another agent's upload.
+
+    Returns:
+        dict: upload_id, chunk_size, total_chunks and missing_chunks
+    """
+    extension = file_name.rsplit('.', 1)[-1].lower() if '.' in file_name else ''
+    if extension not in UPLOAD_CONFIG['allowed_types']:
+        raise ValueError(f"File type '{extension}' is not allowed")
+    if total_size <= 0 or total_size > UPLOAD_CONFIG['max_file_bytes']:
+        raise ValueError("Invalid file size")
+
+    if chunk_size is not None and chunk_size <= 0:
+        raise ValueError("Invalid chunk size")
+    chunk_size = min(chunk_size or UPLOAD_CONFIG['chunk_size'], UPLOAD_CONFIG['max_chunk_bytes'])
+
+    with engine.begin() as conn:
+        existing = conn.execute(text("""
+            SELECT upload_id FROM document_uploads
+            WHERE status = 'uploading'
+            AND agent_id IS NOT DISTINCT FROM :agent
+            AND assignment_id IS NOT DISTINCT FROM :aid
+            AND file_name = :name AND total_size = :size
+            AND file_checksum IS NOT DISTINCT FROM :checksum
+            ORDER BY created_at DESC
+            LIMIT 1
+        """), {'agent': agent_id, 'aid': assignment_id, 'name': file_name, 'size': total_size,
+               'checksum': file_checksum}).scalar()
+        if existing:
+            return get_upload_status(str(existing))
+
+        upload_id = str(uuid.uuid4())
+        conn.execute(text("""
+            INSERT INTO document_uploads
+            (upload_id, assignment_id, agent_id, document_type, file_name, content_type,
+             total_size, chunk_size, total_chunks, file_checksum)
+            VALUES (:uid, :aid, :agent, :dtype, :name, :ctype, :size, :chunk, :chunks, :checksum)
+        """), {
+            'uid': upload_id, 'aid': assignment_id, 'agent': agent_id,
+            'dtype': document_type, 'name': file_name, 'ctype': content_type,
+            'size': total_size, 'chunk': chunk_size,
+            'chunks': -(-total_size // chunk_size), 'checksum': file_checksum
+        })
+
+    return get_upload_status(upload_id)
+
+
+def get_upload_status(upload_id: str) -> Optional[Dict]:
+    """Get an upload's progress, including the chunk indexes still missing"""
+    with engine.connect() as conn:
+        upload = conn.execute(text("""
+            SELECT u.upload_id, u.assignment_id, u.agent_id, u.file_name, u.status, u.total_size,
+                   u.chunk_size, u.total_chunks, u.storage_key, u.error_message,
+                   COALESCE(ARRAY(
+                       SELECT g FROM generate_series(0, u.total_chunks - 1) g
+                       WHERE NOT EXISTS (
+                           SELECT 1 FROM document_upload_chunks c
+                           WHERE c.upload_id = u.upload_id AND c.chunk_index = g
+                       )
+                       ORDER BY g
+                   ), '{}') AS missing_chunks
+            FROM document_uploads u
+            WHERE u.upload_id = :uid
+        """), {'uid': upload_id}).mappings().first()
+
+    if not upload:
+        return None
+    status = dict(upload)
+    status['upload_id'] = str(status['upload_id'])
+    status['missing_chunks'] = list(status['missing_chunks'])
+    return status
+
+
+def receive_chunk(upload_id: str, chunk_index: int, stream: BinaryIO, size: int,
+                  checksum: str, storage: Optional[DocumentStorage] = None) -> Dict:
+    """
+    Stream one chunk to disk after checking it belongs to the upload
+
+    Re-sending a chunk that was already received simply replaces it.
+    """
+    storage = storage or get_document_storage()
+
+    with engine.connect() as conn:
+        upload = conn.execute(text("""
+            SELECT status, chunk_size, total_chunks, total_size
+            FROM document_uploads WHERE upload_id = :uid
+        """), {'uid': upload_id}).mappings().first()
+
+    if not upload:
+        raise LookupError("Upload not found")
+    if upload['status'] != 'uploading':
+        raise ValueError(f"Upload is {upload['status']}")
+    if not 0 <= chunk_index < upload['total_chunks']:
+        raise ValueError(f"Chunk index {chunk_index} out of range")
+
+    expected_size = upload['chunk_size']
+    if chunk_index == upload['total_chunks'] - 1:
+        expected_size = upload['total_size'] - upload['chunk_size'] * chunk_index
+    if size != expected_size:
+        raise ValueError(f"Chunk {chunk_index} should be {expected_size} bytes, got {size}")
+
+    storage.write_part(upload_id, chunk_index, stream, size, checksum)
+
+    with engine.begin() as conn:
+        conn.execute(text("""
+            INSERT INTO document_upload_chunks (upload_id, chunk_index, size, checksum)
+            VALUES (:uid, :idx, :size, :checksum)
+            ON CONFLICT (upload_id, chunk_index)
+            DO UPDATE SET size = EXCLUDED.size, checksum = EXCLUDED.checksum, received_at = NOW()
+        """), {'uid': upload_id, 'idx': chunk_index, 'size': size, 'checksum': checksum.lower()})
+
+    return {'upload_id': upload_id, 'chunk_index': chunk_index, 'received': True}
+
+
+def complete_upload(upload_id: str, storage: Optional[DocumentStorage] = None) -> Dict:
+    """
+    Assemble the received chunks into the final document
+
+    Parts are streamed straight into storage while the whole-file SHA-256 is
+    computed, so memory use stays at one block regardless of file size.
+    """
+    storage = storage or get_document_storage()
+    status = get_upload_status(upload_id)
+    if not status:
+        raise LookupError("Upload not found")
+    if status['status'] == 'complete':
+        return status
+    if status['missing_chunks']:
+        raise ValueError(f"{len(status['missing_chunks'])} chunk(s) still missing")
+
+    with engine.connect() as conn:
+        expected_checksum = conn.execute(text("""
+            SELECT file_checksum FROM document_uploads WHERE upload_id = :uid
+        """), {'uid': upload_id}).scalar()
+
+    storage_key = f"assignments/{status['assignment_id']}/{upload_id}/{_safe_file_name(status['file_name'])}"
+    hasher = hashlib.sha256()
+    storage.store(storage_key, io.BufferedReader(
+        _BlockReader(storage.iter_parts(upload_id, status['total_chunks'], hasher)),
+        UPLOAD_CONFIG['block_size']
+    ))
+    file_checksum = hasher.hexdigest()
+
+    if expected_checksum and file_checksum != expected_checksum.lower():
+        storage.discard(storage_key)
+        with engine.begin() as conn:
+            # Drop the chunk records so the client re-sends everything
+            conn.execute(text("DELETE FROM document_upload_chunks WHERE upload_id = :uid"),
+                         {'uid': upload_id})
+        storage.discard_parts(upload_id)
+        raise ValueError("Assembled file checksum does not match")
+
+    with engine.begin() as conn:
+        conn.execute(text("""
+            UPDATE document_uploads
+            SET status = 'complete', storage_backend = :backend, storage_key = :key,
+                file_checksum = :checksum, completed_at = NOW()
+            WHERE upload_id = :uid
+        """), {'backend': storage.backend, 'key': storage_key,
+               'checksum': file_checksum, 'uid': upload_id})
+    storage.discard_parts(upload_id)
+
+    logger.info(f"Assembled document {storage_key} ({status['total_size']} bytes)")
+    return get_upload_status(upload_id)
+
+
+def get_assignment_documents(assignment_id: int) -> List[Dict]:
+    """Get completed documents for an assignment"""
+    try:
+        with engine.connect() as conn:
+            result = conn.execute(text("""
+                SELECT upload_id, document_type, file_name, total_size, storage_key, completed_at
+                FROM document_uploads
+                WHERE assignment_id = :aid AND status = 'complete'
+                ORDER BY completed_at DESC
+            """), {'aid': assignment_id}).mappings().all()
+            return [dict(row) for row in result]
+    except Exception as e:
+        logger.error(f"Error fetching assignment documents: {str(e)}")
+        return []
+
+
+def upload_file_object(file_obj: BinaryIO, file_name: str, total_size: int,
+                       assignment_id: Optional[int], agent_id: Optional[int],
+                       document_type: Optional[str] = None,
+                       content_type: Optional[str] = None) -> Dict:
+    """
+    Upload a seekable file object in-process through the chunked path
+
+    Used by the Streamlit uploader; only chunks not yet received are sent, so
+    a rerun after a failure picks up where the previous attempt stopped.
+    """
+    hasher = hashlib.sha256()
+    file_obj.seek(0)
+    for block in iter(lambda: file_obj.read(UPLOAD_CONFIG['block_size']), b''):
+        hasher.update(block)
+
+    status = start_upload(assignment_id, agent_id, file_name, total_size,
+                          file_checksum=hasher.hexdigest(), content_type=content_type,
+                          document_type=document_type)
+    storage = get_document_storage()
+    for chunk_index in status['missing_chunks']:
+        file_obj.seek(chunk_index * status['chunk_size'])
+        data = file_obj.read(status['chunk_size'])
+        receive_chunk(status['upload_id'], chunk_index, io.BytesIO(data), len(data),
+                      hashlib.sha256(data).hexdigest(), storage)
+    return complete_upload(status['upload_id'], storage)
+
+
+# ---------------- Client ----------------
+def _request_json(url: str, method: str, data: bytes = None, headers: Dict = None,
+                  timeout: int = 30) -> Dict:
+    req = urlrequest.Request(url, data=data, headers=headers or {}, method=method)
+    with urlrequest.urlopen(req, timeout=timeout) as resp:
+        return json.loads(resp.read())
+
+
+def upload_document(url: str, path: str, assignment_id: Optional[int], token: str,
+                    document_type: Optional[str] = None, chunk_size: Optional[int] = None,
+                    retries: int = 5, timeout: int = 30) -> Dict:
+    """
+    Upload a file to the ingestion service in resumable chunks, as the agent
+    the token belongs to
+
+    Each chunk is retried with exponential backoff; calling again after a
+    failure resumes from the chunks the server is still missing.
+    """
+    base = f"{url.rstrip('/')}/documents/uploads"
+    auth = {'Authorization': f"Bearer {token}"}
+    total_size = os.path.getsize(path)
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(UPLOAD_CONFIG['block_size']), b''):
+            hasher.update(block)
+
+    status = _request_json(base, 'POST', json.dumps({
+        'assignment_id': assignment_id,
+        'file_name': os.path.basename(path), 'total_size': total_size,
+        'file_checksum': hasher.hexdigest(), 'document_type': document_type,
+        'chunk_size': chunk_size
+    }).encode(), {'Content-Type': 'application/json', **auth}, timeout)
+
+    upload_id = status['upload_id']
+    with open(path, 'rb') as f:
+        for chunk_index in status['missing_chunks']:
+            f.seek(chunk_index * status['chunk_size'])
+            data = f.read(status['chunk_size'])
+            for attempt in range(retries):
+                try:
+                    _request_json(f"{base}/{upload_id}/chunks/{chunk_index}", 'PUT', data, {
+                        'Content-Type': 'application/octet-stream',
+                        'X-Chunk-Checksum': hashlib.sha256(data).hexdigest(), **auth
+                    }, timeout)
+                    break
+                except (urlerror.URLError, OSError) as e:
+                    if attempt == retries - 1:
+                        raise
+                    logger.warning(f"Chunk {chunk_index} failed ({e}), retrying")
+                    time.sleep(2 ** attempt)
+
+    return _request_json(f"{base}/{upload_id}/complete", 'POST', b'{}',
+                         {'Content-Type': 'application/json', **auth}, timeout)
+
+
+# Run table setup when module is imported
+setup_document_tables()
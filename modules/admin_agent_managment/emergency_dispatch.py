@@ -0,0 +1,449 @@
+"""
+Emergency Alert Dispatch
+Raises field emergencies into an indexed open-alerts queue, pushes them to every
+connected supervisor session through the change feed and fans out email/SMS
+from a transactional outbox
+"""
+
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import streamlit as st
+from sqlalchemy import text
+
+from census_app.db import engine
+from census_app.modules.admin_agent_managment.change_feed import (
+    attach_change_trigger,
+    get_session_subscription,
+    live_fragment,
+)
+from census_app.modules.low_bandwidth import is_low_bandwidth
+
+logger = logging.getLogger('emergency_dispatch')
+
+EMERGENCY_CONFIG = {
+    'display_interval': 1,   # seconds between supervisor banner checks (target < 2 s end to end)
+    'low_bandwidth_interval': 15,  # banner checks in low-bandwidth mode
+    # Local stand-in for the email/SMS gateway: one JSON line per message
+    'outbox_dir': os.getenv('EMERGENCY_OUTBOX_DIR', 'outbox'),
+    'dispatch_interval': 5,  # seconds between outbox scans when not woken by a new alert
+    'retry_delay': 5,        # seconds before the first retry, doubled per failed attempt
+    'max_retry_delay': 300,
+}
+
+ALERT_LABELS = {
+    'safety_concern': '🆘 Safety Concern',
+    'medical_emergency': '🚑 Medical Emergency',
+    'data_breach': '🔐 Data Breach',
+}
+
+
+def setup_emergency_tables():
+    """Add dispatch columns, the open-alerts index, the notification outbox and delivery tracking tables"""
+    try:
+        with engine.begin() as conn:
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS emergency_alerts (
+                    alert_id BIGSERIAL PRIMARY KEY,
+                    agent_id INTEGER,
+                    alert_type VARCHAR(50),
+                    priority VARCHAR(20),
+                    status VARCHAR(20) DEFAULT 'active',
+                    created_at TIMESTAMP DEFAULT NOW()
+                )
+            """))
+            conn.execute(text("""
+                ALTER TABLE emergency_alerts
+                ADD COLUMN IF NOT EXISTS alert_id BIGSERIAL,
+                ADD COLUMN IF NOT EXISTS created_at TIMESTAMP DEFAULT NOW(),
+                ADD COLUMN IF NOT EXISTS details JSONB,
+                ADD COLUMN IF NOT EXISTS acknowledged_at TIMESTAMP,
+                ADD COLUMN IF NOT EXISTS acknowledged_by INTEGER,
+                ADD COLUMN IF NOT EXISTS resolved_at TIMESTAMP,
+                ADD COLUMN IF NOT EXISTS resolved_by INTEGER
+            """))
+            conn.execute(text("""
+                CREATE INDEX IF NOT EXISTS idx_emergency_alerts_open
+                ON emergency_alerts (created_at DESC)
+                WHERE status IN ('active', 'acknowledged')
+            """))
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS emergency_alert_deliveries (
+                    alert_id BIGINT NOT NULL,
+                    channel VARCHAR(10) NOT NULL,
+                    recipient VARCHAR(255) NOT NULL,
+                    delivered_at TIMESTAMP NOT NULL DEFAULT NOW(),
+                    latency_ms INTEGER,
+                    PRIMARY KEY (alert_id, channel, recipient)
+                )
+            """))
+            # Written in the same transaction as the alert; cleared once a delivery is recorded
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS emergency_notification_outbox (
+                    alert_id BIGINT PRIMARY KEY,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at TIMESTAMP NOT NULL DEFAULT NOW(),
+                    last_error TEXT,
+                    sent_at TIMESTAMP,
+                    created_at TIMESTAMP DEFAULT NOW()
+                )
+            """))
+            conn.execute(text("""
+                CREATE INDEX IF NOT EXISTS idx_emergency_notification_outbox_due
+                ON emergency_notification_outbox (next_attempt_at)
+                WHERE sent_at IS NULL
+            """))
+        # The table may be new, so make sure the change feed watches it
+        attach_change_trigger('emergency_alerts')
+        return True
+    except Exception as e:
+        logger.error(f"Error setting up emergency tables: {str(e)}")
+        return False
+
+
+# ---------------- Email/SMS Fan-out ----------------
+class LocalOutboxGateway:
+    """Stand-in for the email/SMS provider; appends each message to a JSON-lines outbox"""
+
+    def __init__(self, outbox_dir: Optional[str] = None):
+        self.outbox_dir = outbox_dir or EMERGENCY_CONFIG['outbox_dir']
+        os.makedirs(self.outbox_dir, exist_ok=True)
+        self.lock = threading.Lock()
+
+    def send(self, channel: str, recipient: str, subject: str, body: str):
+        message = {
+            'channel': channel,
+            'recipient': recipient,
+            'subject': subject,
+            'body': body,
+            'sent_at': datetime.now().isoformat()
+        }
+        with self.lock:
+            with open(os.path.join(self.outbox_dir, f"{channel}.jsonl"), 'a', encoding='utf-8') as f:
+                f.write(json.dumps(message) + '\n')
+
+
+class NotificationDispatcher(threading.Thread):
+    """
+    Sends email/SMS for raised alerts off the request path
+
+    Alerts are claimed from emergency_notification_outbox with FOR UPDATE
+    SKIP LOCKED, so several processes can run a dispatcher. A failed or
+    undeliverable alert is retried with exponential backoff until at least
+    one delivery is recorded; recipients already delivered are skipped.
+    """
+
+    def __init__(self, gateway=None):
+        super().__init__(name='emergency-notifier', daemon=True)
+        self.gateway = gateway or LocalOutboxGateway()
+        self.wake = threading.Event()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                self.dispatch_pending()
+            except Exception as e:
+                logger.error(f"Emergency outbox scan failed: {str(e)}")
+            self.wake.wait(EMERGENCY_CONFIG['dispatch_interval'])
+            self.wake.clear()
+
+    def stop(self):
+        self.stopped.set()
+        self.wake.set()
+
+    def dispatch_pending(self) -> int:
+        """Send every due outbox entry, one transaction per alert; returns alerts delivered"""
+        sent = 0
+        while not self.stopped.is_set():
+            with engine.begin() as conn:
+                alert = conn.execute(text("""
+                    SELECT o.alert_id, o.attempts, e.agent_id, e.alert_type, e.priority, e.created_at
+                    FROM emergency_notification_outbox o
+                    JOIN emergency_alerts e ON e.alert_id = o.alert_id
+                    WHERE o.sent_at IS NULL AND o.next_attempt_at <= NOW()
+                    ORDER BY o.next_attempt_at
+                    LIMIT 1
+                    FOR UPDATE OF o SKIP LOCKED
+                """)).mappings().first()
+                if alert is None:
+                    return sent
+
+                try:
+                    with conn.begin_nested():
+                        error = None if self._notify(conn, dict(alert)) else "no deliverable recipients"
+                except Exception as e:
+                    error = str(e)
+
+                if error is None:
+                    conn.execute(text("""
+                        UPDATE emergency_notification_outbox
+                        SET sent_at = NOW(), attempts = attempts + 1, last_error = NULL
+                        WHERE alert_id = :alert_id
+                    """), {'alert_id': alert['alert_id']})
+                    sent += 1
+                    continue
+
+                delay = min(EMERGENCY_CONFIG['retry_delay'] * 2 ** alert['attempts'],
+                            EMERGENCY_CONFIG['max_retry_delay'])
+                conn.execute(text("""
+                    UPDATE emergency_notification_outbox
+                    SET attempts = attempts + 1, last_error = :error,
+                        next_attempt_at = NOW() + make_interval(secs => :delay)
+                    WHERE alert_id = :alert_id
+                """), {'alert_id': alert['alert_id'], 'error': error, 'delay': delay})
+                logger.error(f"Emergency notification failed for alert {alert['alert_id']} "
+                             f"(attempt {alert['attempts'] + 1}, retry in {delay}s): {error}")
+        return sent
+
+    def _notify(self, conn, alert: Dict) -> int:
+        """Send to every recipient not yet delivered and record the deliveries; returns deliveries recorded"""
+        supervisors = conn.execute(text("""
+            SELECT id, username, email FROM users
+            WHERE LOWER(role) = 'admin' AND COALESCE(status, 'active') IN ('active', 'approved')
+        """)).mappings().all()
+        agent = conn.execute(text("""
+            SELECT a.full_name, a.agent_code, i.island_name
+            FROM agents a
+            LEFT JOIN islands i ON a.assigned_island_id = i.island_id
+            WHERE a.agent_id = :aid
+        """), {'aid': alert['agent_id']}).mappings().first() or {}
+        delivered = {(row[0], row[1]) for row in conn.execute(text("""
+            SELECT channel, recipient FROM emergency_alert_deliveries
+            WHERE alert_id = :alert_id AND channel IN ('email', 'sms')
+        """), {'alert_id': alert['alert_id']}).fetchall()}
+
+        label = ALERT_LABELS.get(alert['alert_type'], alert['alert_type'])
+        subject = f"[{alert['priority'].upper()}] {label} - {agent.get('full_name', 'Agent')} ({agent.get('agent_code', alert['agent_id'])})"
+        body = (f"{label} raised at {alert['created_at']} by {agent.get('full_name', 'agent')} "
+                f"on {agent.get('island_name') or 'unknown island'}.")
+
+        recipients = [('email', supervisor['email']) for supervisor in supervisors if supervisor['email']]
+        # One SMS to the on-call line per alert
+        sms_to = os.getenv('EMERGENCY_SMS_NUMBER')
+        if sms_to:
+            recipients.append(('sms', sms_to))
+
+        deliveries = []
+        for channel, recipient in recipients:
+            if (channel, recipient) not in delivered:
+                self.gateway.send(channel, recipient, subject, body if channel == 'email' else subject)
+                deliveries.append((channel, recipient))
+
+        if deliveries:
+            conn.execute(text("""
+                INSERT INTO emergency_alert_deliveries (alert_id, channel, recipient, latency_ms)
+                SELECT :alert_id, d->>'channel', d->>'recipient',
+                       (EXTRACT(EPOCH FROM clock_timestamp() - a.created_at) * 1000)::integer
+                FROM jsonb_array_elements(CAST(:deliveries AS JSONB)) d
+                CROSS JOIN emergency_alerts a
+                WHERE a.alert_id = :alert_id
+                ON CONFLICT DO NOTHING
+            """), {'alert_id': alert['alert_id'], 'deliveries': json.dumps(
+                [{'channel': c, 'recipient': r} for c, r in deliveries])})
+        return len(deliveries) + len(delivered)
+
+
+_dispatcher: Optional[NotificationDispatcher] = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_notification_dispatcher() -> NotificationDispatcher:
+    """Process-wide notifier, started on first use"""
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = NotificationDispatcher()
+            _dispatcher.start()
+        return _dispatcher
+
+
+# ---------------- Raising Alerts ----------------
+def raise_emergency_alert(agent_id: int, alert_type: str, priority: str,
+                          details: Optional[Dict] = None) -> Optional[int]:
+    """
+    Record an emergency and start its fan-out
+
+    The insert fires the change feed trigger, so connected supervisor sessions
+    see it on their next banner check. The outbox row is written in the same
+    transaction, so email/SMS go out on a background thread even if this
+    process dies before sending.
+
+    Returns:
+        int: alert_id, or None if the alert could not be recorded
+    """
+    try:
+        with engine.begin() as conn:
+            alert = conn.execute(text("""
+                INSERT INTO emergency_alerts (agent_id, alert_type, priority, status, details, created_at)
+                VALUES (:aid, :atype, :priority, 'active', CAST(:details AS JSONB), clock_timestamp())
+                RETURNING alert_id, agent_id, alert_type, priority, created_at
+            """), {'aid': agent_id, 'atype': alert_type, 'priority': priority,
+                   'details': json.dumps(details) if details else None}).mappings().first()
+            conn.execute(text("""
+                INSERT INTO emergency_notification_outbox (alert_id) VALUES (:alert_id)
+            """), {'alert_id': alert['alert_id']})
+    except Exception as e:
+        logger.error(f"Error raising {alert_type} alert for agent {agent_id}: {str(e)}")
+        return None
+
+    get_notification_dispatcher().wake.set()
+    logger.warning(f"Emergency {alert_type} ({priority}) raised by agent {agent_id}, alert {alert['alert_id']}")
+    return alert['alert_id']
+
+
+# Alert row with the agent and island shown on the banner
+_ALERT_SELECT = """
+    SELECT e.alert_id, e.agent_id, e.alert_type, e.priority, e.status, e.created_at,
+           e.acknowledged_at, a.full_name, a.agent_code, i.island_name
+    FROM emergency_alerts e
+    LEFT JOIN agents a ON a.agent_id = e.agent_id
+    LEFT JOIN islands i ON i.island_id = a.assigned_island_id
+"""
+
+
+def get_open_alerts(limit: int = 50) -> List[Dict]:
+    """Active and acknowledged alerts, newest first (served by the partial index)"""
+    with engine.connect() as conn:
+        result = conn.execute(text(f"""
+            {_ALERT_SELECT}
+            WHERE e.status IN ('active', 'acknowledged')
+            ORDER BY e.created_at DESC
+            LIMIT :lim
+        """), {'lim': limit}).mappings().all()
+        return [dict(row) for row in result]
+
+
+def get_open_alert(alert_id: int) -> Optional[Dict]:
+    """One alert by primary key, if it is still active or acknowledged"""
+    with engine.connect() as conn:
+        row = conn.execute(text(f"""
+            {_ALERT_SELECT}
+            WHERE e.alert_id = :aid AND e.status IN ('active', 'acknowledged')
+        """), {'aid': alert_id}).mappings().first()
+        return dict(row) if row else None
+
+
+def update_alert_status(alert_id: int, status: str, user_id: Optional[int] = None) -> bool:
+    """Acknowledge or resolve an alert"""
+    column = {'acknowledged': 'acknowledged', 'resolved': 'resolved'}.get(status)
+    if not column:
+        raise ValueError(f"Unknown alert status: {status}")
+    try:
+        with engine.begin() as conn:
+            conn.execute(text(f"""
+                UPDATE emergency_alerts
+                SET status = :status, {column}_at = NOW(), {column}_by = :uid
+                WHERE alert_id = :alert_id
+            """), {'status': status, 'uid': user_id, 'alert_id': alert_id})
+        return True
+    except Exception as e:
+        logger.error(f"Error updating alert {alert_id}: {str(e)}")
+        return False
+
+
+def record_alert_display(alert_id: int, user_id: Optional[int]):
+    """Record when an alert first reached a supervisor screen, with trigger-to-display latency"""
+    try:
+        with engine.begin() as conn:
+            conn.execute(text("""
+                INSERT INTO emergency_alert_deliveries (alert_id, channel, recipient, latency_ms)
+                SELECT alert_id, 'screen', :recipient,
+                       (EXTRACT(EPOCH FROM clock_timestamp() - created_at) * 1000)::integer
+                FROM emergency_alerts WHERE alert_id = :alert_id
+                ON CONFLICT DO NOTHING
+            """), {'alert_id': alert_id, 'recipient': str(user_id)})
+    except Exception as e:
+        logger.error(f"Error recording alert display: {str(e)}")
+
+
+def get_alert_latency_stats(days: int = 7) -> Dict:
+    """p50/p95 trigger-to-display and trigger-to-send latency per channel"""
+    with engine.connect() as conn:
+        result = conn.execute(text("""
+            SELECT channel, COUNT(*) AS deliveries,
+                   ROUND(percentile_cont(0.5) WITHIN GROUP (ORDER BY latency_ms)) AS p50_ms,
+                   ROUND(percentile_cont(0.95) WITHIN GROUP (ORDER BY latency_ms)) AS p95_ms
+            FROM emergency_alert_deliveries
+            WHERE delivered_at >= NOW() - make_interval(days => :days)
+            GROUP BY channel
+        """), {'days': days}).mappings().all()
+        return {row['channel']: dict(row) for row in result}
+
+
+# ---------------- Supervisor Banner ----------------
+def render_emergency_alert_banner(user_id: Optional[int] = None):
+    """
+    Open emergencies for connected supervisors
+
+    Checked every display_interval seconds, or every low_bandwidth_interval
+    in low-bandwidth mode since each check is a websocket round trip.
+    """
+    if is_low_bandwidth():
+        _render_alert_banner_slow(user_id)
+    else:
+        _render_alert_banner_live(user_id)
+
+
+def _render_alert_banner(user_id: Optional[int] = None):
+    """
+    Open alerts are loaded once per session; afterwards only change-feed
+    deltas are applied, with a primary-key lookup for each new alert.
+    """
+    # Supervisor processes drain outbox entries left behind by processes that stopped
+    get_notification_dispatcher()
+    subscription = get_session_subscription('emergency_alerts', ['emergency_alerts'])
+    alerts = st.session_state.get('open_emergency_alerts')
+
+    if alerts is None or subscription.reset_overflow():
+        subscription.drain()
+        alerts = {alert['alert_id']: alert for alert in get_open_alerts()}
+    else:
+        for event in subscription.drain():
+            alert_id = event.get('id')
+            status = (event.get('new') or {}).get('status')
+            if event['op'] == 'DELETE' or status not in ('active', 'acknowledged'):
+                alerts.pop(alert_id, None)
+            elif alert_id in alerts:
+                alerts[alert_id]['status'] = status
+            else:
+                fresh = get_open_alert(alert_id)
+                if fresh:
+                    alerts[alert_id] = fresh
+    st.session_state['open_emergency_alerts'] = alerts
+
+    shown = st.session_state.setdefault('displayed_emergency_alerts', set())
+    for alert_id, alert in sorted(alerts.items(), key=lambda item: item[1]['created_at'], reverse=True):
+        if alert_id not in shown:
+            record_alert_display(alert_id, user_id)
+            shown.add(alert_id)
+            st.toast(f"🚨 {ALERT_LABELS.get(alert['alert_type'], alert['alert_type'])}")
+
+        label = ALERT_LABELS.get(alert['alert_type'], alert['alert_type'])
+        message = (f"**{label}** ({alert['priority']}) - {alert.get('full_name') or 'Agent'} "
+                   f"({alert.get('agent_code') or alert['agent_id']}), {alert.get('island_name') or 'unknown island'} "
+                   f"at {alert['created_at']:%H:%M:%S}")
+        col_alert = st.columns([5, 1, 1])
+        with col_alert[0]:
+            if alert['status'] == 'active':
+                st.error(message)
+            else:
+                st.warning(f"{message} - acknowledged")
+        with col_alert[1]:
+            if alert['status'] == 'active' and st.button("👀 Ack", key=f"ack_alert_{alert_id}"):
+                update_alert_status(alert_id, 'acknowledged', user_id)
+        with col_alert[2]:
+            if st.button("✅ Resolve", key=f"resolve_alert_{alert_id}"):
+                update_alert_status(alert_id, 'resolved', user_id)
+
+
+_render_alert_banner_live = live_fragment(run_every=EMERGENCY_CONFIG['display_interval'])(_render_alert_banner)
+_render_alert_banner_slow = live_fragment(run_every=EMERGENCY_CONFIG['low_bandwidth_interval'])(_render_alert_banner)
+
+
+# Run table setup when module is imported
+setup_emergency_tables()
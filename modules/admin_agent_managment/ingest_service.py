@@ -0,0 +1,878 @@
+"""
+Bulk Sync Ingestion Service
+Standalone HTTP service that accepts batched uploads from many field devices,
+stages them with COPY and applies them to the census tables in set-based merges
+
+Every endpoint except /health needs an agent token (Authorization: Bearer ...);
+the agent is taken from the token, never from the request body.
+
+Run locally:
+    python -m census_app.modules.admin_agent_managment.ingest_service issue-token --agent 42
+    python -m census_app.modules.admin_agent_managment.ingest_service serve --port 8502
+    python -m census_app.modules.admin_agent_managment.ingest_service loadtest --agents 200 --confirm
+
+The load test uses synthetic tokens: rows uploaded with them are staged and
+counted like real ones, but never applied to the census tables or recorded
+in offline_data_queue, and the tokens are revoked when the run ends.
+"""
+
+import argparse
+import csv
+import hashlib
+import io
+import json
+import logging
+import secrets
+import statistics
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib import error as urlerror
+from urllib import request as urlrequest
+
+from sqlalchemy import text
+
+from census_app.db import engine
+from census_app.modules.admin_agent_managment.document_upload import (
+    UPLOAD_CONFIG,
+    complete_upload,
+    get_upload_status,
+    receive_chunk,
+    start_upload,
+)
+from census_app.modules.admin_agent_managment.offline_bundle import build_offline_bundle, compress_bundle
+from census_app.modules.admin_agent_managment.sync_appliers import (
+    APPLY_ROWS_TABLE,
+    SYNTHETIC_ROW_FILTER,
+    apply_sync_rows,
+    create_apply_rows_table,
+)
+from census_app.modules.admin_agent_managment.sync_telemetry import (
+    prune_batch_metrics_daily,
+    record_working_set_metrics,
+)
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger('sync_ingest')
+
+INGEST_CONFIG = {
+    'host': '127.0.0.1',        # put a TLS-terminating proxy in front to serve devices
+    'port': 8502,
+    'max_batch_items': 500,
+    'max_body_bytes': 10 * 1024 * 1024,
+    'apply_chunk_size': 5000,   # staged rows merged per transaction
+    'apply_interval': 2,        # seconds between idle applier passes
+}
+
+STAGING_COLUMNS = [
+    'batch_id', 'item_id', 'agent_id', 'holder_id', 'device_id', 'data_type',
+    'data_payload', 'checksum', 'metadata', 'collected_at'
+]
+
+
+# ---------------- Schema ----------------
+def setup_ingest_tables():
+    """Create ingestion batch and staging tables if they don't exist"""
+    try:
+        with engine.begin() as conn:
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS sync_ingest_batches (
+                    batch_id UUID PRIMARY KEY,
+                    agent_id INTEGER NOT NULL,
+                    device_id VARCHAR(100),
+                    item_count INTEGER NOT NULL DEFAULT 0,
+                    rejected_count INTEGER NOT NULL DEFAULT 0,
+                    payload_bytes INTEGER NOT NULL DEFAULT 0,
+                    received_at TIMESTAMP NOT NULL DEFAULT NOW(),
+                    applied_at TIMESTAMP,
+                    status VARCHAR(20) NOT NULL DEFAULT 'staged'
+                )
+            """))
+            # Staging rows are rewritten once and then deleted; keep them out of WAL
+            conn.execute(text("""
+                CREATE UNLOGGED TABLE IF NOT EXISTS sync_ingest_staging (
+                    staging_id BIGSERIAL PRIMARY KEY,
+                    batch_id UUID NOT NULL,
+                    item_id VARCHAR(64),
+                    agent_id INTEGER NOT NULL,
+                    holder_id INTEGER,
+                    device_id VARCHAR(100),
+                    data_type VARCHAR(50) NOT NULL,
+                    data_payload JSONB NOT NULL,
+                    checksum VARCHAR(64),
+                    metadata JSONB,
+                    collected_at TIMESTAMP,
+                    received_at TIMESTAMP NOT NULL DEFAULT NOW(),
+                    apply_status VARCHAR(20) NOT NULL DEFAULT 'staged',
+                    applied_at TIMESTAMP,
+                    error_message TEXT
+                )
+            """))
+            conn.execute(text("""
+                CREATE INDEX IF NOT EXISTS idx_sync_ingest_staging_staged
+                ON sync_ingest_staging (staging_id)
+                WHERE apply_status = 'staged'
+            """))
+            conn.execute(text("""
+                CREATE INDEX IF NOT EXISTS idx_sync_ingest_staging_batch
+                ON sync_ingest_staging (batch_id)
+            """))
+            # Only a SHA-256 of each token is stored
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS sync_agent_tokens (
+                    token_hash CHAR(64) PRIMARY KEY,
+                    agent_id INTEGER NOT NULL,
+                    label VARCHAR(100),
+                    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+                    last_used_at TIMESTAMP,
+                    revoked_at TIMESTAMP
+                )
+            """))
+            # Load-test tokens: their rows are staged but never applied
+            conn.execute(text("""
+                ALTER TABLE sync_agent_tokens ADD COLUMN IF NOT EXISTS synthetic BOOLEAN NOT NULL DEFAULT FALSE
+            """))
+        return True
+    except Exception as e:
+        logger.error(f"Error setting up ingest tables: {str(e)}")
+        return False
+
+
+# ---------------- Agent Tokens ----------------
+def _token_hash(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def issue_agent_token(agent_id: int, label: Optional[str] = None, synthetic: bool = False) -> str:
+    """
+    Create a device token for an agent; the token itself is only returned here
+
+    Rows uploaded with a synthetic token are marked load_test and never applied.
+    """
+    token = secrets.token_urlsafe(32)
+    with engine.begin() as conn:
+        conn.execute(text("""
+            INSERT INTO sync_agent_tokens (token_hash, agent_id, label, synthetic)
+            VALUES (:hash, :aid, :label, :synthetic)
+        """), {'hash': _token_hash(token), 'aid': agent_id, 'label': label, 'synthetic': synthetic})
+    logger.info(f"Issued {'synthetic ' if synthetic else ''}sync token for agent {agent_id}")
+    return token
+
+
+def revoke_token(token: str) -> bool:
+    """Revoke one token, leaving the agent's other devices signed in"""
+    with engine.begin() as conn:
+        return conn.execute(text("""
+            UPDATE sync_agent_tokens SET revoked_at = NOW()
+            WHERE token_hash = :hash AND revoked_at IS NULL
+        """), {'hash': _token_hash(token)}).rowcount > 0
+
+
+def revoke_agent_tokens(agent_id: int) -> int:
+    """Revoke every active token of an agent"""
+    with engine.begin() as conn:
+        return conn.execute(text("""
+            UPDATE sync_agent_tokens SET revoked_at = NOW()
+            WHERE agent_id = :aid AND revoked_at IS NULL
+        """), {'aid': agent_id}).rowcount
+
+
+def authenticate_agent(token: Optional[str]) -> Optional[Tuple[int, bool]]:
+    """(agent ID, synthetic) for an active token, or None"""
+    if not token:
+        return None
+    with engine.begin() as conn:
+        row = conn.execute(text("""
+            UPDATE sync_agent_tokens SET last_used_at = NOW()
+            WHERE token_hash = :hash AND revoked_at IS NULL
+            RETURNING agent_id, synthetic
+        """), {'hash': _token_hash(token)}).first()
+    return (row.agent_id, row.synthetic) if row else None
+
+
+# ---------------- Staging ----------------
+def _generate_checksum(data: Dict) -> str:
+    """Same MD5 checksum the device computes in OfflineDataCollector"""
+    data_string = json.dumps(data, sort_keys=True, separators=(',', ':'))
+    return hashlib.md5(data_string.encode()).hexdigest()
+
+
+def stage_batch(agent_id: int, device_id: str, items: List[Dict], synthetic: bool = False) -> Dict:
+    """
+    Validate a device batch and COPY it into the staging table
+
+    Args:
+        agent_id: Agent that uploaded the batch
+        device_id: Device identifier
+        items: Queued items as produced by OfflineDataCollector.queue_data
+        synthetic: Uploaded with a load-test token; rows are marked load_test
+
+    Returns:
+        dict: batch_id, accepted count and rejected item ids with reasons
+    """
+    batch_id = str(uuid.uuid4())
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    accepted = 0
+    rejected = []
+
+    for item in items:
+        payload = item.get('data_payload')
+        data_type = item.get('data_type')
+        if not data_type or not isinstance(payload, dict):
+            rejected.append({'item_id': item.get('item_id'), 'error': 'Malformed item'})
+            continue
+        if item.get('checksum') and item['checksum'] != _generate_checksum(payload):
+            rejected.append({'item_id': item.get('item_id'), 'error': 'Checksum mismatch'})
+            continue
+        # Only the server decides what is load-test data
+        metadata = {key: value for key, value in (item.get('metadata') or {}).items() if key != 'load_test'}
+        if synthetic:
+            metadata['load_test'] = True
+
+        writer.writerow([
+            batch_id,
+            item.get('item_id'),
+            agent_id,
+            item.get('holder_id'),
+            device_id,
+            data_type,
+            json.dumps(payload),
+            item.get('checksum'),
+            json.dumps(metadata),
+            item.get('collected_at') or datetime.now().isoformat(),
+        ])
+        accepted += 1
+
+    payload_bytes = buffer.tell()
+
+    raw_conn = engine.raw_connection()
+    try:
+        with raw_conn.cursor() as cur:
+            cur.execute("""
+                INSERT INTO sync_ingest_batches
+                (batch_id, agent_id, device_id, item_count, rejected_count, payload_bytes, status)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+            """, (batch_id, agent_id, device_id, accepted, len(rejected), payload_bytes,
+                  'staged' if accepted else 'rejected'))
+            if accepted:
+                buffer.seek(0)
+                cur.copy_expert(
+                    f"COPY sync_ingest_staging ({', '.join(STAGING_COLUMNS)}) "
+                    f"FROM STDIN WITH (FORMAT csv)",
+                    buffer
+                )
+        raw_conn.commit()
+    except Exception:
+        raw_conn.rollback()
+        raise
+    finally:
+        raw_conn.close()
+
+    logger.info(f"Staged batch {batch_id}: {accepted} accepted, {len(rejected)} rejected "
+                f"(agent {agent_id}, {payload_bytes} bytes)")
+
+    return {'batch_id': batch_id, 'accepted': accepted, 'rejected': rejected}
+
+
+# ---------------- Applying ----------------
+def _drop_already_synced(conn) -> int:
+    """
+    Remove staged items whose item_id is already in offline_data_queue
+
+    Devices re-send items when an upload or status check times out; those
+    items were applied before and must not be applied again. Batches left
+    with nothing to apply are marked applied, so devices mark them synced.
+    """
+    batch_ids = conn.execute(text("""
+        DELETE FROM sync_ingest_staging s
+        WHERE s.apply_status = 'staged'
+        AND EXISTS (SELECT 1 FROM offline_data_queue q WHERE q.item_id = s.item_id)
+        RETURNING s.batch_id
+    """)).scalars().all()
+    if batch_ids:
+        conn.execute(text("""
+            UPDATE sync_ingest_batches b
+            SET status = 'applied', applied_at = NOW()
+            WHERE b.batch_id = ANY(CAST(:ids AS UUID[])) AND b.status = 'staged'
+            AND NOT EXISTS (
+                SELECT 1 FROM sync_ingest_staging p
+                WHERE p.batch_id = b.batch_id AND p.apply_status IN ('staged', 'failed')
+            )
+        """), {'ids': sorted({str(batch_id) for batch_id in batch_ids})})
+        logger.info(f"Dropped {len(batch_ids)} staged items that were already synced")
+    return len(batch_ids)
+
+
+def apply_staged(limit: Optional[int] = None) -> Dict:
+    """
+    Merge one chunk of staged rows into the census tables
+
+    Rows are claimed with FOR UPDATE SKIP LOCKED, so several appliers can run
+    against the same staging table without applying a row twice.
+
+    Returns:
+        dict: claimed row count, rows affected per data type, failures per data type
+    """
+    limit = limit or INGEST_CONFIG['apply_chunk_size']
+
+    with engine.begin() as conn:
+        _drop_already_synced(conn)
+        create_apply_rows_table(conn)
+        claimed = conn.execute(text(f"""
+            WITH claimed AS (
+                UPDATE sync_ingest_staging s
+                SET apply_status = 'applied', applied_at = NOW()
+                WHERE s.staging_id IN (
+                    SELECT staging_id FROM sync_ingest_staging
+                    WHERE apply_status = 'staged'
+                    ORDER BY staging_id
+                    LIMIT :lim
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING s.staging_id, s.agent_id, s.holder_id, s.device_id,
+                          s.data_type, s.data_payload, s.metadata, s.collected_at, s.received_at
+            )
+            INSERT INTO {APPLY_ROWS_TABLE}
+            (row_id, agent_id, holder_id, device_id, data_type, data_payload, metadata, collected_at, received_at)
+            SELECT staging_id, agent_id, holder_id, device_id,
+                   data_type, data_payload, metadata, collected_at, received_at
+            FROM claimed
+        """), {'lim': limit}).rowcount
+
+        if not claimed:
+            return {'claimed': 0, 'applied': {}, 'failures': {}}
+
+        apply_started = time.perf_counter()
+        applied, failures = apply_sync_rows(conn)
+        record_working_set_metrics(conn, 'ingest', (time.perf_counter() - apply_started) * 1000, failures)
+
+        for data_type, error_message in failures.items():
+            conn.execute(text(f"""
+                UPDATE sync_ingest_staging
+                SET apply_status = 'failed', error_message = :err
+                WHERE staging_id IN (
+                    SELECT row_id FROM {APPLY_ROWS_TABLE} WHERE data_type = :dtype
+                )
+            """), {'err': error_message, 'dtype': data_type})
+
+        # Same audit trail the in-session sync writes through save_to_database
+        conn.execute(text(f"""
+            INSERT INTO offline_data_queue
+            (item_id, agent_id, holder_id, device_id, data_type, data_payload,
+             collected_at, sync_status, synced_at, checksum, metadata, priority)
+            SELECT s.item_id, r.agent_id, r.holder_id, r.device_id, r.data_type, r.data_payload,
+                   r.collected_at, 'synced', NOW(), s.checksum, r.metadata,
+                   COALESCE(r.metadata->>'priority', 'normal')
+            FROM {APPLY_ROWS_TABLE} r
+            JOIN sync_ingest_staging s ON s.staging_id = r.row_id
+            WHERE s.apply_status = 'applied'
+            AND NOT COALESCE(r.{SYNTHETIC_ROW_FILTER}, FALSE)
+            ON CONFLICT (item_id) WHERE item_id IS NOT NULL DO NOTHING
+        """))
+
+        conn.execute(text(f"""
+            UPDATE sync_ingest_batches b
+            SET status = CASE WHEN EXISTS (
+                                  SELECT 1 FROM sync_ingest_staging f
+                                  WHERE f.batch_id = b.batch_id AND f.apply_status = 'failed'
+                              ) THEN 'partial' ELSE 'applied' END,
+                applied_at = NOW()
+            WHERE b.batch_id IN (
+                SELECT DISTINCT s.batch_id FROM sync_ingest_staging s
+                JOIN {APPLY_ROWS_TABLE} r ON r.row_id = s.staging_id
+            )
+            AND NOT EXISTS (
+                SELECT 1 FROM sync_ingest_staging p
+                WHERE p.batch_id = b.batch_id AND p.apply_status = 'staged'
+            )
+        """))
+
+        # Applied rows live on in offline_data_queue; only failures stay staged for review
+        conn.execute(text(f"""
+            DELETE FROM sync_ingest_staging
+            WHERE apply_status = 'applied'
+            AND staging_id IN (SELECT row_id FROM {APPLY_ROWS_TABLE})
+        """))
+
+    logger.info(f"Applied {claimed} staged rows: {applied}" +
+                (f", failures: {list(failures)}" if failures else ""))
+
+    return {'claimed': claimed, 'applied': applied, 'failures': failures}
+
+
+def get_batch_status(batch_id: str) -> Optional[Dict]:
+    """Get the status of an uploaded batch"""
+    with engine.connect() as conn:
+        batch = conn.execute(text("""
+            SELECT batch_id, agent_id, device_id, item_count, rejected_count,
+                   payload_bytes, received_at, applied_at, status
+            FROM sync_ingest_batches
+            WHERE batch_id = :bid
+        """), {'bid': batch_id}).mappings().first()
+        if not batch:
+            return None
+
+        errors = conn.execute(text("""
+            SELECT item_id, data_type, error_message
+            FROM sync_ingest_staging
+            WHERE batch_id = :bid AND apply_status = 'failed'
+        """), {'bid': batch_id}).mappings().all()
+
+    status = dict(batch)
+    status['batch_id'] = str(status['batch_id'])
+    status['errors'] = [dict(row) for row in errors]
+    return status
+
+
+class StagedRowApplier(threading.Thread):
+    """Background thread that drains the staging table in set-based chunks"""
+
+    def __init__(self, interval: float = None):
+        super().__init__(name='sync-ingest-applier', daemon=True)
+        self.interval = interval or INGEST_CONFIG['apply_interval']
+        self.wake = threading.Event()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                result = apply_staged()
+                if result['claimed']:
+                    continue  # More may be waiting, keep draining
+                prune_batch_metrics_daily()
+            except Exception as e:
+                logger.error(f"Applier pass failed: {str(e)}")
+            self.wake.wait(self.interval)
+            self.wake.clear()
+
+    def stop(self):
+        self.stopped.set()
+        self.wake.set()
+
+
+# ---------------- HTTP Service ----------------
+class IngestRequestHandler(BaseHTTPRequestHandler):
+    """
+    Endpoints (all but /health need "Authorization: Bearer <agent token>"):
+        POST /sync/batches          {"device_id", "items": [...]}
+        GET  /sync/batches/<id>     batch status, for the agent's own batches
+        POST /offline/bundles       {"known_etags", "reference_etag"}, honours If-None-Match
+        GET  /health
+
+    plus the resumable document upload endpoints listed in document_upload.py
+    """
+
+    applier: Optional[StagedRowApplier] = None
+    synthetic = False
+
+    def _send_json(self, status: int, body: Dict):
+        data = json.dumps(body, default=str).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _authenticate(self) -> Optional[int]:
+        """
+        Agent ID from the bearer token; sends 401 and returns None when missing or invalid.
+        Sets self.synthetic for load-test tokens.
+        """
+        header = self.headers.get('Authorization') or ''
+        token = header[7:].strip() if header.lower().startswith('bearer ') else None
+        try:
+            identity = authenticate_agent(token)
+        except Exception as e:
+            logger.error(f"Token check failed: {str(e)}")
+            self._send_json(503, {'error': 'Authentication unavailable, retry later'})
+            return None
+        if identity is None:
+            self._send_json(401, {'error': 'Valid agent token required'})
+            return None
+        agent_id, self.synthetic = identity
+        return agent_id
+
+    def _owned_upload(self, upload_id: str, agent_id: int) -> Optional[Dict]:
+        """Upload status if it belongs to the agent; sends 404 otherwise"""
+        status = get_upload_status(upload_id)
+        if not status or status.get('agent_id') != agent_id:
+            self._send_json(404, {'error': 'Upload not found'})
+            return None
+        return status
+
+    def do_GET(self):
+        if self.path == '/health':
+            self._send_json(200, {'status': 'ok'})
+            return
+        agent_id = self._authenticate()
+        if agent_id is None:
+            return
+        if self.path.startswith('/documents/uploads/'):
+            try:
+                status = self._owned_upload(self.path.rsplit('/', 1)[-1], agent_id)
+            except Exception as e:
+                self._send_json(400, {'error': str(e)})
+                return
+            if status:
+                self._send_json(200, status)
+        elif self.path.startswith('/sync/batches/'):
+            batch_id = self.path.rsplit('/', 1)[-1]
+            try:
+                status = get_batch_status(batch_id)
+            except Exception as e:
+                self._send_json(400, {'error': str(e)})
+                return
+            if status and status['agent_id'] == agent_id:
+                self._send_json(200, status)
+            else:
+                self._send_json(404, {'error': 'Batch not found'})
+        else:
+            self._send_json(404, {'error': 'Not found'})
+
+    def do_POST(self):
+        agent_id = self._authenticate()
+        if agent_id is None:
+            return
+        if self.path.startswith('/documents/uploads'):
+            if self.synthetic:
+                self._send_json(403, {'error': 'Load-test tokens cannot upload documents'})
+                return
+            self._handle_document_post(agent_id)
+            return
+        if self.path == '/offline/bundles':
+            self._handle_bundle_post(agent_id)
+            return
+        if self.path != '/sync/batches':
+            self._send_json(404, {'error': 'Not found'})
+            return
+
+        length = int(self.headers.get('Content-Length') or 0)
+        if length <= 0 or length > INGEST_CONFIG['max_body_bytes']:
+            self._send_json(413, {'error': 'Invalid body size'})
+            return
+
+        try:
+            body = json.loads(self.rfile.read(length))
+            items = body.get('items') or []
+        except (ValueError, KeyError, TypeError) as e:
+            self._send_json(400, {'error': f"Invalid batch: {str(e)}"})
+            return
+
+        if len(items) > INGEST_CONFIG['max_batch_items']:
+            self._send_json(413, {'error': f"Batch exceeds {INGEST_CONFIG['max_batch_items']} items"})
+            return
+
+        try:
+            result = stage_batch(agent_id, body.get('device_id', 'unknown'), items, self.synthetic)
+        except Exception as e:
+            logger.error(f"Staging failed for agent {agent_id}: {str(e)}")
+            self._send_json(503, {'error': 'Staging failed, retry later'})
+            return
+
+        if self.applier:
+            self.applier.wake.set()
+        self._send_json(202, result)
+
+    def _handle_document_post(self, agent_id: int):
+        parts = self.path.strip('/').split('/')
+        try:
+            if parts == ['documents', 'uploads']:
+                length = int(self.headers.get('Content-Length') or 0)
+                if length <= 0 or length > INGEST_CONFIG['max_body_bytes']:
+                    self._send_json(413, {'error': 'Invalid body size'})
+                    return
+                body = json.loads(self.rfile.read(length))
+                status = start_upload(
+                    body.get('assignment_id'), agent_id, body['file_name'],
+                    int(body['total_size']), file_checksum=body.get('file_checksum'),
+                    content_type=body.get('content_type'), document_type=body.get('document_type'),
+                    chunk_size=body.get('chunk_size')
+                )
+                self._send_json(201, status)
+            elif len(parts) == 4 and parts[3] == 'complete':
+                if self._owned_upload(parts[2], agent_id):
+                    self._send_json(200, complete_upload(parts[2]))
+            else:
+                self._send_json(404, {'error': 'Not found'})
+        except LookupError as e:
+            self._send_json(404, {'error': str(e)})
+        except (ValueError, KeyError, TypeError) as e:
+            self._send_json(400, {'error': str(e)})
+        except Exception as e:
+            logger.error(f"Document upload request failed: {str(e)}")
+            self._send_json(503, {'error': 'Upload failed, retry later'})
+
+    def _handle_bundle_post(self, agent_id: int):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length <= 0 or length > INGEST_CONFIG['max_body_bytes']:
+            self._send_json(413, {'error': 'Invalid body size'})
+            return
+        try:
+            body = json.loads(self.rfile.read(length))
+            bundle = build_offline_bundle(agent_id, body.get('known_etags'),
+                                          body.get('reference_etag'))
+        except (ValueError, KeyError, TypeError) as e:
+            self._send_json(400, {'error': str(e)})
+            return
+        except Exception as e:
+            logger.error(f"Bundle build failed: {str(e)}")
+            self._send_json(503, {'error': 'Bundle build failed, retry later'})
+            return
+
+        etag = f'"{bundle["bundle_etag"]}"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        data = compress_bundle(bundle)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('ETag', etag)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_PUT(self):
+        agent_id = self._authenticate()
+        if agent_id is None:
+            return
+        parts = self.path.strip('/').split('/')
+        if len(parts) != 5 or parts[:2] != ['documents', 'uploads'] or parts[3] != 'chunks':
+            self._send_json(404, {'error': 'Not found'})
+            return
+
+        length = int(self.headers.get('Content-Length') or 0)
+        checksum = self.headers.get('X-Chunk-Checksum')
+        if length <= 0 or length > UPLOAD_CONFIG['max_chunk_bytes']:
+            self._send_json(413, {'error': 'Invalid chunk size'})
+            return
+        if not checksum:
+            self._send_json(400, {'error': 'X-Chunk-Checksum header required'})
+            return
+
+        try:
+            if not self._owned_upload(parts[2], agent_id):
+                return
+            # The body is streamed to the part file, never read whole into memory
+            result = receive_chunk(parts[2], int(parts[4]), self.rfile, length, checksum)
+        except LookupError as e:
+            self._send_json(404, {'error': str(e)})
+            return
+        except ValueError as e:
+            self._send_json(400, {'error': str(e)})
+            return
+        except Exception as e:
+            logger.error(f"Chunk upload failed: {str(e)}")
+            self._send_json(503, {'error': 'Chunk upload failed, retry later'})
+            return
+        self._send_json(200, result)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def run_ingest_service(host: str = None, port: int = None):
+    """Start the ingestion HTTP service and its background applier"""
+    host = host or INGEST_CONFIG['host']
+    port = port or INGEST_CONFIG['port']
+
+    setup_ingest_tables()
+
+    applier = StagedRowApplier()
+    applier.start()
+    IngestRequestHandler.applier = applier
+
+    server = ThreadingHTTPServer((host, port), IngestRequestHandler)
+    server.daemon_threads = True
+    logger.info(f"Sync ingestion service listening on {host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        applier.stop()
+        applier.join(timeout=10)
+
+
+# ---------------- Client ----------------
+def _auth_headers(token: str) -> Dict[str, str]:
+    return {'Content-Type': 'application/json', 'Authorization': f"Bearer {token}"}
+
+
+def upload_batch(url: str, token: str, device_id: str, items: List[Dict],
+                 timeout: int = 30) -> Tuple[bool, Dict]:
+    """
+    Upload a batch of queued items to the ingestion service
+
+    A 202 only means the items were staged; poll fetch_batch_status for the
+    apply result.
+
+    Returns:
+        tuple: (success_status, response body or error)
+    """
+    data = json.dumps({'device_id': device_id, 'items': items}, default=str).encode()
+    req = urlrequest.Request(
+        f"{url.rstrip('/')}/sync/batches",
+        data=data,
+        headers=_auth_headers(token),
+        method='POST'
+    )
+    try:
+        with urlrequest.urlopen(req, timeout=timeout) as resp:
+            return resp.status == 202, json.loads(resp.read())
+    except urlerror.HTTPError as e:
+        return False, {'error': f"HTTP {e.code}: {e.read().decode(errors='replace')}"}
+    except Exception as e:
+        return False, {'error': str(e)}
+
+
+def fetch_batch_status(url: str, token: str, batch_id: str, timeout: int = 30) -> Tuple[Optional[int], Dict]:
+    """
+    Apply status of an uploaded batch
+
+    Returns:
+        tuple: (HTTP status or None when unreachable, response body or error)
+    """
+    req = urlrequest.Request(f"{url.rstrip('/')}/sync/batches/{batch_id}",
+                             headers=_auth_headers(token), method='GET')
+    try:
+        with urlrequest.urlopen(req, timeout=timeout) as resp:
+            return resp.status, json.loads(resp.read())
+    except urlerror.HTTPError as e:
+        return e.code, {'error': e.read().decode(errors='replace')}
+    except Exception as e:
+        return None, {'error': str(e)}
+
+
+# ---------------- Load Test ----------------
+def _simulated_items(agent_id: int, count: int) -> List[Dict]:
+    """Build a device-shaped batch of location and progress updates"""
+    items = []
+    for i in range(count):
+        if i % 2:
+            data_type = 'location_update'
+            payload = {'latitude': 24.0 + (i % 100) / 100, 'longitude': -77.5 + (agent_id % 100) / 100,
+                       'accuracy': 5.0}
+        else:
+            data_type = 'survey_progress'
+            payload = {'assignment_id': agent_id * 1000 + i, 'completion_percentage': (i * 10) % 100}
+        items.append({
+            'item_id': str(uuid.uuid4()),
+            'holder_id': agent_id * 1000 + i,
+            'data_type': data_type,
+            'data_payload': payload,
+            'checksum': _generate_checksum(payload),
+            'collected_at': datetime.now().isoformat(),
+            'metadata': {'priority': 'normal', 'load_test': True},
+        })
+    return items
+
+
+def run_load_test(url: str = None, num_agents: int = 200, batches_per_agent: int = 5,
+                  items_per_batch: int = 50, confirm: bool = False) -> Dict:
+    """
+    Simulate many agents uploading concurrently and report throughput
+
+    Each simulated agent runs in its own thread and uploads its batches back
+    to back, as a device draining its offline queue would. Uploads use
+    synthetic tokens, so the service stages and counts the rows but never
+    applies them; every token is revoked when the run ends.
+
+    Raises:
+        ValueError: unless confirm is set, since the run still writes staging,
+                    batch and telemetry rows to the service's database
+    """
+    if not confirm:
+        raise ValueError("The load test writes to the ingest service's database; pass confirm=True (--confirm)")
+    url = url or f"http://127.0.0.1:{INGEST_CONFIG['port']}"
+    latencies: List[float] = []
+    failures: List[str] = []
+    tokens: List[str] = []
+    lock = threading.Lock()
+
+    def simulate_agent(agent_id: int):
+        device_id = f"loadtest-{agent_id}"
+        token = issue_agent_token(agent_id, label='loadtest', synthetic=True)
+        with lock:
+            tokens.append(token)
+        for _ in range(batches_per_agent):
+            items = _simulated_items(agent_id, items_per_batch)
+            started = time.perf_counter()
+            ok, body = upload_batch(url, token, device_id, items)
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                if not ok:
+                    failures.append(body.get('error', 'unknown'))
+
+    started = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=num_agents) as pool:
+            list(pool.map(simulate_agent, range(1, num_agents + 1)))
+    finally:
+        for token in tokens:
+            try:
+                revoke_token(token)
+            except Exception as e:
+                logger.error(f"Could not revoke load-test token: {str(e)}")
+    wall_time = time.perf_counter() - started
+
+    total_batches = num_agents * batches_per_agent
+    ordered = sorted(latencies)
+    results = {
+        'agents': num_agents,
+        'batches': total_batches,
+        'items': total_batches * items_per_batch,
+        'failed_batches': len(failures),
+        'wall_time_s': round(wall_time, 2),
+        'items_per_s': round(total_batches * items_per_batch / wall_time, 1) if wall_time else 0,
+        'p50_ms': round(statistics.median(ordered) * 1000, 1) if ordered else 0,
+        'p95_ms': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 1) if ordered else 0,
+        'errors': failures[:5],
+    }
+    logger.info(f"Load test results: {results}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk sync ingestion service")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    serve = sub.add_parser('serve', help='Run the ingestion service')
+    serve.add_argument('--host', default=INGEST_CONFIG['host'])
+    serve.add_argument('--port', type=int, default=INGEST_CONFIG['port'])
+
+    issue = sub.add_parser('issue-token', help='Create a device token for an agent')
+    issue.add_argument('--agent', type=int, required=True)
+    issue.add_argument('--label', default=None)
+
+    load = sub.add_parser('loadtest', help='Simulate concurrent agent uploads')
+    load.add_argument('--url', default=None)
+    load.add_argument('--agents', type=int, default=200)
+    load.add_argument('--batches', type=int, default=5)
+    load.add_argument('--items', type=int, default=50)
+    load.add_argument('--confirm', action='store_true',
+                      help='Required: the run writes staging and telemetry rows to the service database')
+
+    args = parser.parse_args()
+    if args.command == 'serve':
+        run_ingest_service(args.host, args.port)
+    elif args.command == 'issue-token':
+        setup_ingest_tables()
+        print(issue_agent_token(args.agent, args.label))
+    else:
+        if not args.confirm:
+            parser.error("loadtest writes to the service database; re-run with --confirm")
+        print(json.dumps(run_load_test(args.url, args.agents, args.batches, args.items, confirm=True), indent=2))
@@ -0,0 +1,191 @@
+"""
+Island Leaderboards
+Per-island completion counts for today, this week and this month, kept in a
+small table that a trigger on agent_assignments updates as interviews complete
+"""
+
+import logging
+from typing import Dict, List, Optional
+
+from sqlalchemy import text
+
+from census_app.db import engine
+
+logger = logging.getLogger('leaderboards')
+
+LEADERBOARD_CONFIG = {
+    'retention_months': 3,   # older periods are pruned on rebuild
+}
+
+# period -> how the period start is derived from a completion timestamp
+LEADERBOARD_PERIODS = {
+    'today': "date_trunc('day', {ts})::date",
+    'week': "date_trunc('week', {ts})::date",
+    'month': "date_trunc('month', {ts})::date",
+}
+
+PERIOD_LABELS = {'today': 'Today', 'week': 'This Week', 'month': 'This Month'}
+
+
+def _period_rows(ts: str) -> str:
+    """VALUES list of (period, period_start) for a timestamp expression"""
+    return ", ".join(
+        f"('{period}', {expression.format(ts=ts)})" for period, expression in LEADERBOARD_PERIODS.items()
+    )
+
+
+def setup_leaderboard_tables():
+    """Create island_leaderboards and the trigger that keeps it current"""
+    try:
+        with engine.begin() as conn:
+            created = conn.execute(text("SELECT to_regclass('island_leaderboards') IS NULL")).scalar()
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS island_leaderboards (
+                    island_id INTEGER NOT NULL,
+                    period VARCHAR(10) NOT NULL,
+                    period_start DATE NOT NULL,
+                    agent_id INTEGER NOT NULL,
+                    completed_surveys INTEGER NOT NULL DEFAULT 0,
+                    total_duration_minutes NUMERIC NOT NULL DEFAULT 0,
+                    updated_at TIMESTAMP DEFAULT NOW(),
+                    PRIMARY KEY (island_id, period, period_start, agent_id)
+                )
+            """))
+
+            # Counts move by +1/-1 whenever an assignment enters or leaves 'completed'.
+            # The island is the agent's assigned island, matching the team comparison.
+            conn.execute(text(f"""
+                CREATE OR REPLACE FUNCTION update_island_leaderboards() RETURNS trigger
+                LANGUAGE plpgsql
+                AS $$
+                BEGIN
+                    IF TG_OP = 'UPDATE' AND OLD.status IS NOT DISTINCT FROM NEW.status THEN
+                        RETURN NULL;
+                    END IF;
+
+                    IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.status = 'completed' THEN
+                        UPDATE island_leaderboards l
+                        SET completed_surveys = GREATEST(l.completed_surveys - 1, 0),
+                            total_duration_minutes = GREATEST(l.total_duration_minutes - COALESCE(
+                                EXTRACT(EPOCH FROM (OLD.completed_date - OLD.assignment_date)) / 60, 0), 0),
+                            updated_at = NOW()
+                        FROM agents a,
+                             (VALUES {_period_rows('COALESCE(OLD.completed_date, OLD.updated_at, NOW())')})
+                             AS p(period, period_start)
+                        WHERE a.agent_id = OLD.agent_id
+                        AND l.island_id = a.assigned_island_id
+                        AND l.agent_id = OLD.agent_id
+                        AND l.period = p.period AND l.period_start = p.period_start;
+                    END IF;
+
+                    IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.status = 'completed' THEN
+                        INSERT INTO island_leaderboards
+                        (island_id, period, period_start, agent_id, completed_surveys, total_duration_minutes)
+                        SELECT a.assigned_island_id, p.period, p.period_start, NEW.agent_id, 1,
+                               COALESCE(EXTRACT(EPOCH FROM (COALESCE(NEW.completed_date, NOW())
+                                                            - NEW.assignment_date)) / 60, 0)
+                        FROM agents a,
+                             (VALUES {_period_rows('COALESCE(NEW.completed_date, NOW())')})
+                             AS p(period, period_start)
+                        WHERE a.agent_id = NEW.agent_id AND a.assigned_island_id IS NOT NULL
+                        ON CONFLICT (island_id, period, period_start, agent_id) DO UPDATE
+                        SET completed_surveys = island_leaderboards.completed_surveys + 1,
+                            total_duration_minutes = island_leaderboards.total_duration_minutes
+                                                     + EXCLUDED.total_duration_minutes,
+                            updated_at = NOW();
+                    END IF;
+                    RETURN NULL;
+                END;
+                $$
+            """))
+            # Only create the trigger when missing; DROP/CREATE would lock agent_assignments on every import
+            has_trigger = conn.execute(text("""
+                SELECT EXISTS (
+                    SELECT 1 FROM pg_trigger
+                    WHERE tgrelid = 'agent_assignments'::regclass
+                    AND tgname = 'trg_agent_assignments_leaderboards'
+                )
+            """)).scalar()
+            if not has_trigger:
+                conn.execute(text("""
+                    CREATE TRIGGER trg_agent_assignments_leaderboards
+                    AFTER INSERT OR DELETE OR UPDATE OF status ON agent_assignments
+                    FOR EACH ROW EXECUTE FUNCTION update_island_leaderboards()
+                """))
+
+        if created:
+            rebuild_island_leaderboards()
+        return True
+    except Exception as e:
+        logger.error(f"Error setting up leaderboard tables: {str(e)}")
+        return False
+
+
+def rebuild_island_leaderboards(island_id: Optional[int] = None) -> int:
+    """
+    Recount the current periods from agent_assignments
+
+    Used when the table is first created and to repair drift, e.g. after agents
+    move between islands. Periods past the retention window are pruned.
+
+    Returns:
+        int: leaderboard rows written
+    """
+    island_filter = "AND a.assigned_island_id = :iid" if island_id is not None else ""
+    params = {'iid': island_id, 'months': LEADERBOARD_CONFIG['retention_months']}
+    with engine.begin() as conn:
+        conn.execute(text("""
+            DELETE FROM island_leaderboards
+            WHERE period_start < date_trunc('month', CURRENT_DATE) - make_interval(months => :months)
+        """), params)
+        conn.execute(text(f"""
+            DELETE FROM island_leaderboards
+            WHERE (period, period_start) IN (VALUES {_period_rows('CURRENT_DATE')})
+            {"AND island_id = :iid" if island_id is not None else ""}
+        """), params)
+
+        result = conn.execute(text(f"""
+            INSERT INTO island_leaderboards
+            (island_id, period, period_start, agent_id, completed_surveys, total_duration_minutes)
+            SELECT a.assigned_island_id, p.period, p.period_start, aa.agent_id,
+                   COUNT(*),
+                   COALESCE(SUM(EXTRACT(EPOCH FROM (aa.completed_date - aa.assignment_date)) / 60), 0)
+            FROM (VALUES {_period_rows('CURRENT_DATE')}) AS p(period, period_start)
+            JOIN agent_assignments aa
+              ON aa.status = 'completed'
+             AND aa.completed_date >= p.period_start
+            JOIN agents a ON a.agent_id = aa.agent_id
+            WHERE a.assigned_island_id IS NOT NULL {island_filter}
+            GROUP BY a.assigned_island_id, p.period, p.period_start, aa.agent_id
+        """), params)
+        return result.rowcount or 0
+
+
+def get_island_leaderboard(island_id: int, period: str = 'week') -> List[Dict]:
+    """
+    Ranked completion counts for one island and period
+
+    A single range read on the leaderboard primary key; only the handful of
+    agents on the island are ranked.
+    """
+    if period not in LEADERBOARD_PERIODS:
+        raise ValueError(f"Unknown leaderboard period: {period}")
+    with engine.connect() as conn:
+        rows = conn.execute(text(f"""
+            SELECT RANK() OVER (ORDER BY l.completed_surveys DESC) AS rank,
+                   a.agent_code, a.full_name,
+                   l.completed_surveys,
+                   ROUND(l.total_duration_minutes / NULLIF(l.completed_surveys, 0), 1) AS avg_duration
+            FROM island_leaderboards l
+            JOIN agents a ON a.agent_id = l.agent_id
+            WHERE l.island_id = :iid
+            AND l.period = :period
+            AND l.period_start = {LEADERBOARD_PERIODS[period].format(ts='CURRENT_DATE')}
+            AND l.completed_surveys > 0
+            ORDER BY rank, a.agent_code
+        """), {'iid': island_id, 'period': period}).mappings().all()
+        return [dict(row) for row in rows]
+
+
+# Run table setup when module is imported
+setup_leaderboard_tables()
@@ -0,0 +1,301 @@
+"""
+Offline Prefetch Bundles
+Gzipped, versioned bundles of an agent's pending holders plus reference data,
+built with one set of bulk queries; repeat prefetches only carry holders whose
+content stamp changed since the device's last bundle
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+
+from census_app.db import engine
+
+logger = logging.getLogger('offline_bundle')
+
+BUNDLE_FORMAT_VERSION = 1
+
+OPEN_STATUSES = ('assigned', 'scheduled', 'in_progress')
+OPEN_STATUSES_SQL = ", ".join(f"'{status}'" for status in OPEN_STATUSES)
+
+# Survey sections carried per holder: table -> ordering column.
+# Sections whose table does not exist in this database are skipped.
+HOLDER_SECTIONS = {
+    'general_information': 'id',
+    'household_information': 'id',
+    'holding_labour': 'question_no',
+    'holder_survey_progress': 'section_id',
+}
+
+# Lookup tables every device needs offline: table -> ordering column
+REFERENCE_TABLES = {
+    'islands': 'island_name',
+    'crop_type': 'code',
+    'market_trade_codes': 'code',
+    'labour_questions_template': 'question_no',
+}
+
+# Server-side columns devices never need
+HOLDER_EXCLUDED_COLUMNS = ('field_versions',)
+
+_available_tables: Optional[set] = None
+_tables_lock = threading.Lock()
+
+
+def setup_bundle_tables():
+    """Create the per-device manifest of what each device has confirmed it holds"""
+    try:
+        with engine.begin() as conn:
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS offline_bundle_manifests (
+                    agent_id INTEGER NOT NULL,
+                    device_id VARCHAR(100) NOT NULL,
+                    holder_etags JSONB NOT NULL DEFAULT '{}'::jsonb,
+                    reference_etag VARCHAR(64),
+                    bundle_etag VARCHAR(64),
+                    generated_at TIMESTAMP NOT NULL DEFAULT NOW(),
+                    PRIMARY KEY (agent_id, device_id)
+                )
+            """))
+            # Last bundle handed out, promoted to the manifest once the device confirms its etag
+            conn.execute(text("""
+                ALTER TABLE offline_bundle_manifests
+                ADD COLUMN IF NOT EXISTS pending_holder_etags JSONB,
+                ADD COLUMN IF NOT EXISTS pending_reference_etag VARCHAR(64),
+                ADD COLUMN IF NOT EXISTS pending_bundle_etag VARCHAR(64),
+                ADD COLUMN IF NOT EXISTS confirmed_at TIMESTAMP
+            """))
+        return True
+    except Exception as e:
+        logger.error(f"Error setting up bundle tables: {str(e)}")
+        return False
+
+
+def _existing_tables(conn) -> set:
+    """Section and reference tables present in this database, looked up once per process"""
+    global _available_tables
+    with _tables_lock:
+        if _available_tables is None:
+            names = list(HOLDER_SECTIONS) + list(REFERENCE_TABLES)
+            _available_tables = set(conn.execute(text("""
+                SELECT name FROM unnest(CAST(:names AS TEXT[])) AS name
+                WHERE to_regclass(name) IS NOT NULL
+            """), {'names': names}).scalars().all())
+        return _available_tables
+
+
+def _etag(payload: str) -> str:
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+# ---------------- Building ----------------
+def _holder_query(sections: List[str]) -> str:
+    """
+    One statement returning every pending holder as a JSON document with its stamp
+
+    Each section table is read once for the whole holder set and aggregated
+    per holder, instead of one query per holder and section.
+    """
+    section_ctes = []
+    section_joins = []
+    section_fields = []
+    for index, table in enumerate(sections):
+        alias = f"s{index}"
+        section_ctes.append(f"""
+            {alias} AS (
+                SELECT t.holder_id, jsonb_agg(to_jsonb(t) ORDER BY t.{HOLDER_SECTIONS[table]}) AS rows
+                FROM {table} t
+                WHERE t.holder_id IN (SELECT holder_id FROM pending)
+                GROUP BY t.holder_id
+            )""")
+        section_joins.append(f"LEFT JOIN {alias} ON {alias}.holder_id = h.holder_id")
+        section_fields.append(f"'{table}', COALESCE({alias}.rows, '[]'::jsonb)")
+
+    excluded = " - ".join(f"'{column}'" for column in HOLDER_EXCLUDED_COLUMNS)
+    return f"""
+        WITH pending AS (
+            SELECT DISTINCT ON (holder_id) holder_id, assignment_id, status, interview_type,
+                   scheduled_date, notes, location_lat, location_lon
+            FROM agent_assignments
+            WHERE agent_id = :aid AND status IN ({OPEN_STATUSES_SQL}) AND holder_id IS NOT NULL
+            ORDER BY holder_id, assignment_date DESC
+        ){"," if section_ctes else ""}{",".join(section_ctes)},
+        documents AS (
+            SELECT p.holder_id,
+                   jsonb_build_object(
+                       'holder', to_jsonb(h) - {excluded},
+                       'assignment', to_jsonb(p) - 'holder_id'
+                       {"".join(", " + field for field in section_fields)}
+                   ) AS document
+            FROM pending p
+            JOIN holders h ON h.holder_id = p.holder_id
+            {" ".join(section_joins)}
+        )
+        SELECT holder_id, document::text AS document, md5(document::text) AS etag
+        FROM documents
+    """
+
+
+def build_offline_bundle(agent_id: int, known_etags: Optional[Dict[str, str]] = None,
+                         reference_etag: Optional[str] = None) -> Dict:
+    """
+    Build the bundle for an agent's pending assignments
+
+    Args:
+        agent_id: Agent whose open assignments are bundled
+        known_etags: holder_id -> etag the device already holds; unchanged holders are left out
+        reference_etag: Etag of the device's reference data; omitted from the bundle if current
+
+    Returns:
+        dict: bundle with holders (changed only), removed holder ids, reference data
+              (if changed), per-holder etags and the overall bundle_etag
+    """
+    known_etags = {str(k): v for k, v in (known_etags or {}).items()}
+
+    with engine.connect() as conn:
+        tables = _existing_tables(conn)
+        base_at = conn.execute(text("SELECT NOW()::timestamp")).scalar()
+        sections = [table for table in HOLDER_SECTIONS if table in tables]
+        rows = conn.execute(text(_holder_query(sections)), {'aid': agent_id}).fetchall()
+
+        reference_parts = []
+        for table, order_column in REFERENCE_TABLES.items():
+            if table in tables:
+                reference_parts.append(
+                    f"'{table}', (SELECT COALESCE(jsonb_agg(to_jsonb(t) ORDER BY t.{order_column}), '[]'::jsonb)"
+                    f" FROM {table} t)"
+                )
+        reference_json = conn.execute(
+            text(f"SELECT jsonb_build_object({', '.join(reference_parts)})::text")
+        ).scalar() if reference_parts else '{}'
+
+    etags = {str(row.holder_id): row.etag for row in rows}
+    changed = {str(row.holder_id): json.loads(row.document) for row in rows
+               if known_etags.get(str(row.holder_id)) != row.etag}
+    removed = sorted(int(holder_id) for holder_id in known_etags if holder_id not in etags)
+
+    current_reference_etag = _etag(reference_json)
+    bundle_etag = _etag(json.dumps(
+        {'format': BUNDLE_FORMAT_VERSION, 'holders': etags, 'reference': current_reference_etag},
+        sort_keys=True
+    ))
+
+    return {
+        'format_version': BUNDLE_FORMAT_VERSION,
+        'agent_id': agent_id,
+        'generated_at': datetime.now().isoformat(),
+        # Devices send this back as metadata.base_at so edits merge against what they saw
+        'base_at': base_at.isoformat() if base_at else None,
+        'bundle_etag': bundle_etag,
+        'holder_etags': etags,
+        'holders': changed,
+        'removed': removed,
+        'reference_etag': current_reference_etag,
+        'reference': json.loads(reference_json) if reference_etag != current_reference_etag else None,
+        'full': not known_etags,
+    }
+
+
+def compress_bundle(bundle: Dict) -> bytes:
+    """Serialise and gzip a bundle"""
+    return gzip.compress(json.dumps(bundle, default=str, separators=(',', ':')).encode(), compresslevel=6)
+
+
+# ---------------- Device Manifests ----------------
+def get_device_manifest(agent_id: int, device_id: str) -> Tuple[Dict[str, str], Optional[str], Optional[str]]:
+    """(holder etags, reference etag, bundle etag) the device last confirmed it holds"""
+    with engine.connect() as conn:
+        row = conn.execute(text("""
+            SELECT holder_etags, reference_etag, bundle_etag
+            FROM offline_bundle_manifests
+            WHERE agent_id = :aid AND device_id = :did
+        """), {'aid': agent_id, 'did': device_id}).first()
+    if not row:
+        return {}, None, None
+    return dict(row.holder_etags or {}), row.reference_etag, row.bundle_etag
+
+
+def save_pending_manifest(agent_id: int, device_id: str, bundle: Dict):
+    """
+    Remember the bundle just handed to a device without trusting it yet
+
+    Deltas keep being computed from the confirmed manifest until
+    confirm_device_bundle() is called with this bundle's etag, so a download
+    that never reached the device is simply sent again.
+    """
+    with engine.begin() as conn:
+        conn.execute(text("""
+            INSERT INTO offline_bundle_manifests
+            (agent_id, device_id, pending_holder_etags, pending_reference_etag, pending_bundle_etag, generated_at)
+            VALUES (:aid, :did, CAST(:etags AS JSONB), :ref, :etag, NOW())
+            ON CONFLICT (agent_id, device_id) DO UPDATE
+            SET pending_holder_etags = EXCLUDED.pending_holder_etags,
+                pending_reference_etag = EXCLUDED.pending_reference_etag,
+                pending_bundle_etag = EXCLUDED.pending_bundle_etag,
+                generated_at = EXCLUDED.generated_at
+        """), {
+            'aid': agent_id, 'did': device_id, 'etags': json.dumps(bundle['holder_etags']),
+            'ref': bundle['reference_etag'], 'etag': bundle['bundle_etag']
+        })
+
+
+def confirm_device_bundle(agent_id: int, device_id: str, bundle_etag: str) -> bool:
+    """
+    Record that a device now holds the bundle with this etag
+
+    Returns:
+        bool: False when the etag is not the bundle last handed to the device
+    """
+    with engine.begin() as conn:
+        result = conn.execute(text("""
+            UPDATE offline_bundle_manifests
+            SET holder_etags = pending_holder_etags,
+                reference_etag = pending_reference_etag,
+                bundle_etag = pending_bundle_etag,
+                pending_holder_etags = NULL,
+                pending_reference_etag = NULL,
+                pending_bundle_etag = NULL,
+                confirmed_at = NOW()
+            WHERE agent_id = :aid AND device_id = :did AND pending_bundle_etag = :etag
+        """), {'aid': agent_id, 'did': device_id, 'etag': bundle_etag})
+        return result.rowcount > 0
+
+
+def prefetch_for_device(agent_id: int, device_id: str, full: bool = False) -> Tuple[Optional[bytes], Dict]:
+    """
+    Build the next bundle for a device, as a delta from what it has confirmed
+
+    The bundle is recorded as pending; call confirm_device_bundle() with
+    summary['bundle_etag'] once the device has it.
+
+    Returns:
+        tuple: (gzipped bundle or None when nothing changed, bundle summary)
+    """
+    known, reference_etag, last_etag = ({}, None, None) if full else get_device_manifest(agent_id, device_id)
+    bundle = build_offline_bundle(agent_id, known, reference_etag)
+    summary = {
+        'bundle_etag': bundle['bundle_etag'],
+        'holders_total': len(bundle['holder_etags']),
+        'holders_sent': len(bundle['holders']),
+        'removed': len(bundle['removed']),
+        'reference_sent': bundle['reference'] is not None,
+        'full': bundle['full'],
+    }
+    if not full and bundle['bundle_etag'] == last_etag:
+        summary['bytes'] = 0
+        return None, summary
+
+    payload = compress_bundle(bundle)
+    save_pending_manifest(agent_id, device_id, bundle)
+    summary['bytes'] = len(payload)
+    return payload, summary
+
+
+# Run table setup when module is imported
+setup_bundle_tables()
@@ -0,0 +1,225 @@
+"""
+Server-side Replay of offline_data_queue
+Applies pending queued payloads to the census tables in ordered, set-based chunks
+
+Run standalone workers:
+    python -m census_app.modules.admin_agent_managment.replay_engine --workers 4
+"""
+
+import argparse
+import logging
+import threading
+import time
+from typing import Dict, List, Optional
+
+from sqlalchemy import text
+
+from census_app.db import engine
+from census_app.modules.admin_agent_managment.sync_appliers import (
+    APPLY_ROWS_TABLE,
+    apply_sync_rows,
+    create_apply_rows_table,
+)
+from census_app.modules.admin_agent_managment.sync_telemetry import (
+    prune_batch_metrics_daily,
+    record_working_set_metrics,
+)
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger('sync_replay')
+
+REPLAY_CONFIG = {
+    'chunk_size': 500,
+    'idle_interval': 5,  # seconds a worker sleeps when the queue is empty
+}
+
+
+def setup_replay_tables():
+    """Add the columns and index the replay engine relies on"""
+    try:
+        with engine.begin() as conn:
+            conn.execute(text("""
+                ALTER TABLE offline_data_queue
+                ADD COLUMN IF NOT EXISTS last_attempt_at TIMESTAMP,
+                ADD COLUMN IF NOT EXISTS error_message TEXT,
+                ADD COLUMN IF NOT EXISTS received_at TIMESTAMP DEFAULT NOW()
+            """))
+            conn.execute(text("""
+                CREATE INDEX IF NOT EXISTS idx_offline_data_queue_pending
+                ON offline_data_queue (collected_at, queue_id)
+                WHERE sync_status = 'pending'
+            """))
+        return True
+    except Exception as e:
+        logger.error(f"Error setting up replay tables: {str(e)}")
+        return False
+
+
+def replay_pending(agent_id: Optional[int] = None, chunk_size: Optional[int] = None,
+                   worker_index: int = 0, worker_count: int = 1) -> Dict:
+    """
+    Claim and apply one chunk of pending offline_data_queue rows
+
+    Rows are claimed oldest first with FOR UPDATE SKIP LOCKED, so parallel
+    workers never pick up the same row. With worker_count > 1 each worker
+    only takes agents where agent_id % worker_count == worker_index. Every
+    replay also holds a per-agent advisory lock for the agents it claims:
+    an agent-scoped replay waits for it, and workers skip agents whose lock
+    is taken, so one device's edits are applied in the order they were
+    collected even when the dashboard and a worker replay the same agent.
+
+    Args:
+        agent_id: Only replay this agent's rows (used by the agent dashboard)
+        chunk_size: Maximum rows to claim in this transaction
+        worker_index: This worker's partition
+        worker_count: Total number of partitions
+
+    Returns:
+        dict: claimed, synced and failed counts, rows affected per data type and errors
+    """
+    chunk_size = chunk_size or REPLAY_CONFIG['chunk_size']
+
+    filters = ["sync_status = 'pending'"]
+    params = {'lim': chunk_size}
+    if agent_id is not None:
+        filters.append("agent_id = :aid")
+        params['aid'] = agent_id
+    if worker_count > 1:
+        filters.append("MOD(agent_id, :wcount) = :windex")
+        params.update({'wcount': worker_count, 'windex': worker_index})
+    if agent_id is None:
+        # Leave agents being replayed elsewhere to that replay
+        filters.append("pg_try_advisory_xact_lock(hashtext('sync_replay'), agent_id)")
+
+    with engine.begin() as conn:
+        if agent_id is not None:
+            # Wait until no other replay holds older rows of this agent
+            conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('sync_replay'), :aid)"), {'aid': agent_id})
+        create_apply_rows_table(conn)
+        claimed = conn.execute(text(f"""
+            WITH claimed AS (
+                UPDATE offline_data_queue q
+                SET sync_status = 'synced', synced_at = NOW(), last_attempt_at = NOW()
+                WHERE q.queue_id IN (
+                    SELECT queue_id FROM offline_data_queue
+                    WHERE {' AND '.join(filters)}
+                    ORDER BY collected_at, queue_id
+                    LIMIT :lim
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING q.queue_id, q.agent_id, q.holder_id, q.device_id, q.data_type,
+                          q.data_payload, q.metadata, q.collected_at, q.received_at
+            )
+            INSERT INTO {APPLY_ROWS_TABLE}
+            (row_id, agent_id, holder_id, device_id, data_type, data_payload, metadata, collected_at, received_at)
+            SELECT queue_id, agent_id, holder_id, device_id, data_type,
+                   data_payload::jsonb, metadata::jsonb, collected_at::timestamp, received_at
+            FROM claimed
+        """), params).rowcount
+
+        if not claimed:
+            return {'claimed': 0, 'synced': 0, 'failed': 0, 'applied': {}, 'errors': []}
+
+        apply_started = time.perf_counter()
+        applied, failures = apply_sync_rows(conn)
+        record_working_set_metrics(conn, 'replay', (time.perf_counter() - apply_started) * 1000,
+                                   failures, queue_table='offline_data_queue')
+
+        failed = 0
+        for data_type, error_message in failures.items():
+            failed += conn.execute(text(f"""
+                UPDATE offline_data_queue
+                SET sync_status = 'failed',
+                    synced_at = NULL,
+                    sync_attempts = COALESCE(sync_attempts, 0) + 1,
+                    error_message = :err
+                WHERE queue_id IN (
+                    SELECT row_id FROM {APPLY_ROWS_TABLE} WHERE data_type = :dtype
+                )
+            """), {'err': error_message, 'dtype': data_type}).rowcount
+
+    errors = [f"Failed to apply {data_type}: {error}" for data_type, error in failures.items()]
+    logger.info(f"Replayed {claimed} queued rows ({failed} failed): {applied}")
+
+    return {
+        'claimed': claimed,
+        'synced': claimed - failed,
+        'failed': failed,
+        'applied': applied,
+        'errors': errors
+    }
+
+
+def replay_agent_queue(agent_id: int, chunk_size: Optional[int] = None) -> Dict:
+    """
+    Replay every pending row of one agent, chunk by chunk
+
+    Returns:
+        dict: Totals across all chunks
+    """
+    totals = {'synced': 0, 'failed': 0, 'errors': []}
+    while True:
+        result = replay_pending(agent_id=agent_id, chunk_size=chunk_size)
+        if not result['claimed']:
+            break
+        totals['synced'] += result['synced']
+        totals['failed'] += result['failed']
+        totals['errors'].extend(result['errors'])
+    return totals
+
+
+class ReplayWorker(threading.Thread):
+    """Background worker draining one partition of the pending queue"""
+
+    def __init__(self, worker_index: int = 0, worker_count: int = 1,
+                 interval: Optional[float] = None):
+        super().__init__(name=f'sync-replay-{worker_index}', daemon=True)
+        self.worker_index = worker_index
+        self.worker_count = worker_count
+        self.interval = interval or REPLAY_CONFIG['idle_interval']
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                result = replay_pending(worker_index=self.worker_index,
+                                        worker_count=self.worker_count)
+                if result['claimed']:
+                    continue  # Keep draining while there is work
+                prune_batch_metrics_daily()
+            except Exception as e:
+                logger.error(f"Replay worker {self.worker_index} pass failed: {str(e)}")
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+
+
+def run_replay_workers(worker_count: int = 4) -> List[ReplayWorker]:
+    """Start worker_count replay workers, one per queue partition"""
+    workers = [ReplayWorker(i, worker_count) for i in range(worker_count)]
+    for worker in workers:
+        worker.start()
+    logger.info(f"Started {worker_count} replay workers")
+    return workers
+
+
+# Run table setup when module is imported
+setup_replay_tables()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay pending offline_data_queue rows")
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    replay_workers = run_replay_workers(args.workers)
+    try:
+        for replay_worker in replay_workers:
+            replay_worker.join()
+    except KeyboardInterrupt:
+        for replay_worker in replay_workers:
+            replay_worker.stop()
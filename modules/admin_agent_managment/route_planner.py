@@ -0,0 +1,219 @@
+"""
+Route Planning for Field Agents
+Cached haversine distance matrices and nearest-neighbour + 2-opt visit ordering
+
+Benchmark (needs numpy; no database access):
+    python -m census_app.modules.admin_agent_managment.route_planner --stops 500 --runs 5
+
+    Prints median matrix, nearest-neighbour, 2-opt and total times, and how
+    much shorter 2-opt makes the route than nearest neighbour alone.
+"""
+
+import argparse
+import hashlib
+import statistics
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+
+ROUTE_CONFIG = {
+    'cache_size': 64,           # distance matrices kept in memory
+    'time_budget_ms': 60,       # 2-opt stops improving after this, keeping plans under 100 ms
+    'coordinate_precision': 6,  # decimals used when keying the cache
+}
+
+_matrix_cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+# ---------------- Distances ----------------
+def haversine_km(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """Elementwise great-circle distance in km; inputs broadcast against each other"""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype=np.float64)) for v in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def haversine_matrix(lats: Sequence[float], lons: Sequence[float],
+                     to_lats: Optional[Sequence[float]] = None,
+                     to_lons: Optional[Sequence[float]] = None) -> np.ndarray:
+    """Distances in km from every point to every point (or to every to_ point), in one broadcast"""
+    lats, lons = np.asarray(lats, dtype=np.float64), np.asarray(lons, dtype=np.float64)
+    to_lats = lats if to_lats is None else np.asarray(to_lats, dtype=np.float64)
+    to_lons = lons if to_lons is None else np.asarray(to_lons, dtype=np.float64)
+    return haversine_km(lats[:, None], lons[:, None], to_lats[None, :], to_lons[None, :])
+
+
+def get_distance_matrix(coords: np.ndarray) -> np.ndarray:
+    """
+    Distance matrix for an (n, 2) array of lat/lon, cached by coordinates
+
+    The same day's stops are planned repeatedly across reruns, so matrices
+    are kept in a small LRU keyed on the rounded coordinates.
+    """
+    rounded = np.round(np.asarray(coords, dtype=np.float64), ROUTE_CONFIG['coordinate_precision'])
+    key = hashlib.sha1(rounded.tobytes()).hexdigest()
+    with _cache_lock:
+        if key in _matrix_cache:
+            _matrix_cache.move_to_end(key)
+            return _matrix_cache[key]
+
+    matrix = haversine_matrix(rounded[:, 0], rounded[:, 1])
+    matrix.setflags(write=False)
+    with _cache_lock:
+        _matrix_cache[key] = matrix
+        while len(_matrix_cache) > ROUTE_CONFIG['cache_size']:
+            _matrix_cache.popitem(last=False)
+    return matrix
+
+
+# ---------------- Ordering ----------------
+def nearest_neighbour_order(dist: np.ndarray, start: int = 0) -> np.ndarray:
+    """Greedy tour: from start, always visit the closest stop not yet visited"""
+    n = len(dist)
+    order = np.empty(n, dtype=np.int64)
+    visited = np.zeros(n, dtype=bool)
+    current = start
+    for step in range(n):
+        order[step] = current
+        visited[current] = True
+        if step == n - 1:
+            break
+        row = np.where(visited, np.inf, dist[current])
+        current = int(np.argmin(row))
+    return order
+
+
+def two_opt(order: np.ndarray, dist: np.ndarray, time_budget_ms: Optional[float] = None) -> np.ndarray:
+    """
+    Improve an open path (fixed first stop, free last stop) with 2-opt moves
+
+    For each position i the gain of reversing order[i..j] is evaluated for
+    every j at once; the best improving move is applied. Passes repeat until
+    no move improves the route or the time budget runs out.
+    """
+    time_budget_ms = time_budget_ms if time_budget_ms is not None else ROUTE_CONFIG['time_budget_ms']
+    deadline = time.perf_counter() + time_budget_ms / 1000
+    route = order.copy()
+    n = len(route)
+    if n < 4:
+        return route
+
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        improved = False
+        for i in range(1, n - 1):
+            a, b = route[i - 1], route[i]
+            js = np.arange(i + 1, n)
+            c = route[js]
+            # Edge c -> next does not exist when c is the last stop of an open path
+            d = route[np.minimum(js + 1, n - 1)]
+            tail = js < n - 1
+            delta = (dist[a, c] - dist[a, b]
+                     + np.where(tail, dist[b, d] - dist[c, d], 0.0))
+            best = int(np.argmin(delta))
+            if delta[best] < -1e-9:
+                j = int(js[best])
+                route[i:j + 1] = route[i:j + 1][::-1]
+                improved = True
+            if time.perf_counter() >= deadline:
+                break
+    return route
+
+
+def route_length(order: np.ndarray, dist: np.ndarray) -> float:
+    """Total km along an open path"""
+    return float(dist[order[:-1], order[1:]].sum()) if len(order) > 1 else 0.0
+
+
+def plan_route(stops: List[Dict], start: Optional[Tuple[float, float]] = None,
+               lat_key: str = 'lat', lon_key: str = 'lon') -> Dict:
+    """
+    Order stops into a short visiting route
+
+    Args:
+        stops: Dicts with lat/lon (other keys are carried through)
+        start: Optional (lat, lon) the route must begin from, e.g. the agent's position
+
+    Returns:
+        dict: ordered stops (with leg_km and cumulative_km), total_km and timing_ms
+    """
+    started = time.perf_counter()
+    if not stops:
+        return {'stops': [], 'total_km': 0.0, 'timing_ms': 0.0}
+
+    coords = np.array([[float(s[lat_key]), float(s[lon_key])] for s in stops], dtype=np.float64)
+    if start is not None:
+        coords = np.vstack([np.asarray(start, dtype=np.float64), coords])
+
+    dist = get_distance_matrix(coords)
+    order = two_opt(nearest_neighbour_order(dist, 0), dist)
+
+    legs = np.concatenate([[0.0], dist[order[:-1], order[1:]]])
+    cumulative = np.cumsum(legs)
+    offset = 1 if start is not None else 0
+
+    ordered = []
+    for index, leg, total in zip(order, legs, cumulative):
+        if index < offset:
+            continue  # the fixed start point is not a stop
+        stop = dict(stops[index - offset])
+        stop.update({'visit_order': len(ordered) + 1, 'leg_km': round(float(leg), 2),
+                     'cumulative_km': round(float(total), 2)})
+        ordered.append(stop)
+
+    return {
+        'stops': ordered,
+        'total_km': round(float(cumulative[-1]), 2),
+        'timing_ms': round((time.perf_counter() - started) * 1000, 1)
+    }
+
+
+# ---------------- Benchmark ----------------
+def benchmark_route_planning(num_stops: int = 500, runs: int = 5, seed: int = 42) -> Dict:
+    """
+    Time matrix build, nearest neighbour and 2-opt on random stops spread over Andros
+
+    Each run uses fresh coordinates so the matrix cache is not hit.
+    """
+    rng = np.random.default_rng(seed)
+    timings = {'matrix_ms': [], 'nearest_ms': [], 'two_opt_ms': [], 'total_ms': []}
+    improvement = []
+    for _ in range(runs):
+        coords = np.column_stack([rng.uniform(23.7, 25.2, num_stops), rng.uniform(-78.4, -77.5, num_stops)])
+        t0 = time.perf_counter()
+        dist = get_distance_matrix(coords)
+        t1 = time.perf_counter()
+        greedy = nearest_neighbour_order(dist, 0)
+        t2 = time.perf_counter()
+        improved = two_opt(greedy, dist)
+        t3 = time.perf_counter()
+        timings['matrix_ms'].append((t1 - t0) * 1000)
+        timings['nearest_ms'].append((t2 - t1) * 1000)
+        timings['two_opt_ms'].append((t3 - t2) * 1000)
+        timings['total_ms'].append((t3 - t0) * 1000)
+        improvement.append(1 - route_length(improved, dist) / route_length(greedy, dist))
+
+    result = {name: round(statistics.median(values), 1) for name, values in timings.items()}
+    result.update({
+        'stops': num_stops,
+        'runs': runs,
+        'max_total_ms': round(max(timings['total_ms']), 1),
+        'two_opt_gain_pct': round(100 * statistics.median(improvement), 1)
+    })
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark route planning")
+    parser.add_argument('--stops', type=int, default=500)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    for key, value in benchmark_route_planning(args.stops, args.runs).items():
+        print(f"{key:>18}: {value}")
@@ -0,0 +1,365 @@
+"""
+Set-based Sync Appliers
+Applies batches of synced offline items to the census tables in one statement per data type
+"""
+
+import logging
+from typing import Dict, List, Tuple
+
+from sqlalchemy import text
+
+from census_app.db import engine
+from census_app.modules.admin_agent_managment.conflict_resolution import build_holder_merge_statement
+
+logger = logging.getLogger('sync_appliers')
+
+# Temporary working set every applier reads from. Callers fill it with the
+# rows they have claimed (from the ingest staging table or offline_data_queue)
+# and the appliers merge them into the census tables.
+APPLY_ROWS_TABLE = "sync_apply_rows"
+# Load-test rows (metadata.load_test, set by the server for synthetic tokens) are never applied
+PARKED_ROWS_TABLE = "sync_apply_rows_synthetic"
+SYNTHETIC_ROW_FILTER = "metadata->>'load_test' = 'true'"
+
+
+def setup_queue_item_ids():
+    """
+    Record the device's item_id on offline_data_queue, unique when set, so an
+    item that was already applied and recorded is never applied again
+    """
+    try:
+        with engine.begin() as conn:
+            conn.execute(text("""
+                ALTER TABLE offline_data_queue ADD COLUMN IF NOT EXISTS item_id VARCHAR(64)
+            """))
+            conn.execute(text("""
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_offline_data_queue_item_id
+                ON offline_data_queue (item_id) WHERE item_id IS NOT NULL
+            """))
+        return True
+    except Exception as e:
+        logger.error(f"Error adding offline_data_queue item ids: {str(e)}")
+        return False
+
+
+def create_apply_rows_table(conn):
+    """Create the per-transaction working table the appliers read from"""
+    conn.execute(text(f"""
+        CREATE TEMP TABLE IF NOT EXISTS {APPLY_ROWS_TABLE} (
+            row_id BIGINT NOT NULL,
+            agent_id INTEGER,
+            holder_id INTEGER,
+            device_id TEXT,
+            data_type TEXT NOT NULL,
+            data_payload JSONB NOT NULL,
+            metadata JSONB,
+            collected_at TIMESTAMP,
+            received_at TIMESTAMP   -- server receipt; NULL when applied as it arrives
+        ) ON COMMIT DROP
+    """))
+
+
+# ---------------- Appliers ----------------
+# Each entry is (data_type, [statements]). Statements only read rows of their
+# own data type from the working table; where several rows target the same
+# record, the most recently collected one wins (DISTINCT ON ... ORDER BY
+# collected_at DESC), matching the order the per-item handlers ran in.
+
+_HOLDER_INFORMATION = [
+    # Existing holders merge field by field (see conflict_resolution)
+    build_holder_merge_statement(APPLY_ROWS_TABLE),
+    f"""
+    INSERT INTO holders
+    (owner_id, name, date_of_birth, gender, education_level,
+     marital_status, phone_number, email, latitude, longitude, status)
+    SELECT agent_id,
+           data_payload->>'name',
+           (data_payload->>'date_of_birth')::date,
+           data_payload->>'gender',
+           data_payload->>'education_level',
+           data_payload->>'marital_status',
+           data_payload->>'phone_number',
+           data_payload->>'email',
+           (data_payload->>'latitude')::double precision,
+           (data_payload->>'longitude')::double precision,
+           'active'
+    FROM {APPLY_ROWS_TABLE}
+    WHERE data_type = 'holder_information' AND holder_id IS NULL
+    ORDER BY row_id
+    """,
+]
+
+_HOUSEHOLD_INFORMATION = [
+    f"""
+    INSERT INTO household_data
+    (holder_id, household_size, dependents, primary_income_source,
+     secondary_income_source, housing_type, data_json)
+    SELECT DISTINCT ON (holder_id)
+           holder_id,
+           (data_payload->>'household_size')::integer,
+           (data_payload->>'dependents')::integer,
+           data_payload->>'primary_income_source',
+           data_payload->>'secondary_income_source',
+           data_payload->>'housing_type',
+           data_payload
+    FROM {APPLY_ROWS_TABLE}
+    WHERE data_type = 'household_information' AND holder_id IS NOT NULL
+    ORDER BY holder_id, collected_at DESC, row_id DESC
+    ON CONFLICT (holder_id)
+    DO UPDATE SET
+        household_size = EXCLUDED.household_size,
+        dependents = EXCLUDED.dependents,
+        primary_income_source = EXCLUDED.primary_income_source,
+        secondary_income_source = EXCLUDED.secondary_income_source,
+        housing_type = EXCLUDED.housing_type,
+        data_json = EXCLUDED.data_json,
+        updated_at = NOW()
+    """,
+]
+
+_LABOUR_INFORMATION = [
+    f"""
+    DELETE FROM labour_data
+    WHERE holder_id IN (
+        SELECT holder_id FROM {APPLY_ROWS_TABLE}
+        WHERE data_type = 'labour_information' AND holder_id IS NOT NULL
+    )
+    """,
+    f"""
+    INSERT INTO labour_data (holder_id, labour_type, count, description, data_json)
+    SELECT s.holder_id,
+           e->>'labour_type',
+           (e->>'count')::integer,
+           e->>'description',
+           e
+    FROM (
+        SELECT DISTINCT ON (holder_id) holder_id, data_payload
+        FROM {APPLY_ROWS_TABLE}
+        WHERE data_type = 'labour_information' AND holder_id IS NOT NULL
+        ORDER BY holder_id, collected_at DESC, row_id DESC
+    ) s
+    CROSS JOIN LATERAL jsonb_array_elements(
+        COALESCE(s.data_payload->'labour_entries', '[]'::jsonb)
+    ) AS e
+    """,
+]
+
+_MACHINERY_INFORMATION = [
+    f"""
+    INSERT INTO machinery_data (holder_id, machinery_json, updated_at)
+    SELECT DISTINCT ON (holder_id) holder_id, data_payload, NOW()
+    FROM {APPLY_ROWS_TABLE}
+    WHERE data_type = 'machinery_information' AND holder_id IS NOT NULL
+    ORDER BY holder_id, collected_at DESC, row_id DESC
+    ON CONFLICT (holder_id)
+    DO UPDATE SET
+        machinery_json = EXCLUDED.machinery_json,
+        updated_at = NOW()
+    """,
+]
+
+_LAND_USE_INFORMATION = [
+    f"""
+    INSERT INTO land_use_data (holder_id, land_data_json, updated_at)
+    SELECT DISTINCT ON (holder_id) holder_id, data_payload, NOW()
+    FROM {APPLY_ROWS_TABLE}
+    WHERE data_type = 'land_use_information' AND holder_id IS NOT NULL
+    ORDER BY holder_id, collected_at DESC, row_id DESC
+    ON CONFLICT (holder_id)
+    DO UPDATE SET
+        land_data_json = EXCLUDED.land_data_json,
+        updated_at = NOW()
+    """,
+]
+
+_ASSIGNMENT_UPDATE = [
+    f"""
+    WITH updates AS (
+        SELECT row_id, agent_id, collected_at, data_payload,
+               (data_payload->>'assignment_id')::integer AS assignment_id
+        FROM {APPLY_ROWS_TABLE}
+        WHERE data_type = 'assignment_update'
+    ),
+    latest AS (
+        SELECT DISTINCT ON (assignment_id, agent_id) assignment_id, agent_id, data_payload
+        FROM updates
+        ORDER BY assignment_id, agent_id, collected_at DESC, row_id DESC
+    ),
+    new_notes AS (
+        SELECT assignment_id, agent_id,
+               string_agg(data_payload->>'notes', E'\\n' ORDER BY collected_at, row_id) AS notes
+        FROM updates
+        WHERE COALESCE(data_payload->>'notes', '') <> ''
+        GROUP BY assignment_id, agent_id
+    )
+    UPDATE agent_assignments aa
+    SET status = l.data_payload->>'status',
+        completed_date = CASE
+            WHEN l.data_payload->>'status' = 'completed' AND aa.status IS DISTINCT FROM 'completed'
+            THEN NOW() ELSE aa.completed_date END,
+        contact_attempts = (l.data_payload->>'contact_attempts')::integer,
+        last_contact_date = (l.data_payload->>'last_contact_date')::timestamp,
+        notes = CONCAT(COALESCE(aa.notes, ''), E'\\n', COALESCE(n.notes, '')),
+        completion_percentage = COALESCE((l.data_payload->>'completion_percentage')::numeric, 0),
+        updated_at = NOW()
+    FROM latest l
+    LEFT JOIN new_notes n
+           ON n.assignment_id = l.assignment_id AND n.agent_id = l.agent_id
+    WHERE aa.assignment_id = l.assignment_id AND aa.agent_id = l.agent_id
+    """,
+]
+
+_LOCATION_UPDATE = [
+    f"""
+    UPDATE holders h
+    SET latitude = (s.data_payload->>'latitude')::double precision,
+        longitude = (s.data_payload->>'longitude')::double precision,
+        location_accuracy = (s.data_payload->>'accuracy')::double precision,
+        updated_at = NOW()
+    FROM (
+        SELECT DISTINCT ON (holder_id) holder_id, data_payload
+        FROM {APPLY_ROWS_TABLE}
+        WHERE data_type = 'location_update' AND holder_id IS NOT NULL
+        ORDER BY holder_id, collected_at DESC, row_id DESC
+    ) s
+    WHERE h.holder_id = s.holder_id
+    """,
+]
+
+_INTERVIEW_SETUP = [
+    f"""
+    INSERT INTO agent_assignments
+    (agent_id, interview_type, status, scheduled_date, notes,
+     created_at, updated_at)
+    SELECT agent_id,
+           data_payload->>'interview_type',
+           'scheduled',
+           (data_payload->>'scheduled_date')::date,
+           COALESCE(data_payload->>'notes', ''),
+           NOW(), NOW()
+    FROM {APPLY_ROWS_TABLE}
+    WHERE data_type = 'interview_setup'
+    ORDER BY row_id
+    """,
+]
+
+_SURVEY_PROGRESS = [
+    f"""
+    UPDATE agent_assignments aa
+    SET completion_percentage = COALESCE((s.data_payload->>'completion_percentage')::numeric, 0),
+        last_activity = NOW(),
+        updated_at = NOW()
+    FROM (
+        SELECT DISTINCT ON ((data_payload->>'assignment_id')::integer, agent_id)
+               (data_payload->>'assignment_id')::integer AS assignment_id,
+               agent_id, data_payload
+        FROM {APPLY_ROWS_TABLE}
+        WHERE data_type = 'survey_progress'
+        ORDER BY (data_payload->>'assignment_id')::integer, agent_id, collected_at DESC, row_id DESC
+    ) s
+    WHERE aa.assignment_id = s.assignment_id AND aa.agent_id = s.agent_id
+    """,
+]
+
+APPLIERS: List[Tuple[str, List[str]]] = [
+    # Holders first so later types in the same set see their updates
+    ('holder_information', _HOLDER_INFORMATION),
+    ('household_information', _HOUSEHOLD_INFORMATION),
+    ('labour_information', _LABOUR_INFORMATION),
+    ('machinery_information', _MACHINERY_INFORMATION),
+    ('land_use_information', _LAND_USE_INFORMATION),
+    ('assignment_update', _ASSIGNMENT_UPDATE),
+    ('location_update', _LOCATION_UPDATE),
+    ('interview_setup', _INTERVIEW_SETUP),
+    ('survey_progress', _SURVEY_PROGRESS),
+]
+
+KNOWN_DATA_TYPES = [data_type for data_type, _ in APPLIERS]
+
+# Unknown types are kept verbatim, like OfflineDataCollector._sync_generic_data
+_GENERIC_DATA = f"""
+    INSERT INTO generic_offline_data
+    (agent_id, data_type, data_payload, metadata, created_at)
+    SELECT agent_id, data_type, data_payload, COALESCE(metadata, '{{}}'::jsonb), NOW()
+    FROM {APPLY_ROWS_TABLE}
+    WHERE data_type <> ALL(:known_types)
+    ORDER BY row_id
+"""
+
+
+def apply_sync_rows(conn) -> Tuple[Dict[str, int], Dict[str, str]]:
+    """
+    Apply every row in the working table to the census tables
+
+    Each data type runs inside its own savepoint, so a bad payload only
+    fails the rows of that type instead of the whole set.
+
+    Args:
+        conn: Connection with an open transaction and a filled working table
+
+    Returns:
+        tuple: (rows affected per data type, error message per failed data type)
+    """
+    # Set synthetic rows aside so no applier sees them, and put them back afterwards
+    conn.execute(text(f"""
+        CREATE TEMP TABLE IF NOT EXISTS {PARKED_ROWS_TABLE} (LIKE {APPLY_ROWS_TABLE}) ON COMMIT DROP
+    """))
+    parked = conn.execute(text(f"""
+        WITH moved AS (
+            DELETE FROM {APPLY_ROWS_TABLE} WHERE {SYNTHETIC_ROW_FILTER} RETURNING *
+        )
+        INSERT INTO {PARKED_ROWS_TABLE} SELECT * FROM moved
+    """)).rowcount
+    if parked:
+        logger.info(f"Skipped {parked} load-test rows")
+
+    present = {
+        row[0]: row[1] for row in conn.execute(text(f"""
+            SELECT data_type, COUNT(*) FROM {APPLY_ROWS_TABLE} GROUP BY data_type
+        """)).fetchall()
+    }
+
+    applied: Dict[str, int] = {}
+    failures: Dict[str, str] = {}
+
+    for data_type, statements in APPLIERS:
+        if data_type not in present:
+            continue
+        savepoint = conn.begin_nested()
+        try:
+            affected = 0
+            for statement in statements:
+                affected += conn.execute(text(statement)).rowcount or 0
+            savepoint.commit()
+            applied[data_type] = affected
+        except Exception as e:
+            savepoint.rollback()
+            failures[data_type] = str(e)
+            logger.error(f"Applier error for {data_type}: {str(e)}")
+
+    unknown = [data_type for data_type in present if data_type not in KNOWN_DATA_TYPES]
+    if unknown:
+        savepoint = conn.begin_nested()
+        try:
+            result = conn.execute(text(_GENERIC_DATA), {'known_types': KNOWN_DATA_TYPES})
+            savepoint.commit()
+            for data_type in unknown:
+                applied[data_type] = present[data_type]
+            logger.info(f"Stored {result.rowcount} generic rows")
+        except Exception as e:
+            savepoint.rollback()
+            for data_type in unknown:
+                failures[data_type] = str(e)
+            logger.error(f"Generic applier error: {str(e)}")
+
+    if parked:
+        conn.execute(text(f"""
+            WITH moved AS (DELETE FROM {PARKED_ROWS_TABLE} RETURNING *)
+            INSERT INTO {APPLY_ROWS_TABLE} SELECT * FROM moved
+        """))
+
+    return applied, failures
+
+
+# Run setup when module is imported
+setup_queue_item_ids()
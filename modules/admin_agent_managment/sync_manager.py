@@ -13,8 +13,12 @@ from sqlalchemy import text, exc
 import logging
 from typing import Dict, List, Optional, Tuple
 import uuid
+import os
 
 from census_app.db import engine
+from census_app.modules.admin_agent_managment.conflict_resolution import build_holder_merge_statement
+from census_app.modules.admin_agent_managment.sync_appliers import APPLY_ROWS_TABLE, create_apply_rows_table
+from census_app.modules.admin_agent_managment.sync_telemetry import record_batch_metrics
 
 # Configure logging
 logging.basicConfig(
@@ -49,7 +53,12 @@ class OfflineDataCollector:
             'batch_size': 50,
             'retry_delay': 5,  # seconds
             'sync_timeout': 30,  # seconds
-            'checksum_validation': True
+            'checksum_validation': True,
+            'app_version': '1.0.0',  # Would come from app config
+            # Bulk ingestion service (ingest_service.py); when set, batches are
+            # uploaded there instead of running handler SQL in this session
+            'ingest_url': os.getenv('SYNC_INGEST_URL'),
+            'ingest_token': os.getenv('SYNC_INGEST_TOKEN')   # this agent's device token
         }
     
     def _initialize_session_state(self):
@@ -104,7 +113,7 @@ class OfflineDataCollector:
                 'sync_attempts': 0,
                 'last_attempt_at': None,
                 'error_message': None,
-                'metadata': metadata or {},
+                'metadata': {**(metadata or {}), 'app_version': self.config['app_version']},
                 'queue_timestamp': datetime.now().timestamp(),
                 'priority': metadata.get('priority', 'normal') if metadata else 'normal'
             }
@@ -133,39 +142,22 @@ class OfflineDataCollector:
     
     def save_to_database(self, queued_item: Dict) -> Tuple[bool, Optional[str]]:
         """
-        Save queued item to database with enhanced error handling
+        Record an applied item in offline_data_queue as synced (the audit trail)
         
         Args:
             queued_item: Dictionary containing queued data
         
         Returns:
-            tuple: (success_status, queue_id_or_error_message)
+            tuple: (success_status, queue_id_or_error_message); False if the
+                   item was already recorded
         """
         try:
             with engine.begin() as conn:
-                result = conn.execute(text("""
-                    INSERT INTO offline_data_queue 
-                    (agent_id, holder_id, device_id, data_type, data_payload, 
-                     collected_at, sync_status, checksum, metadata, priority)
-                    VALUES (:aid, :hid, :did, :dtype, :payload, :collected, 
-                            :status, :check, :meta, :priority)
-                    RETURNING queue_id
-                """), {
-                    'aid': queued_item['agent_id'],
-                    'hid': queued_item.get('holder_id'),
-                    'did': queued_item['device_id'],
-                    'dtype': queued_item['data_type'],
-                    'payload': json.dumps(queued_item['data_payload']),
-                    'collected': queued_item['collected_at'],
-                    'status': 'pending',
-                    'check': queued_item['checksum'],
-                    'meta': json.dumps(queued_item.get('metadata', {})),
-                    'priority': queued_item.get('priority', 'normal')
-                })
-                
-                queue_id = result.scalar()
-                logger.info(f"Saved to database queue: {queue_id}")
-                return True, str(queue_id)
+                queue_id = self._record_synced_item(conn, queued_item)
+            if queue_id is None:
+                return False, f"Item {queued_item['item_id']} already recorded"
+            logger.info(f"Saved to database queue: {queue_id}")
+            return True, str(queue_id)
                 
         except exc.SQLAlchemyError as e:
             error_msg = f"Database save failed: {str(e)}"
@@ -176,6 +168,32 @@ class OfflineDataCollector:
             logger.error(error_msg)
             return False, error_msg
     
+    def _record_synced_item(self, conn, queued_item: Dict) -> Optional[int]:
+        """
+        Insert the item's audit row as already synced, so replay_engine never
+        applies it again; returns None when the item_id is already recorded
+        """
+        return conn.execute(text("""
+            INSERT INTO offline_data_queue 
+            (item_id, agent_id, holder_id, device_id, data_type, data_payload, 
+             collected_at, sync_status, synced_at, checksum, metadata, priority)
+            VALUES (:iid, :aid, :hid, :did, :dtype, :payload, :collected, 
+                    'synced', NOW(), :check, :meta, :priority)
+            ON CONFLICT (item_id) WHERE item_id IS NOT NULL DO NOTHING
+            RETURNING queue_id
+        """), {
+            'iid': queued_item.get('item_id'),
+            'aid': queued_item['agent_id'],
+            'hid': queued_item.get('holder_id'),
+            'did': queued_item['device_id'],
+            'dtype': queued_item['data_type'],
+            'payload': json.dumps(queued_item['data_payload']),
+            'collected': queued_item['collected_at'],
+            'check': queued_item['checksum'],
+            'meta': json.dumps(queued_item.get('metadata', {})),
+            'priority': queued_item.get('priority', 'normal')
+        }).scalar()
+    
     def attempt_sync(self, force: bool = False) -> Dict:
         """
         Attempt to sync all pending data with enhanced error handling
@@ -282,6 +300,8 @@ class OfflineDataCollector:
     
     def _process_sync_batches(self) -> Dict:
         """Process sync queue in batches with error handling"""
+        if self.config.get('ingest_url'):
+            self._resolve_staged_items()
         pending_queue = st.session_state['offline_queue'].copy()
         synced_count = 0
         failed_count = 0
@@ -321,9 +341,18 @@ class OfflineDataCollector:
     
     def _sync_batch(self, batch: List[Dict]) -> Dict:
         """Sync a batch of items"""
+        if self.config.get('ingest_url'):
+            return self._sync_batch_via_ingest(batch)
+        
         synced = 0
         failed = 0
         errors = []
+        failure_reasons = {}
+        to_send = [item for item in batch if item['sync_status'] in ('pending', 'failed')]
+        retries = sum(item['sync_attempts'] for item in to_send)
+        # Applied as it arrives, so there is no server-side wait; the device-side wait is offline age
+        offline_age = time.time() - min((item['queue_timestamp'] for item in to_send), default=time.time())
+        apply_started = time.perf_counter()
         
         for item in batch:
             if item['sync_status'] == 'pending' or item['sync_status'] == 'failed':
@@ -343,6 +372,23 @@ class OfflineDataCollector:
                     error_msg = f"Failed to sync {item['data_type']} (attempt {item['sync_attempts']})"
                     errors.append(error_msg)
                     item['error_message'] = error_msg
+                    failure_reasons[item['data_type']] = error_msg
+        
+        if to_send:
+            record_batch_metrics({
+                'agent_id': self.agent_id,
+                'device_id': self.device_id,
+                'app_version': self.config['app_version'],
+                'source': 'session',
+                'item_count': len(to_send),
+                'failed_count': failed,
+                'payload_bytes': sum(len(json.dumps(item['data_payload'], default=str)) for item in to_send),
+                'queue_wait_ms': 0,
+                'offline_age_ms': offline_age * 1000,
+                'apply_ms': (time.perf_counter() - apply_started) * 1000,
+                'retries': retries,
+                'failure_reasons': failure_reasons
+            })
         
         return {
             'synced': synced,
@@ -350,6 +396,86 @@ class OfflineDataCollector:
             'errors': errors
         }
     
+    def _sync_batch_via_ingest(self, batch: List[Dict]) -> Dict:
+        """Upload a batch to the bulk ingestion service in one request"""
+        from census_app.modules.admin_agent_managment.ingest_service import upload_batch
+        
+        to_send = [item for item in batch if item['sync_status'] in ('pending', 'failed')]
+        if not to_send:
+            return {'synced': 0, 'failed': 0, 'errors': []}
+        
+        if not self.config.get('ingest_token'):
+            ok, response = False, {'error': 'SYNC_INGEST_TOKEN is not set'}
+        else:
+            ok, response = upload_batch(
+                self.config['ingest_url'], self.config['ingest_token'], self.device_id, to_send,
+                timeout=self.config['sync_timeout']
+            )
+        rejected = {r.get('item_id'): r.get('error') for r in response.get('rejected', [])} if ok else {}
+        
+        synced = 0
+        failed = 0
+        errors = []
+        now = datetime.now().isoformat()
+        for item in to_send:
+            error_msg = response.get('error') if not ok else rejected.get(item['item_id'])
+            if error_msg is None:
+                # Staged only: kept in the queue until the server reports the batch applied
+                item['sync_status'] = 'staged'
+                item['batch_id'] = response['batch_id']
+                item['last_attempt_at'] = now
+                synced += 1
+            else:
+                item['sync_status'] = 'failed'
+                item['sync_attempts'] += 1
+                item['last_attempt_at'] = now
+                item['error_message'] = error_msg
+                failed += 1
+                errors.append(f"Failed to sync {item['data_type']}: {error_msg}")
+        
+        return {
+            'synced': synced,
+            'failed': failed,
+            'errors': errors
+        }
+    
+    def _resolve_staged_items(self):
+        """
+        Check the apply result of batches the ingestion service has staged
+
+        Items of applied batches become synced; items the server failed to
+        apply, or whose batch it no longer knows, go back to failed so the
+        next sync re-sends them. Batches still being applied stay staged.
+        """
+        from census_app.modules.admin_agent_managment.ingest_service import fetch_batch_status
+        
+        staged = {}
+        for item in st.session_state['offline_queue']:
+            if item['sync_status'] == 'staged':
+                staged.setdefault(item.get('batch_id'), []).append(item)
+        
+        now = datetime.now().isoformat()
+        for batch_id, items in staged.items():
+            code, body = fetch_batch_status(self.config['ingest_url'], self.config['ingest_token'],
+                                            batch_id, timeout=self.config['sync_timeout'])
+            if code == 200 and body.get('status') == 'staged':
+                continue
+            if code == 200 and body.get('status') in ('applied', 'partial'):
+                errors = {e.get('item_id'): e.get('error_message') for e in body.get('errors', [])}
+            elif code == 404:
+                errors = {item['item_id']: 'Batch unknown to the ingestion service' for item in items}
+            else:
+                continue  # Unreachable: ask again on the next sync
+            for item in items:
+                error_msg = errors.get(item['item_id'])
+                if error_msg is None:
+                    item['sync_status'] = 'synced'
+                    item['synced_at'] = now
+                else:
+                    item['sync_status'] = 'failed'
+                    item['sync_attempts'] += 1
+                    item['error_message'] = f"Apply failed: {error_msg}"
+    
     def _sync_single_item(self, item: Dict) -> bool:
         """
         Sync individual queued item with retry logic and conflict resolution
@@ -365,12 +491,10 @@ class OfflineDataCollector:
                         logger.warning(f"Data integrity check failed for {item['item_id']}")
                         return False
                 
-                # Route to appropriate handler
+                # Route to appropriate handler; it records the audit row in the same transaction
                 success = self._route_sync_handler(item)
                 
                 if success:
-                    # Also save to database queue for audit
-                    self.save_to_database(item)
                     return True
                 else:
                     # Wait before retry (exponential backoff)
@@ -386,84 +510,94 @@ class OfflineDataCollector:
         return False
     
     def _route_sync_handler(self, item: Dict) -> bool:
-        """Route item to appropriate sync handler"""
-        data_payload = item['data_payload']
-        data_type = item['data_type']
-        
+        """
+        Apply an item and record its audit row in one transaction
+
+        The audit row is inserted first and keyed by item_id: an item that is
+        already in offline_data_queue was applied before and is skipped.
+        """
         try:
             with engine.begin() as conn:
-                if data_type == 'holder_information':
-                    return self._sync_holder_info(conn, data_payload, item)
-                
-                elif data_type == 'household_information':
-                    return self._sync_household_info(conn, data_payload, item)
-                
-                elif data_type == 'labour_information':
-                    return self._sync_labour_info(conn, data_payload, item)
-                
-                elif data_type == 'machinery_information':
-                    return self._sync_machinery_info(conn, data_payload, item)
-                
-                elif data_type == 'land_use_information':
-                    return self._sync_land_use_info(conn, data_payload, item)
-                
-                elif data_type == 'assignment_update':
-                    return self._sync_assignment_update(conn, data_payload, item)
-                
-                elif data_type == 'location_update':
-                    return self._sync_location_update(conn, data_payload, item)
-                
-                elif data_type == 'interview_setup':
-                    return self._sync_interview_setup(conn, data_payload, item)
-                
-                elif data_type == 'survey_progress':
-                    return self._sync_survey_progress(conn, data_payload, item)
-                
-                else:
-                    # Generic handler for unknown types
-                    return self._sync_generic_data(conn, data_payload, item)
-                    
+                if self._record_synced_item(conn, item) is None:
+                    logger.info(f"Item {item['item_id']} was already synced, not applying it again")
+                    return True
+                success = self._dispatch_sync_handler(conn, item)
+                if not success:
+                    conn.execute(text("DELETE FROM offline_data_queue WHERE item_id = :iid"),
+                                 {'iid': item['item_id']})
+                return success
         except Exception as e:
-            logger.error(f"Handler error for {data_type}: {str(e)}")
+            logger.error(f"Handler error for {item['data_type']}: {str(e)}")
             return False
     
+    def _dispatch_sync_handler(self, conn, item: Dict) -> bool:
+        """Route item to appropriate sync handler"""
+        data_payload = item['data_payload']
+        data_type = item['data_type']
+        
+        if data_type == 'holder_information':
+            return self._sync_holder_info(conn, data_payload, item)
+        
+        elif data_type == 'household_information':
+            return self._sync_household_info(conn, data_payload, item)
+        
+        elif data_type == 'labour_information':
+            return self._sync_labour_info(conn, data_payload, item)
+        
+        elif data_type == 'machinery_information':
+            return self._sync_machinery_info(conn, data_payload, item)
+        
+        elif data_type == 'land_use_information':
+            return self._sync_land_use_info(conn, data_payload, item)
+        
+        elif data_type == 'assignment_update':
+            return self._sync_assignment_update(conn, data_payload, item)
+        
+        elif data_type == 'location_update':
+            return self._sync_location_update(conn, data_payload, item)
+        
+        elif data_type == 'interview_setup':
+            return self._sync_interview_setup(conn, data_payload, item)
+        
+        elif data_type == 'survey_progress':
+            return self._sync_survey_progress(conn, data_payload, item)
+        
+        else:
+            # Generic handler for unknown types
+            return self._sync_generic_data(conn, data_payload, item)
+    
     def _sync_holder_info(self, conn, data: Dict, item: Dict) -> bool:
         """Sync holder information with conflict resolution"""
         try:
             holder_id = item.get('holder_id')
             
             if holder_id:
-                # Update existing holder with conflict detection
-                result = conn.execute(text("""
-                    UPDATE holders 
-                    SET name = COALESCE(:name, name),
-                        date_of_birth = COALESCE(:dob, date_of_birth),
-                        gender = COALESCE(:gender, gender),
-                        education_level = COALESCE(:edu, education_level),
-                        marital_status = COALESCE(:marital, marital_status),
-                        phone_number = COALESCE(:phone, phone_number),
-                        email = COALESCE(:email, email),
-                        latitude = COALESCE(:lat, latitude),
-                        longitude = COALESCE(:lon, longitude),
-                        updated_at = NOW()
-                    WHERE holder_id = :hid
-                    RETURNING holder_id
-                """), {
-                    'hid': holder_id,
-                    'name': data.get('name'),
-                    'dob': data.get('date_of_birth'),
-                    'gender': data.get('gender'),
-                    'edu': data.get('education_level'),
-                    'marital': data.get('marital_status'),
-                    'phone': data.get('phone_number'),
-                    'email': data.get('email'),
-                    'lat': data.get('latitude'),
-                    'lon': data.get('longitude')
-                })
+                # Merge field by field with the same rules as the batch path;
+                # concurrent online edits are logged to sync_conflicts
+                exists = conn.execute(text("""
+                    SELECT 1 FROM holders WHERE holder_id = :hid
+                """), {'hid': holder_id}).scalar()
                 
-                if result.scalar() is None:
+                if exists is None:
                     logger.warning(f"Holder {holder_id} not found, may have been deleted")
                     return False
+                
+                create_apply_rows_table(conn)
+                conn.execute(text(f"""
+                    INSERT INTO {APPLY_ROWS_TABLE}
+                    (row_id, agent_id, holder_id, device_id, data_type, data_payload, metadata, collected_at)
+                    VALUES (0, :aid, :hid, :did, 'holder_information', CAST(:payload AS JSONB),
+                            CAST(:meta AS JSONB), :collected)
+                """), {
+                    'aid': self.agent_id,
+                    'hid': holder_id,
+                    'did': self.device_id,
+                    'payload': json.dumps(data),
+                    'meta': json.dumps(item.get('metadata', {})),
+                    'collected': item.get('collected_at')
+                })
+                conn.execute(text(build_holder_merge_statement(APPLY_ROWS_TABLE)))
+                conn.execute(text(f"DELETE FROM {APPLY_ROWS_TABLE}"))
                     
             else:
                 # Create new holder
@@ -713,7 +847,7 @@ class OfflineDataCollector:
                     'aid': self.agent_id,
                     'did': self.device_id,
                     'ctype': st.session_state.get('network_status', 'unknown'),
-                    'version': '1.0.0',  # Would come from app config
+                    'version': self.config['app_version'],
                     'device_info': json.dumps({
                         'user_agent': 'Streamlit',
                         'screen_resolution': 'N/A',
@@ -756,10 +890,10 @@ class OfflineDataCollector:
     
     def _update_queue_after_sync(self, processed_queue: List[Dict]):
         """Update the queue after sync operation"""
-        # Keep only pending and failed items
+        # Keep pending and failed items, and staged ones awaiting their apply result
         st.session_state['offline_queue'] = [
             item for item in processed_queue
-            if item['sync_status'] in ['pending', 'failed']
+            if item['sync_status'] in ['pending', 'failed', 'staged']
         ]
     
     def _generate_checksum(self, data: Dict) -> str:
@@ -789,6 +923,7 @@ class OfflineDataCollector:
             'total': len(queue),
             'pending': len([item for item in queue if item['sync_status'] == 'pending']),
             'failed': len([item for item in queue if item['sync_status'] == 'failed']),
+            'staged': len([item for item in queue if item['sync_status'] == 'staged']),
             'synced': len([item for item in queue if item['sync_status'] == 'synced']),
             'by_type': self._get_queue_stats_by_type(queue),
             'oldest_item': min([item['collected_at'] for item in queue]) if queue else None,
@@ -841,16 +976,26 @@ class OfflineDataCollector:
         return st.session_state['sync_errors'][-limit:]
     
     def get_sync_history(self, days: int = 7) -> List[Dict]:
-        """Get sync history from database"""
+        """Get sync history from database, with batch timings from sync_batch_metrics"""
         try:
             with engine.connect() as conn:
                 result = conn.execute(text("""
-                    SELECT session_id, sync_started_at, sync_completed_at,
-                           records_uploaded, records_failed, sync_status
-                    FROM sync_sessions
-                    WHERE agent_id = :aid 
-                    AND sync_started_at >= NOW() - INTERVAL ':days days'
-                    ORDER BY sync_started_at DESC
+                    SELECT s.session_id, s.sync_started_at, s.sync_completed_at,
+                           s.records_uploaded, s.records_failed, s.sync_status,
+                           m.batches, m.kb_uploaded, m.p95_latency_ms, m.retries
+                    FROM sync_sessions s
+                    LEFT JOIN LATERAL (
+                        SELECT COUNT(*) AS batches,
+                               ROUND(SUM(payload_bytes) / 1024.0, 1) AS kb_uploaded,
+                               ROUND(percentile_cont(0.95) WITHIN GROUP (ORDER BY queue_wait_ms + apply_ms)) AS p95_latency_ms,
+                               SUM(retries) AS retries
+                        FROM sync_batch_metrics
+                        WHERE device_id = s.device_id
+                        AND recorded_at BETWEEN s.sync_started_at AND COALESCE(s.sync_completed_at, NOW())
+                    ) m ON TRUE
+                    WHERE s.agent_id = :aid 
+                    AND s.sync_started_at >= NOW() - make_interval(days => :days)
+                    ORDER BY s.sync_started_at DESC
                 """), {'aid': self.agent_id, 'days': days}).mappings().all()
                 
                 return [dict(row) for row in result]
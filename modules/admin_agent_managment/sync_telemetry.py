@@ -0,0 +1,330 @@
+"""
+Sync Telemetry & Device Health
+Per-batch sync timings recorded as a compact time series, plus the admin health view
+"""
+
+import json
+import logging
+import threading
+from datetime import date
+from typing import Dict, List, Optional
+
+import pandas as pd
+import streamlit as st
+from sqlalchemy import text
+
+from census_app.db import engine
+from census_app.modules.admin_agent_managment.sync_appliers import APPLY_ROWS_TABLE
+
+logger = logging.getLogger('sync_telemetry')
+
+TELEMETRY_CONFIG = {
+    'retention_days': 90,
+    'failing_rate_pct': 20,  # failure rate that flags a device as failing
+}
+
+# Dimension name -> SQL expression over sync_batch_metrics m / islands i
+HEALTH_DIMENSIONS = {
+    'island': "COALESCE(i.island_name, 'Unassigned')",
+    'device': "m.device_id",
+    'app_version': "COALESCE(m.app_version, 'unknown')",
+}
+
+_METRICS_COLUMNS = [
+    'agent_id', 'device_id', 'app_version', 'source', 'item_count', 'failed_count',
+    'payload_bytes', 'queue_wait_ms', 'offline_age_ms', 'apply_ms', 'retries', 'failure_reasons'
+]
+
+
+def setup_telemetry_tables():
+    """Create the sync_batch_metrics time-series table if it doesn't exist"""
+    try:
+        with engine.begin() as conn:
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS sync_batch_metrics (
+                    recorded_at TIMESTAMP NOT NULL DEFAULT NOW(),
+                    agent_id INTEGER,
+                    device_id VARCHAR(100),
+                    app_version VARCHAR(20),
+                    source VARCHAR(10) NOT NULL,
+                    item_count INTEGER NOT NULL DEFAULT 0,
+                    failed_count INTEGER NOT NULL DEFAULT 0,
+                    payload_bytes INTEGER NOT NULL DEFAULT 0,
+                    queue_wait_ms BIGINT NOT NULL DEFAULT 0,
+                    offline_age_ms BIGINT NOT NULL DEFAULT 0,
+                    apply_ms INTEGER NOT NULL DEFAULT 0,
+                    retries SMALLINT NOT NULL DEFAULT 0,
+                    failure_reasons JSONB
+                )
+            """))
+            # Tables created before offline_age_ms existed: INTEGER overflowed after ~24.8 days
+            conn.execute(text("""
+                ALTER TABLE sync_batch_metrics ADD COLUMN IF NOT EXISTS offline_age_ms BIGINT NOT NULL DEFAULT 0
+            """))
+            if conn.execute(text("""
+                SELECT data_type = 'integer' FROM information_schema.columns
+                WHERE table_name = 'sync_batch_metrics' AND column_name = 'queue_wait_ms'
+            """)).scalar():
+                conn.execute(text("ALTER TABLE sync_batch_metrics ALTER COLUMN queue_wait_ms TYPE BIGINT"))
+            # Rows arrive in time order, so a BRIN index stays tiny
+            conn.execute(text("""
+                CREATE INDEX IF NOT EXISTS idx_sync_batch_metrics_time
+                ON sync_batch_metrics USING BRIN (recorded_at)
+            """))
+            conn.execute(text("""
+                CREATE INDEX IF NOT EXISTS idx_sync_batch_metrics_device
+                ON sync_batch_metrics (device_id, recorded_at)
+            """))
+        return True
+    except Exception as e:
+        logger.error(f"Error setting up telemetry tables: {str(e)}")
+        return False
+
+
+# ---------------- Recording ----------------
+def record_batch_metrics(metrics: Dict, conn=None):
+    """
+    Record timings for one synced batch
+
+    Args:
+        metrics: agent_id, device_id, app_version, source ('session', 'ingest'
+                 or 'replay'), item_count, failed_count, payload_bytes,
+                 queue_wait_ms (server receipt to apply), offline_age_ms
+                 (device collection to server receipt), apply_ms, retries,
+                 failure_reasons
+        conn: Optional open connection to record inside the caller's transaction
+    """
+    params = {column: metrics.get(column) for column in _METRICS_COLUMNS}
+    params['failure_reasons'] = json.dumps(metrics['failure_reasons']) if metrics.get('failure_reasons') else None
+    for column in ('item_count', 'failed_count', 'payload_bytes', 'queue_wait_ms', 'offline_age_ms',
+                   'apply_ms', 'retries'):
+        params[column] = int(params[column] or 0)
+
+    statement = text("""
+        INSERT INTO sync_batch_metrics
+        (agent_id, device_id, app_version, source, item_count, failed_count,
+         payload_bytes, queue_wait_ms, offline_age_ms, apply_ms, retries, failure_reasons)
+        VALUES (:agent_id, :device_id, :app_version, :source, :item_count, :failed_count,
+                :payload_bytes, :queue_wait_ms, :offline_age_ms, :apply_ms, :retries,
+                CAST(:failure_reasons AS JSONB))
+    """)
+    try:
+        if conn is not None:
+            conn.execute(statement, params)
+        else:
+            with engine.begin() as new_conn:
+                new_conn.execute(statement, params)
+    except Exception as e:
+        # Telemetry must never fail a sync
+        logger.error(f"Error recording sync metrics: {str(e)}")
+
+
+def record_working_set_metrics(conn, source: str, apply_ms: float, failures: Dict[str, str],
+                               queue_table: Optional[str] = None):
+    """
+    Record one metrics row per agent/device in the applier working set
+
+    Called after apply_sync_rows inside the same transaction, so the rows are
+    still in the working table. Queue wait runs from the earliest server
+    receipt (received_at) in the group to the applying transaction; offline
+    age is the longest time an item spent on the device before it arrived.
+
+    Args:
+        conn: Connection holding the filled working table
+        source: 'ingest' or 'replay'
+        apply_ms: Time apply_sync_rows took for the whole set
+        failures: Error message per failed data type, as returned by apply_sync_rows
+        queue_table: offline_data_queue when rows came from it, to report retries
+    """
+    retries = "COALESCE(SUM(q.sync_attempts), 0)" if queue_table else "0"
+    queue_join = f"LEFT JOIN {queue_table} q ON q.queue_id = r.row_id" if queue_table else ""
+    savepoint = conn.begin_nested()
+    try:
+        conn.execute(text(f"""
+            INSERT INTO sync_batch_metrics
+            (agent_id, device_id, app_version, source, item_count, failed_count,
+             payload_bytes, queue_wait_ms, offline_age_ms, apply_ms, retries, failure_reasons)
+            SELECT r.agent_id, r.device_id, MAX(r.metadata->>'app_version'), :source,
+                   COUNT(*),
+                   COUNT(*) FILTER (WHERE CAST(:failures AS JSONB) ? r.data_type),
+                   SUM(OCTET_LENGTH(r.data_payload::text)),
+                   GREATEST(EXTRACT(EPOCH FROM NOW() - MIN(COALESCE(r.received_at, NOW()))) * 1000, 0)::bigint,
+                   GREATEST(EXTRACT(EPOCH FROM MAX(COALESCE(r.received_at, NOW()) - r.collected_at)) * 1000,
+                            0)::bigint,
+                   :apply_ms,
+                   {retries},
+                   (SELECT jsonb_object_agg(f.key, f.value)
+                    FROM jsonb_each(CAST(:failures AS JSONB)) f
+                    WHERE f.key = ANY(ARRAY_AGG(r.data_type)))
+            FROM {APPLY_ROWS_TABLE} r
+            {queue_join}
+            GROUP BY r.agent_id, r.device_id
+        """), {'source': source, 'apply_ms': int(apply_ms), 'failures': json.dumps(failures)})
+        savepoint.commit()
+    except Exception as e:
+        savepoint.rollback()
+        logger.error(f"Error recording sync metrics: {str(e)}")
+
+
+def prune_batch_metrics(retention_days: Optional[int] = None) -> int:
+    """Delete metrics older than the retention window"""
+    retention_days = retention_days or TELEMETRY_CONFIG['retention_days']
+    with engine.begin() as conn:
+        return conn.execute(text("""
+            DELETE FROM sync_batch_metrics
+            WHERE recorded_at < NOW() - make_interval(days => :days)
+        """), {'days': retention_days}).rowcount
+
+
+_pruned_on: Optional[date] = None
+_prune_lock = threading.Lock()
+
+
+def prune_batch_metrics_daily() -> int:
+    """Prune at most once a day per process; called from the sync background loops when idle"""
+    global _pruned_on
+    with _prune_lock:
+        if _pruned_on == date.today():
+            return 0
+        _pruned_on = date.today()
+    removed = prune_batch_metrics()
+    if removed:
+        logger.info(f"Pruned {removed} sync metric rows")
+    return removed
+
+
+# ---------------- Health Queries ----------------
+def get_sync_health(dimension: str = 'island', hours: int = 24) -> List[Dict]:
+    """
+    Throughput, p95 latency and failure rate grouped by island, device or app version
+
+    Latency is server-side: queue wait plus apply time, from when the server
+    received the oldest item in a batch to when the batch was applied. How
+    long items sat on devices before arriving is reported separately as
+    offline age, so time spent offline does not read as slow syncing.
+    """
+    if dimension not in HEALTH_DIMENSIONS:
+        raise ValueError(f"Unknown dimension: {dimension}")
+
+    with engine.connect() as conn:
+        result = conn.execute(text(f"""
+            SELECT {HEALTH_DIMENSIONS[dimension]} AS {dimension},
+                   COUNT(*) AS batches,
+                   SUM(m.item_count) AS items,
+                   ROUND(SUM(m.item_count)::numeric / (:hours * 60), 2) AS items_per_min,
+                   ROUND(percentile_cont(0.5) WITHIN GROUP (ORDER BY m.queue_wait_ms + m.apply_ms)) AS p50_latency_ms,
+                   ROUND(percentile_cont(0.95) WITHIN GROUP (ORDER BY m.queue_wait_ms + m.apply_ms)) AS p95_latency_ms,
+                   ROUND(percentile_cont(0.95) WITHIN GROUP (ORDER BY m.apply_ms)) AS p95_apply_ms,
+                   ROUND(percentile_cont(0.95) WITHIN GROUP (ORDER BY m.offline_age_ms) / 60000.0, 1)
+                       AS p95_offline_age_min,
+                   SUM(m.failed_count) AS failed_items,
+                   ROUND(100.0 * SUM(m.failed_count) / NULLIF(SUM(m.item_count), 0), 1) AS failure_rate_pct,
+                   SUM(m.retries) AS retries,
+                   ROUND(SUM(m.payload_bytes) / 1024.0, 1) AS kb_uploaded,
+                   MAX(m.recorded_at) AS last_seen
+            FROM sync_batch_metrics m
+            LEFT JOIN agents a ON a.agent_id = m.agent_id
+            LEFT JOIN islands i ON i.island_id = a.assigned_island_id
+            WHERE m.recorded_at >= NOW() - make_interval(hours => :hours)
+            GROUP BY 1
+            ORDER BY p95_latency_ms DESC NULLS LAST
+        """), {'hours': hours}).mappings().all()
+        return [dict(row) for row in result]
+
+
+def get_sync_timeseries(hours: int = 24) -> List[Dict]:
+    """Hourly throughput and p95 latency across all devices"""
+    with engine.connect() as conn:
+        result = conn.execute(text("""
+            SELECT DATE_TRUNC('hour', recorded_at) AS hour,
+                   SUM(item_count) AS items,
+                   SUM(failed_count) AS failed_items,
+                   ROUND(percentile_cont(0.95) WITHIN GROUP (ORDER BY queue_wait_ms + apply_ms)) AS p95_latency_ms
+            FROM sync_batch_metrics
+            WHERE recorded_at >= NOW() - make_interval(hours => :hours)
+            GROUP BY 1
+            ORDER BY 1
+        """), {'hours': hours}).mappings().all()
+        return [dict(row) for row in result]
+
+
+def get_failing_devices(hours: int = 24, min_failure_rate: Optional[float] = None) -> List[Dict]:
+    """Devices whose recent failure rate is above the threshold, worst first"""
+    min_failure_rate = min_failure_rate if min_failure_rate is not None else TELEMETRY_CONFIG['failing_rate_pct']
+    with engine.connect() as conn:
+        result = conn.execute(text("""
+            SELECT m.device_id, a.agent_code, a.full_name,
+                   SUM(m.item_count) AS items,
+                   SUM(m.failed_count) AS failed_items,
+                   ROUND(100.0 * SUM(m.failed_count) / NULLIF(SUM(m.item_count), 0), 1) AS failure_rate_pct,
+                   MAX(m.recorded_at) AS last_seen,
+                   (ARRAY_AGG(m.failure_reasons ORDER BY m.recorded_at DESC)
+                        FILTER (WHERE m.failure_reasons IS NOT NULL))[1] AS last_failure
+            FROM sync_batch_metrics m
+            LEFT JOIN agents a ON a.agent_id = m.agent_id
+            WHERE m.recorded_at >= NOW() - make_interval(hours => :hours)
+            GROUP BY m.device_id, a.agent_code, a.full_name
+            HAVING 100.0 * SUM(m.failed_count) / NULLIF(SUM(m.item_count), 0) >= :rate
+            ORDER BY failure_rate_pct DESC, failed_items DESC
+        """), {'hours': hours, 'rate': min_failure_rate}).mappings().all()
+        return [dict(row) for row in result]
+
+
+# ---------------- Admin View ----------------
+def render_sync_health():
+    """Admin panel: sync throughput, p95 latency and failing devices"""
+    st.subheader("📡 Sync Health")
+
+    col1, col2 = st.columns(2)
+    with col1:
+        hours = st.selectbox("Window", [1, 6, 24, 72, 168], index=2,
+                             format_func=lambda h: f"Last {h}h", key="sync_health_hours")
+    with col2:
+        dimension = st.radio("Group by", list(HEALTH_DIMENSIONS.keys()), horizontal=True,
+                             format_func=lambda d: d.replace('_', ' ').title(),
+                             key="sync_health_dimension")
+
+    try:
+        failing = get_failing_devices(hours)
+        health = get_sync_health(dimension, hours)
+        series = get_sync_timeseries(hours)
+    except Exception as e:
+        st.error(f"Could not load sync telemetry: {e}")
+        return
+
+    if failing:
+        st.warning(f"⚠️ {len(failing)} device(s) failing more than "
+                   f"{TELEMETRY_CONFIG['failing_rate_pct']}% of synced items")
+        st.dataframe(pd.DataFrame(failing), use_container_width=True)
+
+    if not health:
+        st.info("No sync activity recorded in this window.")
+        return
+
+    health_df = pd.DataFrame(health)
+    col_m = st.columns(4)
+    with col_m[0]:
+        st.metric("Items Synced", int(health_df['items'].sum()))
+    with col_m[1]:
+        st.metric("Worst p95 Latency", f"{health_df['p95_latency_ms'].max():,.0f} ms")
+    with col_m[2]:
+        st.metric("Worst p95 Offline Age", f"{health_df['p95_offline_age_min'].max():,.1f} min",
+                  help="Time items waited on the device before reaching the server; not part of latency")
+    with col_m[3]:
+        st.metric("Failed Items", int(health_df['failed_items'].sum()))
+
+    st.dataframe(health_df, use_container_width=True)
+
+    if len(series) > 1:
+        series_df = pd.DataFrame(series).set_index('hour')
+        col_c = st.columns(2)
+        with col_c[0]:
+            st.line_chart(series_df[['items', 'failed_items']])
+            st.caption("Items synced per hour")
+        with col_c[1]:
+            st.line_chart(series_df[['p95_latency_ms']])
+            st.caption("p95 sync latency (ms)")
+
+
+# Run table setup when module is imported
+setup_telemetry_tables()
@@ -0,0 +1,478 @@
+"""
+Workload Balancing for Agent Assignments
+Assigns unassigned holders and registrations to the nearest agent on their island
+with spare capacity, levelling open workloads, and applies the plan in one transaction
+
+Benchmark (needs numpy, pandas and the census database, since importing the
+module runs setup_balancer_columns; the plan itself uses synthetic data and
+is not applied):
+    python -m census_app.modules.admin_agent_managment.workload_balancer --candidates 50000 --agents 120
+
+    Prints planning time, placed/unassigned counts, load spread and mean distance.
+"""
+
+import argparse
+import logging
+import time
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+from sqlalchemy import text
+
+from census_app.db import engine
+from census_app.modules.admin_agent_managment.route_planner import haversine_km, haversine_matrix
+
+logger = logging.getLogger('workload_balancer')
+
+OPEN_STATUSES = ('assigned', 'scheduled', 'in_progress')
+OPEN_STATUSES_SQL = ", ".join(f"'{status}'" for status in OPEN_STATUSES)
+
+BALANCER_CONFIG = {
+    'interview_type': 'in_person',
+    'default_max_assignments': 10,
+}
+
+
+def setup_balancer_columns():
+    """Link assignments to registrations, agent capacity and the unassigned-candidate indexes"""
+    try:
+        with engine.begin() as conn:
+            # load_agents reads per-agent capacity; NULL falls back to default_max_assignments
+            conn.execute(text("""
+                ALTER TABLE agents ADD COLUMN IF NOT EXISTS max_assignments INTEGER
+            """))
+            conn.execute(text("""
+                ALTER TABLE agent_assignments ADD COLUMN IF NOT EXISTS registration_id INTEGER
+            """))
+            conn.execute(text("""
+                CREATE INDEX IF NOT EXISTS idx_agent_assignments_registration
+                ON agent_assignments (registration_id) WHERE registration_id IS NOT NULL
+            """))
+            conn.execute(text("""
+                CREATE INDEX IF NOT EXISTS idx_agent_assignments_holder_status
+                ON agent_assignments (holder_id, status)
+            """))
+        return True
+    except Exception as e:
+        logger.error(f"Error setting up balancer columns: {str(e)}")
+        return False
+
+
+# ---------------- Loading ----------------
+def load_candidates() -> pd.DataFrame:
+    """Unassigned holders and registrations with island and location"""
+    with engine.connect() as conn:
+        return pd.read_sql(text(f"""
+            SELECT 'holder' AS kind, h.holder_id AS source_id, i.island_id,
+                   NULLIF(h.latitude, 0) AS lat, NULLIF(h.longitude, 0) AS lon
+            FROM holders h
+            LEFT JOIN (
+                SELECT DISTINCT ON (holder_id) holder_id, island
+                FROM general_information
+                WHERE holder_id IS NOT NULL
+                ORDER BY holder_id, id DESC
+            ) g ON g.holder_id = h.holder_id
+            LEFT JOIN islands i ON LOWER(i.island_name) = LOWER(g.island)
+            WHERE h.assigned_agent_id IS NULL
+            AND COALESCE(h.status, 'pending') <> 'rejected'
+            AND NOT EXISTS (
+                SELECT 1 FROM agent_assignments aa
+                WHERE aa.holder_id = h.holder_id AND aa.status IN ({OPEN_STATUSES_SQL})
+            )
+            UNION ALL
+            SELECT 'registration', r.id, i.island_id,
+                   r.latitude::double precision, r.longitude::double precision
+            FROM registration_form r
+            LEFT JOIN islands i ON LOWER(i.island_name) = LOWER(r.island)
+            WHERE NOT EXISTS (
+                SELECT 1 FROM agent_assignments aa WHERE aa.registration_id = r.id
+            )
+        """), conn)
+
+
+def load_agents() -> pd.DataFrame:
+    """
+    Active agents with their open workload and the centre of their open assignments
+
+    Requires agents.max_assignments (added by setup_balancer_columns).
+    """
+    with engine.connect() as conn:
+        return pd.read_sql(text(f"""
+            SELECT a.agent_id, a.assigned_island_id AS island_id,
+                   COALESCE(a.max_assignments, :default_max) AS max_assignments,
+                   COALESCE(o.open_count, 0) AS open_count,
+                   o.lat, o.lon
+            FROM agents a
+            LEFT JOIN (
+                SELECT agent_id, COUNT(*) AS open_count,
+                       AVG(location_lat) AS lat, AVG(location_lon) AS lon
+                FROM agent_assignments
+                WHERE status IN ({OPEN_STATUSES_SQL})
+                GROUP BY agent_id
+            ) o ON o.agent_id = a.agent_id
+            WHERE a.status = 'active'
+        """), conn, params={'default_max': BALANCER_CONFIG['default_max_assignments']})
+
+
+# ---------------- Planning ----------------
+def _level_capacity(load: np.ndarray, limit: np.ndarray, demand: int) -> np.ndarray:
+    """
+    Water-filling: raise the lowest loads first
+
+    Returns how many new assignments each agent may take so that demand is
+    met with the smallest possible maximum load (never above limit).
+    """
+    headroom = np.maximum(limit - load, 0)
+    if demand <= 0 or headroom.sum() == 0:
+        return np.zeros_like(load)
+    if headroom.sum() <= demand:
+        return headroom
+
+    low, high = int(load.min()), int(limit.max())
+    while low < high:
+        level = (low + high) // 2
+        if np.clip(level - load, 0, headroom).sum() >= demand:
+            high = level
+        else:
+            low = level + 1
+    return np.clip(low - load, 0, headroom)
+
+
+def _capacitated_nearest(dist: np.ndarray, capacity: np.ndarray) -> np.ndarray:
+    """
+    Assign each row to its nearest column with capacity left
+
+    Every round, all open candidates pick their nearest open agent at once;
+    each agent keeps the closest picks up to its capacity and the rest retry
+    after full agents are masked out. Rows that never fit get -1.
+    """
+    n, m = dist.shape
+    assigned = np.full(n, -1, dtype=np.int64)
+    remaining = capacity.astype(np.int64).copy()
+    dist = dist.copy()
+    dist[:, remaining <= 0] = np.inf
+    pending = np.arange(n)
+
+    while len(pending):
+        sub = dist[pending]
+        choice = np.argmin(sub, axis=1)
+        best = sub[np.arange(len(pending)), choice]
+        feasible = np.isfinite(best)
+        if not feasible.any():
+            break
+        pending, choice, best = pending[feasible], choice[feasible], best[feasible]
+
+        order = np.lexsort((best, choice))
+        pending, choice = pending[order], choice[order]
+        rank = np.arange(len(choice)) - np.searchsorted(choice, choice, side='left')
+        accept = rank < remaining[choice]
+
+        assigned[pending[accept]] = choice[accept]
+        taken = np.bincount(choice[accept], minlength=m)
+        remaining -= taken
+        dist[:, (remaining <= 0) & (taken > 0)] = np.inf
+        pending = pending[~accept]
+
+    return assigned
+
+
+def _fill_locations(lat: np.ndarray, lon: np.ndarray, island: np.ndarray,
+                    ref_lat: np.ndarray, ref_lon: np.ndarray, ref_island: np.ndarray):
+    """Replace missing agent positions with the centre of their island's candidates"""
+    lat, lon = lat.copy(), lon.copy()
+    missing = np.isnan(lat) | np.isnan(lon)
+    known = ~(np.isnan(ref_lat) | np.isnan(ref_lon))
+    overall = (np.nanmean(ref_lat[known]), np.nanmean(ref_lon[known])) if known.any() else (0.0, 0.0)
+    for index in np.flatnonzero(missing):
+        same = known & (ref_island == island[index])
+        if same.any():
+            lat[index], lon[index] = ref_lat[same].mean(), ref_lon[same].mean()
+        else:
+            lat[index], lon[index] = overall
+    return lat, lon
+
+
+def plan_balanced_assignment(candidates: pd.DataFrame, agents: pd.DataFrame,
+                             max_load: Optional[int] = None) -> Dict:
+    """
+    Compute a balanced assignment without touching the database
+
+    Candidates with a known island only go to agents on that island; within an
+    island each agent's share is set by water-filling the open workloads, and
+    candidates go to the nearest agent with share left. Candidates with no
+    island are then spread over all agents' remaining headroom the same way.
+
+    Args:
+        candidates: kind, source_id, island_id, lat, lon
+        agents: agent_id, island_id, max_assignments, open_count, lat, lon
+        max_load: Cap on open assignments per agent, overriding max_assignments
+
+    Returns:
+        dict: assignments frame, per-agent summary, unassigned count and timing_ms
+    """
+    started = time.perf_counter()
+    n, m = len(candidates), len(agents)
+    if n == 0 or m == 0:
+        return {'assignments': candidates.iloc[0:0].assign(agent_id=[]), 'summary': [],
+                'unassigned': n, 'timing_ms': 0.0}
+
+    c_island = candidates['island_id'].fillna(-1).to_numpy(dtype=np.int64)
+    c_lat = candidates['lat'].to_numpy(dtype=np.float64)
+    c_lon = candidates['lon'].to_numpy(dtype=np.float64)
+    a_island = agents['island_id'].fillna(-2).to_numpy(dtype=np.int64)
+    load = agents['open_count'].to_numpy(dtype=np.int64)
+    limit = (np.full(m, max_load, dtype=np.int64) if max_load
+             else agents['max_assignments'].to_numpy(dtype=np.int64))
+    a_lat, a_lon = _fill_locations(agents['lat'].to_numpy(dtype=np.float64),
+                                   agents['lon'].to_numpy(dtype=np.float64),
+                                   a_island, c_lat, c_lon, c_island)
+
+    def distances(rows: np.ndarray, cols: np.ndarray) -> np.ndarray:
+        # Candidates without coordinates are equally far from everyone: pure balancing
+        block = haversine_matrix(c_lat[rows], c_lon[rows], a_lat[cols], a_lon[cols])
+        return np.nan_to_num(block, nan=0.0)
+
+    assigned = np.full(n, -1, dtype=np.int64)
+
+    # Island-bound candidates only see their island's agents, one small block per island
+    for island in np.unique(a_island[a_island >= 0]):
+        cols = np.flatnonzero(a_island == island)
+        rows = np.flatnonzero(c_island == island)
+        if not len(rows):
+            continue
+        capacity = _level_capacity(load[cols], limit[cols], len(rows))
+        picks = _capacitated_nearest(distances(rows, cols), capacity)
+        assigned[rows[picks >= 0]] = cols[picks[picks >= 0]]
+
+    new_load = load + np.bincount(assigned[assigned >= 0], minlength=m)
+
+    # Candidates with no island go wherever headroom is left
+    free = np.flatnonzero(c_island < 0)
+    if len(free):
+        capacity = _level_capacity(new_load, limit, len(free))
+        assigned[free] = _capacitated_nearest(distances(free, np.arange(m)), capacity)
+        new_load = load + np.bincount(assigned[assigned >= 0], minlength=m)
+
+    placed = np.flatnonzero(assigned >= 0)
+    agent_index = assigned[placed]
+    plan = candidates.iloc[placed].copy()
+    plan['agent_id'] = agents['agent_id'].to_numpy()[agent_index]
+    plan['agent_limit'] = limit[agent_index]
+    plan['island_id'] = pd.Series(np.where(c_island[placed] >= 0, c_island[placed], a_island[agent_index]),
+                                  index=plan.index).where(lambda v: v >= 0)
+    plan['distance_km'] = np.nan_to_num(
+        haversine_km(c_lat[placed], c_lon[placed], a_lat[agent_index], a_lon[agent_index])).round(2)
+
+    summary = pd.DataFrame({
+        'agent_id': agents['agent_id'].to_numpy(),
+        'island_id': agents['island_id'].to_numpy(),
+        'open_before': load,
+        'new_assignments': new_load - load,
+        'open_after': new_load,
+        'limit': limit,
+    })
+    return {
+        'assignments': plan,
+        'summary': summary.to_dict('records'),
+        'unassigned': n - len(placed),
+        'timing_ms': round((time.perf_counter() - started) * 1000, 1)
+    }
+
+
+# ---------------- Applying ----------------
+def _nullable(values: pd.Series) -> list:
+    return [None if pd.isna(v) else v for v in values.tolist()]
+
+
+def apply_balanced_assignment(plan: Dict, interview_type: Optional[str] = None) -> int:
+    """
+    Write a plan in one set-based transaction
+
+    Rows that were assigned by someone else since the plan was computed are
+    skipped, and each agent's open assignments are re-counted so a stale plan
+    never takes an agent past the limit it was planned with. Concurrent
+    balancer runs are serialised with an advisory lock.
+
+    Returns:
+        int: assignments created
+    """
+    rows = plan['assignments']
+    if rows.empty:
+        return 0
+    with engine.begin() as conn:
+        conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('workload_balancer'))"))
+        created = conn.execute(text(f"""
+            WITH plan AS (
+                SELECT * FROM unnest(
+                    CAST(:kinds AS TEXT[]), CAST(:source_ids AS INTEGER[]), CAST(:agent_ids AS INTEGER[]),
+                    CAST(:island_ids AS INTEGER[]), CAST(:lats AS DOUBLE PRECISION[]),
+                    CAST(:lons AS DOUBLE PRECISION[]), CAST(:limits AS INTEGER[])
+                ) WITH ORDINALITY AS p(kind, source_id, agent_id, island_id, lat, lon, agent_limit, ord)
+            ),
+            fresh AS (
+                SELECT p.*, ROW_NUMBER() OVER (PARTITION BY p.agent_id ORDER BY p.ord) AS agent_rank
+                FROM plan p
+                WHERE NOT (p.kind = 'holder' AND EXISTS (
+                    SELECT 1 FROM holders h
+                    WHERE h.holder_id = p.source_id AND h.assigned_agent_id IS NOT NULL))
+                AND NOT (p.kind = 'holder' AND EXISTS (
+                    SELECT 1 FROM agent_assignments aa
+                    WHERE aa.holder_id = p.source_id AND aa.status IN ({OPEN_STATUSES_SQL})))
+                AND NOT (p.kind = 'registration' AND EXISTS (
+                    SELECT 1 FROM agent_assignments aa WHERE aa.registration_id = p.source_id))
+            ),
+            open_load AS (
+                SELECT agent_id, COUNT(*) AS open_count
+                FROM agent_assignments
+                WHERE agent_id IN (SELECT agent_id FROM fresh)
+                AND status IN ({OPEN_STATUSES_SQL})
+                GROUP BY agent_id
+            ),
+            accepted AS (
+                -- Work assigned since planning counts against the agent's limit
+                SELECT f.* FROM fresh f
+                LEFT JOIN open_load o ON o.agent_id = f.agent_id
+                WHERE COALESCE(o.open_count, 0) + f.agent_rank <= f.agent_limit
+            ),
+            inserted AS (
+                INSERT INTO agent_assignments
+                (agent_id, holder_id, registration_id, island_id, interview_type, status,
+                 assignment_date, location_lat, location_lon, created_at, updated_at)
+                SELECT agent_id,
+                       CASE WHEN kind = 'holder' THEN source_id END,
+                       CASE WHEN kind = 'registration' THEN source_id END,
+                       island_id, :itype, 'assigned', NOW(), lat, lon, NOW(), NOW()
+                FROM accepted
+                RETURNING agent_id, holder_id
+            ),
+            holder_update AS (
+                UPDATE holders h
+                SET assigned_agent_id = i.agent_id, updated_at = NOW()
+                FROM inserted i
+                WHERE h.holder_id = i.holder_id
+            ),
+            agent_update AS (
+                UPDATE agents a
+                SET current_assignments = COALESCE(a.current_assignments, 0) + c.new_count
+                FROM (SELECT agent_id, COUNT(*) AS new_count FROM inserted GROUP BY agent_id) c
+                WHERE a.agent_id = c.agent_id
+            )
+            SELECT COUNT(*) FROM inserted
+        """), {
+            'kinds': rows['kind'].tolist(),
+            'source_ids': rows['source_id'].astype(int).tolist(),
+            'agent_ids': rows['agent_id'].astype(int).tolist(),
+            'island_ids': [None if pd.isna(v) else int(v) for v in rows['island_id'].tolist()],
+            'lats': _nullable(rows['lat']),
+            'lons': _nullable(rows['lon']),
+            'limits': rows['agent_limit'].astype(int).tolist(),
+            'itype': interview_type or BALANCER_CONFIG['interview_type'],
+        }).scalar()
+    logger.info(f"Workload balancer created {created} of {len(rows)} planned assignments")
+    return created or 0
+
+
+# ---------------- Admin UI ----------------
+def render_workload_balancing():
+    """Admin panel: preview and apply a balanced batch assignment"""
+    st.subheader("⚖️ Workload Balancing")
+
+    col1, col2 = st.columns(2)
+    with col1:
+        cap_override = st.checkbox("Override per-agent limits", key="balancer_cap_override")
+    with col2:
+        max_load = st.number_input("Max open assignments per agent", min_value=1, value=50,
+                                   disabled=not cap_override, key="balancer_max_load")
+
+    if st.button("🔍 Preview Assignment", key="balancer_preview"):
+        try:
+            candidates, agents = load_candidates(), load_agents()
+        except Exception as e:
+            st.error(f"Could not load assignment data: {e}")
+            return
+        st.session_state['balancer_plan'] = plan_balanced_assignment(
+            candidates, agents, int(max_load) if cap_override else None)
+
+    plan = st.session_state.get('balancer_plan')
+    if not plan:
+        st.info("Preview an assignment to see how unassigned holders and registrations would be spread.")
+        return
+
+    col_m = st.columns(3)
+    with col_m[0]:
+        st.metric("To Assign", len(plan['assignments']))
+    with col_m[1]:
+        st.metric("Left Unassigned", plan['unassigned'])
+    with col_m[2]:
+        st.metric("Planning Time", f"{plan['timing_ms']:,.0f} ms")
+
+    if plan['unassigned']:
+        st.warning("⚠️ Some candidates have no agent with capacity on their island.")
+
+    summary_df = pd.DataFrame(plan['summary'])
+    if not summary_df.empty:
+        st.dataframe(summary_df.sort_values('open_after', ascending=False), use_container_width=True)
+
+    if st.button("✅ Apply Assignment", key="balancer_apply", disabled=plan['assignments'].empty):
+        try:
+            created = apply_balanced_assignment(plan)
+            st.success(f"✅ Created {created} assignments")
+            st.session_state.pop('balancer_plan', None)
+        except Exception as e:
+            st.error(f"Error applying assignment: {e}")
+
+
+# ---------------- Benchmark ----------------
+def benchmark_balancing(num_candidates: int = 50000, num_agents: int = 120,
+                        num_islands: int = 16, seed: int = 42) -> Dict:
+    """Time plan_balanced_assignment on random candidates and agents spread over the islands"""
+    rng = np.random.default_rng(seed)
+    island_lat = rng.uniform(21.0, 27.0, num_islands)
+    island_lon = rng.uniform(-79.5, -73.0, num_islands)
+
+    c_island = rng.integers(0, num_islands, num_candidates)
+    candidates = pd.DataFrame({
+        'kind': np.where(rng.random(num_candidates) < 0.8, 'holder', 'registration'),
+        'source_id': np.arange(num_candidates),
+        'island_id': pd.Series(c_island, dtype='Int64').mask(rng.random(num_candidates) < 0.05),
+        'lat': island_lat[c_island] + rng.normal(0, 0.2, num_candidates),
+        'lon': island_lon[c_island] + rng.normal(0, 0.2, num_candidates),
+    })
+    a_island = rng.integers(0, num_islands, num_agents)
+    agents = pd.DataFrame({
+        'agent_id': np.arange(num_agents),
+        'island_id': a_island,
+        'max_assignments': np.full(num_agents, num_candidates),
+        'open_count': rng.integers(0, 300, num_agents),
+        'lat': island_lat[a_island] + rng.normal(0, 0.2, num_agents),
+        'lon': island_lon[a_island] + rng.normal(0, 0.2, num_agents),
+    })
+
+    plan = plan_balanced_assignment(candidates, agents)
+    summary = pd.DataFrame(plan['summary'])
+    loads = summary.groupby('island_id')['open_after'].agg(lambda s: s.max() - s.min())
+    return {
+        'candidates': num_candidates,
+        'agents': num_agents,
+        'assigned': len(plan['assignments']),
+        'unassigned': plan['unassigned'],
+        'timing_ms': plan['timing_ms'],
+        'max_island_load_spread': int(loads.max()),
+        'mean_distance_km': round(float(plan['assignments']['distance_km'].mean()), 2),
+    }
+
+
+# Run column setup when module is imported
+setup_balancer_columns()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark workload balancing")
+    parser.add_argument('--candidates', type=int, default=50000)
+    parser.add_argument('--agents', type=int, default=120)
+    args = parser.parse_args()
+
+    for key, value in benchmark_balancing(args.candidates, args.agents).items():
+        print(f"{key:>24}: {value}")
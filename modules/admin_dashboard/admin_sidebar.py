@@ -2,6 +2,8 @@
 
 import streamlit as st
 
+from census_app.modules.admin_agent_managment.change_feed import render_live_counters
+
 def admin_sidebar():
     st.sidebar.title("👨‍💼 Admin Panel")
 
@@ -12,13 +14,19 @@ def admin_sidebar():
     else:
         st.sidebar.warning("Not logged in")
 
+    # ----------------- Live Counters -----------------
+    with st.sidebar:
+        render_live_counters()
+
     st.sidebar.markdown("---")
 
     # ----------------- Navigation -----------------
     st.sidebar.subheader("Navigation")
     tab = st.sidebar.radio(
         "Go to",
-        ["Manage Users/Holders", "General Information", "Advanced Query", "Alerts Monitor", "Graphs & Reports"]
+        ["Manage Users/Holders", "General Information", "Advanced Query", "Alerts Monitor",
+         "Sync Conflicts", "Sync Health", "Workload Balancing", "Agent Performance",
+         "Graphs & Reports"]
     )
     st.session_state["admin_tab"] = tab
 
@@ -32,6 +40,14 @@ def admin_sidebar():
         st.sidebar.info("Run queries and download CSV/Excel reports.")
     elif tab == "Alerts Monitor":
         st.sidebar.info("Check recent and all system alerts.")
+    elif tab == "Sync Conflicts":
+        st.sidebar.info("Review field conflicts between offline and online edits.")
+    elif tab == "Sync Health":
+        st.sidebar.info("Sync throughput, p95 latency and failing devices.")
+    elif tab == "Workload Balancing":
+        st.sidebar.info("Spread unassigned holders and registrations evenly across agents.")
+    elif tab == "Agent Performance":
+        st.sidebar.info("Completion and workload KPIs for every agent on an island.")
     elif tab == "Graphs & Reports":
         st.sidebar.info("View data visualizations and summary reports.")
 
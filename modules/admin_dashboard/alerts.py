@@ -1,17 +1,41 @@
 # census_app/modules/admin_dashboard/alerts.py
 
 import json
+import logging
 import os
+import re
+import threading
+import time
 from datetime import datetime
+from typing import Optional
 from sqlalchemy import text
 from census_app.config import engine
+from census_app.modules.admin_dashboard.queries import compile_conditions, get_table_columns
 import streamlit as st
 
-# Paths for alert templates and history
+logger = logging.getLogger('admin_alerts')
+
+# Paths for alert templates and the legacy JSON history (imported once into alert_history)
 BASE_DIR = os.path.dirname(__file__)
-TEMPLATES_FILE = os.path.join(BASE_DIR, "alert_templates.json")
+TEMPLATES_FILE = os.path.join(BASE_DIR, "data", "alert_templates.json")
 HISTORY_FILE = os.path.join(BASE_DIR, "alert_history.json")
 
+ALERT_ENGINE_CONFIG = {
+    "tables": ["users", "holders"],
+    "interval_seconds": 300,     # background evaluation period
+    "min_refresh_seconds": 15,   # manual re-evaluations closer together than this are ignored
+    "history_retention_days": 365,
+    "history_page_size": 25,
+}
+
+# One comparison "column op literal" in a template condition
+_CONDITION_CLAUSE = re.compile(
+    r"\s*(?P<col>[A-Za-z_][A-Za-z0-9_]*)\s*(?P<op><=|>=|!=|<>|=|<|>)\s*"
+    r"(?P<val>'(?:[^']|'')*'|-?[0-9]+(?:\.[0-9]+)?)\s*"
+)
+_CONDITION_CONNECTOR = re.compile(r"(?i)(AND|OR)\b")
+
+
 # -------------------- Load Alert Templates --------------------
 def load_alerts():
     """Load alert templates from JSON file."""
@@ -21,65 +45,312 @@ def load_alerts():
     except FileNotFoundError:
         return {}
 
-# -------------------- Load Alert History --------------------
-def load_history():
-    """Load alert history from JSON file."""
+# -------------------- Alert History Store --------------------
+def setup_alert_history(engine=engine):
+    """
+    Create the alert_history table, one row per alert per day
+
+    The unique (alert_name, day) key makes the daily dedupe a single insert;
+    entries from the old alert_history.json are imported the first time.
+    """
+    try:
+        with engine.begin() as conn:
+            created = conn.execute(text("SELECT to_regclass('alert_history') IS NULL")).scalar()
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS alert_history (
+                    id BIGSERIAL PRIMARY KEY,
+                    alert_name VARCHAR(200) NOT NULL,
+                    day DATE NOT NULL,
+                    triggered_at TIMESTAMP NOT NULL DEFAULT NOW(),
+                    trigger_count INTEGER NOT NULL DEFAULT 0,
+                    details TEXT,
+                    UNIQUE (alert_name, day)
+                )
+            """))
+            conn.execute(text("""
+                CREATE INDEX IF NOT EXISTS idx_alert_history_triggered
+                ON alert_history (triggered_at DESC, id DESC)
+            """))
+            if created:
+                _import_json_history(conn)
+        return True
+    except Exception as e:
+        logger.error(f"Error setting up alert history: {str(e)}")
+        return False
+
+
+def _import_json_history(conn):
+    """Copy entries from the legacy JSON history file into alert_history"""
     try:
         with open(HISTORY_FILE, "r") as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return []
+            history = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return
+    entries = [h for h in history if isinstance(h, dict) and h.get("alert_name") and h.get("triggered_at")] \
+        if isinstance(history, list) else []
+    if entries:
+        conn.execute(text("""
+            INSERT INTO alert_history (alert_name, day, triggered_at, details)
+            SELECT e->>'alert_name', CAST(e->>'triggered_at' AS TIMESTAMP)::date,
+                   CAST(e->>'triggered_at' AS TIMESTAMP), e->>'details'
+            FROM jsonb_array_elements(CAST(:entries AS JSONB)) e
+            ON CONFLICT (alert_name, day) DO NOTHING
+        """), {"entries": json.dumps(entries)})
+        logger.info(f"Imported {len(entries)} alert history entries from {HISTORY_FILE}")
 
-# -------------------- Save Alert History --------------------
-def save_history(history):
-    """Save alert history to JSON file."""
-    with open(HISTORY_FILE, "w") as f:
-        json.dump(history, f, indent=4)
 
-# -------------------- Check Alerts --------------------
-def check_alerts(engine, send_notifications=False):
+def prune_alert_history(engine=engine, retention_days=None):
+    """Delete history older than the retention window; returns rows removed."""
+    retention_days = retention_days or ALERT_ENGINE_CONFIG["history_retention_days"]
+    with engine.begin() as conn:
+        return conn.execute(text("DELETE FROM alert_history WHERE day < CURRENT_DATE - :days"),
+                            {"days": retention_days}).rowcount
+
+
+def get_alert_history(engine=engine, before=None, limit=None, alert_name=None):
     """
-    Evaluate alert conditions and return newly triggered alerts.
-    Adds them to history and optionally displays notifications in Streamlit.
+    One page of history, newest first
+
+    Args:
+        before: (triggered_at, id) of the last row of the previous page
+        limit: page size, defaults to history_page_size
+        alert_name: only this alert
+
+    Returns:
+        list of dicts with id, alert_name, day, triggered_at, trigger_count, details
+    """
+    limit = limit or ALERT_ENGINE_CONFIG["history_page_size"]
+    filters, params = [], {"limit": limit}
+    if before is not None:
+        filters.append("(triggered_at, id) < (:before_at, :before_id)")
+        params.update(before_at=before[0], before_id=before[1])
+    if alert_name:
+        filters.append("alert_name = :alert_name")
+        params["alert_name"] = alert_name
+    where = f"WHERE {' AND '.join(filters)}" if filters else ""
+    with engine.connect() as conn:
+        rows = conn.execute(text(f"""
+            SELECT id, alert_name, day, triggered_at, trigger_count, details
+            FROM alert_history
+            {where}
+            ORDER BY triggered_at DESC, id DESC
+            LIMIT :limit
+        """), params).mappings().all()
+    return [dict(row) for row in rows]
+
+
+# -------------------- Compile Alerts --------------------
+def parse_condition(condition):
+    """
+    Parse a template condition such as "status = 'pending' AND days_since_creation > 7"
+    into query builder conditions.
+
+    Only comparisons of a column with a quoted string or a number, joined by a
+    single kind of connector, are accepted; anything else raises ValueError
+    rather than being passed to SQL.
+
+    Returns:
+        tuple: ([(column, operator, value), ...], connector)
     """
-    alerts = load_alerts()
-    history = load_history()
-    new_alerts = []
+    conditions, connectors, pos = [], set(), 0
+    while True:
+        match = _CONDITION_CLAUSE.match(condition, pos)
+        if not match:
+            raise ValueError(f"Unsupported alert condition near: {condition[pos:pos + 30]!r}")
+        value = match.group("val")
+        value = value[1:-1].replace("''", "'") if value.startswith("'") else value
+        op = "!=" if match.group("op") == "<>" else match.group("op")
+        conditions.append((match.group("col"), op, value))
+        pos = match.end()
+        if pos == len(condition):
+            break
+        connector = _CONDITION_CONNECTOR.match(condition, pos)
+        if not connector:
+            raise ValueError(f"Expected AND/OR near: {condition[pos:pos + 30]!r}")
+        connectors.add(connector.group(1).upper())
+        pos = connector.end()
+    if len(connectors) > 1:
+        raise ValueError("Alert conditions cannot mix AND and OR")
+    return conditions, connectors.pop() if connectors else "AND"
 
+
+def compile_alerts(engine, alerts):
+    """
+    Compile every alert into one COUNT(*) FILTER query per table.
+
+    An alert applies to a table only if all its columns exist there.
+
+    Returns:
+        tuple: ({table: (sql, params, {column alias: alert name})}, {alert name: error})
+    """
+    parsed, errors = {}, {}
     for name, alert in alerts.items():
-        condition_sql = alert.get("condition")
-        message = alert.get("message", name)
-        if not condition_sql:
+        if not alert.get("condition"):
             continue
+        try:
+            parsed[name] = parse_condition(alert["condition"])
+        except ValueError as e:
+            errors[name] = str(e)
 
-        triggered_count = 0
-        # Check both users and holders tables
-        for table in ["users", "holders"]:
-            query = f"SELECT COUNT(*) FROM {table} WHERE {condition_sql}"
+    plan = {}
+    for table in ALERT_ENGINE_CONFIG["tables"]:
+        columns = get_table_columns(engine, table)
+        aggregates, params, aliases = [], {}, {}
+        for index, (name, (conditions, connector)) in enumerate(parsed.items()):
             try:
-                with engine.connect() as conn:
-                    count = conn.execute(text(query)).scalar()
-                triggered_count += count
+                where, alert_params, skipped = compile_conditions(conditions, connector, columns,
+                                                                  prefix=f"a{index}_")
+            except ValueError as e:
+                errors[name] = str(e)
+                continue
+            if skipped:
+                continue
+            alias = f"a{index}"
+            aggregates.append(f"COUNT(*) FILTER (WHERE {where}) AS {alias}")
+            params.update(alert_params)
+            aliases[alias] = name
+        if aggregates:
+            plan[table] = (f"SELECT {', '.join(aggregates)} FROM {table} t", params, aliases)
+    return plan, errors
+
+
+def evaluate_alerts(engine, alerts=None):
+    """
+    Count the records triggering each alert, one query per table on one connection.
+
+    Returns:
+        dict: evaluated_at, counts per alert, errors per alert/table, duration_ms
+    """
+    alerts = load_alerts() if alerts is None else alerts
+    started = time.perf_counter()
+    counts = {name: 0 for name, alert in alerts.items() if alert.get("condition")}
+    plan, errors = compile_alerts(engine, alerts)
+
+    with engine.connect() as conn:
+        for table, (sql, params, aliases) in plan.items():
+            try:
+                row = conn.execute(text(sql), params).mappings().first()
+            except Exception as e:
+                conn.rollback()
+                errors[table] = str(e)
+                continue
+            for alias, name in aliases.items():
+                counts[name] += row[alias] or 0
+
+    applied = {name for _, _, aliases in plan.values() for name in aliases.values()}
+    for name in counts:
+        if name not in applied and name not in errors:
+            errors[name] = f"No columns match in {', '.join(ALERT_ENGINE_CONFIG['tables'])}"
+    return {
+        "evaluated_at": datetime.now(),
+        "counts": counts,
+        "errors": errors,
+        "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+
+
+def record_triggered(engine, result, alerts):
+    """
+    Log alerts triggered for the first time today; returns their messages.
+
+    A single insert for all triggered alerts: the (alert_name, day) key skips
+    alerts already logged today, also when several processes evaluate at once.
+    """
+    triggered = {name: count for name, count in result["counts"].items() if count > 0}
+    if not triggered:
+        return []
+    with engine.begin() as conn:
+        rows = conn.execute(text("""
+            INSERT INTO alert_history (alert_name, day, triggered_at, trigger_count, details)
+            SELECT name, CURRENT_DATE, NOW(), count, count || ' record(s) triggered'
+            FROM unnest(CAST(:names AS TEXT[]), CAST(:counts AS INTEGER[])) AS t(name, count)
+            ON CONFLICT (alert_name, day) DO NOTHING
+            RETURNING alert_name, trigger_count
+        """), {"names": list(triggered), "counts": list(triggered.values())}).fetchall()
+    return [f"{alerts[row.alert_name].get('message', row.alert_name)} ({row.trigger_count} triggered)"
+            for row in rows]
+
+# -------------------- Background Evaluation --------------------
+class AlertEvaluator(threading.Thread):
+    """Evaluates alerts on a schedule and keeps the latest result for every viewer"""
+
+    def __init__(self, engine, interval=None):
+        super().__init__(name='alert-evaluator', daemon=True)
+        self.engine = engine
+        self.interval = interval or ALERT_ENGINE_CONFIG["interval_seconds"]
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.stopped = threading.Event()
+        self.evaluated = threading.Event()
+        self.latest = None
+        self.new_alerts = []
+        self.pruned_on = None
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                alerts = load_alerts()
+                result = evaluate_alerts(self.engine, alerts)
+                new_alerts = record_triggered(self.engine, result, alerts)
+                with self.lock:
+                    self.latest = result
+                    self.new_alerts = new_alerts
+                if result["duration_ms"] > 1000:
+                    logger.warning(f"Alert evaluation took {result['duration_ms']} ms")
+                if self.pruned_on != datetime.now().date():
+                    removed = prune_alert_history(self.engine)
+                    self.pruned_on = datetime.now().date()
+                    if removed:
+                        logger.info(f"Pruned {removed} alert history rows")
             except Exception as e:
-                st.warning(f"Failed to evaluate alert '{name}' on table '{table}': {e}")
-
-        # Log if alert triggered
-        if triggered_count > 0:
-            today_str = datetime.now().strftime("%Y-%m-%d")
-            already_logged = any(
-                h.get("alert_name") == name and h.get("triggered_at", "").startswith(today_str)
-                for h in history
-            )
-            if not already_logged:
-                entry = {
-                    "alert_name": name,
-                    "triggered_at": datetime.now().isoformat(),
-                    "details": f"{triggered_count} record(s) triggered"
-                }
-                history.append(entry)
-                save_history(history)
-                new_alerts.append(f"{message} ({triggered_count} triggered)")
-                if send_notifications:
-                    st.warning(f"🔥 {message} ({triggered_count} triggered)")
-
-    return new_alerts
+                logger.error(f"Alert evaluation failed: {str(e)}")
+            self.evaluated.set()
+            self.wake.wait(self.interval)
+            self.wake.clear()
+
+    def refresh(self):
+        """Re-evaluate now, unless the last evaluation is very recent"""
+        with self.lock:
+            latest = self.latest
+        if latest and (datetime.now() - latest["evaluated_at"]).total_seconds() < ALERT_ENGINE_CONFIG["min_refresh_seconds"]:
+            return
+        self.wake.set()
+
+    def snapshot(self):
+        with self.lock:
+            return self.latest, list(self.new_alerts)
+
+
+_evaluator: Optional[AlertEvaluator] = None
+_evaluator_lock = threading.Lock()
+
+
+def get_alert_evaluator(engine=engine) -> AlertEvaluator:
+    """Process-wide evaluator, started on first use"""
+    global _evaluator
+    with _evaluator_lock:
+        if _evaluator is None:
+            _evaluator = AlertEvaluator(engine)
+            _evaluator.start()
+        return _evaluator
+
+# -------------------- Check Alerts --------------------
+def check_alerts(engine, send_notifications=False, wait_seconds=5):
+    """
+    Return the latest evaluation result and the alerts it newly triggered.
+
+    Reads the background evaluator's cached result, so the cost does not depend
+    on how many admins have the tab open. Only the very first call in a process
+    waits (up to wait_seconds) for the first evaluation.
+    """
+    evaluator = get_alert_evaluator(engine)
+    evaluator.evaluated.wait(wait_seconds)
+    result, new_alerts = evaluator.snapshot()
+    if send_notifications:
+        for message in new_alerts:
+            st.warning(f"🔥 {message}")
+    return result, new_alerts
+
+
+# Run table setup when module is imported
+setup_alert_history()
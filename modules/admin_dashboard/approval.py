@@ -1,54 +1,455 @@
 # census_app/modules/admin_dashboard/approval.py
 
+import logging
+import threading
+import time
+from typing import Dict, List, Optional
+
+import pandas as pd
+import streamlit as st
 from sqlalchemy import text
 from census_app.config import engine
+from census_app.modules.admin_dashboard.queries import QUERY_TABLES, invalidate_grid_cache
+from census_app.modules.admin_agent_managment.change_feed import live_fragment
 
-# ---------------- Bulk Approve ----------------
-def bulk_approve(table_name, ids):
+logger = logging.getLogger('approval')
+
+BULK_JOB_CONFIG = {
+    "chunk_size": 500,           # rows locked and changed per transaction
+    "lock_retries": 3,           # passes over rows skipped because another transaction held them
+    "retry_delay_seconds": 2,
+    "stale_seconds": 120,        # a running job without a heartbeat this long is picked up again
+                                 # (inline jobs are only marked failed, after 5x this; their caller owns them)
+    "poll_seconds": 30,          # worker wake-up when no job is submitted
+    "jobs_shown": 10,
+    "progress_refresh": 2,
+}
+
+# action -> new status, None deletes the rows
+BULK_ACTIONS = {"approve": "approved", "reject": "rejected", "delete": None}
+ACTIVE_JOB_STATUSES = ("queued", "running")
+
+
+# ---------------- Job Tables ----------------
+def setup_bulk_jobs():
     """
-    Approve multiple records by updating their status to 'approved'.
-    Returns the number of records affected.
+    Create bulk_jobs (one row per request, with progress) and bulk_job_chunks
+    (one audit row per committed chunk, listing the IDs changed and skipped)
+    """
+    try:
+        with engine.begin() as conn:
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS bulk_jobs (
+                    id SERIAL PRIMARY KEY,
+                    table_name VARCHAR(100) NOT NULL,
+                    key_column VARCHAR(100) NOT NULL,
+                    action VARCHAR(20) NOT NULL,
+                    ids BIGINT[] NOT NULL,
+                    total INTEGER NOT NULL,
+                    processed INTEGER NOT NULL DEFAULT 0,
+                    affected INTEGER NOT NULL DEFAULT 0,
+                    skipped INTEGER NOT NULL DEFAULT 0,
+                    status VARCHAR(20) NOT NULL DEFAULT 'queued',
+                    cancel_requested BOOLEAN NOT NULL DEFAULT FALSE,
+                    requested_by INTEGER,
+                    error TEXT,
+                    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+                    started_at TIMESTAMP,
+                    heartbeat_at TIMESTAMP,
+                    finished_at TIMESTAMP
+                )
+            """))
+            # Inline jobs run in the requesting session and are never claimed by the worker
+            conn.execute(text("""
+                ALTER TABLE bulk_jobs ADD COLUMN IF NOT EXISTS inline BOOLEAN NOT NULL DEFAULT FALSE
+            """))
+            conn.execute(text("""
+                CREATE INDEX IF NOT EXISTS idx_bulk_jobs_active
+                ON bulk_jobs (id) WHERE status IN ('queued', 'running')
+            """))
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS bulk_job_chunks (
+                    id BIGSERIAL PRIMARY KEY,
+                    job_id INTEGER NOT NULL REFERENCES bulk_jobs(id) ON DELETE CASCADE,
+                    chunk_no INTEGER NOT NULL,
+                    attempt INTEGER NOT NULL DEFAULT 0,
+                    affected_ids BIGINT[] NOT NULL,
+                    skipped_ids BIGINT[] NOT NULL,
+                    duration_ms INTEGER,
+                    committed_at TIMESTAMP NOT NULL DEFAULT NOW()
+                )
+            """))
+            conn.execute(text("""
+                CREATE INDEX IF NOT EXISTS idx_bulk_job_chunks_job
+                ON bulk_job_chunks (job_id, id)
+            """))
+        return True
+    except Exception as e:
+        logger.error(f"Error setting up bulk jobs: {str(e)}")
+        return False
+
+
+# ---------------- Jobs ----------------
+def submit_bulk_job(table_name, action, ids, key_column="id", requested_by=None):
+    """
+    Queue a bulk status change for the background worker.
+    Returns the job ID, or None when there is nothing to do.
     """
+    job = _create_job(table_name, action, ids, key_column, requested_by, "queued")
+    if job is None:
+        return None
+    logger.info(f"Queued bulk {action} job {job['id']} for {job['total']} {table_name}")
+    return job["id"]
+
+
+def _create_job(table_name, action, ids, key_column, requested_by, status):
+    if action not in BULK_ACTIONS:
+        raise ValueError(f"Unknown bulk action: {action}")
+    if QUERY_TABLES.get(table_name) != key_column:
+        raise ValueError(f"Bulk actions are not allowed on {table_name}.{key_column}")
+    ids = list(dict.fromkeys(int(i) for i in ids))
     if not ids:
-        return 0
-    query = text(f"""
-        UPDATE {table_name}
-        SET status = 'approved'
-        WHERE id = ANY(:ids)
-    """)
+        return None
+    with engine.begin() as conn:
+        return conn.execute(text("""
+            INSERT INTO bulk_jobs (table_name, key_column, action, ids, total, requested_by, status,
+                                   inline, started_at, heartbeat_at)
+            VALUES (:table_name, :key_column, :action, :ids, :total, :requested_by, :status,
+                    :status = 'running',
+                    CASE WHEN :status = 'running' THEN NOW() END, CASE WHEN :status = 'running' THEN NOW() END)
+            RETURNING *
+        """), {"table_name": table_name, "key_column": key_column, "action": action, "ids": ids,
+               "total": len(ids), "requested_by": requested_by, "status": status}).mappings().first()
+
+
+def _claim_job(conn):
+    """
+    Mark the oldest queued (or stale running background) job as running and
+    return it; SKIP LOCKED keeps concurrent workers off the same job. Inline
+    jobs are never claimed, even when their heartbeat is stale.
+    """
+    return conn.execute(text("""
+        UPDATE bulk_jobs SET status = 'running', started_at = COALESCE(started_at, NOW()), heartbeat_at = NOW()
+        WHERE id = (
+            SELECT id FROM bulk_jobs
+            WHERE status = 'queued'
+               OR (status = 'running' AND NOT inline
+                   AND heartbeat_at < NOW() - make_interval(secs => :stale))
+            ORDER BY id
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING *
+    """), {"stale": BULK_JOB_CONFIG["stale_seconds"]}).mappings().first()
+
+
+def _fail_abandoned_inline_jobs(conn):
+    """
+    Mark inline jobs whose session stopped heartbeating as failed
+
+    Nobody else may resume them, since the caller could still be running;
+    chunks already committed stay applied and audited.
+    """
+    return conn.execute(text("""
+        UPDATE bulk_jobs
+        SET status = 'failed', error = 'Inline run stopped without finishing', finished_at = NOW()
+        WHERE inline AND status = 'running'
+        AND heartbeat_at < NOW() - make_interval(secs => :stale)
+    """), {"stale": BULK_JOB_CONFIG["stale_seconds"] * 5}).rowcount
+
+
+def _apply_chunk(conn, job, chunk):
+    """Change the chunk's rows that are not locked elsewhere; returns the IDs changed"""
+    table, key, status = job["table_name"], job["key_column"], BULK_ACTIONS[job["action"]]
+    locked = f"SELECT {key} FROM {table} WHERE {key} = ANY(:ids) FOR UPDATE SKIP LOCKED"
+    if status is None:
+        sql = f"WITH locked AS ({locked}) DELETE FROM {table} t USING locked WHERE t.{key} = locked.{key} RETURNING t.{key}"
+    else:
+        sql = f"""WITH locked AS ({locked})
+                  UPDATE {table} t SET status = :status FROM locked WHERE t.{key} = locked.{key} RETURNING t.{key}"""
+    return [row[0] for row in conn.execute(text(sql), {"ids": chunk, "status": status})]
+
+
+def _run_chunk(job, chunk_no, chunk, attempt):
+    """
+    One transaction: change the chunk, write its audit row and advance the job's
+    progress. Returns (IDs skipped, whether the job was cancelled).
+    """
+    started = time.perf_counter()
+    with engine.begin() as conn:
+        cancelled = conn.execute(text("SELECT cancel_requested FROM bulk_jobs WHERE id = :id"),
+                                 {"id": job["id"]}).scalar()
+        if cancelled:
+            return chunk, True
+        affected = _apply_chunk(conn, job, chunk)
+        done = set(affected)
+        skipped = [i for i in chunk if i not in done]
+        conn.execute(text("""
+            INSERT INTO bulk_job_chunks (job_id, chunk_no, attempt, affected_ids, skipped_ids, duration_ms)
+            VALUES (:job_id, :chunk_no, :attempt, :affected_ids, :skipped_ids, :duration_ms)
+        """), {"job_id": job["id"], "chunk_no": chunk_no, "attempt": attempt,
+               "affected_ids": affected, "skipped_ids": skipped,
+               "duration_ms": int((time.perf_counter() - started) * 1000)})
+        # First pass counts toward processed; retries only move rows from skipped to affected
+        conn.execute(text("""
+            UPDATE bulk_jobs
+            SET processed = processed + :processed, affected = affected + :affected,
+                skipped = skipped + :skipped, heartbeat_at = NOW()
+            WHERE id = :id
+        """), {"id": job["id"], "processed": 0 if attempt else len(chunk), "affected": len(affected),
+               "skipped": len(skipped) - (len(chunk) if attempt else 0)})
+    return skipped, False
+
+
+def _heartbeat(job_id):
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE bulk_jobs SET heartbeat_at = NOW() WHERE id = :id"), {"id": job_id})
+
+
+def _finish_job(job_id, status, error=None):
+    with engine.begin() as conn:
+        conn.execute(text("""
+            UPDATE bulk_jobs SET status = :status, error = :error, finished_at = NOW() WHERE id = :id
+        """), {"id": job_id, "status": status, "error": error})
+
+
+def _load_resume_state(job):
+    """
+    IDs a resumed job skipped earlier and has not changed since, and the next chunk number
+
+    The skipped IDs only live in the audit rows, so they are read back from
+    bulk_job_chunks to be retried like those of an uninterrupted run.
+    """
+    with engine.connect() as conn:
+        pending = conn.execute(text("""
+            SELECT DISTINCT s.id
+            FROM bulk_job_chunks c, unnest(c.skipped_ids) AS s(id)
+            WHERE c.job_id = :job_id
+            AND NOT EXISTS (
+                SELECT 1 FROM bulk_job_chunks a
+                WHERE a.job_id = :job_id AND s.id = ANY(a.affected_ids)
+            )
+            ORDER BY s.id
+        """), {"job_id": job["id"]}).scalars().all()
+        next_chunk = conn.execute(text("""
+            SELECT COALESCE(MAX(chunk_no) + 1, 0) FROM bulk_job_chunks WHERE job_id = :job_id
+        """), {"job_id": job["id"]}).scalar()
+    return list(pending), next_chunk
+
+
+def run_bulk_job(job, raise_errors=False):
+    """
+    Process a claimed job chunk by chunk from where it left off.
+
+    Each chunk commits on its own, so rows are only locked for one chunk and a
+    cancelled or failed job keeps the chunks already done. Rows skipped because
+    another transaction held them are retried in later passes, including those
+    skipped before a resumed job was interrupted.
+    Returns the job's final status; with raise_errors, a failure is re-raised
+    after the job is marked failed.
+    """
+    size = BULK_JOB_CONFIG["chunk_size"]
+    ids = list(job["ids"])
+    first = -(-job["processed"] // size) * size
+    status = "completed"
+    error = None
+    try:
+        pending, chunk_no = _load_resume_state(job) if job["processed"] else ([], 0)
+        for start in range(first, len(ids), size):
+            skipped, cancelled = _run_chunk(job, chunk_no, ids[start:start + size], attempt=0)
+            if cancelled:
+                status = "cancelled"
+                break
+            pending += skipped
+            chunk_no += 1
+
+        for attempt in range(1, BULK_JOB_CONFIG["lock_retries"] + 1):
+            if status == "cancelled" or not pending:
+                break
+            time.sleep(BULK_JOB_CONFIG["retry_delay_seconds"])
+            _heartbeat(job["id"])
+            retry, pending = pending, []
+            for start in range(0, len(retry), size):
+                skipped, cancelled = _run_chunk(job, chunk_no, retry[start:start + size], attempt)
+                if cancelled:
+                    status = "cancelled"
+                    break
+                pending += skipped
+                chunk_no += 1
+        _finish_job(job["id"], status)
+    except Exception as e:
+        logger.error(f"Bulk job {job['id']} failed: {str(e)}")
+        status = "failed"
+        error = e
+        _finish_job(job["id"], status, str(e))
+    invalidate_grid_cache(job["table_name"])
+    logger.info(f"Bulk {job['action']} job {job['id']} {status}")
+    if error is not None and raise_errors:
+        raise error
+    return status
+
+
+def cancel_bulk_job(job_id):
+    """
+    Stop a job before its next chunk; chunks already committed stay applied.
+    Returns True if the job was still queued or running.
+    """
     with engine.begin() as conn:
-        result = conn.execute(query, {"ids": ids})
-    return result.rowcount
+        row = conn.execute(text("""
+            UPDATE bulk_jobs
+            SET cancel_requested = TRUE,
+                status = CASE WHEN status = 'queued' THEN 'cancelled' ELSE status END,
+                finished_at = CASE WHEN status = 'queued' THEN NOW() ELSE finished_at END
+            WHERE id = :id AND status IN ('queued', 'running')
+            RETURNING id
+        """), {"id": job_id}).first()
+    return row is not None
+
+
+def get_bulk_jobs(limit=None, requested_by=None) -> List[Dict]:
+    """Most recent jobs, newest first, without their ID lists"""
+    where = "WHERE requested_by = :requested_by" if requested_by else ""
+    with engine.connect() as conn:
+        rows = conn.execute(text(f"""
+            SELECT id, table_name, action, total, processed, affected, skipped, status,
+                   cancel_requested, requested_by, error, created_at, started_at, finished_at
+            FROM bulk_jobs {where}
+            ORDER BY id DESC
+            LIMIT :limit
+        """), {"limit": limit or BULK_JOB_CONFIG["jobs_shown"], "requested_by": requested_by}).mappings().all()
+    return [dict(row) for row in rows]
+
+
+def get_bulk_job_chunks(job_id) -> pd.DataFrame:
+    """Audit rows of a job: one per committed chunk"""
+    with engine.connect() as conn:
+        return pd.read_sql_query(text("""
+            SELECT chunk_no, attempt, cardinality(affected_ids) AS affected, cardinality(skipped_ids) AS skipped,
+                   affected_ids, skipped_ids, duration_ms, committed_at
+            FROM bulk_job_chunks WHERE job_id = :job_id
+            ORDER BY id
+        """), conn, params={"job_id": job_id})
+
+
+# ---------------- Worker ----------------
+class BulkJobWorker(threading.Thread):
+    """Runs queued bulk jobs one at a time, woken on submit"""
+
+    def __init__(self, engine):
+        super().__init__(name='bulk-job-worker', daemon=True)
+        self.engine = engine
+        self.wake = threading.Event()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                with self.engine.begin() as conn:
+                    abandoned = _fail_abandoned_inline_jobs(conn)
+                if abandoned:
+                    logger.warning(f"Marked {abandoned} abandoned inline bulk job(s) failed")
+                while not self.stopped.is_set():
+                    with self.engine.begin() as conn:
+                        job = _claim_job(conn)
+                    if job is None:
+                        break
+                    run_bulk_job(job)
+            except Exception as e:
+                logger.error(f"Bulk job worker error: {str(e)}")
+            self.wake.wait(BULK_JOB_CONFIG["poll_seconds"])
+            self.wake.clear()
+
+
+_worker: Optional[BulkJobWorker] = None
+_worker_lock = threading.Lock()
+
+
+def get_bulk_job_worker(engine=engine) -> BulkJobWorker:
+    """Process-wide worker, started on first use"""
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            _worker = BulkJobWorker(engine)
+            _worker.start()
+        return _worker
+
+
+def _bulk_action(action, table_name, ids, key_column, background, requested_by):
+    if background:
+        job_id = submit_bulk_job(table_name, action, ids, key_column, requested_by)
+        if job_id is not None:
+            get_bulk_job_worker().wake.set()
+        return job_id
+    # Run here, still chunked and audited, and report the rows changed; failures reach the caller
+    job = _create_job(table_name, action, ids, key_column, requested_by, "running")
+    if job is None:
+        return 0
+    run_bulk_job(job, raise_errors=True)
+    with engine.connect() as conn:
+        return conn.execute(text("SELECT affected FROM bulk_jobs WHERE id = :id"), {"id": job["id"]}).scalar() or 0
+
+
+# ---------------- Bulk Approve ----------------
+def bulk_approve(table_name, ids, key_column="id", background=False, requested_by=None):
+    """
+    Approve multiple records by updating their status to 'approved'.
+    Returns the number of records affected, or the job ID when background=True.
+    """
+    return _bulk_action("approve", table_name, ids, key_column, background, requested_by)
 
 # ---------------- Bulk Reject ----------------
-def bulk_reject(table_name, ids):
+def bulk_reject(table_name, ids, key_column="id", background=False, requested_by=None):
     """
     Reject multiple records by updating their status to 'rejected'.
-    Returns the number of records affected.
+    Returns the number of records affected, or the job ID when background=True.
     """
-    if not ids:
-        return 0
-    query = text(f"""
-        UPDATE {table_name}
-        SET status = 'rejected'
-        WHERE id = ANY(:ids)
-    """)
-    with engine.begin() as conn:
-        result = conn.execute(query, {"ids": ids})
-    return result.rowcount
+    return _bulk_action("reject", table_name, ids, key_column, background, requested_by)
 
 # ---------------- Bulk Delete ----------------
-def bulk_delete(table_name, ids):
+def bulk_delete(table_name, ids, key_column="id", background=False, requested_by=None):
     """
     Delete multiple records from the table.
-    Returns the number of records deleted.
+    Returns the number of records deleted, or the job ID when background=True.
     """
-    if not ids:
-        return 0
-    query = text(f"""
-        DELETE FROM {table_name}
-        WHERE id = ANY(:ids)
-    """)
-    with engine.begin() as conn:
-        result = conn.execute(query, {"ids": ids})
-    return result.rowcount
+    return _bulk_action("delete", table_name, ids, key_column, background, requested_by)
+
+
+# ---------------- Job Progress ----------------
+@live_fragment(run_every=BULK_JOB_CONFIG["progress_refresh"])
+def render_bulk_jobs(requested_by=None):
+    """Recent bulk jobs with progress, cancel buttons and the per-chunk audit"""
+    try:
+        jobs = get_bulk_jobs(requested_by=requested_by)
+    except Exception as e:
+        st.warning(f"Could not load bulk jobs: {e}")
+        return
+    if not jobs:
+        return
+
+    st.markdown("#### ⏳ Bulk Jobs")
+    if any(job["status"] in ACTIVE_JOB_STATUSES for job in jobs):
+        # Jobs left by a restarted process are resumed by this process's worker
+        get_bulk_job_worker().wake.set()
+    for job in jobs:
+        label = (f"#{job['id']} {job['action'].title()} {job['total']:,} {job['table_name']} — "
+                 f"{job['status']}{' (cancelling)' if job['cancel_requested'] and job['status'] == 'running' else ''}")
+        col_progress, col_cancel = st.columns([5, 1])
+        with col_progress:
+            st.progress(job["processed"] / job["total"] if job["total"] else 1.0, text=label)
+            st.caption(f"{job['affected']:,} changed, {job['skipped']:,} skipped (locked or missing)"
+                       + (f" — ❌ {job['error']}" if job["error"] else ""))
+        with col_cancel:
+            if job["status"] in ACTIVE_JOB_STATUSES and not job["cancel_requested"]:
+                if st.button("🛑 Cancel", key=f"bulk_job_cancel_{job['id']}"):
+                    cancel_bulk_job(job["id"])
+                    st.rerun()
+        # Loaded only on request: the panel re-runs every few seconds
+        if st.checkbox(f"Show audit for job #{job['id']}", key=f"bulk_job_audit_{job['id']}"):
+            try:
+                st.dataframe(get_bulk_job_chunks(job["id"]), use_container_width=True)
+            except Exception as e:
+                st.warning(f"Could not load audit: {e}")
+
+
+# Run table setup when module is imported
+setup_bulk_jobs()
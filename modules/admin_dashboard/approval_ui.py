@@ -6,6 +6,7 @@ from census_app.modules.admin_dashboard.approval import (
     bulk_reject,
     bulk_delete,
 )
+from census_app.modules.admin_dashboard.queries import QUERY_TABLES
 
 
 def render_approval_ui(entity: str, selected_ids: list):
@@ -23,7 +24,7 @@ def render_approval_ui(entity: str, selected_ids: list):
 
     with col1:
         if st.button("✅ Approve Selected"):
-            affected = bulk_approve(entity, selected_ids)
+            affected = bulk_approve(entity, selected_ids, QUERY_TABLES.get(entity, "id"))
             if affected > 0:
                 st.success(f"{affected} {entity} approved successfully.")
                 st.experimental_rerun()
@@ -32,7 +33,7 @@ def render_approval_ui(entity: str, selected_ids: list):
 
     with col2:
         if st.button("❌ Reject Selected"):
-            affected = bulk_reject(entity, selected_ids)
+            affected = bulk_reject(entity, selected_ids, QUERY_TABLES.get(entity, "id"))
             if affected > 0:
                 st.warning(f"{affected} {entity} rejected.")
                 st.experimental_rerun()
@@ -41,7 +42,7 @@ def render_approval_ui(entity: str, selected_ids: list):
 
     with col3:
         if st.button("🗑️ Delete Selected"):
-            affected = bulk_delete(entity, selected_ids)
+            affected = bulk_delete(entity, selected_ids, QUERY_TABLES.get(entity, "id"))
             if affected > 0:
                 st.error(f"{affected} {entity} deleted.")
                 st.experimental_rerun()
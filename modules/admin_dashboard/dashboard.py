@@ -7,66 +7,66 @@ from sqlalchemy import text
 
 # FIX: Import from db.py instead of config.py
 from census_app.db import engine
-from census_app.modules.admin_dashboard.utils import fetch_table
-from census_app.modules.admin_dashboard.alerts import load_alerts, check_alerts
-from census_app.modules.admin_dashboard.queries import render_aggrid, apply_conditions, load_templates
+from census_app.modules.admin_dashboard.utils import summarize_table
+from census_app.modules.admin_dashboard.alerts import (
+    ALERT_ENGINE_CONFIG, load_alerts, check_alerts, get_alert_evaluator, get_alert_history
+)
+from census_app.modules.admin_dashboard.queries import (
+    QUERY_TABLES, render_server_grid, render_query_results, clear_grid_selection,
+    load_templates
+)
 from census_app.modules.admin_dashboard.reports import generate_report
-from census_app.modules.admin_dashboard.approval import bulk_approve, bulk_reject, bulk_delete
+from census_app.modules.admin_dashboard.approval import bulk_approve, bulk_reject, bulk_delete, render_bulk_jobs
 from census_app.modules.admin_dashboard.general_info_admin import general_info_admin
+from census_app.modules.map_clusters import render_cluster_map
+from census_app.modules.admin_agent_managment.conflict_resolution import render_conflict_review
+from census_app.modules.admin_agent_managment.sync_telemetry import render_sync_health
+from census_app.modules.admin_agent_managment.emergency_dispatch import render_emergency_alert_banner, get_alert_latency_stats
+from census_app.modules.admin_agent_managment.workload_balancer import render_workload_balancing
+from census_app.modules.admin_agent_managment.agent_stats import render_island_agent_statistics
 
 def admin_dashboard():
     st.title("👨‍💼 Admin Dashboard")
     st.write("Welcome, Admin! Manage users, holders, holdings, general information, alerts, and reports here.")
 
+    # Open field emergencies, pushed live to every connected admin
+    render_emergency_alert_banner(st.session_state.get("user_id"))
+
     # ---------------- Navigation Tabs ----------------
     tab = st.radio(
         "Select Action",
-        ["Manage Users/Holders", "General Information", "Advanced Query", "Alerts Monitor", "Graphs & Reports"]
+        ["Manage Users/Holders", "General Information", "Advanced Query", "Alerts Monitor",
+         "Sync Conflicts", "Sync Health", "Workload Balancing", "Agent Performance",
+         "Graphs & Reports"]
     )
 
     # ---------------- Manage Users/Holders ----------------
     if tab == "Manage Users/Holders":
         for entity, table_name in [("Users", "users"), ("Holders", "holders")]:
             st.subheader(f"{entity} Management")
-            df = fetch_table(engine, table_name)
-            if df.empty:
-                st.info(f"No {entity.lower()} found.")
-                continue
-
-            with st.form(key=f"{table_name}_form"):
-                selected_ids = render_aggrid(df, grid_key=f"{table_name}_grid")
-                col1, col2, col3 = st.columns(3)
-                with col1:
-                    if st.form_submit_button(f"Approve Selected {entity}") and selected_ids:
-                        bulk_approve(table_name, selected_ids)
-                        st.success(f"Approved {len(selected_ids)} {entity.lower()}.")
-                        st.experimental_rerun()
-                with col2:
-                    if st.form_submit_button(f"Reject Selected {entity}") and selected_ids:
-                        bulk_reject(table_name, selected_ids)
-                        st.success(f"Rejected {len(selected_ids)} {entity.lower()}.")
-                        st.experimental_rerun()
-                with col3:
-                    if st.form_submit_button(f"Delete Selected {entity}") and selected_ids:
-                        bulk_delete(table_name, selected_ids)
-                        st.success(f"Deleted {len(selected_ids)} {entity.lower()}.")
-                        st.experimental_rerun()
+            # Rows are served a block at a time from Postgres; selection is kept as IDs
+            grid_key = f"{table_name}_grid"
+            selected_ids = render_server_grid(engine, table_name, grid_key=grid_key)
+            key_column = QUERY_TABLES[table_name]
+            col1, col2, col3 = st.columns(3)
+            # Large selections run as chunked background jobs; progress is shown below
+            actions = [(col1, "Approve", bulk_approve), (col2, "Reject", bulk_reject), (col3, "Delete", bulk_delete)]
+            for col, verb, action in actions:
+                with col:
+                    if st.button(f"{verb} Selected {entity}", key=f"{table_name}_{verb.lower()}") and selected_ids:
+                        job_id = action(table_name, selected_ids, key_column, background=True,
+                                        requested_by=st.session_state.get("user_id"))
+                        clear_grid_selection(grid_key)
+                        st.success(f"Queued job #{job_id}: {verb.lower()} {len(selected_ids)} {entity.lower()}.")
+        render_bulk_jobs()
 
     # ---------------- General Information ----------------
     elif tab == "General Information":
         df_general = general_info_admin(return_df=True)
         if df_general is not None and not df_general.empty:
-            df_map = df_general.dropna(subset=["latitude", "longitude"])
-            if not df_map.empty:
-                try:
-                    df_map["latitude"] = df_map["latitude"].astype(float)
-                    df_map["longitude"] = df_map["longitude"].astype(float)
-                    st.subheader("🌍 Map of All Holdings")
-                    st.map(df_map[["latitude", "longitude"]], zoom=7)
-                except Exception as e:
-                    st.warning(f"Could not render map: {e}")
-            else:
-                st.info("No valid coordinates found for holdings.")
+            # The records above are one search page; the map clusters every holding server-side
+            st.subheader("🌍 Map of All Holdings")
+            render_cluster_map("general_information", key="general_info_map")
 
     # ---------------- Advanced Query ----------------
     elif tab == "Advanced Query":
@@ -74,42 +74,100 @@ def admin_dashboard():
         entity = st.selectbox("Entity", ["Users", "Holders", "General Information"])
         table_map = {"Users": "users", "Holders": "holders", "General Information": "general_information"}
         table = table_map[entity]
-        df = fetch_table(engine, table)
-        if df.empty:
-            st.info(f"No data found for {entity}.")
-        else:
-            templates = load_templates()
-            tpl_names = ["None"] + list(templates.keys())
-            selected_tpl = st.selectbox("Load Template", tpl_names)
-            filtered = df
-            if selected_tpl != "None":
-                filtered = apply_conditions(
-                    df,
-                    templates[selected_tpl]["conditions"],
-                    templates[selected_tpl]["connector"]
-                )
-            selected_ids = render_aggrid(filtered, grid_key=f"{table}_query_grid")
-            if not filtered.empty:
-                st.download_button(
-                    "Download CSV",
-                    filtered.to_csv(index=False).encode('utf-8'),
-                    f"{table}_query.csv"
-                )
+        templates = load_templates()
+        tpl_names = ["None"] + list(templates.keys())
+        selected_tpl = st.selectbox("Load Template", tpl_names)
+        conditions, connector = [], "AND"
+        if selected_tpl != "None":
+            conditions = templates[selected_tpl]["conditions"]
+            connector = templates[selected_tpl]["connector"]
+        # Filtering and paging run in Postgres; only the visible page is transferred
+        selected_ids = render_query_results(engine, table, conditions, connector,
+                                            grid_key=f"{table}_query_grid", export_name=f"{table}_query")
 
     # ---------------- Alerts Monitor ----------------
     elif tab == "Alerts Monitor":
         st.subheader("Alerts Monitor")
-        new_alerts = check_alerts(engine, send_notifications=True)
+        latency = get_alert_latency_stats()
+        if latency:
+            st.markdown("### ⏱️ Emergency Alert Latency (7 days)")
+            cols = st.columns(len(latency))
+            for col, (channel, stats) in zip(cols, latency.items()):
+                col.metric(f"{channel.title()} p95", f"{stats['p95_ms'] or 0:,.0f} ms",
+                           help=f"p50 {stats['p50_ms'] or 0:,.0f} ms over {stats['deliveries']} deliveries")
+
+        # Evaluated on a background schedule; this only reads the cached result
+        result, new_alerts = check_alerts(engine)
         if new_alerts:
             st.markdown("### 🔥 Newly Triggered Alerts")
             for a in new_alerts:
                 st.warning(f"{a}")
 
         alerts = load_alerts()
-        if alerts:
+        if result is None:
+            st.info("⏳ Alerts are being evaluated; check back shortly.")
+        elif alerts:
             st.subheader("All Alerts")
+            st.caption(f"Evaluated {result['evaluated_at']:%Y-%m-%d %H:%M:%S} in {result['duration_ms']} ms")
             for name, alert in alerts.items():
-                st.write(f"- {name}: {alert}")
+                count = result["counts"].get(name, 0)
+                icon = "🔴" if count else "🟢"
+                st.write(f"{icon} **{name}**: {alert.get('message', name)} ({count} triggered)")
+                if name in result["errors"]:
+                    st.caption(f"⚠️ {result['errors'][name]}")
+            for table in ALERT_ENGINE_CONFIG["tables"]:
+                if table in result["errors"]:
+                    st.warning(f"⚠️ Failed to evaluate alerts on '{table}': {result['errors'][table]}")
+        if st.button("🔄 Re-evaluate Now"):
+            get_alert_evaluator(engine).refresh()
+            st.info("Re-evaluation requested; results update within a few seconds.")
+
+        # ---------- Alert History (keyset paged, newest first) ----------
+        st.subheader("Alert History")
+        history_filter = st.selectbox("Alert", ["All"] + list(alerts.keys()), key="alert_history_filter")
+        alert_name = None if history_filter == "All" else history_filter
+        cursors = st.session_state.get("alert_history_cursors")
+        if not cursors or st.session_state.get("alert_history_for") != alert_name:
+            cursors = st.session_state["alert_history_cursors"] = [None]
+            st.session_state["alert_history_for"] = alert_name
+        page_size = ALERT_ENGINE_CONFIG["history_page_size"]
+        try:
+            history = get_alert_history(engine, before=cursors[-1], limit=page_size + 1, alert_name=alert_name)
+        except Exception as e:
+            st.error(f"Could not load alert history: {e}")
+            history = []
+        if history:
+            st.dataframe(pd.DataFrame(history[:page_size]), use_container_width=True, hide_index=True)
+        else:
+            st.info("No alerts logged yet.")
+        col_prev, col_page, col_next = st.columns([1, 2, 1])
+        with col_prev:
+            if len(cursors) > 1 and st.button("⬅️ Previous", key="alert_history_prev"):
+                cursors.pop()
+                st.rerun()
+        with col_page:
+            st.caption(f"Page {len(cursors)}")
+        with col_next:
+            if len(history) > page_size and st.button("Next ➡️", key="alert_history_next"):
+                last = history[page_size - 1]
+                cursors.append((last["triggered_at"], last["id"]))
+                st.rerun()
+
+    # ---------------- Sync Conflicts ----------------
+    elif tab == "Sync Conflicts":
+        render_conflict_review(reviewer_id=st.session_state.get("user_id"))
+
+    # ---------------- Sync Health ----------------
+    elif tab == "Sync Health":
+        render_sync_health()
+
+    # ---------------- Workload Balancing ----------------
+    elif tab == "Workload Balancing":
+        render_workload_balancing()
+
+    # ---------------- Agent Performance ----------------
+    elif tab == "Agent Performance":
+        render_island_agent_statistics()
 
     # ---------------- Graphs & Reports ----------------
     elif tab == "Graphs & Reports":
@@ -122,13 +180,22 @@ def admin_dashboard():
             "General Information": "general_information"
         }
         table = table_map[entity]
-        df = fetch_table(engine, table)
-        if df.empty:
+        # Only the columns the charts use; General Information is shown in full
+        report_columns = {
+            "users": ["id", "role", "status", "last_updated", "updated_at"],
+            "holders": ["holder_id", "name", "status", "assigned_agent_id", "last_updated", "updated_at"],
+            "holdings": ["id", "assigned_agent_id", "status", "last_updated", "updated_at"],
+        }
+        # Streamed in chunks; only counts, a preview and recent rows are kept
+        report = summarize_table(engine, table, columns=report_columns.get(table),
+                                 count_columns=['role', 'status', 'assigned_agent_id'], chunksize=50000)
+        counts = report['counts']
+        if not report['rows']:
             st.info(f"No data found for {entity}.")
         else:
             # ---------- Users Charts ----------
-            if entity == "Users" and 'role' in df.columns:
-                role_counts = df['role'].value_counts().reset_index()
+            if entity == "Users" and 'role' in counts:
+                role_counts = counts['role'].reset_index()
                 role_counts.columns = ['Role', 'Count']
                 fig = px.pie(
                     role_counts, values='Count', names='Role',
@@ -138,8 +205,8 @@ def admin_dashboard():
                 st.plotly_chart(fig)
 
             # ---------- Holders Charts ----------
-            if entity == "Holders" and 'status' in df.columns:
-                status_counts = df['status'].value_counts().reset_index()
+            if entity == "Holders" and 'status' in counts:
+                status_counts = counts['status'].reset_index()
                 status_counts.columns = ['Status', 'Count']
                 fig = px.bar(
                     status_counts, x='Status', y='Count',
@@ -157,15 +224,11 @@ def admin_dashboard():
                         st.markdown("### 📊 Holdings Summary")
                         st.dataframe(summary_df)
 
-                    df_map = df.dropna(subset=["latitude", "longitude"])
-                    if not df_map.empty:
-                        df_map["latitude"] = df_map["latitude"].astype(float)
-                        df_map["longitude"] = df_map["longitude"].astype(float)
-                        st.subheader("🌍 Map of All Holdings")
-                        st.map(df_map[["latitude", "longitude"]], zoom=7)
+                    st.subheader("🌍 Map of All Holdings")
+                    render_cluster_map("holdings", key="holdings_map")
 
-                    if 'assigned_agent_id' in df.columns:
-                        agent_counts = df['assigned_agent_id'].value_counts().reset_index()
+                    if 'assigned_agent_id' in counts:
+                        agent_counts = counts['assigned_agent_id'].reset_index()
                         agent_counts.columns = ['Agent ID', 'Total Holdings']
                         fig2 = px.bar(
                             agent_counts,
@@ -180,14 +243,14 @@ def admin_dashboard():
 
             # ---------- General Info ----------
             if entity == "General Information":
-                st.dataframe(df)
+                st.dataframe(report['preview'])
+                if report['rows'] > len(report['preview']):
+                    st.caption(f"Showing the first {len(report['preview'])} of {report['rows']} rows")
 
             # ---------- Last 24h Updates ----------
-            if 'last_updated' in df.columns:
-                df['last_updated'] = pd.to_datetime(df['last_updated'])
-                df_recent = df[df['last_updated'] >= pd.Timestamp.now() - pd.Timedelta(hours=24)]
-                if not df_recent.empty:
-                    st.markdown("### 🕒 Records Updated in Last 24h")
-                    st.dataframe(df_recent)
+            df_recent = report['recent']
+            if not df_recent.empty:
+                st.markdown("### 🕒 Records Updated in Last 24h")
+                st.dataframe(df_recent)
 
         st.success("Graphs and reports updated in real-time!")
\ No newline at end of file
@@ -2,21 +2,27 @@
 
 import streamlit as st
 import pandas as pd
-from sqlalchemy import text
 from census_app.db import engine
 from census_app.modules.admin_dashboard.approval import bulk_approve, bulk_reject, bulk_delete
+from census_app.modules.admin_dashboard.general_info_search import search_general_info, search_export_query
+from census_app.modules.admin_dashboard.utils import get_table_schema
+from census_app.modules.exports import render_export_buttons
 
 TABLE_NAME = "general_information"
 
 def general_info_admin(filter_status=None, return_df=False):
     st.header("📋 General Information Records")
 
-    # --- Load records ---
-    with engine.connect() as conn:
-        df = pd.read_sql_query(
-            text(f"SELECT * FROM {TABLE_NAME} ORDER BY created_at DESC"),
-            conn
-        )
+    # --- Search (ranked, paged, in Postgres) ---
+    search = st.text_input("🔍 Search by Name, Phone, Email, Island, or Holding")
+    paging = st.session_state.get("general_info_page")
+    if not paging or paging[0] != (search, filter_status):
+        paging = st.session_state["general_info_page"] = [(search, filter_status), 0]
+    try:
+        df, has_next = search_general_info(search, status=filter_status, page=paging[1])
+    except Exception as e:
+        st.error(f"Search failed: {e}")
+        return pd.DataFrame() if return_df else None
 
     if df.empty:
         st.info("No general information records found.")
@@ -24,20 +30,19 @@ def general_info_admin(filter_status=None, return_df=False):
             return df
         return
 
-    # --- Filter by status if provided ---
-    if filter_status:
-        df = df[df.get("status", "") == filter_status]
-
-    # --- Search ---
-    search = st.text_input("🔍 Search by Name, Phone, Email, or Island")
-    if search:
-        df = df[df.apply(
-            lambda row: search.lower() in row.astype(str).str.lower().to_string(),
-            axis=1
-        )]
-
     # --- Show table ---
     st.dataframe(df, use_container_width=True)
+    col_prev, col_page, col_next = st.columns([1, 2, 1])
+    with col_prev:
+        if paging[1] > 0 and st.button("⬅️ Previous", key="general_info_prev"):
+            paging[1] -= 1
+            st.rerun()
+    with col_page:
+        st.caption(f"Page {paging[1] + 1} · {len(df)} records" + (" · best matches first" if search else ""))
+    with col_next:
+        if has_next and st.button("Next ➡️", key="general_info_next"):
+            paging[1] += 1
+            st.rerun()
 
     # --- Map of records with coordinates ---
     df_map = df.dropna(subset=["latitude", "longitude"])
@@ -109,19 +114,11 @@ def general_info_admin(filter_status=None, return_df=False):
                 st.warning("No records selected.")
 
     # --- Export Options ---
+    # All matches of the same search (not just this page), streamed from Postgres to a file
     st.subheader("📤 Export Data")
-    col1, col2 = st.columns(2)
-    with col1:
-        csv = df.to_csv(index=False).encode("utf-8")
-        st.download_button("⬇️ Download CSV", csv, "general_info.csv", "text/csv")
-    with col2:
-        excel_data = df.to_excel(index=False, engine="openpyxl")
-        st.download_button(
-            "⬇️ Download Excel",
-            excel_data,
-            "general_info.xlsx",
-            "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-        )
+    export_sql, export_params = search_export_query(list(get_table_schema(engine, TABLE_NAME)),
+                                                    search, status=filter_status)
+    render_export_buttons(engine, export_sql, export_params, base_name="general_info", key="general_info_export")
 
     if return_df:
         return df
@@ -0,0 +1,223 @@
+# census_app/modules/admin_dashboard/general_info_search.py
+
+import argparse
+import logging
+import re
+import pandas as pd
+from sqlalchemy import text
+from census_app.db import engine
+from census_app.modules.admin_dashboard.utils import invalidate_table_schema
+
+logger = logging.getLogger('general_info_search')
+
+SEARCH_CONFIG = {
+    "page_size": 50,
+    "min_fuzzy_length": 3,     # shorter queries skip trigram fuzzy matching
+}
+
+# Searchable columns and their full-text weight (A ranks highest)
+SEARCH_WEIGHTS = {
+    "respondent_name": "A",
+    "holder_name": "A",
+    "holding_name": "B",
+    "island": "C",
+    "respondent_email": "D",
+    "respondent_phone": "D",
+    "holder_phone": "D",
+    "holding_phone": "D",
+}
+PHONE_COLUMNS = ("respondent_phone", "holder_phone", "holding_phone")
+
+# GIN expression indexes over _search_vector_sql() and _search_text_sql()
+SEARCH_INDEXES = {
+    "fulltext": "idx_general_information_search_vector",
+    "trigram": "idx_general_information_search_trgm",
+}
+
+# Set by load_search_support: which search indexes exist and are valid
+_search_support = {"fulltext": False, "trigram": False}
+
+
+def _search_text_sql():
+    """Lower-cased text of all searchable columns plus digits-only phones, immutable for an index expression"""
+    parts = [f"COALESCE({column}, '')" for column in SEARCH_WEIGHTS]
+    parts += [f"regexp_replace(COALESCE({column}, ''), '[^0-9]', '', 'g')" for column in PHONE_COLUMNS]
+    return "lower(" + " || ' ' || ".join(parts) + ")"
+
+
+def _search_vector_sql():
+    return " || ".join(
+        f"setweight(to_tsvector('simple'::regconfig, COALESCE({column}, '')), '{weight}')"
+        for column, weight in SEARCH_WEIGHTS.items()
+    )
+
+
+def load_search_support():
+    """Enable indexed search for each search index that exists and is valid (catalog lookup only)"""
+    try:
+        with engine.connect() as conn:
+            valid = set(conn.execute(text("""
+                SELECT c.relname FROM pg_index i
+                JOIN pg_class c ON c.oid = i.indexrelid
+                WHERE c.relname = ANY(:names) AND i.indisvalid AND i.indexprs IS NOT NULL
+            """), {"names": list(SEARCH_INDEXES.values())}).scalars().all())
+    except Exception as e:
+        logger.error(f"Error checking general information search indexes: {str(e)}")
+        valid = set()
+    for kind, name in SEARCH_INDEXES.items():
+        _search_support[kind] = name in valid
+    return _search_support["fulltext"]
+
+
+def setup_general_info_search():
+    """
+    Build the search indexes on general_information
+
+    A one-off migration, run from the command line rather than at import:
+
+        python -m census_app.modules.admin_dashboard.general_info_search --setup-indexes
+
+    The weighted tsvector expression gets a GIN index for ranked full-text
+    matches; the lower-cased text expression gets a pg_trgm GIN index for
+    substring and typo-tolerant matches. Without pg_trgm, search uses
+    full-text only. Indexes are built CONCURRENTLY, so the table stays
+    writable; one left invalid by an interrupted build is rebuilt. The
+    generated search columns of earlier versions are dropped afterwards.
+    """
+    expressions = {
+        "fulltext": f"USING GIN (({_search_vector_sql()}))",
+        "trigram": f"USING GIN (({_search_text_sql()}) gin_trgm_ops)",
+    }
+    try:
+        with engine.execution_options(isolation_level="AUTOCOMMIT").connect() as conn:
+            # Indexes of the same name on the old generated columns have no expressions
+            indexes = dict(conn.execute(text("""
+                SELECT c.relname, i.indisvalid AND i.indexprs IS NOT NULL FROM pg_index i
+                JOIN pg_class c ON c.oid = i.indexrelid
+                WHERE c.relname = ANY(:names)
+            """), {"names": list(SEARCH_INDEXES.values())}).fetchall())
+            for kind, name in SEARCH_INDEXES.items():
+                if indexes.get(name):
+                    continue
+                try:
+                    if kind == "trigram":
+                        conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+                    if name in indexes:
+                        logger.warning(f"Rebuilding index {name}")
+                    conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+                    conn.execute(text(f"CREATE INDEX CONCURRENTLY {name} ON general_information {expressions[kind]}"))
+                    logger.info(f"Created index {name}")
+                except Exception as e:
+                    logger.error(f"Error creating general information {kind} search index: {str(e)}")
+            conn.execute(text("""
+                ALTER TABLE general_information
+                DROP COLUMN IF EXISTS search_vector,
+                DROP COLUMN IF EXISTS search_text
+            """))
+    except Exception as e:
+        logger.error(f"Error setting up general information search: {str(e)}")
+    invalidate_table_schema("general_information")
+    return load_search_support()
+
+
+def _prefix_tsquery(search):
+    """'jo smi' -> 'jo:* & smi:*'; only word characters reach to_tsquery"""
+    tokens = re.findall(r"\w+", search.lower())
+    return " & ".join(f"{token}:*" for token in tokens)
+
+
+def _search_clause(search, status=None):
+    """
+    WHERE clause, params, rank expression and ordering for a search
+
+    Matches are full-text prefix matches on the weighted search vector, plus
+    substring and fuzzy (word similarity) matches on the search text. Both are
+    written as the indexed expressions so the planner uses the GIN indexes.
+    Rank combines ts_rank_cd with trigram similarity. An empty search orders
+    newest first.
+    """
+    search = (search or "").strip()
+    filters, params = [], {}
+    if status:
+        filters.append("g.status = :status")
+        params["status"] = status
+
+    rank, order = "NULL::real", "g.created_at DESC, g.id DESC"
+    if search and (_search_support["fulltext"] or _search_support["trigram"]):
+        matches, ranks = [], []
+        search_vector, search_text = f"({_search_vector_sql()})", f"({_search_text_sql()})"
+        tsquery = _prefix_tsquery(search)
+        if _search_support["fulltext"] and tsquery:
+            matches.append(f"{search_vector} @@ to_tsquery('simple', :tsquery)")
+            ranks.append(f"ts_rank_cd({search_vector}, to_tsquery('simple', :tsquery))")
+            params["tsquery"] = tsquery
+        if _search_support["trigram"]:
+            params["needle"] = search.lower()
+            params["like"] = "%" + re.sub(r"([%_\\])", r"\\\1", search.lower()) + "%"
+            matches.append(f"{search_text} LIKE :like")
+            if len(search) >= SEARCH_CONFIG["min_fuzzy_length"]:
+                matches.append(f":needle <% {search_text}")
+            ranks.append(f"word_similarity(:needle, {search_text})")
+        filters.append("(" + (" OR ".join(matches) or "FALSE") + ")")
+        rank = " + ".join(ranks) or "0::real"
+        order = "rank DESC, g.id DESC"
+    elif search:
+        # Search indexes not built: unindexed substring match on the same columns
+        params["like"] = "%" + re.sub(r"([%_\\])", r"\\\1", search) + "%"
+        filters.append("(" + " OR ".join(f"g.{column} ILIKE :like" for column in SEARCH_WEIGHTS) + ")")
+
+    where = f"WHERE {' AND '.join(filters)}" if filters else ""
+    return where, params, rank, order
+
+
+def search_general_info(search="", status=None, page=0, page_size=None):
+    """
+    One page of general information records matching a search, best matches first
+
+    Returns:
+        tuple: (DataFrame of up to page_size rows, with a rank column when searching;
+                whether more pages exist)
+    """
+    page_size = page_size or SEARCH_CONFIG["page_size"]
+    where, params, rank, order = _search_clause(search, status)
+    params.update(limit=page_size + 1, offset=page * page_size)
+    with engine.connect() as conn:
+        df = pd.read_sql_query(text(f"""
+            SELECT g.*, {rank} AS rank
+            FROM general_information g
+            {where}
+            ORDER BY {order}
+            LIMIT :limit OFFSET :offset
+        """), conn, params=params)
+
+    # Generated search columns remain until the index migration has run
+    df = df.drop(columns=["search_vector", "search_text"], errors="ignore")
+    if (search or "").strip():
+        df["rank"] = df["rank"].astype(float).round(3)
+    else:
+        df = df.drop(columns=["rank"])
+    return df.iloc[:page_size], len(df) > page_size
+
+
+def search_export_query(columns, search="", status=None):
+    """SQL and params selecting every match of a search, in result order, for export"""
+    where, params, rank, order = _search_clause(search, status)
+    column_sql = ", ".join(f'g."{c}"' for c in columns if c not in ("search_vector", "search_text"))
+    order = order.replace("rank DESC", f"{rank} DESC") if rank != "NULL::real" else order
+    return f"SELECT {column_sql} FROM general_information g {where} ORDER BY {order}", params
+
+
+# Only check which search indexes exist when module is imported; build them with --setup-indexes
+load_search_support()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="General information search maintenance")
+    parser.add_argument('--setup-indexes', action='store_true',
+                        help="Build missing or invalid search indexes and drop the old generated columns")
+    args = parser.parse_args()
+
+    if not args.setup_indexes:
+        parser.error("nothing to do; pass --setup-indexes")
+    if not setup_general_info_search():
+        raise SystemExit(1)
@@ -1,13 +1,62 @@
 import streamlit as st
 import pandas as pd
+import argparse
 import json
 import os
+import re
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from sqlalchemy import text
 from st_aggrid import AgGrid, GridOptionsBuilder, GridUpdateMode
 
+from census_app.db import engine
+from census_app.modules.admin_dashboard.utils import status_icons
+from census_app.modules.exports import render_export_buttons
+
+logger = logging.getLogger('admin_queries')
+
 # ---------------- Config ----------------
 BASE_DIR = os.path.dirname(__file__)
 TEMPLATE_FILE = os.path.join(BASE_DIR, "query_templates.json")
 
+# Tables the query builder may read, with the key used for ordering and paging
+QUERY_TABLES = {"users": "id", "holders": "holder_id", "general_information": "id"}
+QUERY_OPERATORS = ["=", "!=", "<", "<=", ">", ">=", "contains", "not contains"]
+
+# Computed columns templates may filter on: name -> (required column, SQL, kind)
+DERIVED_COLUMNS = {
+    "days_since_creation": ("created_at", "EXTRACT(EPOCH FROM (NOW() - t.created_at)) / 86400", "numeric"),
+    "last_updated": ("updated_at", "t.updated_at", "temporal"),
+}
+
+NUMERIC_TYPES = {"smallint", "integer", "bigint", "numeric", "real", "double precision"}
+TEMPORAL_TYPES = {"date", "timestamp without time zone", "timestamp with time zone"}
+NUMERIC_TEXT = r"^\s*-?[0-9]+(\.[0-9]+)?\s*$"
+
+_column_cache = {}
+_column_lock = threading.Lock()
+
+# Server-side grid: rows are fetched from Postgres one block at a time
+GRID_CONFIG = {
+    "block_size": 100,
+    "cache_blocks": 256,      # blocks kept per process
+    "cache_ttl_seconds": 30,  # cached blocks and counts older than this are re-read
+    "max_select_all": 50000,  # cap for "select all matching"
+}
+# Columns the grid may sort by besides the key; each gets an index on (column, key) from setup_grid_indexes
+GRID_SORT_COLUMNS = {
+    "users": ["username", "role", "status", "created_at"],
+    "holders": ["name", "status", "assigned_agent_id", "created_at", "updated_at"],
+    "general_information": ["island", "status", "created_at"],
+}
+
+_block_cache = OrderedDict()
+_block_lock = threading.Lock()
+
 
 # ---------------- Load/Save Templates ----------------
 def load_templates():
@@ -25,49 +74,450 @@ def save_templates(templates):
         json.dump(templates, f, indent=4)
 
 
-# ---------------- Apply Query Conditions ----------------
-def apply_conditions(df, conditions, connector="AND"):
-    """Filter dataframe based on conditions and connector (AND/OR)."""
-    if df is None or df.empty or not conditions:
-        return df.copy()
+# ---------------- Server-side Query Compilation ----------------
+def get_table_columns(engine, table):
+    """
+    Column name -> kind (numeric, temporal, boolean, text) for a queryable table, cached.
+
+    Generated columns (such as the general_information search columns) are
+    left out, so they are never filtered on, shown or exported.
+    """
+    if table not in QUERY_TABLES:
+        raise ValueError(f"Table '{table}' is not queryable")
+    with _column_lock:
+        if table in _column_cache:
+            return _column_cache[table]
+    with engine.connect() as conn:
+        rows = conn.execute(text("""
+            SELECT column_name, data_type FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = :table
+            AND is_generated = 'NEVER'
+            ORDER BY ordinal_position
+        """), {"table": table}).fetchall()
+    columns = {}
+    for name, data_type in rows:
+        if data_type in NUMERIC_TYPES:
+            columns[name] = "numeric"
+        elif data_type in TEMPORAL_TYPES:
+            columns[name] = "temporal"
+        elif data_type == "boolean":
+            columns[name] = "boolean"
+        else:
+            columns[name] = "text"
+    with _column_lock:
+        _column_cache[table] = columns
+    return columns
+
+
+def _coerce(value, kind, column):
+    """Convert a condition value to the column's type, or raise ValueError."""
+    value = str(value).strip()
+    try:
+        if kind == "numeric":
+            return float(value)
+        if kind == "temporal":
+            return datetime.fromisoformat(value)
+        if kind == "boolean":
+            lowered = value.lower()
+            if lowered in ("true", "t", "yes", "y", "1"):
+                return True
+            if lowered in ("false", "f", "no", "n", "0"):
+                return False
+            raise ValueError(value)
+    except ValueError:
+        raise ValueError(f"'{value}' is not a valid {kind} value for {column}")
+    return value
+
+
+def compile_conditions(conditions, connector, columns, prefix="p"):
+    """
+    Compile (column, operator, value) conditions into a parameterized WHERE clause.
 
-    mask = pd.Series(True, index=df.index) if connector == "AND" else pd.Series(False, index=df.index)
+    Columns must be real columns of the table (or derived columns whose source
+    exists); values are bound as parameters of the column's type, named with
+    `prefix`. Conditions with an empty value are ignored, as in the form.
 
-    for col, op, val in conditions:
-        if not val or col not in df.columns:
+    Returns:
+        tuple: (where_sql, params, skipped columns that are not in the table)
+    """
+    if connector not in ("AND", "OR"):
+        raise ValueError(f"Unknown connector '{connector}'")
+
+    clauses, params, skipped = [], {}, []
+    for index, (col, op, val) in enumerate(conditions or []):
+        if val is None or str(val) == "":
+            continue
+        if op not in QUERY_OPERATORS:
+            raise ValueError(f"Unknown operator '{op}'")
+        if col in columns:
+            expr, kind = f't."{col}"', columns[col]
+        elif col in DERIVED_COLUMNS and DERIVED_COLUMNS[col][0] in columns:
+            _, expr, kind = DERIVED_COLUMNS[col]
+        else:
+            skipped.append(col)
             continue
-        try:
-            if op == "=":
-                cond = df[col].astype(str) == val
-            elif op == "!=":
-                cond = df[col].astype(str) != val
-            elif op == "<":
-                cond = pd.to_numeric(df[col], errors="coerce") < float(val)
-            elif op == "<=":
-                cond = pd.to_numeric(df[col], errors="coerce") <= float(val)
-            elif op == ">":
-                cond = pd.to_numeric(df[col], errors="coerce") > float(val)
-            elif op == ">=":
-                cond = pd.to_numeric(df[col], errors="coerce") >= float(val)
-            elif op == "contains":
-                cond = df[col].astype(str).str.contains(val, case=False, na=False)
-            elif op == "not contains":
-                cond = ~df[col].astype(str).str.contains(val, case=False, na=False)
+
+        name = f"{prefix}{index}"
+        if op in ("contains", "not contains"):
+            pattern = re.sub(r"([%_\\])", r"\\\1", str(val))
+            params[name] = f"%{pattern}%"
+            if op == "contains":
+                clauses.append(f"CAST({expr} AS TEXT) ILIKE :{name}")
+            else:
+                clauses.append(f"COALESCE(CAST({expr} AS TEXT), '') NOT ILIKE :{name}")
+        elif op in ("=", "!="):
+            params[name] = _coerce(val, kind, col)
+            sql_op = "=" if op == "=" else "IS DISTINCT FROM"
+            clauses.append(f"{expr} {sql_op} :{name}")
+        else:
+            if kind == "boolean":
+                raise ValueError(f"Operator '{op}' does not apply to boolean column {col}")
+            if kind == "text":
+                # Text holding numbers compares numerically; anything else never matches
+                params[name] = _coerce(val, "numeric", col)
+                expr = f"(CASE WHEN {expr} ~ '{NUMERIC_TEXT}' THEN CAST({expr} AS NUMERIC) END)"
             else:
-                cond = pd.Series(True, index=df.index)
-        except Exception:
-            cond = pd.Series(True, index=df.index)
+                params[name] = _coerce(val, kind, col)
+            clauses.append(f"{expr} {op} :{name}")
+
+    where = f" {connector} ".join(f"({clause})" for clause in clauses) if clauses else "TRUE"
+    return where, params, skipped
+
+
+def _select_columns(engine, table):
+    """Explicit t."column" list of a table's stored columns, in place of t.*"""
+    return ", ".join(f't."{column}"' for column in get_table_columns(engine, table))
+
+
+def count_query_rows(engine, table, where="TRUE", params=None):
+    """Number of rows matching a compiled WHERE clause."""
+    with engine.connect() as conn:
+        return conn.execute(text(f"SELECT COUNT(*) FROM {table} t WHERE {where}"), params or {}).scalar()
 
-        mask = mask & cond if connector == "AND" else mask | cond
 
-    return df[mask].copy()
+def fetch_query_ids(engine, table, where="TRUE", params=None, limit=None):
+    """Keys of the rows matching a compiled WHERE clause, without the rows themselves."""
+    key = QUERY_TABLES[table]
+    limit_sql = "LIMIT :id_limit" if limit else ""
+    with engine.connect() as conn:
+        return conn.execute(text(f"""
+            SELECT t."{key}" FROM {table} t WHERE {where} ORDER BY t."{key}" {limit_sql}
+        """), dict(params or {}, id_limit=limit)).scalars().all()
+
+
+def render_query_results(engine, table, conditions, connector="AND", grid_key="query_results_grid",
+                         export_name=None):
+    """
+    Run conditions in Postgres and show the matches in a server-side grid.
+    Returns the selected row IDs across all blocks.
+    """
+    try:
+        where, params, skipped = compile_conditions(conditions, connector, get_table_columns(engine, table))
+    except ValueError as e:
+        st.error(f"❌ {e}")
+        return []
+    if skipped:
+        st.warning(f"⚠️ Ignored conditions on columns not in {table}: {', '.join(skipped)}")
+
+    selected_ids = render_server_grid(engine, table, where, params, grid_key=grid_key)
+
+    if export_name:
+        # Streamed to a file through a server-side cursor, only when asked for
+        render_export_buttons(
+            engine,
+            f'SELECT {_select_columns(engine, table)} FROM {table} t WHERE {where} ORDER BY t."{QUERY_TABLES[table]}"',
+            params,
+            base_name=export_name, key=f"{grid_key}_export"
+        )
+    return selected_ids
+
+
+# ---------------- Server-side Grid ----------------
+def _grid_signature(table, where, params):
+    """Stable short hash of a table and compiled filter."""
+    raw = repr((table, where, sorted((k, str(v)) for k, v in (params or {}).items())))
+    return hashlib.md5(raw.encode()).hexdigest()[:12]
+
+
+def _cached(cache_key, loader):
+    """Block cache lookup: fresh entries are reused, misses are loaded and stored LRU."""
+    now = time.time()
+    with _block_lock:
+        hit = _block_cache.get(cache_key)
+        if hit and now - hit[0] < GRID_CONFIG["cache_ttl_seconds"]:
+            _block_cache.move_to_end(cache_key)
+            return hit[1]
+    value = loader()
+    with _block_lock:
+        _block_cache[cache_key] = (now, value)
+        _block_cache.move_to_end(cache_key)
+        while len(_block_cache) > GRID_CONFIG["cache_blocks"]:
+            _block_cache.popitem(last=False)
+    return value
+
+
+def invalidate_grid_cache(table=None):
+    """Drop cached blocks and counts for a table (or all tables) after its rows change."""
+    with _block_lock:
+        for cache_key in list(_block_cache):
+            if table is None or cache_key[0] == table:
+                del _block_cache[cache_key]
+
+
+def setup_grid_indexes(engine=engine):
+    """
+    Create the (column, key) indexes backing grid sorts
+
+    A one-off migration, run from the command line rather than at import:
+
+        python -m census_app.modules.admin_dashboard.queries --setup-indexes
+
+    Built CONCURRENTLY on an autocommit connection so writes to the tables
+    are not blocked; sort columns missing from a table are skipped. An index
+    left invalid by an interrupted build is dropped and built again.
+    """
+    try:
+        with engine.connect() as conn:
+            rows = conn.execute(text("""
+                SELECT table_name, column_name FROM information_schema.columns
+                WHERE table_schema = current_schema() AND table_name = ANY(:tables)
+            """), {"tables": list(GRID_SORT_COLUMNS)}).fetchall()
+            indexes = dict(conn.execute(text("""
+                SELECT c.relname, i.indisvalid FROM pg_index i
+                JOIN pg_class c ON c.oid = i.indexrelid
+                WHERE c.relnamespace = current_schema()::regnamespace
+                AND c.relname LIKE 'idx\\_%\\_grid'
+            """)).fetchall())
+        existing = {(table, column) for table, column in rows}
+        with engine.execution_options(isolation_level="AUTOCOMMIT").connect() as conn:
+            for table, sort_columns in GRID_SORT_COLUMNS.items():
+                key = QUERY_TABLES[table]
+                for column in sort_columns:
+                    if column == key or (table, column) not in existing:
+                        continue
+                    name = f"idx_{table}_{column}_grid"
+                    if indexes.get(name):
+                        continue
+                    if name in indexes:
+                        logger.warning(f"Rebuilding invalid index {name}")
+                        conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+                    conn.execute(text(f'CREATE INDEX CONCURRENTLY {name} ON {table} ("{column}", "{key}")'))
+                    logger.info(f"Created index {name}")
+        return True
+    except Exception as e:
+        logger.error(f"Error creating grid sort indexes: {str(e)}")
+        return False
+
+
+def _keyset_clause(key, sort_column, descending, after, params):
+    """
+    WHERE clause for the rows after cursor `after` = (sort value, key) in grid order.
+
+    NULL sort values come last ascending and first descending, as in ORDER BY.
+    """
+    if after is None:
+        return "TRUE"
+    value, last_key = after
+    params["after_key"] = last_key
+    op = "<" if descending else ">"
+    if sort_column == key:
+        return f't."{key}" {op} :after_key'
+    column = f't."{sort_column}"'
+    if value is None:
+        if descending:
+            return f'({column} IS NOT NULL OR t."{key}" < :after_key)'
+        return f'({column} IS NULL AND t."{key}" > :after_key)'
+    params["after_value"] = value
+    keyset = f'({column}, t."{key}") {op} (:after_value, :after_key)'
+    return keyset if descending else f"({keyset} OR {column} IS NULL)"
+
+
+def fetch_grid_block(engine, table, where="TRUE", params=None, sort_column=None, descending=False, after=None):
+    """
+    One block of matching rows in sort order, served from the block cache when fresh.
+
+    Rows are ordered by the sort column then the key and paged by keyset from
+    `after`, the cursor of the previous block, so each block is one index
+    range scan however deep the grid is paged.
+
+    Returns:
+        tuple: (DataFrame of rows, cursor of the last row or None when empty)
+    """
+    key = QUERY_TABLES[table]
+    sort_column = sort_column or key
+    direction = "DESC" if descending else "ASC"
+    order = f't."{key}" {direction}' if sort_column == key else f't."{sort_column}" {direction}, t."{key}" {direction}'
+
+    def load():
+        query_params = dict(params or {}, block_limit=GRID_CONFIG["block_size"])
+        keyset = _keyset_clause(key, sort_column, descending, after, query_params)
+        with engine.connect() as conn:
+            rows = conn.execute(text(f"""
+                SELECT {_select_columns(engine, table)} FROM {table} t
+                WHERE ({where}) AND {keyset}
+                ORDER BY {order}
+                LIMIT :block_limit
+            """), query_params).mappings().all()
+        # Cursor from the raw row, before pandas converts its types
+        cursor = (rows[-1][sort_column], rows[-1][key]) if rows else None
+        return pd.DataFrame(rows), cursor
+
+    signature = _grid_signature(table, where, params)
+    return _cached((table, signature, sort_column, descending, after), load)
+
+
+def count_grid_rows(engine, table, where="TRUE", params=None):
+    """Matching row count, cached alongside the blocks."""
+    signature = _grid_signature(table, where, params)
+    return _cached((table, signature, "count"), lambda: count_query_rows(engine, table, where, params))
+
+
+def clear_grid_selection(grid_key):
+    """Forget the IDs selected in a server-side grid."""
+    st.session_state.pop(f"{grid_key}_selection", None)
+
+
+def render_server_grid(engine, table, where="TRUE", params=None, grid_key="server_grid"):
+    """
+    Show matching rows of a table one block at a time, sorted and filtered in Postgres.
+
+    Only the visible block is sent to the browser. Selection is kept as a set
+    of keys in session state, so rows stay selected when moving between blocks
+    and "select all matching" fetches keys only.
+
+    Returns:
+        list: selected keys (holder_id for holders, id otherwise)
+    """
+    key = QUERY_TABLES[table]
+    try:
+        columns = get_table_columns(engine, table)
+    except Exception as e:
+        st.error(f"❌ Could not read {table}: {e}")
+        return []
+    params = dict(params or {})
+
+    # --- Sort and filter model ---
+    sortable = [key] + [c for c in GRID_SORT_COLUMNS.get(table, []) if c in columns and c != key]
+    col_sort, col_dir, col_fcol, col_fop, col_fval = st.columns([2, 1, 2, 1, 2])
+    with col_sort:
+        sort_column = st.selectbox("Sort by", sortable, key=f"{grid_key}_sort")
+    with col_dir:
+        descending = st.checkbox("Descending", key=f"{grid_key}_desc")
+    with col_fcol:
+        filter_column = st.selectbox("Filter column", list(columns), key=f"{grid_key}_filter_col")
+    with col_fop:
+        filter_op = st.selectbox("Operator", QUERY_OPERATORS, key=f"{grid_key}_filter_op")
+    with col_fval:
+        filter_value = st.text_input("Value", key=f"{grid_key}_filter_val")
+    try:
+        grid_where, grid_params, _ = compile_conditions([(filter_column, filter_op, filter_value)], "AND",
+                                                        columns, prefix="g")
+    except ValueError as e:
+        st.error(f"❌ {e}")
+        grid_where, grid_params = "TRUE", {}
+    if grid_where != "TRUE":
+        where = f"({where}) AND ({grid_where})"
+        params.update(grid_params)
+
+    # --- Block position and selection, reset when the filter changes ---
+    signature = _grid_signature(table, where, params)
+    selection = st.session_state.get(f"{grid_key}_selection")
+    if not selection or selection["signature"] != signature:
+        selection = {"signature": signature, "ids": set(), "seen": set(), "version": 0}
+        st.session_state[f"{grid_key}_selection"] = selection
+    # Keyset cursors of the blocks visited so far; the last one starts the current block
+    position_key = f"{grid_key}_block"
+    position = st.session_state.get(position_key)
+    if not position or position[0] != (signature, sort_column, descending):
+        position = [(signature, sort_column, descending), [None]]
+        st.session_state[position_key] = position
+    cursors = position[1]
+    block = len(cursors) - 1
+
+    try:
+        total = count_grid_rows(engine, table, where, params)
+        block_df, next_cursor = fetch_grid_block(engine, table, where, params, sort_column, descending,
+                                                 cursors[-1])
+    except Exception as e:
+        st.error(f"❌ Query failed: {e}")
+        return sorted(selection["ids"])
+    if not total:
+        st.warning("No records found.")
+        return []
+
+    size = GRID_CONFIG["block_size"]
+    first = block * size
+    st.caption(f"Rows {first + 1}–{first + len(block_df)} of {total} · {len(selection['ids'])} selected")
+
+    block_df = block_df.copy()
+    if "status" in block_df.columns:
+        block_df.insert(0, "status_icon", status_icons(block_df["status"]))
+    block_ids = block_df[key].tolist()
+
+    gb = GridOptionsBuilder.from_dataframe(block_df)
+    gb.configure_selection(
+        "multiple", use_checkbox=True,
+        pre_selected_rows=[i for i, row_id in enumerate(block_ids) if row_id in selection["ids"]],
+    )
+    # Sorting and filtering happen in SQL; in the grid they would only apply to this block
+    gb.configure_default_column(editable=False, filter=False, sortable=False)
+    # A new grid key per block (and per bulk selection change) so pre-selection is applied
+    grid_id = f"{grid_key}_{signature}_{sort_column}_{int(descending)}_{block}_{selection['version']}"
+    response = AgGrid(
+        block_df,
+        gridOptions=gb.build(),
+        height=400,
+        width="100%",
+        update_mode=GridUpdateMode.SELECTION_CHANGED,
+        fit_columns_on_grid_load=True,
+        key=grid_id,
+        enable_enterprise_modules=False,
+    )
+
+    # The first render of a block reports no selection yet; keep the stored one until the grid answers
+    if grid_id in selection["seen"]:
+        selected_rows = response.get("selected_rows", []) if response else []
+        if isinstance(selected_rows, pd.DataFrame):
+            selected_rows = selected_rows.to_dict(orient="records")
+        block_selected = {row[key] for row in selected_rows or [] if isinstance(row, dict) and key in row}
+        selection["ids"] = (selection["ids"] - set(block_ids)) | block_selected
+    selection["seen"].add(grid_id)
+
+    blocks = max(1, -(-total // size))
+    col_prev, col_page, col_next, col_all, col_clear = st.columns([1, 2, 1, 2, 1])
+    with col_prev:
+        if block > 0 and st.button("⬅️ Previous", key=f"{grid_key}_prev"):
+            cursors.pop()
+            st.rerun()
+    with col_page:
+        st.caption(f"Block {block + 1} of {blocks}")
+    with col_next:
+        if block + 1 < blocks and next_cursor is not None and st.button("Next ➡️", key=f"{grid_key}_next"):
+            cursors.append(next_cursor)
+            st.rerun()
+    with col_all:
+        if st.button(f"☑️ Select All {total} Matching", key=f"{grid_key}_select_all"):
+            limit = GRID_CONFIG["max_select_all"]
+            selection["ids"] = set(fetch_query_ids(engine, table, where, params, limit=limit))
+            if total > limit:
+                st.warning(f"⚠️ Selected the first {limit} of {total} matching rows")
+            selection["version"] += 1
+            st.rerun()
+    with col_clear:
+        if selection["ids"] and st.button("✖️ Clear", key=f"{grid_key}_clear"):
+            selection["ids"] = set()
+            selection["version"] += 1
+            st.rerun()
+
+    return sorted(selection["ids"])
 
 
 # ---------------- Render AgGrid ----------------
-def render_aggrid(df, grid_key="default_grid"):
+def render_aggrid(df, grid_key="default_grid", id_column="id"):
     """
     Render dataframe in AgGrid and return selected row IDs.
-    Always returns a list (never None).
+    Always returns a list (never None). Sends the whole frame to the browser;
+    use render_server_grid for database tables.
     """
     if df is None or df.empty:
         st.warning("No records found.")
@@ -100,13 +550,13 @@ def render_aggrid(df, grid_key="default_grid"):
 
     # Always return a list of IDs
     selected_ids = [
-        row["id"] for row in selected_rows if isinstance(row, dict) and "id" in row
+        row[id_column] for row in selected_rows if isinstance(row, dict) and id_column in row
     ]
     return selected_ids
 
 
 # ---------------- Streamlit Query Builder UI ----------------
-def query_builder_ui(df):
+def query_builder_ui(engine, table):
     st.subheader("🔎 Advanced Query Builder")
 
     templates = load_templates()
@@ -127,8 +577,9 @@ def query_builder_ui(df):
     with st.form(key="query_builder_form"):
         st.write("### Conditions")
         new_conditions = []
-        cols = list(df.columns)
-        operators = ["=", "!=", "<", "<=", ">", ">=", "contains", "not contains"]
+        columns = get_table_columns(engine, table)
+        cols = list(columns) + [name for name, (source, _, _) in DERIVED_COLUMNS.items() if source in columns]
+        operators = QUERY_OPERATORS
 
         num_rules = st.number_input(
             "Number of conditions",
@@ -167,31 +618,25 @@ def query_builder_ui(df):
 
     # --- Handle Run Query ---
     if run_query:
-        filtered_df = apply_conditions(df, new_conditions, connector)
-        st.success(f"{len(filtered_df)} records found")
-
-        if not filtered_df.empty:
-            selected_ids = render_aggrid(filtered_df, grid_key="query_results_grid")
-            st.write("Selected IDs:", selected_ids)
-
-            csv = filtered_df.to_csv(index=False).encode("utf-8")
+        st.session_state["query_builder_active"] = (table, new_conditions, connector)
+
+    active = st.session_state.get("query_builder_active")
+    if active and active[0] == table:
+        _, active_conditions, active_connector = active
+        selected_ids = render_query_results(engine, table, active_conditions, active_connector,
+                                            grid_key="query_results_grid", export_name="query_results")
+        st.write("Selected IDs:", selected_ids)
+
+        if selected_ids:
+            ids_df = pd.DataFrame(selected_ids, columns=[QUERY_TABLES[table]])
+            ids_csv = ids_df.to_csv(index=False).encode("utf-8")
             st.download_button(
-                "⬇️ Download All Results (CSV)",
-                data=csv,
-                file_name="query_results.csv",
+                "⬇️ Download Selected IDs (CSV)",
+                data=ids_csv,
+                file_name="selected_ids.csv",
                 mime="text/csv",
             )
 
-            if selected_ids:
-                ids_df = pd.DataFrame(selected_ids, columns=["id"])
-                ids_csv = ids_df.to_csv(index=False).encode("utf-8")
-                st.download_button(
-                    "⬇️ Download Selected IDs (CSV)",
-                    data=ids_csv,
-                    file_name="selected_ids.csv",
-                    mime="text/csv",
-                )
-
     # --- Handle Save Template ---
     if save_template:
         if template_name.strip():
@@ -204,3 +649,15 @@ def query_builder_ui(df):
             # No rerun needed; UI stays active
         else:
             st.warning("⚠️ Please enter a template name before saving.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Admin query grid maintenance")
+    parser.add_argument('--setup-indexes', action='store_true',
+                        help="Create missing grid sort indexes and rebuild invalid ones")
+    args = parser.parse_args()
+
+    if not args.setup_indexes:
+        parser.error("nothing to do; pass --setup-indexes")
+    if not setup_grid_indexes():
+        raise SystemExit(1)
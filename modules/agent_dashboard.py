@@ -5,11 +5,35 @@ Supports offline data collection, phone/in-person interviews, auto-sync, and rea
 
 import streamlit as st
 import pandas as pd
-import json
+import logging
+import re
 import time
+import uuid
 from datetime import datetime, timedelta
 from sqlalchemy import text
 from db import engine
+from census_app.modules.admin_agent_managment.replay_engine import replay_agent_queue
+from census_app.modules.admin_agent_managment.document_upload import upload_file_object, get_assignment_documents
+from census_app.modules.admin_agent_managment.activity_log import get_activity_writer
+from census_app.modules.admin_agent_managment.change_feed import get_session_subscription, live_fragment
+from census_app.modules.admin_agent_managment.emergency_dispatch import raise_emergency_alert
+from census_app.modules.admin_agent_managment.route_planner import plan_route
+from census_app.modules.admin_agent_managment.leaderboards import get_island_leaderboard, PERIOD_LABELS
+from census_app.modules.admin_agent_managment.offline_bundle import prefetch_for_device, confirm_device_bundle
+from census_app.modules.admin_agent_managment.agent_stats import get_agent_kpis
+from modules.low_bandwidth import inject_css, show_dataframe, show_map
+
+logger = logging.getLogger('agent_dashboard')
+
+ASSIGNMENT_PAGE_SIZE = {'desktop': 20, 'mobile': 10}
+
+# Only the columns the assignment cards and pickers read
+ASSIGNMENT_LIST_COLUMNS = """
+    aa.assignment_id, aa.agent_id, aa.holder_id, aa.status, aa.interview_type,
+    aa.assignment_date, aa.scheduled_date, aa.contact_attempts, aa.last_contact_date,
+    aa.notes, COALESCE(aa.progress_percentage, 0) AS progress_percentage,
+    h.name AS holder_name, i.island_name
+"""
 
 def agent_dashboard():
     """Main agent dashboard with enhanced field operations management"""
@@ -89,7 +113,7 @@ def render_mobile_optimization():
             st.rerun()
     
     if st.session_state.mobile_view:
-        st.markdown("""
+        inject_css("""
         <style>
         .main .block-container {
             padding-top: 1rem;
@@ -103,7 +127,7 @@ def render_mobile_optimization():
             font-size: 0.9rem;
         }
         </style>
-        """, unsafe_allow_html=True)
+        """)
 
 def render_emergency_quick_actions(agent):
     """Emergency quick actions at the top"""
@@ -206,46 +230,121 @@ def render_agent_assignments(agent):
         pending = get_pending_assignments_count(agent['agent_id'])
         st.metric("Pending Review", pending)
     
+    render_assignment_change_notice(agent['agent_id'])
+    
     # Assignment filters
     st.markdown("---")
-    if st.session_state.get('mobile_view', False):
+    mobile = st.session_state.get('mobile_view', False)
+    interview_type_filter = "all"
+    date_range = "all"
+    
+    if mobile:
         col_filter = st.columns(2)
-        with col_filter[0]:
-            status_filter = st.selectbox("Status", 
-                ["all", "assigned", "in_progress", "completed", "cancelled"])
-        with col_filter[1]:
-            if st.button("🔄 Refresh", use_container_width=True):
-                st.rerun()
+        status_col, refresh_col = col_filter[0], col_filter[1]
     else:
         col_filter = st.columns([2, 2, 2, 1])
-        with col_filter[0]:
-            status_filter = st.selectbox("Status", 
-                ["all", "assigned", "in_progress", "completed", "cancelled"])
+        status_col, refresh_col = col_filter[0], col_filter[3]
         with col_filter[1]:
             interview_type_filter = st.selectbox("Interview Type",
                 ["all", "phone", "in_person", "remote"])
         with col_filter[2]:
             date_range = st.selectbox("Date Range",
                 ["all", "today", "this_week", "this_month"])
-        with col_filter[3]:
-            if st.button("🔄 Refresh", use_container_width=True):
-                st.rerun()
     
-    # Get assignments
+    # One aggregate gives the count shown next to every status option
+    status_counts = get_assignment_status_counts(agent['agent_id'], interview_type_filter, date_range)
+    status_counts['all'] = sum(status_counts.values())
+    with status_col:
+        status_filter = st.selectbox("Status", 
+            ["all", "assigned", "in_progress", "completed", "cancelled"],
+            format_func=lambda s: f"{s} ({status_counts.get(s, 0)})")
+    with refresh_col:
+        if st.button("🔄 Refresh", use_container_width=True):
+            st.rerun()
+    
+    # Keyset pagination: keep the cursor of every page visited so Previous works;
+    # start over whenever the filters change
+    filters = (status_filter, interview_type_filter, date_range)
+    if st.session_state.get('assignment_page_filters') != filters:
+        st.session_state['assignment_page_filters'] = filters
+        st.session_state['assignment_page_cursors'] = [None]
+    cursors = st.session_state['assignment_page_cursors']
+    page_size = ASSIGNMENT_PAGE_SIZE['mobile' if mobile else 'desktop']
+    
+    # Fetch one extra row to know whether a next page exists
     assignments = get_agent_assignments(
-        agent['agent_id'], 
-        status_filter, 
-        interview_type_filter if not st.session_state.get('mobile_view', False) else "all",
-        date_range if not st.session_state.get('mobile_view', False) else "all"
+        agent['agent_id'], status_filter, interview_type_filter, date_range,
+        limit=page_size + 1, after=cursors[-1]
     )
     
     if not assignments:
         st.info("📭 No assignments found matching filters")
         return
     
-    # Display assignments
+    has_next = len(assignments) > page_size
+    assignments = assignments[:page_size]
+    
+    # Display only the visible page
     for assignment in assignments:
         render_enhanced_assignment_card(assignment, agent)
+    
+    col_page = st.columns([1, 2, 1])
+    with col_page[0]:
+        if len(cursors) > 1 and st.button("⬅️ Previous", use_container_width=True):
+            cursors.pop()
+            st.rerun()
+    with col_page[1]:
+        st.caption(f"Page {len(cursors)} of {max(1, -(-status_counts.get(status_filter, 0) // page_size))}")
+    with col_page[2]:
+        if has_next and st.button("Next ➡️", use_container_width=True):
+            last = assignments[-1]
+            cursors.append((last['assignment_date'], last['assignment_id']))
+            st.rerun()
+
+def record_own_assignment_write(assignment_id, status):
+    """Remember a status this session wrote so its change feed echo is not treated as news"""
+    st.session_state.setdefault('own_assignment_writes', {})[assignment_id] = status
+
+@live_fragment
+def render_assignment_change_notice(agent_id):
+    """
+    Rerun the page when the change feed reports changes to this agent's work
+
+    New or reassigned work (or a lost feed) starts again from the first page;
+    other changes rerun in place, and echoes of this session's own status
+    edits are ignored since the page already reran after making them.
+    """
+    
+    subscription = get_session_subscription(
+        f"assignments_{agent_id}", ['agent_assignments'],
+        lambda event: agent_id in ((event.get('new') or {}).get('agent_id'),
+                                   (event.get('old') or {}).get('agent_id'))
+    )
+    events = subscription.drain()
+    overflowed = subscription.reset_overflow()
+    if not events and not overflowed:
+        return
+    
+    new_work = [e for e in events if (e.get('new') or {}).get('agent_id') == agent_id
+                and (e['op'] == 'INSERT' or (e.get('old') or {}).get('agent_id') != agent_id)]
+    if new_work or overflowed:
+        if new_work:
+            st.toast(f"🔔 {len(new_work)} new assignment(s)")
+        st.session_state.pop('assignment_page_filters', None)
+        st.rerun()
+    
+    own_writes = st.session_state.get('own_assignment_writes', {})
+    external = []
+    for event in events:
+        new, old = event.get('new') or {}, event.get('old') or {}
+        if (event['op'] == 'UPDATE' and new.get('agent_id') == old.get('agent_id')
+                and own_writes.get(event['id']) == new.get('status')):
+            own_writes.pop(event['id'], None)
+            continue
+        external.append(event)
+    if external:
+        # Keyset cursors stay valid when rows change status or leave the list
+        st.rerun()
 
 def render_enhanced_assignment_card(assignment, agent):
     """Render individual assignment card with enhanced features"""
@@ -685,12 +784,37 @@ def render_document_collection(assignment):
     
     with col_docs[1]:
         st.markdown("#### Document Upload")
+        document_type = st.selectbox("Document Type", 
+                                   ["ID Document", "Proof of Address", "Consent Form", "Land Title", "Other"])
         uploaded_files = st.file_uploader("Upload document photos", 
                                         accept_multiple_files=True,
                                         type=['jpg', 'jpeg', 'png', 'pdf'])
         
         if uploaded_files:
-            st.success(f"✅ {len(uploaded_files)} files uploaded")
+            # Files go through the chunked upload path; chunks already stored are
+            # skipped, so a failed upload resumes on the next rerun
+            stored_key = f"stored_documents_{assignment['assignment_id']}"
+            stored = st.session_state.setdefault(stored_key, set())
+            for uploaded_file in uploaded_files:
+                file_key = (uploaded_file.name, uploaded_file.size)
+                if file_key in stored:
+                    continue
+                try:
+                    upload_file_object(uploaded_file, uploaded_file.name, uploaded_file.size,
+                                       assignment['assignment_id'], assignment.get('agent_id'),
+                                       document_type=document_type, content_type=uploaded_file.type)
+                    stored.add(file_key)
+                except Exception as e:
+                    st.error(f"❌ {uploaded_file.name} did not finish uploading ({e}). It will resume on retry.")
+            
+            st.success(f"✅ {len(stored)} files uploaded")
+        
+        documents = get_assignment_documents(assignment['assignment_id'])
+        if documents:
+            st.markdown("#### Stored Documents")
+            for doc in documents:
+                st.write(f"📄 {doc['file_name']} ({doc['document_type'] or 'Other'}, "
+                         f"{doc['total_size'] / 1024:.0f} KB)")
 
 def render_review_submit(assignment):
     """Render review and submit step"""
@@ -783,6 +907,8 @@ def render_enhanced_data_sync_manager(agent):
             reset_local_cache(agent['agent_id'])
             st.success("Cache reset!")
     
+    render_offline_prefetch(agent)
+    
     # Pending data queue
     if pending_count > 0:
         st.markdown("---")
@@ -792,8 +918,8 @@ def render_enhanced_data_sync_manager(agent):
         
         if pending_data:
             df = pd.DataFrame(pending_data)
-            st.dataframe(df[['queue_id', 'data_type', 'collected_at', 'sync_status', 'sync_attempts']], 
-                        use_container_width=True)
+            show_dataframe(df[['queue_id', 'data_type', 'collected_at', 'sync_status', 'sync_attempts']], 
+                           use_container_width=True)
             
             # Bulk actions
             col_bulk = st.columns(3)
@@ -837,7 +963,8 @@ def render_enhanced_agent_performance(agent):
     
     # Overview metrics
     stats = get_agent_statistics(agent['agent_id'])
-    enhanced_stats = get_enhanced_agent_statistics(agent['agent_id'])
+    if stats is None:
+        return
     
     col_perf = st.columns(4)
     
@@ -846,7 +973,7 @@ def render_enhanced_agent_performance(agent):
     with col_perf[1]:
         st.metric("Completion Rate", f"{stats['completion_rate']:.1f}%")
     with col_perf[2]:
-        st.metric("Quality Score", f"{enhanced_stats.get('quality_score', 0)}/10")
+        st.metric("Open Assignments", stats['open_assignments'])
     with col_perf[3]:
         st.metric("This Month", stats['this_month'])
     
@@ -854,17 +981,15 @@ def render_enhanced_agent_performance(agent):
     col_perf2 = st.columns(4)
     
     with col_perf2[0]:
-        avg_duration = enhanced_stats.get('avg_duration', 0)
-        st.metric("Avg Duration", f"{avg_duration}m")
+        avg_duration = stats['avg_duration']
+        st.metric("Avg Duration", f"{avg_duration}m" if avg_duration is not None else "—")
     with col_perf2[1]:
-        first_time_rate = enhanced_stats.get('first_time_completion_rate', 0)
-        st.metric("First-time Complete", f"{first_time_rate}%")
+        st.metric("First-time Complete", f"{stats['first_time_completion_rate']}%")
     with col_perf2[2]:
-        success_rate = enhanced_stats.get('success_rate', 0)
-        st.metric("Success Rate", f"{success_rate}%")
+        st.metric("Success Rate", f"{stats['success_rate']}%")
     with col_perf2[3]:
-        satisfaction = enhanced_stats.get('satisfaction_score', 0)
-        st.metric("Satisfaction", f"{satisfaction}/5")
+        avg_attempts = stats['avg_contact_attempts']
+        st.metric("Avg Contact Attempts", avg_attempts if avg_attempts is not None else "—")
     
     # Performance charts
     st.markdown("---")
@@ -891,11 +1016,15 @@ def render_enhanced_agent_performance(agent):
     # Comparative analytics
     st.markdown("---")
     st.markdown("#### 📊 Team Comparison")
-    team_stats = get_team_comparison(agent['agent_id'])
-    
+    leaderboard_period = st.radio(
+        "Leaderboard period", list(PERIOD_LABELS.keys()), index=1,
+        format_func=PERIOD_LABELS.get, horizontal=True, key="leaderboard_period"
+    )
+    team_stats = get_team_comparison(agent.get('assigned_island_id'), leaderboard_period)
+
     if team_stats:
         comparison_df = pd.DataFrame(team_stats)
-        st.dataframe(comparison_df, use_container_width=True)
+        show_dataframe(comparison_df, use_container_width=True)
     else:
         st.info("No team comparison data available")
     
@@ -1022,49 +1151,117 @@ def render_territory_map(agent):
         
         if map_data:
             df = pd.DataFrame(map_data)
-            st.map(df[['lat', 'lon']].rename(columns={'lat': 'lat', 'lon': 'lon'}))
+            show_map(df[['lat', 'lon']])
             
             st.markdown("#### 📍 Assignment Locations")
-            st.dataframe(df[['name', 'status', 'lat', 'lon']], use_container_width=True)
+            show_dataframe(df[['name', 'status', 'lat', 'lon']], use_container_width=True)
+            
+            render_route_planner(assignments_with_location)
         else:
             st.info("No assignments with valid location data for mapping")
     else:
         st.info("No assignments with location data")
 
+def render_route_planner(assignments_with_location):
+    """Suggest a visiting order for today's pending assignments"""
+    
+    st.markdown("#### 🧭 Today's Route")
+    
+    today = datetime.now().date()
+    stops = [
+        {
+            'assignment_id': a['assignment_id'],
+            'name': a['holder_name'],
+            'status': a['status'],
+            'lat': float(a['location_lat']),
+            'lon': float(a['location_lon'])
+        }
+        for a in assignments_with_location
+        if a['status'] in ('assigned', 'in_progress')
+        and (a.get('scheduled_date') is None or a['scheduled_date'] <= today)
+    ]
+    
+    if len(stops) < 2:
+        st.info("Fewer than two pending stops today - no route to plan")
+        return
+    
+    col_route = st.columns(2)
+    with col_route[0]:
+        start_lat = st.number_input("Start latitude (optional)", value=0.0, format="%.6f", key="route_start_lat")
+    with col_route[1]:
+        start_lon = st.number_input("Start longitude (optional)", value=0.0, format="%.6f", key="route_start_lon")
+    start = (start_lat, start_lon) if start_lat or start_lon else None
+    
+    route = plan_route(stops, start=start)
+    
+    col_metrics = st.columns(3)
+    with col_metrics[0]:
+        st.metric("Stops", len(route['stops']))
+    with col_metrics[1]:
+        st.metric("Total Distance", f"{route['total_km']} km")
+    with col_metrics[2]:
+        st.metric("Planned In", f"{route['timing_ms']} ms")
+    
+    route_df = pd.DataFrame(route['stops'])
+    show_dataframe(route_df[['visit_order', 'name', 'status', 'leg_km', 'cumulative_km']],
+                   use_container_width=True, hide_index=True)
+
 # ============================================================================
 # ENHANCED HELPER FUNCTIONS
 # ============================================================================
 
-def get_agent_assignments(agent_id, status_filter, interview_filter, date_range):
-    """Get agent assignments with filters"""
-    
-    query = """
-        SELECT aa.*, h.name as holder_name, i.island_name,
-               COALESCE(aa.progress_percentage, 0) as progress_percentage
-        FROM agent_assignments aa
-        LEFT JOIN holders h ON aa.holder_id = h.holder_id
-        LEFT JOIN islands i ON aa.island_id = i.island_id
-        WHERE aa.agent_id = :aid
-    """
+def _assignment_filter_clauses(agent_id, status_filter, interview_filter, date_range):
+    """Build the WHERE clauses and params shared by assignment listing and counts"""
     
+    clauses = ["aa.agent_id = :aid"]
     params = {"aid": agent_id}
     
     if status_filter != "all":
-        query += " AND aa.status = :status"
+        clauses.append("aa.status = :status")
         params["status"] = status_filter
     
     if interview_filter != "all":
-        query += " AND aa.interview_type = :itype"
+        clauses.append("aa.interview_type = :itype")
         params["itype"] = interview_filter
     
     if date_range == "today":
-        query += " AND DATE(aa.assignment_date) = CURRENT_DATE"
+        clauses.append("aa.assignment_date >= CURRENT_DATE AND aa.assignment_date < CURRENT_DATE + 1")
     elif date_range == "this_week":
-        query += " AND aa.assignment_date >= CURRENT_DATE - INTERVAL '7 days'"
+        clauses.append("aa.assignment_date >= CURRENT_DATE - INTERVAL '7 days'")
     elif date_range == "this_month":
-        query += " AND aa.assignment_date >= CURRENT_DATE - INTERVAL '30 days'"
+        clauses.append("aa.assignment_date >= CURRENT_DATE - INTERVAL '30 days'")
+    
+    return clauses, params
+
+def get_agent_assignments(agent_id, status_filter, interview_filter, date_range,
+                          limit=None, after=None):
+    """
+    Get agent assignments with filters, newest first
+    
+    Args:
+        limit: Maximum rows to return (all when None)
+        after: (assignment_date, assignment_id) of the last row of the previous
+               page; rows continue strictly after it in keyset order
+    """
+    
+    clauses, params = _assignment_filter_clauses(agent_id, status_filter, interview_filter, date_range)
+    
+    if after is not None:
+        clauses.append("(aa.assignment_date, aa.assignment_id) < (:after_date, :after_id)")
+        params["after_date"], params["after_id"] = after
     
-    query += " ORDER BY aa.assignment_date DESC"
+    query = f"""
+        SELECT {ASSIGNMENT_LIST_COLUMNS}
+        FROM agent_assignments aa
+        LEFT JOIN holders h ON aa.holder_id = h.holder_id
+        LEFT JOIN islands i ON aa.island_id = i.island_id
+        WHERE {' AND '.join(clauses)}
+        ORDER BY aa.assignment_date DESC, aa.assignment_id DESC
+    """
+    
+    if limit is not None:
+        query += " LIMIT :lim"
+        params["lim"] = limit
     
     try:
         with engine.connect() as conn:
@@ -1074,6 +1271,24 @@ def get_agent_assignments(agent_id, status_filter, interview_filter, date_range)
         st.error(f"Query error: {e}")
         return []
 
+def get_assignment_status_counts(agent_id, interview_filter, date_range):
+    """Count an agent's assignments per status in one aggregate"""
+    
+    clauses, params = _assignment_filter_clauses(agent_id, "all", interview_filter, date_range)
+    
+    try:
+        with engine.connect() as conn:
+            result = conn.execute(text(f"""
+                SELECT aa.status, COUNT(*) AS total
+                FROM agent_assignments aa
+                WHERE {' AND '.join(clauses)}
+                GROUP BY aa.status
+            """), params).fetchall()
+            return {row[0]: row[1] for row in result}
+    except Exception as e:
+        st.error(f"Query error: {e}")
+        return {}
+
 def get_pending_assignments_count(agent_id):
     """Get count of pending review assignments"""
     try:
@@ -1094,6 +1309,7 @@ def start_interview(assignment_id, agent_id):
                 SET status = 'in_progress', updated_at = NOW()
                 WHERE assignment_id = :aid
             """), {"aid": assignment_id})
+            record_own_assignment_write(assignment_id, 'in_progress')
             
             log_agent_activity(agent_id, 'interview_started', 
                              f"Started interview for assignment {assignment_id}")
@@ -1109,6 +1325,7 @@ def complete_interview(assignment_id):
                 SET status = 'completed', completed_date = NOW(), updated_at = NOW()
                 WHERE assignment_id = :aid
             """), {"aid": assignment_id})
+            record_own_assignment_write(assignment_id, 'completed')
             
             # Update agent stats
             conn.execute(text("""
@@ -1158,32 +1375,29 @@ def update_agent_device(agent_id, device_id):
     except Exception as e:
         st.error(f"Error: {e}")
 
-def get_agent_activity(agent_id, limit=10):
-    """Get recent agent activity"""
+def get_agent_activity(agent_id, limit=10, days=90):
+    """Get recent agent activity, including events not yet flushed to the log"""
+    pending = get_activity_writer().pending_events(agent_id)[:limit]
+    if len(pending) >= limit:
+        return pending
     try:
         with engine.connect() as conn:
+            # The created_at bound lets the planner skip old monthly partitions
             result = conn.execute(text("""
-                SELECT * FROM agent_activity_log 
+                SELECT log_id, agent_id, activity_type, description, metadata, created_at
+                FROM agent_activity_log 
                 WHERE agent_id = :aid 
+                AND created_at >= NOW() - make_interval(days => :days)
                 ORDER BY created_at DESC LIMIT :lim
-            """), {"aid": agent_id, "lim": limit}).mappings().all()
-            return [dict(row) for row in result]
+            """), {"aid": agent_id, "days": days, "lim": limit - len(pending)}).mappings().all()
+            return pending + [dict(row) for row in result]
     except:
-        return []
+        return pending
 
 def log_agent_activity(agent_id, activity_type, description, metadata=None):
-    """Log agent activity"""
+    """Log agent activity through the buffered writer"""
     try:
-        with engine.begin() as conn:
-            conn.execute(text("""
-                INSERT INTO agent_activity_log (agent_id, activity_type, description, metadata)
-                VALUES (:aid, :atype, :desc, :meta)
-            """), {
-                "aid": agent_id,
-                "atype": activity_type,
-                "desc": description,
-                "meta": json.dumps(metadata) if metadata else None
-            })
+        get_activity_writer().log(agent_id, activity_type, description, metadata)
     except Exception as e:
         print(f"Activity log error: {e}")
 
@@ -1223,6 +1437,7 @@ def create_interview_assignment(agent_id, assignment_id, candidate_name,
                     "sdate": scheduled_date, "notes": notes,
                     "lat": lat, "lon": lon
                 })
+                record_own_assignment_write(assignment_id, 'in_progress')
             else:
                 # Create holder first
                 holder_result = conn.execute(text("""
@@ -1307,6 +1522,7 @@ def save_interview_draft(assignment_id):
                 SET status = 'in_progress', updated_at = NOW()
                 WHERE assignment_id = :aid
             """), {"aid": assignment_id})
+            record_own_assignment_write(assignment_id, 'in_progress')
     except Exception as e:
         st.error(f"Draft save error: {e}")
 
@@ -1335,7 +1551,7 @@ def get_pending_sync_data(agent_id):
         return []
 
 def perform_data_sync(agent_id):
-    """Perform data synchronization"""
+    """Replay the agent's pending queue into the census tables"""
     try:
         with engine.begin() as conn:
             # Create sync session
@@ -1344,35 +1560,38 @@ def perform_data_sync(agent_id):
                 VALUES (:aid, 'web', 'wifi')
                 RETURNING session_id
             """), {"aid": agent_id})
-            
+
             session_id = result.scalar()
-            
-            # Update pending items
-            result = conn.execute(text("""
-                UPDATE offline_data_queue 
-                SET sync_status = 'synced', synced_at = NOW()
-                WHERE agent_id = :aid AND sync_status = 'pending'
-                RETURNING queue_id
-            """), {"aid": agent_id})
-            
-            synced_count = len(result.fetchall())
-            
+
+        # Apply pending items in ordered, set-based chunks
+        results = replay_agent_queue(agent_id)
+
+        with engine.begin() as conn:
             # Complete sync session
             conn.execute(text("""
-                UPDATE sync_sessions 
-                SET sync_completed_at = NOW(), 
+                UPDATE sync_sessions
+                SET sync_completed_at = NOW(),
                     records_uploaded = :count,
-                    sync_status = 'completed'
+                    records_failed = :failed,
+                    sync_status = :status
                 WHERE session_id = :sid
-            """), {"sid": session_id, "count": synced_count})
-            
+            """), {
+                "sid": session_id,
+                "count": results['synced'],
+                "failed": results['failed'],
+                "status": 'completed' if results['failed'] == 0 else 'partial'
+            })
+
             # Update agent last sync
             conn.execute(text("""
                 UPDATE agents SET last_sync_at = NOW() WHERE agent_id = :aid
             """), {"aid": agent_id})
-            
-            return synced_count
-            
+
+        if results['failed']:
+            st.warning(f"⚠️ {results['failed']} item(s) failed to sync")
+
+        return results['synced']
+
     except Exception as e:
         st.error(f"Sync error: {e}")
         return 0
@@ -1385,12 +1604,14 @@ def retry_failed_syncs(agent_id):
     """Retry failed sync attempts"""
     try:
         with engine.begin() as conn:
+            # Attempts are counted by the replay engine when an item fails
             conn.execute(text("""
-                UPDATE offline_data_queue 
-                SET sync_status = 'pending', sync_attempts = sync_attempts + 1
+                UPDATE offline_data_queue
+                SET sync_status = 'pending', error_message = NULL
                 WHERE agent_id = :aid AND sync_status = 'failed'
             """), {"aid": agent_id})
-            st.success("✅ Failed syncs queued for retry")
+        synced = perform_data_sync(agent_id)
+        st.success(f"✅ Retried failed syncs: {synced} synced")
     except Exception as e:
         st.error(f"Error: {e}")
 
@@ -1433,6 +1654,65 @@ def get_offline_storage_usage(agent_id):
     except:
         return 0.0
 
+def get_browser_device_id():
+    """
+    ID of this browser for its offline manifest
+
+    Kept in the ?device= query parameter so it survives reloads and bookmarks.
+    A browser without one gets a new ID, so its first prefetch is a full bundle
+    instead of a delta against another browser's manifest.
+    """
+    device_id = st.query_params.get('device') or st.session_state.get('offline_device_id')
+    if not device_id or not re.fullmatch(r'[A-Za-z0-9_-]{8,64}', device_id):
+        device_id = f"browser-{uuid.uuid4().hex}"
+    st.session_state['offline_device_id'] = device_id
+    if st.query_params.get('device') != device_id:
+        st.query_params['device'] = device_id
+    return device_id
+
+def render_offline_prefetch(agent):
+    """Download a bundle of pending holders and reference data before leaving coverage"""
+    st.markdown("#### 📦 Prefetch for Offline")
+    device_id = get_browser_device_id()
+    
+    col_prefetch = st.columns([2, 1])
+    with col_prefetch[1]:
+        full_refresh = st.checkbox("Full refresh", value=False, key="prefetch_full",
+                                   help="Download every pending holder, not just changes")
+    with col_prefetch[0]:
+        if st.button("📥 Prefetch My Assignments", use_container_width=True):
+            try:
+                with st.spinner("Building offline bundle..."):
+                    payload, summary = prefetch_for_device(agent['agent_id'], device_id, full_refresh)
+                st.session_state['offline_bundle'] = (payload, summary)
+            except Exception as e:
+                st.error(f"Prefetch error: {e}")
+    
+    if 'offline_bundle' not in st.session_state:
+        return
+    
+    payload, summary = st.session_state['offline_bundle']
+    if payload is None:
+        st.info("✅ Your offline data is already up to date")
+        return
+    
+    st.caption(
+        f"{summary['holders_sent']} of {summary['holders_total']} holders changed, "
+        f"{summary['removed']} removed, reference data {'included' if summary['reference_sent'] else 'unchanged'} "
+        f"({summary['bytes'] / 1024:.1f} KB)"
+    )
+    saved = st.download_button(
+        "💾 Save Offline Bundle", data=payload,
+        file_name=f"offline_bundle_{agent['agent_id']}_{summary['bundle_etag'][:8]}.json.gz",
+        mime="application/gzip", use_container_width=True
+    )
+    # Only a saved bundle becomes the base for the next delta; otherwise it is sent again
+    if saved:
+        try:
+            confirm_device_bundle(agent['agent_id'], device_id, summary['bundle_etag'])
+        except Exception as e:
+            st.error(f"Could not record saved bundle: {e}")
+
 def export_offline_data(agent_id):
     """Export offline data for backup"""
     # This would typically generate a file for download
@@ -1461,86 +1741,12 @@ def reset_local_cache(agent_id):
         st.error(f"Cache reset error: {e}")
 
 def get_agent_statistics(agent_id):
-    """Get agent performance statistics"""
-    try:
-        with engine.connect() as conn:
-            # Total surveys
-            total = conn.execute(text("""
-                SELECT COUNT(*) FROM agent_assignments 
-                WHERE agent_id = :aid AND status = 'completed'
-            """), {"aid": agent_id}).scalar() or 0
-            
-            # This month
-            this_month = conn.execute(text("""
-                SELECT COUNT(*) FROM agent_assignments 
-                WHERE agent_id = :aid AND status = 'completed'
-                AND completed_date >= DATE_TRUNC('month', CURRENT_DATE)
-            """), {"aid": agent_id}).scalar() or 0
-            
-            # Total assigned
-            total_assigned = conn.execute(text("""
-                SELECT COUNT(*) FROM agent_assignments 
-                WHERE agent_id = :aid
-            """), {"aid": agent_id}).scalar() or 1
-            
-            completion_rate = (total / total_assigned * 100) if total_assigned > 0 else 0
-            avg_per_day = total / 30.0 if total > 0 else 0
-            
-            return {
-                'total_surveys': total,
-                'completion_rate': completion_rate,
-                'avg_per_day': avg_per_day,
-                'this_month': this_month
-            }
-    except:
-        return {
-            'total_surveys': 0,
-            'completion_rate': 0,
-            'avg_per_day': 0,
-            'this_month': 0
-        }
-
-def get_enhanced_agent_statistics(agent_id):
-    """Get enhanced agent performance statistics"""
+    """Get agent performance statistics (one query, see agent_stats.KPI_AGGREGATES)"""
     try:
-        with engine.connect() as conn:
-            # Average duration
-            avg_duration = conn.execute(text("""
-                SELECT AVG(EXTRACT(EPOCH FROM (completed_date - assignment_date))/60)
-                FROM agent_assignments 
-                WHERE agent_id = :aid AND status = 'completed'
-                AND completed_date IS NOT NULL
-            """), {"aid": agent_id}).scalar() or 30
-            
-            # First-time completion rate
-            first_time_complete = conn.execute(text("""
-                SELECT COUNT(*) FROM agent_assignments 
-                WHERE agent_id = :aid AND status = 'completed'
-                AND contact_attempts = 1
-            """), {"aid": agent_id}).scalar() or 0
-            
-            total_completed = conn.execute(text("""
-                SELECT COUNT(*) FROM agent_assignments 
-                WHERE agent_id = :aid AND status = 'completed'
-            """), {"aid": agent_id}).scalar() or 1
-            
-            first_time_rate = (first_time_complete / total_completed * 100) if total_completed > 0 else 0
-            
-            return {
-                'avg_duration': round(avg_duration, 1),
-                'first_time_completion_rate': round(first_time_rate, 1),
-                'quality_score': 8.5,  # This would come from quality assessments
-                'success_rate': 95,    # This would be calculated from various metrics
-                'satisfaction_score': 4.2  # This would come from participant feedback
-            }
-    except:
-        return {
-            'avg_duration': 30,
-            'first_time_completion_rate': 0,
-            'quality_score': 0,
-            'success_rate': 0,
-            'satisfaction_score': 0
-        }
+        return get_agent_kpis(agent_id)
+    except Exception as e:
+        st.warning(f"⚠️ Statistics unavailable: {e}")
+        return None
 
 def get_survey_trend(agent_id, days=30):
     """Get survey completion trend"""
@@ -1573,23 +1779,14 @@ def get_interview_type_breakdown(agent_id):
     except:
         return []
 
-def get_team_comparison(agent_id):
-    """Get team comparison data"""
-    # This would typically compare the agent with their team
+def get_team_comparison(island_id, period='week'):
+    """Get team comparison data from the precomputed island leaderboard"""
+    if not island_id:
+        return []
     try:
-        with engine.connect() as conn:
-            result = conn.execute(text("""
-                SELECT a.agent_code, a.full_name,
-                       COUNT(aa.assignment_id) as completed_surveys,
-                       ROUND(AVG(EXTRACT(EPOCH FROM (aa.completed_date - aa.assignment_date))/60), 1) as avg_duration
-                FROM agents a
-                LEFT JOIN agent_assignments aa ON a.agent_id = aa.agent_id AND aa.status = 'completed'
-                WHERE a.assigned_island_id = (SELECT assigned_island_id FROM agents WHERE agent_id = :aid)
-                GROUP BY a.agent_id, a.agent_code, a.full_name
-                ORDER BY completed_surveys DESC
-            """), {"aid": agent_id}).mappings().all()
-            return [dict(row) for row in result]
-    except:
+        return get_island_leaderboard(island_id, period)
+    except Exception as e:
+        logger.error(f"Team comparison error: {str(e)}")
         return []
 
 def get_time_analysis(agent_id):
@@ -1641,39 +1838,27 @@ def get_assignments_with_location(agent_id):
 # Emergency and Support Functions
 def trigger_safety_protocol(agent_id):
     """Trigger safety protocol"""
-    try:
-        with engine.begin() as conn:
-            conn.execute(text("""
-                INSERT INTO emergency_alerts (agent_id, alert_type, priority, status)
-                VALUES (:aid, 'safety_concern', 'high', 'active')
-            """), {"aid": agent_id})
-            log_agent_activity(agent_id, 'safety_alert', 'Safety protocol activated')
-    except Exception as e:
-        st.error(f"Safety alert error: {e}")
+    alert_id = raise_emergency_alert(agent_id, 'safety_concern', 'high')
+    if alert_id is None:
+        st.error("Safety alert error: alert could not be recorded, call your supervisor directly")
+        return
+    log_agent_activity(agent_id, 'safety_alert', 'Safety protocol activated', {'alert_id': alert_id})
 
 def trigger_medical_emergency(agent_id):
     """Trigger medical emergency protocol"""
-    try:
-        with engine.begin() as conn:
-            conn.execute(text("""
-                INSERT INTO emergency_alerts (agent_id, alert_type, priority, status)
-                VALUES (:aid, 'medical_emergency', 'critical', 'active')
-            """), {"aid": agent_id})
-            log_agent_activity(agent_id, 'medical_alert', 'Medical emergency protocol activated')
-    except Exception as e:
-        st.error(f"Medical alert error: {e}")
+    alert_id = raise_emergency_alert(agent_id, 'medical_emergency', 'critical')
+    if alert_id is None:
+        st.error("Medical alert error: alert could not be recorded, call your supervisor directly")
+        return
+    log_agent_activity(agent_id, 'medical_alert', 'Medical emergency protocol activated', {'alert_id': alert_id})
 
 def trigger_data_breach_protocol(agent_id):
     """Trigger data breach protocol"""
-    try:
-        with engine.begin() as conn:
-            conn.execute(text("""
-                INSERT INTO emergency_alerts (agent_id, alert_type, priority, status)
-                VALUES (:aid, 'data_breach', 'high', 'active')
-            """), {"aid": agent_id})
-            log_agent_activity(agent_id, 'data_breach_alert', 'Data breach protocol activated')
-    except Exception as e:
-        st.error(f"Data breach alert error: {e}")
+    alert_id = raise_emergency_alert(agent_id, 'data_breach', 'high')
+    if alert_id is None:
+        st.error("Data breach alert error: alert could not be recorded, call your supervisor directly")
+        return
+    log_agent_activity(agent_id, 'data_breach_alert', 'Data breach protocol activated', {'alert_id': alert_id})
 
 def request_supervisor_call(agent_id):
     """Request supervisor call"""
@@ -1734,4 +1919,18 @@ def get_support_history(agent_id, limit=5):
             """), {"aid": agent_id, "lim": limit}).mappings().all()
             return [dict(row) for row in result]
     except:
-        return []
\ No newline at end of file
+        return []
+
+def setup_assignment_indexes():
+    """Index backing the keyset-paginated assignment listing"""
+    try:
+        with engine.begin() as conn:
+            conn.execute(text("""
+                CREATE INDEX IF NOT EXISTS idx_agent_assignments_agent_keyset
+                ON agent_assignments (agent_id, assignment_date DESC, assignment_id DESC)
+            """))
+    except Exception as e:
+        logger.error(f"Error creating assignment indexes: {str(e)}")
+
+# Run index setup when module is imported
+setup_assignment_indexes()
@@ -4,6 +4,7 @@ import psycopg2
 from psycopg2.extras import execute_values
 import logging
 from typing import List, Dict, Any
+from modules.low_bandwidth import celebrate
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -294,7 +295,7 @@ def agricultural_machinery_section(holder_id: str):
             if validate_machinery_data(machinery_data):
                 if save_to_db(machinery_data):
                     st.success("✅ Agricultural machinery data saved successfully!")
-                    st.balloons()
+                    celebrate()
                     # Refresh the page to show updated data
                     st.rerun()
 
@@ -13,6 +13,7 @@ import pandas as pd
 import requests
 from streamlit_js_eval import get_geolocation
 import pydeck as pdk
+from modules.low_bandwidth import celebrate
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
@@ -137,7 +138,7 @@ def create_holder_for_user(user_id, username):
                 st.session_state[f"holder_id_{user_id}"] = holder_id
                 st.session_state["current_section"] = 1  # Start at section 1
                 st.session_state["section_completion"] = {}  # Initialize completion tracking
-                st.balloons()
+                celebrate()
                 st.rerun()
             except Exception as e:
                 st.error(f"❌ Failed to create holder: {e}")
@@ -456,7 +457,7 @@ def show_enhanced_holder_dashboard(holder_id):
                     # Mark final section as completed
                     mark_section_complete(current_section)
                     st.success("🎉 Survey completed successfully!")
-                    st.balloons()
+                    celebrate()
 
                     # Show completion summary
                     with st.expander("📋 Survey Completion Summary", expanded=True):
@@ -0,0 +1,300 @@
+# census_app/modules/exports.py
+"""
+Streaming Exports
+Query results are read through a server-side cursor in chunks and written
+chunk by chunk to CSV, XLSX (xlsxwriter constant-memory mode) or Parquet
+files, so export memory stays bounded by the chunk size rather than the
+row count. Finished files are handed to the download button from disk.
+"""
+
+import argparse
+import logging
+import os
+import tempfile
+import time
+import tracemalloc
+import uuid
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Callable, Dict, Iterable, Iterator, Optional
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+from sqlalchemy import text
+
+logger = logging.getLogger('exports')
+
+EXPORT_CONFIG = {
+    'chunk_rows': 20000,
+    'export_dir': os.getenv('EXPORT_DIR', os.path.join(tempfile.gettempdir(), 'census_exports')),
+    'max_age_seconds': 3600,        # finished export files older than this are removed
+    'xlsx_sheet_rows': 1048575,     # Excel row limit minus the header row
+}
+
+EXPORT_FORMATS = {
+    'csv': ('.csv', 'text/csv'),
+    'xlsx': ('.xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    'parquet': ('.parquet', 'application/vnd.apache.parquet'),
+}
+
+
+# ---------------- Reading ----------------
+def iter_query_chunks(engine, sql: str, params: Optional[Dict] = None,
+                      chunk_rows: Optional[int] = None) -> Iterator[pd.DataFrame]:
+    """Run a query with a server-side cursor and yield its rows as DataFrames of chunk_rows"""
+    chunk_rows = chunk_rows or EXPORT_CONFIG['chunk_rows']
+    with engine.connect() as conn:
+        conn = conn.execution_options(stream_results=True, max_row_buffer=chunk_rows)
+        result = conn.execute(text(sql), params or {})
+        columns = list(result.keys())
+        while True:
+            rows = result.fetchmany(chunk_rows)
+            if not rows:
+                break
+            yield pd.DataFrame.from_records(rows, columns=columns)
+
+
+# ---------------- Writers ----------------
+def _write_csv(chunks: Iterable[pd.DataFrame], path: str) -> int:
+    rows = 0
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        for chunk in chunks:
+            chunk.to_csv(f, header=rows == 0, index=False)
+            rows += len(chunk)
+    return rows
+
+
+def _excel_value(value):
+    """Cell value xlsxwriter can write: blanks for missing, plain types otherwise"""
+    if value is None or value is pd.NaT or (isinstance(value, float) and np.isnan(value)):
+        return None
+    if isinstance(value, pd.Timestamp):
+        return value.tz_localize(None).to_pydatetime() if value.tzinfo else value.to_pydatetime()
+    if isinstance(value, datetime) and value.tzinfo:
+        return value.replace(tzinfo=None)
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (str, int, float, bool, datetime, date)):
+        return value
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
+
+
+def _write_xlsx(chunks: Iterable[pd.DataFrame], path: str) -> int:
+    """
+    Write rows with xlsxwriter's constant_memory mode, which flushes each row
+    to disk once the next starts. Rows beyond Excel's limit continue on new sheets.
+    """
+    import xlsxwriter
+
+    workbook = xlsxwriter.Workbook(path, {'constant_memory': True, 'remove_timezone': True})
+    date_format = workbook.add_format({'num_format': 'yyyy-mm-dd hh:mm:ss'})
+    sheet_rows = EXPORT_CONFIG['xlsx_sheet_rows']
+    worksheet, sheet_row, rows, header = None, 0, 0, None
+    try:
+        for chunk in chunks:
+            header = list(chunk.columns)
+            for record in chunk.itertuples(index=False, name=None):
+                if worksheet is None or sheet_row > sheet_rows:
+                    worksheet = workbook.add_worksheet(f"Sheet{rows // sheet_rows + 1}")
+                    worksheet.write_row(0, 0, header)
+                    sheet_row = 1
+                for col, value in enumerate(record):
+                    value = _excel_value(value)
+                    if value is None:
+                        continue
+                    if isinstance(value, (datetime, date)):
+                        worksheet.write_datetime(sheet_row, col, value, date_format)
+                    else:
+                        worksheet.write(sheet_row, col, value)
+                sheet_row += 1
+                rows += 1
+        if worksheet is None:
+            worksheet = workbook.add_worksheet("Sheet1")
+            if header:
+                worksheet.write_row(0, 0, header)
+    finally:
+        workbook.close()
+    return rows
+
+
+def _write_parquet(chunks: Iterable[pd.DataFrame], path: str) -> int:
+    """Write each chunk as a row group; the schema is fixed by the first chunk"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    writer, schema, rows = None, None, 0
+    try:
+        for chunk in chunks:
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                # Columns that are entirely null in the first chunk are written as strings
+                schema = pa.schema([
+                    field.with_type(pa.string()) if pa.types.is_null(field.type) else field
+                    for field in table.schema
+                ]).remove_metadata()
+                writer = pq.ParquetWriter(path, schema, compression='snappy')
+            writer.write_table(table.cast(schema))
+            rows += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is None:
+        pq.write_table(pa.table({}), path)
+    return rows
+
+
+EXPORT_WRITERS = {'csv': _write_csv, 'xlsx': _write_xlsx, 'parquet': _write_parquet}
+
+
+def write_export(chunks: Iterable[pd.DataFrame], fmt: str, path: str,
+                 transform: Optional[Callable[[pd.DataFrame], pd.DataFrame]] = None) -> int:
+    """Write DataFrame chunks to path in the given format; returns the row count"""
+    if fmt not in EXPORT_WRITERS:
+        raise ValueError(f"Unknown export format '{fmt}'")
+    if transform is not None:
+        chunks = (transform(chunk) for chunk in chunks)
+    return EXPORT_WRITERS[fmt](chunks, path)
+
+
+def _cleanup_exports():
+    """Remove finished exports older than max_age_seconds"""
+    export_dir = EXPORT_CONFIG['export_dir']
+    cutoff = time.time() - EXPORT_CONFIG['max_age_seconds']
+    try:
+        for name in os.listdir(export_dir):
+            path = os.path.join(export_dir, name)
+            if os.path.isfile(path) and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+    except OSError as e:
+        logger.warning(f"Export cleanup failed: {e}")
+
+
+def export_query(engine, sql: str, params: Optional[Dict] = None, fmt: str = 'csv',
+                 path: Optional[str] = None, transform: Optional[Callable[[pd.DataFrame], pd.DataFrame]] = None,
+                 chunk_rows: Optional[int] = None) -> Dict:
+    """
+    Stream a query's rows into an export file
+
+    Args:
+        sql: SELECT to export (bound with params)
+        fmt: csv, xlsx or parquet
+        path: output file; a new file in the export directory when omitted
+        transform: applied to each chunk before writing (renames, formatting)
+
+    Returns:
+        dict: path, rows, bytes and seconds taken
+    """
+    if path is None:
+        os.makedirs(EXPORT_CONFIG['export_dir'], exist_ok=True)
+        _cleanup_exports()
+        path = os.path.join(EXPORT_CONFIG['export_dir'], f"{uuid.uuid4().hex}{EXPORT_FORMATS[fmt][0]}")
+    started = time.perf_counter()
+    rows = write_export(iter_query_chunks(engine, sql, params, chunk_rows), fmt, path, transform)
+    return {
+        'path': path,
+        'rows': rows,
+        'bytes': os.path.getsize(path),
+        'seconds': round(time.perf_counter() - started, 2),
+    }
+
+
+# ---------------- Streamlit ----------------
+def render_export_buttons(engine, sql: str, params: Optional[Dict] = None, base_name: str = "export",
+                          key: str = "export", formats=('csv', 'xlsx', 'parquet'),
+                          transform: Optional[Callable[[pd.DataFrame], pd.DataFrame]] = None):
+    """
+    Format picker, a button that streams the query to a file, and a download of that file
+
+    The export is only built when asked for and is tied to the query it was
+    built from, so changing filters hides a stale download.
+    """
+    signature = (sql, tuple(sorted((k, str(v)) for k, v in (params or {}).items())))
+    col_format, col_prepare, col_download = st.columns([1, 1, 2])
+    with col_format:
+        fmt = st.selectbox("Format", list(formats), key=f"{key}_format", format_func=str.upper)
+    with col_prepare:
+        if st.button("📦 Prepare Export", key=f"{key}_prepare"):
+            with st.spinner("Exporting..."):
+                try:
+                    st.session_state[key] = (signature, fmt, export_query(engine, sql, params, fmt,
+                                                                          transform=transform))
+                except Exception as e:
+                    logger.error(f"Export {base_name} failed: {str(e)}")
+                    st.error(f"❌ Export failed: {e}")
+    prepared = st.session_state.get(key)
+    if not prepared or prepared[0] != signature or not os.path.exists(prepared[2]['path']):
+        return
+    _, prepared_fmt, info = prepared
+    extension, mime = EXPORT_FORMATS[prepared_fmt]
+    with col_download:
+        with open(info['path'], 'rb') as f:
+            st.download_button(
+                f"⬇️ Download {prepared_fmt.upper()} ({info['rows']:,} rows, {info['bytes'] / 2 ** 20:.1f} MB)",
+                data=f, file_name=f"{base_name}_{datetime.now():%Y%m%d_%H%M}{extension}", mime=mime,
+                key=f"{key}_download"
+            )
+
+
+# ---------------- Benchmark ----------------
+def _synthetic_chunks(rows: int, chunk_rows: int, seed: int = 42) -> Iterator[pd.DataFrame]:
+    rng = np.random.default_rng(seed)
+    islands = np.array(['New Providence', 'Grand Bahama', 'Abaco', 'Eleuthera', 'Exuma', 'Andros'])
+    statuses = np.array(['approved', 'pending', 'rejected'])
+    start = pd.Timestamp('2025-01-01')
+    for offset in range(0, rows, chunk_rows):
+        n = min(chunk_rows, rows - offset)
+        yield pd.DataFrame({
+            'id': np.arange(offset, offset + n),
+            'holder_name': [f"Holder {i}" for i in range(offset, offset + n)],
+            'island': islands[rng.integers(0, len(islands), n)],
+            'status': statuses[rng.integers(0, len(statuses), n)],
+            'latitude': rng.uniform(21.0, 27.0, n).round(6),
+            'longitude': rng.uniform(-79.5, -73.0, n).round(6),
+            'created_at': start + pd.to_timedelta(rng.integers(0, 86400 * 300, n), unit='s'),
+        })
+
+
+def _measure(fn) -> Dict:
+    tracemalloc.start()
+    started = time.perf_counter()
+    rows = fn()
+    seconds = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'rows': rows, 'seconds': round(seconds, 2), 'peak_mb': round(peak / 2 ** 20, 1)}
+
+
+def benchmark_exports(rows: int = 1_000_000, formats=('csv', 'xlsx', 'parquet'),
+                      chunk_rows: Optional[int] = None) -> Dict:
+    """
+    Time and peak traced memory of each streaming writer on synthetic rows,
+    against building the whole frame and encoding it in memory (the old exports)
+    """
+    chunk_rows = chunk_rows or EXPORT_CONFIG['chunk_rows']
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        def in_memory_csv():
+            df = pd.concat(_synthetic_chunks(rows, chunk_rows), ignore_index=True)
+            df.to_csv(index=False).encode('utf-8')
+            return len(df)
+
+        results['csv (in memory)'] = _measure(in_memory_csv)
+        for fmt in formats:
+            path = os.path.join(tmp, f"bench{EXPORT_FORMATS[fmt][0]}")
+            results[f"{fmt} (streaming)"] = _measure(
+                lambda: write_export(_synthetic_chunks(rows, chunk_rows), fmt, path))
+            results[f"{fmt} (streaming)"]['file_mb'] = round(os.path.getsize(path) / 2 ** 20, 1)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark streaming exports")
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--formats', nargs='+', default=['csv', 'xlsx', 'parquet'], choices=list(EXPORT_FORMATS))
+    args = parser.parse_args()
+
+    for name, stats in benchmark_exports(args.rows, args.formats).items():
+        print(f"{name:>18}: " + ", ".join(f"{k}={v}" for k, v in stats.items()))
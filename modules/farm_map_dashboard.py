@@ -5,6 +5,8 @@ import pandas as pd
 import pydeck as pdk
 from sqlalchemy import text
 from census_app.db import engine
+from census_app.modules.low_bandwidth import show_dataframe, show_map
+from census_app.modules.map_clusters import render_cluster_map
 
 def farm_map_dashboard(user_id=None, role="holder"):
     """
@@ -14,29 +16,27 @@ def farm_map_dashboard(user_id=None, role="holder"):
     """
     st.header("🌾 Farm Map Dashboard")
 
+    if role == "admin":
+        # All holdings: clustered in SQL for the viewport, points only at street level
+        level, df = render_cluster_map("holders", key="farm_map", tooltip="{label}\nLegal Status: {legal_status}")
+        if level == "points" and not df.empty:
+            st.subheader("🏠 Holdings Details")
+            show_dataframe(df[["holder_name", "holding_name", "lat", "lon", "legal_status"]],
+                           use_container_width=True)
+        return
+
     # --- Fetch holdings data ---
     try:
         with engine.connect() as conn:
-            if role == "admin":
-                holdings = conn.execute(
-                    text("""
-                        SELECT h.holder_id, h.name AS holder_name, h.latitude, h.longitude,
-                               g.holding_name, g.legal_status
-                        FROM holders h
-                        LEFT JOIN general_information g ON h.holder_id = g.holder_id
-                        WHERE h.latitude IS NOT NULL AND h.longitude IS NOT NULL
-                    """)
-                ).mappings().fetchall()
-            else:
-                holdings = conn.execute(
-                    text("""
-                        SELECT h.holder_id, h.name AS holder_name, h.latitude, h.longitude,
-                               g.holding_name, g.legal_status
-                        FROM holders h
-                        LEFT JOIN general_information g ON h.holder_id = g.holder_id
-                        WHERE h.owner_id=:uid AND h.latitude IS NOT NULL AND h.longitude IS NOT NULL
-                    """), {"uid": user_id}
-                ).mappings().fetchall()
+            holdings = conn.execute(
+                text("""
+                    SELECT h.holder_id, h.name AS holder_name, h.latitude, h.longitude,
+                           g.holding_name, g.legal_status
+                    FROM holders h
+                    LEFT JOIN general_information g ON h.holder_id = g.holder_id
+                    WHERE h.owner_id=:uid AND h.latitude IS NOT NULL AND h.longitude IS NOT NULL
+                """), {"uid": user_id}
+            ).mappings().fetchall()
     except Exception as e:
         st.warning(f"Could not load holdings: {e}")
         holdings = []
@@ -51,7 +51,7 @@ def farm_map_dashboard(user_id=None, role="holder"):
     df = pd.DataFrame(holdings)
     df["lat"] = pd.to_numeric(df["latitude"])
     df["lon"] = pd.to_numeric(df["longitude"])
-    df["label"] = df.apply(lambda x: f"{x['holder_name']} ({x['holding_name'] or 'No Holding'})", axis=1)
+    df["label"] = df["holder_name"].astype(str) + " (" + df["holding_name"].fillna("No Holding").astype(str) + ")"
 
     # --- PyDeck Layer ---
     layer = pdk.Layer(
@@ -80,9 +80,9 @@ def farm_map_dashboard(user_id=None, role="holder"):
         }
     )
 
-    st.pydeck_chart(r)
+    show_map(df, r, zoom=7)
 
     # --- Holdings Table ---
     st.subheader("🏠 Holdings Details")
     display_df = df[["holder_name", "holding_name", "lat", "lon", "legal_status"]]
-    st.dataframe(display_df, use_container_width=True)
+    show_dataframe(display_df, use_container_width=True)
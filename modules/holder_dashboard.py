@@ -17,7 +17,9 @@ from config import (
 )
 from helpers import calculate_age
 from modules.agricultural_machinery import agricultural_machinery_section
+from modules.holder_picker import count_holders, render_holder_picker, search_holders
 from modules.land_use import land_use_section
+from modules.low_bandwidth import celebrate, inject_css, show_map
 
 
 # =============================================================================
@@ -25,7 +27,7 @@ from modules.land_use import land_use_section
 # =============================================================================
 def inject_custom_styles():
     """Inject professional CSS styles for enhanced UI"""
-    st.markdown("""
+    inject_css("""
     <style>
         .dashboard-header {
             background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
@@ -79,7 +81,7 @@ def inject_custom_styles():
             background: white;
         }
     </style>
-    """, unsafe_allow_html=True)
+    """)
 
 
 # =============================================================================
@@ -229,7 +231,7 @@ class FarmLocationManager:
                 tooltip={"text": "Farm Location\nLat: {lat}\nLon: {lon}"}
             )
 
-            st.pydeck_chart(deck)
+            show_map(pd.DataFrame([[current_lat, current_lon]], columns=["lat", "lon"]), deck, zoom=15)
 
         except Exception as e:
             st.warning(f"📊 Advanced map unavailable: {e}")
@@ -292,7 +294,7 @@ def farm_location_widget(holder_id: int):
         with col_btn2:
             if st.button("💾 Save Location", type="primary", use_container_width=True):
                 if location_manager.save_coordinates(current_lat, current_lon):
-                    st.balloons()
+                    celebrate()
 
     with col_map:
         location_manager.render_interactive_map(current_lat, current_lon)
@@ -443,18 +445,17 @@ class HolderDashboard:
             return False
         return True
 
-    def fetch_holders(self) -> List[Dict]:
-        """Fetch holders with comprehensive error handling"""
+    def fetch_holder(self, holder_id: int) -> Optional[Dict]:
+        """Fetch one of the user's holders with comprehensive error handling"""
         try:
             with engine.connect() as conn:
-                holders = conn.execute(
-                    text(f"SELECT * FROM {HOLDERS_TABLE} WHERE owner_id = :uid ORDER BY holder_id"),
-                    {"uid": self.user_id}
-                ).mappings().all()
-            return holders
+                return conn.execute(
+                    text(f"SELECT * FROM {HOLDERS_TABLE} WHERE holder_id = :hid AND owner_id = :uid"),
+                    {"hid": holder_id, "uid": self.user_id}
+                ).mappings().first()
         except Exception as e:
             st.error(f"🔧 **Data Retrieval Error**\n\nUnable to fetch holder information: {e}")
-            return []
+            return None
 
     def render_holder_creation(self):
         """Render holder creation interface"""
@@ -494,29 +495,22 @@ class HolderDashboard:
             st.error(f"❌ **Database Error**\n\nUnable to create holder: {e}")
             return False
 
-    def render_holder_selector(self, holders: List[Dict]):
+    def render_holder_selector(self):
         """Render enhanced holder selection interface"""
         st.sidebar.markdown("### 👤 Farm Holder Management")
 
-        # Holder selection
-        holder_names = [h["name"] for h in holders]
-        current_index = next((i for i, h in enumerate(holders)
-                              if h["holder_id"] == self.holder_id), 0)
-
-        selected_name = st.sidebar.selectbox(
-            "**Select Holder:**",
-            holder_names,
-            index=current_index,
-            key="holder_selector"
+        # Search-as-you-type over the user's holders; only matches are loaded
+        selected = render_holder_picker(
+            "**Select Holder:**", "holder_selector", user_id=self.user_id,
+            owner_id=self.user_id, selected_id=self.holder_id
         )
 
         # Update selection if changed
-        if selected_name != holder_names[current_index]:
-            selected_holder = next(h for h in holders if h["name"] == selected_name)
-            st.session_state["holder_id"] = selected_holder["holder_id"]
+        if selected and selected["holder_id"] != self.holder_id:
+            st.session_state["holder_id"] = selected["holder_id"]
             st.rerun()
 
-        return next(h for h in holders if h["holder_id"] == self.holder_id)
+        return self.fetch_holder(self.holder_id)
 
     def render_sidebar_analytics(self, holder: Dict):
         """Render sidebar analytics and quick actions"""
@@ -549,7 +543,7 @@ class HolderDashboard:
 
         with col2:
             if st.button("➕ New Holder", use_container_width=True):
-                self.create_new_holder(f"Farm Holder {len(self.fetch_holders()) + 1}")
+                self.create_new_holder(f"Farm Holder {count_holders(owner_id=self.user_id) + 1}")
 
     def render_survey_sections(self, holder_id: int):
         """Render enhanced survey sections with professional UI"""
@@ -630,21 +624,20 @@ class HolderDashboard:
         if not self.validate_access():
             return
 
-        # Fetch holders
-        holders = self.fetch_holders()
+        # Ensure holder_id is set, from the user's first holder
+        if self.holder_id is None:
+            first = search_holders(owner_id=self.user_id, limit=1)
 
-        # Handle no holders case
-        if not holders:
-            self.render_holder_creation()
-            return
+            # Handle no holders case
+            if not first:
+                self.render_holder_creation()
+                return
 
-        # Ensure holder_id is set
-        if self.holder_id is None:
-            self.holder_id = holders[0]["holder_id"]
+            self.holder_id = first[0]["holder_id"]
             st.session_state["holder_id"] = self.holder_id
 
         # Get current holder
-        current_holder = self.render_holder_selector(holders)
+        current_holder = self.render_holder_selector()
         if not current_holder:
             st.error("❌ Selected holder not found")
             return
@@ -752,7 +745,7 @@ def test_holder_dashboard():
         else:
             if st.button("✅ Complete Survey", type="primary", key="complete_survey"):
                 st.success("🎉 Survey completed successfully!")
-                st.balloons()
+                celebrate()
                 st.session_state["next_survey_section"] = 1
 
     # Render the appropriate section
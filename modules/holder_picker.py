@@ -0,0 +1,244 @@
+# census_app/modules/holder_picker.py
+"""
+Holder Picker
+Search-as-you-type holder selection for the sidebars: matches come from an
+indexed prefix/trigram search on holder names with a result limit, and an
+empty search shows the user's recently used holders instead of every holder.
+"""
+
+import logging
+import re
+from typing import Dict, List, Optional
+
+import streamlit as st
+from sqlalchemy import text
+
+from census_app.db import engine
+
+logger = logging.getLogger('holder_picker')
+
+HOLDER_PICKER_CONFIG = {
+    'result_limit': 20,        # matches offered per search
+    'recent_limit': 8,         # recently used holders shown before typing
+    'recent_kept': 50,         # recent rows kept per user
+    'min_fuzzy_length': 3,     # shorter terms only match by prefix/substring
+}
+
+# Set by setup_holder_picker: whether pg_trgm indexes are available
+_trigram = {'available': False}
+
+
+def setup_holder_picker():
+    """Create the name search indexes and the per-user recent holders table"""
+    try:
+        with engine.begin() as conn:
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS holder_picker_recent (
+                    user_id INTEGER NOT NULL,
+                    holder_id INTEGER NOT NULL,
+                    used_at TIMESTAMP NOT NULL DEFAULT NOW(),
+                    PRIMARY KEY (user_id, holder_id)
+                )
+            """))
+            conn.execute(text("""
+                CREATE INDEX IF NOT EXISTS idx_holder_picker_recent_used
+                ON holder_picker_recent (user_id, used_at DESC)
+            """))
+            # Prefix matches on lower(name) and per-agent scoping
+            conn.execute(text("""
+                CREATE INDEX IF NOT EXISTS idx_holders_name_prefix
+                ON holders (lower(name) text_pattern_ops)
+            """))
+            conn.execute(text("""
+                CREATE INDEX IF NOT EXISTS idx_holders_assigned_agent
+                ON holders (assigned_agent_id)
+            """))
+    except Exception as e:
+        logger.error(f"Error setting up holder picker: {str(e)}")
+        return False
+
+    try:
+        with engine.begin() as conn:
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            conn.execute(text("""
+                CREATE INDEX IF NOT EXISTS idx_holders_name_trgm
+                ON holders USING GIN (lower(name) gin_trgm_ops)
+            """))
+        _trigram['available'] = True
+    except Exception as e:
+        logger.error(f"Error creating holder name trigram index: {str(e)}")
+    return True
+
+
+def _scope(owner_id: Optional[int] = None, agent_id: Optional[int] = None,
+           verified_only: bool = False):
+    """WHERE conditions and params limiting holders to what the user may pick"""
+    conditions, params = [], {}
+    if owner_id:
+        conditions.append("h.owner_id = :owner_id")
+        params['owner_id'] = owner_id
+    if agent_id:
+        conditions.append("h.assigned_agent_id = :agent_id")
+        params['agent_id'] = agent_id
+    if verified_only:
+        conditions.append("h.status = 'active'")
+    return conditions, params
+
+
+def holder_label(holder: Dict) -> str:
+    return f"{holder['name']} (ID: {holder['holder_id']})"
+
+
+# ---------------- Queries ----------------
+def search_holders(term: str = "", owner_id: Optional[int] = None, agent_id: Optional[int] = None,
+                   verified_only: bool = False, limit: Optional[int] = None) -> List[Dict]:
+    """
+    Holders whose name matches a search term, best matches first, at most `limit`
+
+    Prefix matches rank first, then substring and (with pg_trgm) fuzzy matches
+    by similarity. A numeric term also matches the holder ID. An empty term
+    returns the first holders by ID.
+    """
+    limit = limit or HOLDER_PICKER_CONFIG['result_limit']
+    conditions, params = _scope(owner_id, agent_id, verified_only)
+    params['limit'] = limit
+    term = (term or "").strip().lower()
+    order = "h.holder_id"
+
+    if term:
+        escaped = re.sub(r"([%_\\])", r"\\\1", term)
+        params.update(term=term, prefix=f"{escaped}%", contains=f"%{escaped}%")
+        matches = ["lower(h.name) LIKE :prefix"]
+        if _trigram['available']:
+            matches.append("lower(h.name) LIKE :contains")
+            if len(term) >= HOLDER_PICKER_CONFIG['min_fuzzy_length']:
+                matches.append("lower(h.name) % :term")
+            order = "lower(h.name) LIKE :prefix DESC, similarity(lower(h.name), :term) DESC, h.name"
+        else:
+            order = "lower(h.name)"
+        if term.isdigit():
+            matches.append("h.holder_id = :holder_id")
+            params['holder_id'] = int(term)
+            order = f"h.holder_id = :holder_id DESC, {order}"
+        conditions.append("(" + " OR ".join(matches) + ")")
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    with engine.connect() as conn:
+        rows = conn.execute(text(f"""
+            SELECT h.holder_id, h.name FROM holders h
+            {where}
+            ORDER BY {order}
+            LIMIT :limit
+        """), params).mappings().all()
+    return [dict(row) for row in rows]
+
+
+def count_holders(owner_id: Optional[int] = None, agent_id: Optional[int] = None,
+                  verified_only: bool = False) -> int:
+    conditions, params = _scope(owner_id, agent_id, verified_only)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    with engine.connect() as conn:
+        return conn.execute(text(f"SELECT COUNT(*) FROM holders h {where}"), params).scalar() or 0
+
+
+def get_holder_option(holder_id: int, owner_id: Optional[int] = None, agent_id: Optional[int] = None,
+                      verified_only: bool = False) -> Optional[Dict]:
+    """The holder as a picker option, or None if it is outside the user's scope"""
+    conditions, params = _scope(owner_id, agent_id, verified_only)
+    conditions.append("h.holder_id = :hid")
+    params['hid'] = holder_id
+    with engine.connect() as conn:
+        row = conn.execute(text(f"""
+            SELECT h.holder_id, h.name FROM holders h WHERE {' AND '.join(conditions)}
+        """), params).mappings().first()
+    return dict(row) if row else None
+
+
+def get_recent_holders(user_id: int, owner_id: Optional[int] = None, agent_id: Optional[int] = None,
+                       verified_only: bool = False) -> List[Dict]:
+    """The user's most recently picked holders that are still in scope"""
+    conditions, params = _scope(owner_id, agent_id, verified_only)
+    params.update(user_id=user_id, limit=HOLDER_PICKER_CONFIG['recent_limit'])
+    scope = "".join(f" AND {condition}" for condition in conditions)
+    with engine.connect() as conn:
+        rows = conn.execute(text(f"""
+            SELECT h.holder_id, h.name FROM holder_picker_recent r
+            JOIN holders h ON h.holder_id = r.holder_id
+            WHERE r.user_id = :user_id {scope}
+            ORDER BY r.used_at DESC
+            LIMIT :limit
+        """), params).mappings().all()
+    return [dict(row) for row in rows]
+
+
+def remember_holder(user_id: int, holder_id: int):
+    """Record a pick and keep only the user's latest recent_kept picks"""
+    try:
+        with engine.begin() as conn:
+            conn.execute(text("""
+                INSERT INTO holder_picker_recent (user_id, holder_id, used_at)
+                VALUES (:user_id, :holder_id, NOW())
+                ON CONFLICT (user_id, holder_id) DO UPDATE SET used_at = EXCLUDED.used_at
+            """), {'user_id': user_id, 'holder_id': holder_id})
+            conn.execute(text("""
+                DELETE FROM holder_picker_recent
+                WHERE user_id = :user_id AND holder_id NOT IN (
+                    SELECT holder_id FROM holder_picker_recent
+                    WHERE user_id = :user_id ORDER BY used_at DESC LIMIT :keep
+                )
+            """), {'user_id': user_id, 'keep': HOLDER_PICKER_CONFIG['recent_kept']})
+    except Exception as e:
+        logger.error(f"Error recording recent holder for user {user_id}: {str(e)}")
+
+
+# ---------------- Widget ----------------
+def render_holder_picker(label: str, key: str, user_id: Optional[int] = None, owner_id: Optional[int] = None,
+                         agent_id: Optional[int] = None, verified_only: bool = False,
+                         selected_id: Optional[int] = None, container=None) -> Optional[Dict]:
+    """
+    Search box plus a short selectbox of matches; returns the chosen holder
+    as {'holder_id', 'name'}, or None when nothing matches
+
+    Before anything is typed the options are the user's recent holders (the
+    first holders when there are none). Only the limited matches are sent to
+    the browser. The current selection stays available while searching.
+    """
+    container = container or st.sidebar
+    scope = {'owner_id': owner_id, 'agent_id': agent_id, 'verified_only': verified_only}
+    term = container.text_input(f"🔍 Search {label}", key=f"{key}_search",
+                                placeholder="Type a name or ID")
+
+    try:
+        if term.strip():
+            options = search_holders(term, **scope)
+        else:
+            options = get_recent_holders(user_id, **scope) if user_id else []
+            options = options or search_holders("", **scope)
+        selected_id = selected_id or st.session_state.get(f"{key}_value")
+        if selected_id and all(h['holder_id'] != selected_id for h in options):
+            current = get_holder_option(selected_id, **scope)
+            if current:
+                options.insert(0, current)
+    except Exception as e:
+        container.error(f"Could not search holders: {e}")
+        return None
+
+    if not options:
+        container.info("No matching holders." if term.strip() else "No holders available.")
+        return None
+
+    by_id = {h['holder_id']: h for h in options}
+    ids = list(by_id)
+    holder_id = container.selectbox(
+        label, ids, index=ids.index(selected_id) if selected_id in by_id else 0,
+        format_func=lambda hid: holder_label(by_id[hid]), key=f"{key}_select"
+    )
+
+    if user_id and holder_id != st.session_state.get(f"{key}_value"):
+        remember_holder(user_id, holder_id)
+    st.session_state[f"{key}_value"] = holder_id
+    return by_id[holder_id]
+
+
+# Run setup when module is imported
+setup_holder_picker()
@@ -6,6 +6,7 @@ from config import SQLALCHEMY_DATABASE_URI
 import pandas as pd
 from typing import Dict, List, Optional, Tuple
 import logging
+from modules.low_bandwidth import celebrate
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -734,7 +735,7 @@ def holding_labour_permanent_form(holder_id: int, prefix: str = "") -> bool:
                 Your permanent workers information has been securely stored 
                 and is ready for agricultural census reporting.
                 """)
-                st.balloons()
+                celebrate()
                 return True
 
     return False
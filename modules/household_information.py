@@ -7,6 +7,7 @@ from db import engine
 from typing import Dict, List, Optional
 import plotly.express as px
 import plotly.graph_objects as go
+from modules.low_bandwidth import celebrate
 
 # =============================================================================
 # PROFESSIONAL CONSTANTS & CONFIGURATION
@@ -287,7 +288,7 @@ def render_household_summary_section(holder_id: int, prefix: str) -> Dict:
 
             if HouseholdDataManager.save_household_summary(holder_id, summary_data):
                 st.success("✅ Household summary saved successfully!")
-                st.balloons()
+                celebrate()
 
         st.markdown('</div>', unsafe_allow_html=True)
 
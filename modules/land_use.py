@@ -13,6 +13,7 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 # Import your existing database configuration
 from .db import engine
 from sqlalchemy import text
+from modules.low_bandwidth import celebrate
 
 # ---------------- ENUM MAPPINGS ----------------
 # Crop Methods - exact values from crop_method_enum
@@ -469,7 +470,7 @@ def land_use_section(holder_id):
 
                 # Save to database
                 if save_land_use_to_db(land_use_data, holder_id):
-                    st.balloons()
+                    celebrate()
                     return True
 
     return False
@@ -0,0 +1,207 @@
+# census_app/modules/low_bandwidth.py
+"""
+Low-bandwidth Rendering
+Helpers the agent and holder pages render heavy components through: in
+low-bandwidth mode CSS blocks and balloons are dropped, dataframes are capped
+and WebGL decks become small static maps. A meter reports the websocket bytes
+each rerun sent so savings can be checked on slow links.
+"""
+
+import logging
+import os
+import threading
+from collections import OrderedDict, deque
+from typing import Optional
+from urllib.parse import quote
+
+import pandas as pd
+import streamlit as st
+
+logger = logging.getLogger('low_bandwidth')
+
+LOW_BANDWIDTH_CONFIG = {
+    'state_key': 'low_bandwidth',
+    'max_dataframe_rows': 50,
+    'static_map_width': 600,
+    'static_map_height': 360,
+    'static_map_max_points': 300,
+    # e.g. https://tiles.example.org/static?center={lat},{lon}&zoom={zoom}&size={width}x{height}&markers={markers}
+    # The browser fetches the image straight from the map server, not over the websocket.
+    'static_map_url': os.getenv('STATIC_MAP_URL'),
+    'meter_history': 20,        # reruns remembered per session
+    'meter_sessions': 500,      # sessions remembered per process
+}
+
+
+def is_low_bandwidth() -> bool:
+    return bool(st.session_state.get(LOW_BANDWIDTH_CONFIG['state_key'], False))
+
+
+# ---------------- Lightweight Components ----------------
+def inject_css(css: str):
+    """Send a <style> block unless in low-bandwidth mode"""
+    if not is_low_bandwidth():
+        st.markdown(css, unsafe_allow_html=True)
+
+
+def celebrate():
+    """Balloons, skipped in low-bandwidth mode"""
+    if not is_low_bandwidth():
+        st.balloons()
+
+
+def show_dataframe(df: pd.DataFrame, **kwargs):
+    """st.dataframe, capped to max_dataframe_rows in low-bandwidth mode"""
+    limit = LOW_BANDWIDTH_CONFIG['max_dataframe_rows']
+    if is_low_bandwidth() and len(df) > limit:
+        st.dataframe(df.head(limit), **kwargs)
+        st.caption(f"📶 Showing {limit} of {len(df)} rows (low-bandwidth mode)")
+    else:
+        st.dataframe(df, **kwargs)
+
+
+def _static_map_svg(points: pd.DataFrame) -> str:
+    """Points on a plain equirectangular canvas, a few KB of SVG"""
+    width, height = LOW_BANDWIDTH_CONFIG['static_map_width'], LOW_BANDWIDTH_CONFIG['static_map_height']
+    pad = 20
+    lat_min, lat_max = points['lat'].min(), points['lat'].max()
+    lon_min, lon_max = points['lon'].min(), points['lon'].max()
+    lat_span = max(lat_max - lat_min, 1e-3)
+    lon_span = max(lon_max - lon_min, 1e-3)
+    scale = min((width - 2 * pad) / lon_span, (height - 2 * pad) / lat_span)
+
+    xs = pad + (points['lon'] - lon_min) * scale
+    ys = height - pad - (points['lat'] - lat_min) * scale
+    circles = "".join(f'<circle cx="{x:.1f}" cy="{y:.1f}" r="5"/>' for x, y in zip(xs, ys))
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="100%" viewBox="0 0 {width} {height}" '
+        f'style="background:#eef3f7;border-radius:8px">'
+        f'<g fill="#d62728" fill-opacity="0.8" stroke="white" stroke-width="1">{circles}</g>'
+        f'<text x="{pad}" y="{height - 4}" font-size="11" fill="#555">'
+        f'{lat_min:.4f}, {lon_min:.4f} — {lat_max:.4f}, {lon_max:.4f}</text></svg>'
+    )
+
+
+def static_map(points: pd.DataFrame, zoom: Optional[int] = None):
+    """
+    Render points as a static image
+
+    Uses the STATIC_MAP_URL service when configured, otherwise an inline SVG
+    of the points without map tiles.
+    """
+    points = points[['lat', 'lon']].dropna().astype(float)
+    if points.empty:
+        st.info("📍 No location to show")
+        return
+    max_points = LOW_BANDWIDTH_CONFIG['static_map_max_points']
+    if len(points) > max_points:
+        points = points.sample(max_points, random_state=0)
+
+    template = LOW_BANDWIDTH_CONFIG['static_map_url']
+    if template:
+        markers = "|".join(f"{lat:.5f},{lon:.5f}" for lat, lon in points.itertuples(index=False))
+        st.image(template.format(
+            lat=points['lat'].mean(), lon=points['lon'].mean(), zoom=zoom or 12,
+            width=LOW_BANDWIDTH_CONFIG['static_map_width'],
+            height=LOW_BANDWIDTH_CONFIG['static_map_height'],
+            markers=quote(markers)
+        ))
+    else:
+        st.markdown(_static_map_svg(points), unsafe_allow_html=True)
+
+
+def show_map(points: pd.DataFrame, deck=None, zoom: Optional[int] = None):
+    """
+    Map for lat/lon points: the given pydeck Deck (or st.map) normally,
+    a static image in low-bandwidth mode
+    """
+    if is_low_bandwidth():
+        static_map(points, zoom)
+    elif deck is not None:
+        st.pydeck_chart(deck)
+    else:
+        st.map(points[['lat', 'lon']], zoom=zoom)
+
+
+# ---------------- Bandwidth Meter ----------------
+_meter_lock = threading.Lock()
+
+
+def install_bandwidth_meter() -> bool:
+    """
+    Count the serialized size of every message sent to each browser session
+
+    Wraps AppSession._enqueue_forward_msg; bytes up to each script_finished
+    make up one rerun (full or fragment). Sizes are protobuf bytes before any
+    websocket compression. Returns False if this Streamlit version has no such hook.
+    """
+    try:
+        from streamlit.runtime.app_session import AppSession
+    except ImportError:
+        return False
+
+    with _meter_lock:
+        if getattr(AppSession, '_bandwidth_meter', None) is not None:
+            return True
+        original = getattr(AppSession, '_enqueue_forward_msg', None)
+        if original is None:
+            logger.warning("Bandwidth meter unavailable in this Streamlit version")
+            return False
+
+        sessions: "OrderedDict[str, dict]" = OrderedDict()
+
+        def metered(self, msg):
+            try:
+                kind = msg.WhichOneof('type')
+                with _meter_lock:
+                    stats = sessions.get(self.id)
+                    if stats is None:
+                        stats = sessions[self.id] = {
+                            'current': 0, 'reruns': deque(maxlen=LOW_BANDWIDTH_CONFIG['meter_history'])
+                        }
+                        while len(sessions) > LOW_BANDWIDTH_CONFIG['meter_sessions']:
+                            sessions.popitem(last=False)
+                    if kind == 'new_session':
+                        stats['current'] = 0
+                    stats['current'] += msg.ByteSize()
+                    if kind == 'script_finished':
+                        stats['reruns'].append(stats['current'])
+                        # Fragment reruns do not start with new_session
+                        stats['current'] = 0
+            except Exception as e:
+                logger.debug(f"Bandwidth meter error: {e}")
+            return original(self, msg)
+
+        AppSession._enqueue_forward_msg = metered
+        AppSession._bandwidth_meter = sessions
+        return True
+
+
+def get_rerun_bytes() -> list:
+    """Bytes sent by this session's completed reruns, oldest first"""
+    try:
+        from streamlit.runtime.app_session import AppSession
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+    except ImportError:
+        return []
+    sessions = getattr(AppSession, '_bandwidth_meter', None)
+    ctx = get_script_run_ctx()
+    if sessions is None or ctx is None:
+        return []
+    with _meter_lock:
+        stats = sessions.get(ctx.session_id)
+        return list(stats['reruns']) if stats else []
+
+
+def render_bandwidth_controls(container=None):
+    """Low-bandwidth toggle with the bytes the last reruns sent"""
+    container = container or st.sidebar
+    install_bandwidth_meter()
+    with container:
+        st.toggle("📶 Low Bandwidth", key=LOW_BANDWIDTH_CONFIG['state_key'],
+                  help="Skip styling, animations and interactive maps; cap tables")
+        reruns = get_rerun_bytes()
+        if reruns:
+            average = sum(reruns) / len(reruns)
+            st.caption(f"Last rerun: {reruns[-1] / 1024:.1f} KB · avg {average / 1024:.1f} KB "
+                       f"over {len(reruns)} reruns")
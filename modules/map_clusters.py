@@ -0,0 +1,236 @@
+# census_app/modules/map_clusters.py
+"""
+Map Clusters
+Server-side clustering for the all-holdings maps: Postgres groups the points
+inside the current viewport into grid cells sized for the zoom level and
+returns one row per cell, so the browser gets a few hundred clusters instead
+of every holding. Individual points are only sent at street level, or when
+few enough points are in view. Clicking a cluster zooms into it.
+
+The map tables store coordinates as plain latitude/longitude columns, not
+PostGIS geometry, so cells are computed with floor() on those columns: the
+same cells ST_SnapToGrid would give, without building a geometry per row,
+and the viewport filter stays a B-tree range scan on (latitude, longitude).
+"""
+
+import logging
+import math
+from typing import Dict, Optional, Tuple
+
+import pandas as pd
+import pydeck as pdk
+import streamlit as st
+from sqlalchemy import text
+
+from census_app.db import engine
+from census_app.modules.low_bandwidth import is_low_bandwidth, static_map
+
+logger = logging.getLogger('map_clusters')
+
+MAP_CLUSTER_CONFIG = {
+    'width_px': 800,          # assumed map canvas, used to derive the viewport from centre and zoom
+    'height_px': 500,
+    'cluster_px': 60,         # grid cell size on screen
+    'street_zoom': 14,        # from this zoom, individual points are shown
+    'max_points': 2000,       # ... or whenever no more than this many points are in view
+    'min_zoom': 3,
+    'max_zoom': 18,
+    'default_view': (24.25, -76.6, 6),   # the Bahamas
+}
+
+# Point tables the maps can show: coordinates, and the label/extra columns for street level
+MAP_SOURCES = {
+    'holders': {
+        'from': "holders t LEFT JOIN general_information g ON g.holder_id = t.holder_id",
+        'label': "t.name || ' (' || COALESCE(g.holding_name, 'No Holding') || ')'",
+        'extra': "t.holder_id, t.name AS holder_name, g.holding_name, g.legal_status",
+    },
+    'general_information': {
+        'from': "general_information t",
+        'label': "COALESCE(t.holding_name, t.holder_name, t.respondent_name, 'Record ' || t.id)",
+        'extra': "t.id, t.status",
+    },
+    'holdings': {
+        'from': "holdings t",
+        'label': "'Holding ' || t.id",
+        'extra': "t.id, t.status",
+    },
+}
+
+_indexed = set()
+
+
+def _ensure_coordinate_index(table: str):
+    """B-tree index on (latitude, longitude) for viewport range scans, once per process"""
+    if table in _indexed:
+        return
+    try:
+        with engine.begin() as conn:
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS idx_{table}_lat_lon ON {table} (latitude, longitude)"))
+    except Exception as e:
+        logger.error(f"Error creating coordinate index on {table}: {str(e)}")
+    _indexed.add(table)
+
+
+def viewport(lat: float, lon: float, zoom: float) -> Tuple[float, float, float, float]:
+    """(south, north, west, east) visible on the canvas at this centre and web-mercator zoom"""
+    deg_per_px = 360.0 / (256 * 2 ** zoom)
+    half_w = deg_per_px * MAP_CLUSTER_CONFIG['width_px'] / 2
+    half_h = deg_per_px * MAP_CLUSTER_CONFIG['height_px'] / 2 * math.cos(math.radians(lat))
+    return lat - half_h, lat + half_h, lon - half_w, lon + half_w
+
+
+def cell_size(zoom: float) -> float:
+    """Grid cell size in degrees for a zoom level: cluster_px screen pixels"""
+    return 360.0 / (256 * 2 ** zoom) * MAP_CLUSTER_CONFIG['cluster_px']
+
+
+# ---------------- Queries ----------------
+def fetch_clusters(source: str, lat: float, lon: float, zoom: float) -> pd.DataFrame:
+    """
+    Points in the viewport aggregated into zoom-sized grid cells
+
+    Cells are aligned to a fixed global grid for each zoom, so clusters do not
+    jump as the view pans. Each row has count, the centroid and the bounds.
+    """
+    config = MAP_SOURCES[source]
+    table = config['from'].split()[0]
+    _ensure_coordinate_index(table)
+    south, north, west, east = viewport(lat, lon, zoom)
+    with engine.connect() as conn:
+        rows = conn.execute(text(f"""
+            SELECT COUNT(*) AS count, AVG(p.lat) AS lat, AVG(p.lon) AS lon,
+                   MIN(p.lat) AS south, MAX(p.lat) AS north, MIN(p.lon) AS west, MAX(p.lon) AS east
+            FROM (
+                SELECT CAST(t.latitude AS DOUBLE PRECISION) AS lat, CAST(t.longitude AS DOUBLE PRECISION) AS lon
+                FROM {table} t
+                WHERE t.latitude BETWEEN :south AND :north AND t.longitude BETWEEN :west AND :east
+            ) p
+            GROUP BY floor(p.lon / :cell), floor(p.lat / :cell)
+        """), {'south': south, 'north': north, 'west': west, 'east': east,
+               'cell': cell_size(zoom)}).mappings().all()
+    return pd.DataFrame(rows, columns=['count', 'lat', 'lon', 'south', 'north', 'west', 'east'])
+
+
+def fetch_points(source: str, lat: float, lon: float, zoom: float, limit: Optional[int] = None) -> pd.DataFrame:
+    """Individual points in the viewport with their labels, at most `limit`"""
+    config = MAP_SOURCES[source]
+    south, north, west, east = viewport(lat, lon, zoom)
+    with engine.connect() as conn:
+        rows = conn.execute(text(f"""
+            SELECT CAST(t.latitude AS DOUBLE PRECISION) AS lat, CAST(t.longitude AS DOUBLE PRECISION) AS lon,
+                   {config['label']} AS label, {config['extra']}
+            FROM {config['from']}
+            WHERE t.latitude BETWEEN :south AND :north AND t.longitude BETWEEN :west AND :east
+            LIMIT :limit
+        """), {'south': south, 'north': north, 'west': west, 'east': east,
+               'limit': limit or MAP_CLUSTER_CONFIG['max_points']}).mappings().all()
+    return pd.DataFrame(rows)
+
+
+def fetch_map_view(source: str, lat: float, lon: float, zoom: float) -> Tuple[str, pd.DataFrame, int]:
+    """
+    What to draw for a viewport
+
+    Returns:
+        tuple: ('points' or 'clusters', rows, points in view)
+    """
+    clusters = fetch_clusters(source, lat, lon, zoom)
+    total = int(clusters['count'].sum()) if not clusters.empty else 0
+    if total and (zoom >= MAP_CLUSTER_CONFIG['street_zoom'] or total <= MAP_CLUSTER_CONFIG['max_points']):
+        return 'points', fetch_points(source, lat, lon, zoom), total
+    return 'clusters', clusters, total
+
+
+# ---------------- Rendering ----------------
+def _cluster_deck(clusters: pd.DataFrame, view: Dict) -> pdk.Deck:
+    clusters = clusters.assign(
+        radius=(clusters['count'] ** 0.5) * cell_size(view['zoom']) * 111000 / 12,
+        count_label=clusters['count'].astype(str),
+    )
+    return pdk.Deck(
+        layers=[
+            pdk.Layer("ScatterplotLayer", id="clusters", data=clusters, get_position='[lon, lat]',
+                      get_radius='radius', get_fill_color='[200, 30, 0, 140]', pickable=True),
+            pdk.Layer("TextLayer", data=clusters, get_position='[lon, lat]', get_text='count_label',
+                      get_size=14, get_color='[255, 255, 255, 230]'),
+        ],
+        initial_view_state=pdk.ViewState(latitude=view['lat'], longitude=view['lon'], zoom=view['zoom']),
+        tooltip={"text": "{count} holdings — click to zoom in"},
+    )
+
+
+def _point_deck(points: pd.DataFrame, view: Dict, tooltip: str) -> pdk.Deck:
+    return pdk.Deck(
+        layers=[pdk.Layer("ScatterplotLayer", id="points", data=points, get_position='[lon, lat]',
+                          get_fill_color='[200, 30, 0, 160]', get_radius=30, radius_min_pixels=4,
+                          pickable=True)],
+        initial_view_state=pdk.ViewState(latitude=view['lat'], longitude=view['lon'], zoom=view['zoom']),
+        tooltip={"text": tooltip},
+    )
+
+
+def render_cluster_map(source: str, key: str, tooltip: str = "{label}") -> Tuple[str, pd.DataFrame]:
+    """
+    Clustered map of a point table with zoom controls; clicking a cluster zooms into it
+
+    Returns:
+        tuple: ('points' or 'clusters', the rows drawn) so callers can list visible points
+    """
+    state_key = f"{key}_view"
+    default_lat, default_lon, default_zoom = MAP_CLUSTER_CONFIG['default_view']
+    view = st.session_state.setdefault(state_key, {'lat': default_lat, 'lon': default_lon,
+                                                   'zoom': default_zoom, 'sync': True})
+
+    slider_key = f"{key}_zoom"
+    # Zoom changed by a click or button on the last run: move the slider before it is drawn
+    if view.pop('sync', False):
+        st.session_state[slider_key] = int(view['zoom'])
+
+    col_zoom, col_out, col_reset = st.columns([4, 1, 1])
+    with col_zoom:
+        view['zoom'] = st.slider("Zoom", MAP_CLUSTER_CONFIG['min_zoom'], MAP_CLUSTER_CONFIG['max_zoom'],
+                                 key=slider_key)
+    with col_out:
+        if st.button("➖ Zoom Out", key=f"{key}_zoom_out"):
+            view.update(zoom=max(MAP_CLUSTER_CONFIG['min_zoom'], view['zoom'] - 2), sync=True)
+            st.rerun()
+    with col_reset:
+        if st.button("🔄 Reset", key=f"{key}_reset"):
+            st.session_state[state_key] = {'lat': default_lat, 'lon': default_lon,
+                                           'zoom': default_zoom, 'sync': True}
+            st.rerun()
+
+    try:
+        level, rows, total = fetch_map_view(source, view['lat'], view['lon'], view['zoom'])
+    except Exception as e:
+        st.warning(f"Could not load map: {e}")
+        return 'clusters', pd.DataFrame()
+
+    if rows.empty:
+        st.info("No holdings with coordinates in view.")
+        return level, rows
+
+    if level == 'points':
+        st.caption(f"{len(rows):,} of {total:,} holdings in view")
+    else:
+        st.caption(f"{total:,} holdings in view, in {len(rows):,} clusters — click a cluster to zoom in")
+
+    if is_low_bandwidth():
+        static_map(rows[['lat', 'lon']], zoom=int(view['zoom']))
+        return level, rows
+
+    deck = _point_deck(rows, view, tooltip) if level == 'points' else _cluster_deck(rows, view)
+    event = st.pydeck_chart(deck, on_select="rerun", selection_mode="single-object", key=f"{key}_deck")
+
+    picked = (getattr(event, 'selection', None) or {}).get('objects', {}).get('clusters') if event else None
+    # The selection outlives the rerun, so only act on a newly clicked cluster
+    if picked and picked[0] != view.get('picked'):
+        cluster = view['picked'] = picked[0]
+        # Zoom so the cluster's bounds fill the view (at least two levels in)
+        span = max(cluster['north'] - cluster['south'], cluster['east'] - cluster['west'], 1e-4)
+        fit_zoom = math.floor(math.log2(360.0 * MAP_CLUSTER_CONFIG['height_px'] / (256 * span)))
+        view.update(lat=cluster['lat'], lon=cluster['lon'], sync=True,
+                    zoom=min(MAP_CLUSTER_CONFIG['max_zoom'], max(view['zoom'] + 2, fit_zoom)))
+        st.rerun()
+    return level, rows
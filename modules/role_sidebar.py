@@ -1,7 +1,6 @@
 import streamlit as st
-from sqlalchemy import text
-from census_app.db import engine
 from census_app.config import TOTAL_SURVEY_SECTIONS
+from census_app.modules.holder_picker import count_holders, get_holder_option, holder_label, render_holder_picker
 
 # Lazy import to avoid circular issues
 def _import_survey_sidebar():
@@ -10,33 +9,19 @@ def _import_survey_sidebar():
 
 survey_sidebar = _import_survey_sidebar()
 
-# ---------------- Fetch Holders ----------------
-def fetch_holder_options(user_id=None, agent_id=None, verified_only=False):
+# ---------------- Pick Holder ----------------
+def select_holder(label, select_key, user_id=None, holder_id=None, **scope):
     """
-    Return a dict: {holder_name (ID): holder_id} for a given user/agent.
+    Return the holder {holder_id, name} to show, from the scope given by
+    owner_id/agent_id/verified_only. A provided holder_id in scope is used
+    as-is; otherwise the user picks through the search-as-you-type picker.
     """
-    query = "SELECT holder_id, name AS full_name FROM holders"
-    conditions = []
-    params = {}
-
-    if user_id:
-        conditions.append("owner_id = :uid")
-        params["uid"] = user_id
-    if agent_id:
-        conditions.append("assigned_agent_id = :aid")
-        params["aid"] = agent_id
-    if verified_only:
-        conditions.append("status = 'active'")
-
-    if conditions:
-        query += " WHERE " + " AND ".join(conditions)
-
-    query += " ORDER BY holder_id"
-
-    with engine.connect() as conn:
-        result = conn.execute(text(query), params).mappings().all()
-
-    return {f"{row['full_name']} (ID: {row['holder_id']})": row['holder_id'] for row in result}
+    # Pre-select holder if provided
+    if holder_id:
+        holder = get_holder_option(holder_id, **scope)
+        if holder:
+            return holder
+    return render_holder_picker(label, select_key, user_id=user_id, **scope)
 
 
 # ---------------- Role Sidebar ----------------
@@ -52,26 +37,14 @@ def role_sidebar(user_role=None, user_id=None, agent_id=None, holder_id=None):
         st.sidebar.markdown("### Holder Dashboard")
         st.sidebar.info("Complete your survey sections here.")
 
-        holder_options = fetch_holder_options(user_id=user_id, verified_only=True)
-        if not holder_options:
+        holder = select_holder("Select Holder", f"holder_selectbox_{user_role}", user_id=user_id,
+                               holder_id=holder_id, owner_id=user_id, verified_only=True)
+        if not holder:
             st.sidebar.warning("⚠️ No holders available.")
             return
 
-        select_key = f"holder_selectbox_{user_role}"
-
-        # Pre-select holder if provided
-        if holder_id and holder_id in holder_options.values():
-            selected_holder_name = [
-                name for name, hid in holder_options.items() if hid == holder_id
-            ][0]
-        else:
-            selected_holder_name = st.sidebar.selectbox(
-                "Select Holder",
-                options=list(holder_options.keys()),
-                key=select_key
-            )
-
-        holder_id = holder_options[selected_holder_name]
+        holder_id = holder["holder_id"]
+        selected_holder_name = holder_label(holder)
         st.session_state["selected_holder_id"] = holder_id
 
         st.sidebar.markdown(
@@ -89,28 +62,19 @@ def role_sidebar(user_role=None, user_id=None, agent_id=None, holder_id=None):
         st.sidebar.markdown("### Agent Dashboard")
         st.sidebar.info("Access your assigned holders here.")
 
-        holder_options = fetch_holder_options(agent_id=agent_id, verified_only=True)
-        if not holder_options:
+        total = count_holders(agent_id=agent_id, verified_only=True)
+        if not total:
             st.sidebar.warning("⚠️ No holders assigned to you yet.")
             return
 
-        st.sidebar.markdown(f"Assigned Holders: {len(holder_options)}")
+        st.sidebar.markdown(f"Assigned Holders: {total}")
 
-        select_key = "agent_holder_selectbox"
-
-        # Pre-select holder if provided
-        if holder_id and holder_id in holder_options.values():
-            selected_holder_name = [
-                name for name, hid in holder_options.items() if hid == holder_id
-            ][0]
-        else:
-            selected_holder_name = st.sidebar.selectbox(
-                "Select Holder to Review",
-                options=list(holder_options.keys()),
-                key=select_key
-            )
+        holder = select_holder("Select Holder to Review", "agent_holder_selectbox", user_id=user_id,
+                               holder_id=holder_id, agent_id=agent_id, verified_only=True)
+        if not holder:
+            return
 
-        holder_id = holder_options[selected_holder_name]
+        holder_id = holder["holder_id"]
         st.session_state["selected_holder_id"] = holder_id
 
         survey_sidebar(holder_id, prefix=f"agent_sidebar_{holder_id}")
@@ -120,28 +84,19 @@ def role_sidebar(user_role=None, user_id=None, agent_id=None, holder_id=None):
         st.sidebar.markdown("### Admin Dashboard")
         st.sidebar.info("Manage users, agents, and holders here.")
 
-        holder_options = fetch_holder_options(verified_only=False)
-        if not holder_options:
+        total = count_holders()
+        if not total:
             st.sidebar.warning("⚠️ No holders in system.")
             return
 
-        st.sidebar.markdown(f"Total Holders: {len(holder_options)}")
+        st.sidebar.markdown(f"Total Holders: {total}")
 
-        select_key = "admin_holder_selectbox"
-
-        # Pre-select holder if provided
-        if holder_id and holder_id in holder_options.values():
-            selected_holder_name = [
-                name for name, hid in holder_options.items() if hid == holder_id
-            ][0]
-        else:
-            selected_holder_name = st.sidebar.selectbox(
-                "Select Holder to Review / Verify",
-                options=list(holder_options.keys()),
-                key=select_key
-            )
+        holder = select_holder("Select Holder to Review / Verify", "admin_holder_selectbox", user_id=user_id,
+                               holder_id=holder_id)
+        if not holder:
+            return
 
-        holder_id = holder_options[selected_holder_name]
+        holder_id = holder["holder_id"]
         st.session_state["selected_holder_id"] = holder_id
 
         survey_sidebar(holder_id, prefix=f"admin_sidebar_{holder_id}")
@@ -6,6 +6,7 @@ from modules.household_information import household_information
 from modules.agricultural_machinery import agricultural_machinery_section
 from modules.land_use import land_use_section
 from modules.survey_helpers import get_completed_sections
+from modules.low_bandwidth import inject_css, show_dataframe
 
 # =============================================================================
 # PROFESSIONAL SURVEY CONFIGURATION
@@ -55,7 +56,7 @@ SURVEY_SECTIONS = {
 # =============================================================================
 def inject_survey_styles():
     """Inject professional CSS styles for survey interface"""
-    st.markdown("""
+    inject_css("""
     <style>
         .survey-header {
             background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
@@ -93,7 +94,7 @@ def inject_survey_styles():
             margin: 1rem 0;
         }
     </style>
-    """, unsafe_allow_html=True)
+    """)
 
 
 def survey_sidebar(holder_id=None, prefix=""):
@@ -385,7 +386,7 @@ def export_survey_progress(holder_id):
 
             # Show preview
             with st.sidebar.expander("📋 Preview Export Data"):
-                st.dataframe(display_df, use_container_width=True)
+                show_dataframe(display_df, use_container_width=True)
 
         else:
             st.sidebar.info("📝 No survey progress data available for export")
@@ -16,6 +16,9 @@ from streamlit_folium import folium_static, st_folium
 import math
 from datetime import datetime, timedelta
 import io
+import tempfile
+import uuid
+from contextlib import nullcontext
 
 
 # =============================
@@ -2499,51 +2502,107 @@ def clear_all_data():
         return True
 
 
+EXPORT_CHUNK_ROWS = 20000
+EXPORT_DIR = os.path.join(tempfile.gettempdir(), "nacp_exports")
+
+# registration_form column -> CSV header, in export order
+EXPORT_COLUMNS = {
+    "id": "ID",
+    "first_name": "First Name",
+    "last_name": "Last Name",
+    "email": "Email",
+    "cell": "Cell",
+    "telephone": "Telephone",
+    "communication_methods": "Communication Methods",
+    "island": "Island",
+    "settlement": "Settlement",
+    "street_address": "Street Address",
+    "interview_methods": "Interview Methods",
+    "available_days": "Available Days",
+    "available_times": "Available Times",
+    "latitude": "Latitude",
+    "longitude": "Longitude",
+    "gps_accuracy": "GPS Accuracy",
+    "location_source": "Location Source",
+    "confirmed": "Confirmed",
+    "created_at": "Created At",
+}
+ARRAY_EXPORT_COLUMNS = ["communication_methods", "interview_methods", "available_days", "available_times"]
+
+
+def format_export_chunk(df):
+    """Format array columns and rename to the export headers"""
+    for column in ARRAY_EXPORT_COLUMNS:
+        df[column] = df[column].map(format_array_for_display)
+    df["confirmed"] = df["confirmed"].fillna(False).astype(bool)
+    text_columns = [c for c in EXPORT_COLUMNS if c not in ARRAY_EXPORT_COLUMNS
+                    and c not in ("id", "latitude", "longitude", "gps_accuracy", "confirmed")]
+    df[text_columns] = df[text_columns].fillna("")
+    return df.rename(columns=EXPORT_COLUMNS)
+
+
+def stream_registrations_csv(path):
+    """
+    Write every registration to a CSV file chunk by chunk
+
+    Rows come through a server-side cursor (where the database supports one)
+    and are written EXPORT_CHUNK_ROWS at a time, so memory does not grow
+    with the number of registrations.
+
+    Returns:
+        int: rows written
+    """
+    rows = 0
+    columns_sql = ", ".join(EXPORT_COLUMNS)
+    with engine.connect() as conn, open(path, "w", newline="", encoding="utf-8") as f:
+        conn = conn.execution_options(stream_results=True, max_row_buffer=EXPORT_CHUNK_ROWS)
+        result = conn.execute(text(f"SELECT {columns_sql} FROM registration_form ORDER BY id DESC"))
+        while True:
+            batch = result.fetchmany(EXPORT_CHUNK_ROWS)
+            if not batch:
+                break
+            chunk = format_export_chunk(pd.DataFrame.from_records(batch, columns=list(EXPORT_COLUMNS)))
+            chunk.to_csv(f, header=rows == 0, index=False)
+            rows += len(chunk)
+    return rows
+
+
 def export_data():
     """Export registration data to CSV"""
-    registrations = get_all_registrations()
-    if not registrations:
-        st.info("📭 No data to export")
-        return False
-
-    # Convert to DataFrame
-    df_data = []
-    for reg in registrations:
-        df_data.append({
-            "ID": reg.get('id'),
-            "First Name": reg.get('first_name', ''),
-            "Last Name": reg.get('last_name', ''),
-            "Email": reg.get('email', ''),
-            "Cell": reg.get('cell', ''),
-            "Telephone": reg.get('telephone', ''),
-            "Communication Methods": format_array_for_display(reg.get('communication_methods')),
-            "Island": reg.get('island', ''),
-            "Settlement": reg.get('settlement', ''),
-            "Street Address": reg.get('street_address', ''),
-            "Interview Methods": format_array_for_display(reg.get('interview_methods')),
-            "Available Days": format_array_for_display(reg.get('available_days')),
-            "Available Times": format_array_for_display(reg.get('available_times')),
-            "Latitude": reg.get('latitude'),
-            "Longitude": reg.get('longitude'),
-            "GPS Accuracy": reg.get('gps_accuracy'),
-            "Location Source": reg.get('location_source', ''),
-            "Confirmed": reg.get('confirmed', False),
-            "Created At": reg.get('created_at', '')
-        })
-
-    df = pd.DataFrame(df_data)
-
-    # Generate CSV
-    csv = df.to_csv(index=False)
-
-    # Create download button
-    st.download_button(
-        label="📥 Download CSV",
-        data=csv,
-        file_name=f"nacp_registrations_{pd.Timestamp.now().strftime('%Y%m%d_%H%M')}.csv",
-        mime="text/csv",
-        use_container_width=True
-    )
+    if engine is None:
+        registrations = get_all_registrations()
+        if not registrations:
+            st.info("📭 No data to export")
+            return False
+        df = pd.DataFrame(registrations).reindex(columns=list(EXPORT_COLUMNS))
+        data = format_export_chunk(df).to_csv(index=False)
+    else:
+        # Replace this session's previous export file
+        previous = st.session_state.get("export_data")
+        if previous and os.path.exists(previous):
+            os.remove(previous)
+        os.makedirs(EXPORT_DIR, exist_ok=True)
+        path = os.path.join(EXPORT_DIR, f"registrations_{uuid.uuid4().hex}.csv")
+        try:
+            rows = stream_registrations_csv(path)
+        except Exception as e:
+            st.error(f"Export error: {e}")
+            return False
+        if not rows:
+            os.remove(path)
+            st.info("📭 No data to export")
+            return False
+        st.session_state.export_data = path
+
+    # Create download button (the export file is closed once the button has it)
+    with open(path, "rb") if engine is not None else nullcontext(data) as payload:
+        st.download_button(
+            label="📥 Download CSV",
+            data=payload,
+            file_name=f"nacp_registrations_{pd.Timestamp.now().strftime('%Y%m%d_%H%M')}.csv",
+            mime="text/csv",
+            use_container_width=True
+        )
 
     return True
 